@@ -0,0 +1,882 @@
+import os
+import sys
+import time
+from collections import Counter, namedtuple
+from itertools import chain
+
+from binary_block import BinaryContent, BinaryContentError, binary_matches_file, split_integrity
+from content_compare import ASCII_WHITESPACE, content_matches_file
+from diff_preview import intern_lines, match_lines
+from file_system import DEFAULT_IO_WORKERS, LocalFileSystem, OverlayFileSystem, map_in_pool
+from patch_ops import PatchParseError, apply_patch_text
+from text_format import TextFormat, read_file_text, sniff_file
+from text_span import TextSpan, as_text, content_is_ascii, content_length, iter_content_chunks
+from transaction import DEFAULT_DURABILITY, Transaction, TransactionAborted
+
+# 本模块不依赖 Tkinter、pywin32 或 pystray，可供托盘程序和命令行 (autoapply.py) 共用。
+
+# 将中文或英文指令统一映射为大写的英文指令，比较时不区分大小写
+OPERATION_ALIASES = {
+    'create': "CREATE", '创建': "CREATE",
+    'overwrite': "OVERWRITE", '覆盖': "OVERWRITE", '修改': "OVERWRITE",
+    'append': "APPEND", '追加': "APPEND",
+    'delete': "DELETE", '删除': "DELETE",
+    'patch': "PATCH", '补丁': "PATCH",
+    'replace': "REPLACE", '替换': "REPLACE",
+    'binary': "BINARY", 'base64': "BINARY", '二进制': "BINARY",
+}
+
+# 只修改现有文件中匹配部分的操作，代码块内容为补丁而不是完整文件
+PATCH_OPERATIONS = ("PATCH", "REPLACE")
+
+
+def normalize_operation(operation_raw):
+    """将原始操作指令标准化为 CREATE/OVERWRITE/APPEND/DELETE/PATCH/REPLACE/BINARY，未知指令返回 None。"""
+    return OPERATION_ALIASES.get(operation_raw.strip().lower())
+
+
+# 预读结果：exists 表示目标文件是否存在；unchanged 表示无需写入（CREATE/OVERWRITE 内容一致，
+# 或 APPEND 的内容已经位于文件末尾）；append_separator 为 APPEND 前需要补的换行符；read_error 为读取错误；
+# patch_result 为 PATCH/REPLACE 应用补丁后的 PatchResult，补丁无法解析时为 PatchParseError；
+# text_format 为现有文件的 TextFormat（编码、BOM 和换行符），文件不存在或无法判断时为 None；
+# binary_summary 为 BINARY 内容解码后的 (字节数, sha256)，无法解码或校验失败时为 BinaryContentError。
+TargetProbe = namedtuple('TargetProbe', ['exists', 'unchanged', 'append_separator', 'read_error', 'patch_result',
+                                         'text_format', 'binary_summary'], defaults=(None, None, None))
+
+# 判断 APPEND 是否已执行时额外读取的尾部字节数，用于容纳末尾空白
+APPEND_TAIL_SLACK = 4096
+# 混合换行的文件整体写入时，逐行对应新旧内容的时间上限（秒），超过后剩余的行使用占多数的换行符
+LINE_ENDING_TIME_BUDGET = 0.5
+_ASCII_WHITESPACE_TEXT = ASCII_WHITESPACE.decode('ascii')
+
+
+def _probe_append(fs, target_path, new_content):
+    """
+    APPEND 只读取文件开头（判断格式）和末尾：末尾是否以换行结束决定是否需要补换行符，
+    末尾（按文件格式解码、标准化换行并去掉尾部空白后）已经是完整一行或多行的新内容时视为已追加。
+    读取量与新内容长度成正比，与文件大小无关；只有新内容含非 ASCII 字符、文件开头又全是 ASCII 时，
+    才逐块读取到第一个非 ASCII 的块确认编码（追加的字节必须与文件原有内容的编码一致）。
+    """
+    text_format = sniff_file(fs, target_path, full=not content_is_ascii(new_content))
+    if isinstance(new_content, TextSpan):
+        # 零拷贝内容：文件比新内容还短时不可能已追加，只需读取最后一个字符，无需生成完整文本
+        if fs.getsize(target_path) < content_length(new_content):
+            tail, at_start = fs.read_tail(target_path, 4)
+            text = text_format.decode_tail(tail, at_start)
+            return TargetProbe(True, False, "\n" if text and not text.endswith('\n') else "", None,
+                               text_format=text_format)
+        new_content = as_text(new_content)
+    try:
+        expected_size = len(text_format.encode(new_content))
+    except UnicodeEncodeError:
+        expected_size = None # 内容无法用文件的编码表示，不可能已经追加过，只需判断末尾
+    tail, at_start = fs.read_tail(target_path, 4 if expected_size is None else 2 * expected_size + APPEND_TAIL_SLACK)
+    text = text_format.decode_tail(tail, at_start)
+    separator = "\n" if text and not text.endswith('\n') else ""
+    if not new_content or expected_size is None:
+        return TargetProbe(True, not new_content, separator, None, text_format=text_format)
+    normalized = text.rstrip(_ASCII_WHITESPACE_TEXT)
+    already_appended = normalized.endswith(new_content) and (
+        normalized[-len(new_content) - 1:-len(new_content)] == '\n'
+        or (at_start and len(normalized.lstrip(_ASCII_WHITESPACE_TEXT)) == len(new_content))
+    )
+    return TargetProbe(True, already_appended, separator, None, text_format=text_format)
+
+
+def _probe_patch(fs, operation_type, target_path, patch_text, file_exists):
+    """读取现有文件并应用补丁；文件不存在时补丁作用于空内容（只有纯新增的块能被应用）。"""
+    existing, error, text_format = "", None, None
+    if file_exists:
+        try:
+            existing, text_format = read_file_text(fs, target_path)
+        except Exception as e:
+            return TargetProbe(True, False, "", e)
+    try:
+        result = apply_patch_text(operation_type, existing, patch_text)
+    except PatchParseError as e:
+        return TargetProbe(file_exists, False, "", error, e, text_format)
+    return TargetProbe(file_exists, file_exists and result.content == existing, "", error, result, text_format)
+
+
+def _probe_binary(fs, target_path, content):
+    """BINARY 完整解码一遍（不保存结果）得到大小和 sha256 并校验；文件存在时按大小和摘要判断是否一致。"""
+    file_exists = fs.isfile(target_path)
+    try:
+        summary = content.summary()
+    except BinaryContentError as e:
+        return TargetProbe(file_exists, False, "", None, binary_summary=e)
+    try:
+        unchanged = file_exists and binary_matches_file(fs, target_path, content)
+    except OSError as e:
+        return TargetProbe(True, False, "", e, binary_summary=summary)
+    return TargetProbe(file_exists, unchanged, "", None, binary_summary=summary)
+
+
+def _probe_target(fs, operation_type, target_path, new_content):
+    """
+    在线程池中执行的预读步骤。DELETE 只需判断是否存在；CREATE/OVERWRITE 使用
+    content_compare 的快速比较，不必完整读取和解码现有文件；APPEND 只读取文件末尾；
+    PATCH/REPLACE 读取现有文件并在线程池中完成补丁应用；BINARY 在线程池中解码并计算摘要。
+    错误留给调用方按顺序输出。
+    """
+    if operation_type == "DELETE":
+        return TargetProbe(fs.exists(target_path), False, "", None)
+    if operation_type == "BINARY":
+        return _probe_binary(fs, target_path, new_content)
+    if operation_type in PATCH_OPERATIONS:
+        return _probe_patch(fs, operation_type, target_path, new_content, fs.isfile(target_path))
+    if not fs.isfile(target_path):
+        return TargetProbe(False, False, "", None)
+    if operation_type in ("CREATE", "OVERWRITE"):
+        unchanged, error, text_format = content_matches_file(fs, target_path, new_content)
+        return TargetProbe(True, unchanged, "", error, text_format=text_format)
+    try:
+        return _probe_append(fs, target_path, new_content)
+    except Exception as e:
+        return TargetProbe(True, False, "\n", e)
+
+
+class ApplyPlan:
+    """
+    一批代码块经过比对后得到的执行计划：待写入文件、待删除文件以及确认提示中的明细行。
+    """
+    def __init__(self, root_folder):
+        self.root_folder = root_folder
+        # 每项为 dict: filename, code_content (str、TextSpan、片段元组或 BinaryContent), target_path, target_dir, operation
+        # [, write_mode, content_prefix, merged_operations, text_format]；每个路径至多一项
+        self.files_to_write = []
+        self.files_to_delete = [] # 目标文件的完整路径
+        self.prompt_details = []
+        self.target_paths = frozenset() # 规划时检查过的所有路径（包括内容一致而跳过的），用于判断计划是否过期
+        self.path_notes = [] # 文件索引对代码块中路径的解析说明
+        self.projects = () # 由 merge_plans 合并时为 ((项目名, 根目录), ...)
+        self.previews = None # diff_preview.PlanPreviews，由 DiffPreviewer.start() 设置，在后台陆续完成
+
+    def root_folders(self):
+        """计划涉及的所有根目录。"""
+        return [root_folder for _, root_folder in self.projects] or [self.root_folder]
+
+    def is_empty(self):
+        return not self.files_to_write and not self.files_to_delete
+
+    def operation_count(self):
+        return len(self.files_to_write) + len(self.files_to_delete)
+
+    def build_prompt_message(self):
+        """构建确认对话框中显示的提示消息。"""
+        if len(self.projects) > 1:
+            roots = ''.join(f"- {name}: '{root_folder}'\n" for name, root_folder in self.projects)
+            target = f"以下 {len(self.projects)} 个项目根目录下？\n{roots}"
+        else:
+            target = f"您的项目根目录 '{self.root_folder}' 下？\n"
+        prompt_message_parts = [
+            f"在剪贴板中检测到 {self.operation_count()} 个操作请求。\n"
+            f"是否执行这些操作到{target}"
+        ]
+        if self.prompt_details:
+            details = ' \n'.join(self.prompt_details)
+            prompt_message_parts.append(f"\n以下操作将被执行：\n{details}\n")
+        if self.previews is not None:
+            # 只使用已经完成的预览，不等待；确认窗口在全部完成后重新显示
+            preview_lines = '\n'.join(self.previews.format_lines())
+            prompt_message_parts.append(f"\n差异预览：\n{preview_lines}\n")
+        if self.path_notes:
+            notes = ' \n'.join(self.path_notes)
+            prompt_message_parts.append(f"\n路径解析：\n{notes}\n")
+
+        prompt_message_parts.append("\n注意：")
+        operations = {f['operation'] for f in self.files_to_write}
+        if "CREATE" in operations:
+            prompt_message_parts.append(" - 'CREATE' 操作将创建新文件。")
+        if "OVERWRITE" in operations or "OVERWRITE_ON_CREATE" in operations:
+            prompt_message_parts.append(" - 'OVERWRITE' 或因 'CREATE' 请求导致的覆盖操作将覆盖现有文件内容。")
+        if "APPEND" in operations:
+            prompt_message_parts.append(" - 'APPEND' 操作将追加内容到现有文件末尾。")
+        if operations.intersection(PATCH_OPERATIONS):
+            prompt_message_parts.append(" - 'PATCH' 或 'REPLACE' 操作只修改匹配到的部分，被拒绝的块不会被应用。")
+        if "BINARY" in operations:
+            prompt_message_parts.append(" - 'BINARY' 操作将把 base64 解码后的内容写入文件（创建或覆盖）。")
+        if self.files_to_delete:
+            prompt_message_parts.append(" - 'DELETE' 操作将删除指定文件。")
+        return "".join(prompt_message_parts)
+
+
+def _content_chunks(content):
+    """写入内容（str、TextSpan 或片段元组）的文本块。"""
+    if isinstance(content, tuple):
+        return chain.from_iterable(iter_content_chunks(piece) for piece in content)
+    return iter_content_chunks(content)
+
+
+def _output_format(text_format, content):
+    """
+    整体写入时使用的格式：沿用现有文件的格式（新文件为 None，即 DEFAULT_FORMAT）。
+    内容无法用现有文件的编码（GBK 等）表示时改为不带 BOM 的 UTF-8，换行符不变。
+    返回 (格式, 确认提示中的说明或 None)。
+    """
+    if text_format is None or text_format.can_encode(_content_chunks(content)):
+        return text_format, None
+    converted = TextFormat('utf-8', False, text_format.newline)
+    return converted, f"  新内容无法用 {text_format.encoding.upper()} 编码表示，将改为 {converted.describe()} 写入"
+
+
+def _schedule_write(plan, overlay, file_info):
+    """同一批次中有多个代码块的路径只在覆盖层中模拟写入，其余路径直接加入计划。"""
+    target_path = file_info['target_path']
+    if not overlay.is_loaded(target_path):
+        plan.files_to_write.append(file_info)
+    elif file_info.get('write_mode') == 'a':
+        if file_info.get('content_prefix'):
+            overlay.append_text(target_path, file_info['content_prefix'])
+        overlay.append_text(target_path, file_info['code_content'])
+    else:
+        overlay.write_text(target_path, file_info['code_content'])
+
+
+def _plan_net_change(plan, overlay, target_path, filename, operations, details):
+    """
+    将覆盖层中一个路径的最终净变化加入计划，返回该路径在确认提示中的明细文本。
+    写入沿用底层文件的格式（见 _output_format）。
+    """
+    change = overlay.net_change(target_path)
+    merged = f"合并 {len(operations)} 个操作 ({', '.join(operations)})"
+    if change is None:
+        print(f"文件 '{filename}' 的 {len(operations)} 个操作合并后内容不变，跳过写入。")
+        summary = f"- '{filename}' ({merged}, 最终内容不变，无需写入)"
+    elif change[0] == 'delete':
+        plan.files_to_delete.append(target_path)
+        summary = f"- '{filename}' ({merged}: 删除, 路径: '{target_path}')"
+    else:
+        write_mode, content = change
+        text_format, format_note = _output_format(overlay.text_format(target_path), content)
+        if write_mode == 'a' and format_note is not None:
+            # 追加的部分必须与现有内容使用同一编码
+            encoding_name = overlay.text_format(target_path).encoding.upper()
+            print(f"[WARNING] 文件 '{filename}' 合并后追加的内容无法用 {encoding_name} 编码表示，跳过写入。", file=sys.stderr)
+            summary = f"- '{filename}' ({merged}: 追加的内容无法用 {encoding_name} 编码表示，已跳过)"
+            return ' \n'.join([summary] + ["  " + line for line in details])
+        if write_mode == 'a':
+            operation, status = "APPEND", "追加"
+        elif overlay.existed_before(target_path):
+            operation, status = "OVERWRITE", "更新"
+        else:
+            operation, status = "CREATE", "创建"
+        plan.files_to_write.append({
+            'filename': filename,
+            'code_content': content,
+            'target_path': target_path,
+            'target_dir': os.path.dirname(target_path),
+            'operation': operation,
+            'write_mode': write_mode,
+            'merged_operations': len(operations),
+            'text_format': text_format
+        })
+        summary = f"- '{filename}' ({merged}: 一次{status}, 将写入到: '{target_path}')"
+        if format_note is not None:
+            details = details + [format_note.strip()]
+    return ' \n'.join([summary] + ["  " + line for line in details])
+
+
+class _RootGuard:
+    """
+    判断目标路径在解析符号链接（包括最后一个组成部分）之后是否仍位于根目录之内，
+    拒绝 `../`、绝对路径以及指向根目录之外的符号链接。目录的解析结果在一次规划中缓存。
+    """
+    def __init__(self, root_folder):
+        self.root = os.path.normcase(os.path.realpath(root_folder))
+        self._directories = {}
+
+    def allows(self, path):
+        directory, name = os.path.split(os.path.abspath(path))
+        real_directory = self._directories.get(directory)
+        if real_directory is None:
+            real_directory = self._directories[directory] = os.path.realpath(directory)
+        real_path = os.path.join(real_directory, name)
+        if os.path.islink(real_path):
+            real_path = os.path.realpath(real_path)
+        real_path = os.path.normcase(real_path)
+        try:
+            return real_path != self.root and os.path.commonpath([self.root, real_path]) == self.root
+        except ValueError: # Windows 上位于不同的驱动器
+            return False
+
+
+def _resolve_filename(file_index, filename, operation_type, redirect=False):
+    """
+    用文件索引修正只有文件名或目录不对的路径，返回 (实际使用的文件名, 确认提示中的说明或 None, 是否已改用建议的路径)。
+    路径存在时不修正；CREATE 可能确实要新建文件，DELETE 不能删错文件，都不修正，只在提示中列出相似的现有文件；
+    有多个候选时也不修正，由用户决定。唯一候选只是建议：redirect 为 True（计划会经用户确认）时才改用，否则只列出。
+    """
+    resolution = file_index.resolve(filename)
+    if resolution.exact or not resolution.candidates:
+        return filename, None, False
+    if resolution.path is not None and operation_type not in ("CREATE", "DELETE"):
+        if redirect:
+            return resolution.path, f"- '{filename}' 不存在，建议解析为现有文件 '{resolution.path}'（确认后按此路径执行）", True
+        return filename, f"- '{filename}' 不存在，可能是现有文件 '{resolution.path}'，未经确认不自动解析", False
+    listed = ", ".join(f"'{candidate}'" for candidate in resolution.candidates) + (" 等" if resolution.truncated else "")
+    if operation_type == "CREATE":
+        return filename, f"- '{filename}' 将作为新文件创建；已有相似的文件: {listed}", False
+    if operation_type == "DELETE":
+        return filename, f"- '{filename}' 不存在，不会删除相似的现有文件: {listed}", False
+    return filename, f"- '{filename}' 不存在，有多个可能的现有文件: {listed}，未自动解析", False
+
+
+def plan_blocks(blocks, root_folder, confirm_overwrite_on_create, fs=None, max_workers=DEFAULT_IO_WORKERS,
+                file_index=None, redirect_missing=False):
+    """
+    将扫描得到的代码块与根目录下的现有文件比对，生成 ApplyPlan。
+    内容与现有文件一致的块会被跳过。
+    confirm_overwrite_on_create(filename, target_path) 在 CREATE 的目标已存在且内容不同时调用，
+    返回 True 表示覆盖，False 表示跳过该文件。
+
+    现有文件的读取在有界线程池中并发完成；比对、确认回调和日志输出仍按代码块顺序
+    在调用线程中进行，因此结果与串行执行一致。
+    同一路径上有多个代码块时，该路径只读取一次并在内存覆盖层 (OverlayFileSystem) 中依次应用，
+    后面的代码块基于前面代码块的结果比对；计划中只包含该路径的最终净变化。
+    提供 file_index (file_index.FileIndex) 时，不存在的路径按索引查找现有文件，说明记录在 plan.path_notes 中；
+    只有 redirect_missing 为 True（计划会交给用户确认）时才改用唯一的候选，改用的路径同时列在操作明细中。
+    解析符号链接后位于 root_folder 之外的目标（`../`、绝对路径、指向外部的链接）一律拒绝。
+    """
+    fs = fs or LocalFileSystem()
+    plan = ApplyPlan(root_folder)
+    root_guard = _RootGuard(root_folder)
+
+    requests = []
+    for block in blocks:
+        filename = block.filename.strip()
+        operation_raw = block.operation.strip() # 获取原始操作指令
+        # BINARY 的指令可以带完整性校验，例如 `BINARY sha256=<摘要>`
+        operation_name, integrity = split_integrity(operation_raw)
+        operation_type = normalize_operation(operation_name)
+        if integrity is not None and operation_type != "BINARY":
+            operation_type = None
+        if operation_type is None:
+            # 扫描器接受括号内的任意指令文本，未知指令在此跳过
+            print(f"[WARNING] 检测到文件 '{filename}' 的未知操作类型 '{operation_raw}'，跳过此代码块。", file=sys.stderr)
+            continue
+        if file_index is not None:
+            requested = filename
+            filename, note, redirected = _resolve_filename(file_index, filename, operation_type, redirect_missing)
+            if note is not None and note not in plan.path_notes:
+                plan.path_notes.append(note)
+            redirect_detail = f"- '{requested}' -> '{filename}' ({operation_type} - 原路径不存在，按建议的现有文件执行)"
+            if redirected and redirect_detail not in plan.prompt_details:
+                plan.prompt_details.append(redirect_detail)
+        if operation_type == "BINARY":
+            # base64 不预先解码，只引用载荷中的文本；空白在解码时忽略
+            code_content_normalized = BinaryContent(block.content, integrity)
+        elif isinstance(block.content, TextSpan):
+            # 零拷贝模式：只保留区间，换行符在比较和写入时按块标准化；补丁内容较小，直接生成文本
+            code_content_normalized = block.content.normalized() if operation_type in PATCH_OPERATIONS else block.content.strip()
+        else:
+            # 补丁的首行可能以表示上下文的空格开头，不能 strip()
+            code_content_raw = block.content if operation_type in PATCH_OPERATIONS else block.content.strip()
+            # 标准化剪贴板内容的换行符
+            code_content_normalized = code_content_raw.replace('\r\n', '\n').replace('\r', '\n')
+        target_path = os.path.join(root_folder, filename)
+        if not root_guard.allows(target_path):
+            print(f"[WARNING] 文件 '{filename}' 位于项目根目录 '{root_folder}' 之外，拒绝 {operation_type} 操作。", file=sys.stderr)
+            plan.prompt_details.append(f"- '{filename}' ({operation_type} - 路径位于项目根目录之外，已拒绝)")
+            continue
+        requests.append((filename, operation_type, target_path, code_content_normalized))
+
+    # BINARY 的内容不进入文本覆盖层：同一载荷中还有其他代码块操作该路径时，该路径的所有代码块都跳过
+    path_counts = Counter(request[2] for request in requests)
+    shared_binary = {request[2]: request[0] for request in reversed(requests)
+                     if request[1] == "BINARY" and path_counts[request[2]] > 1}
+    if shared_binary:
+        for target_path, filename in shared_binary.items():
+            print(f"[WARNING] 文件 '{filename}' 的 BINARY 代码块不能与同一文件的其他 {path_counts[target_path] - 1} 个代码块合并，"
+                  f"跳过该文件的所有代码块。", file=sys.stderr)
+            plan.prompt_details.append(f"- '{filename}' (BINARY - 同一载荷中还有其他代码块操作此文件，已全部跳过)")
+        requests = [request for request in requests if request[2] not in shared_binary]
+
+    # 被多个代码块操作的路径整体读入覆盖层（每个路径一次），其余路径按原方式并发预读
+    path_counts = Counter(request[2] for request in requests)
+    plan.target_paths = frozenset(path_counts)
+    overlay = OverlayFileSystem(fs)
+    map_in_pool(overlay.load, [path for path, count in path_counts.items() if count > 1], max_workers)
+    single_indexes = [index for index, request in enumerate(requests) if path_counts[request[2]] == 1]
+    probes = dict(zip(single_indexes, map_in_pool(lambda index: _probe_target(fs, *requests[index][1:]),
+                                                  single_indexes, max_workers)))
+    # 覆盖层中的路径：代码块的明细先收集起来，在第一次出现的位置输出合并后的摘要
+    shared_paths = {} # target_path -> (filename, 操作列表, 明细行, 在 prompt_details 中的位置)
+
+    for index, (filename, operation_type, target_path, code_content_normalized) in enumerate(requests):
+        if overlay.is_loaded(target_path):
+            if target_path not in shared_paths:
+                shared_paths[target_path] = (filename, [], [], len(plan.prompt_details))
+                plan.prompt_details.append(None)
+            shared_paths[target_path][1].append(operation_type)
+            details = shared_paths[target_path][2]
+            # 覆盖层已包含本批次中前面代码块的结果，这里的预读不访问磁盘
+            probe = _probe_target(overlay, operation_type, target_path, code_content_normalized)
+        else:
+            details = plan.prompt_details
+            probe = probes[index]
+        file_exists, read_error = probe.exists, probe.read_error
+        target_dir = os.path.dirname(target_path)
+        if read_error is not None:
+            print(f"[WARNING] 无法读取文件 '{target_path}' 进行比较 ({operation_type}): {read_error}. 将视为新内容或空内容。", file=sys.stderr)
+
+        # --- 处理 DELETE 操作 ---
+        if operation_type == "DELETE":
+            if file_exists:
+                if overlay.is_loaded(target_path):
+                    overlay.remove(target_path)
+                else:
+                    plan.files_to_delete.append(target_path)
+                details.append(f"- '{filename}' (删除, 路径: '{target_path}')")
+            else:
+                print(f"[INFO] 文件 '{filename}' 不存在，跳过删除操作。")
+                details.append(f"- '{filename}' (删除 - 文件不存在，已跳过)")
+            continue
+
+        # --- 处理 BINARY 操作 ---
+        if operation_type == "BINARY":
+            summary = probe.binary_summary
+            if isinstance(summary, BinaryContentError):
+                print(f"[WARNING] 文件 '{filename}' 的 BINARY 内容无效: {summary}，跳过此代码块。", file=sys.stderr)
+                details.append(f"- '{filename}' (BINARY - {summary}，已跳过)")
+                continue
+            if file_exists and probe.unchanged:
+                print(f"文件 '{filename}' (BINARY) 内容与现有文件一致，跳过写入。")
+                continue
+            size, digest = summary
+            verified = "已校验" if code_content_normalized.expected_digest is not None else "未提供校验值"
+            _schedule_write(plan, overlay, {
+                'filename': filename,
+                'code_content': code_content_normalized,
+                'target_path': target_path,
+                'target_dir': target_dir,
+                'operation': operation_type,
+                'write_mode': 'w'
+            })
+            details.append(f"- '{filename}' ({'覆盖' if file_exists else '创建'}二进制文件, {size} 字节, "
+                           f"sha256 {digest[:12]}… {verified}, 将写入到: '{target_path}')")
+            continue
+
+        # --- 处理 CREATE 操作 ---
+        if operation_type == "CREATE":
+            if file_exists:
+                if probe.unchanged:
+                    print(f"文件 '{filename}' (CREATE) 内容与现有文件一致，跳过写入。")
+                    continue # 如果文件存在且内容一致，跳过
+                # 文件存在但内容不同，CREATE 操作应询问是否覆盖
+                if not confirm_overwrite_on_create(filename, target_path):
+                    print(f"用户取消了 '{filename}' (CREATE) 操作，文件已存在且内容不同。")
+                    continue # 用户选择不覆盖，跳过此文件
+                # 如果用户确认覆盖，则视为覆盖操作
+                status = "覆盖 (CREATE 请求)"
+                operation_for_log = "OVERWRITE_ON_CREATE"
+            else:
+                status = "创建"
+                operation_for_log = "CREATE"
+
+            text_format, format_note = _output_format(probe.text_format, code_content_normalized)
+            _schedule_write(plan, overlay, {
+                'filename': filename,
+                'code_content': code_content_normalized,
+                'target_path': target_path,
+                'target_dir': target_dir,
+                'operation': operation_for_log, # 存储实际执行的操作类型
+                'text_format': text_format # 覆盖现有文件时沿用它的编码、BOM 和换行符
+            })
+            details.append(f"- '{filename}' ({status}, 将写入到: '{target_path}')")
+            if format_note is not None:
+                details.append(format_note)
+            continue
+
+        # --- 处理 PATCH 和 REPLACE 操作 ---
+        if operation_type in PATCH_OPERATIONS:
+            result = probe.patch_result
+            if read_error is not None:
+                details.append(f"- '{filename}' ({operation_type} - 无法读取现有文件，已跳过)")
+                continue
+            if isinstance(result, PatchParseError):
+                print(f"[WARNING] 文件 '{filename}' 的 {operation_type} 内容无法解析: {result}，跳过此代码块。", file=sys.stderr)
+                details.append(f"- '{filename}' ({operation_type} - 补丁无法解析，已跳过)")
+                continue
+            rejected_details = [f"    第 {number} 个块被拒绝: {reason}" for number, reason in result.rejected]
+            if not result.applied:
+                print(f"[WARNING] 文件 '{filename}' ({operation_type}) 的 {len(result.rejected)} 个块全部被拒绝，跳过写入。", file=sys.stderr)
+                details.append(f"- '{filename}' ({operation_type} - 全部 {len(result.rejected)} 个块被拒绝，已跳过)")
+                details.extend(rejected_details)
+                continue
+            if probe.unchanged:
+                print(f"文件 '{filename}' ({operation_type}) 应用后内容与现有文件一致，跳过写入。")
+                continue
+            status = f"{'修改' if file_exists else '创建'}, 应用 {len(result.applied)} 个块"
+            if result.rejected:
+                status += f", 拒绝 {len(result.rejected)} 个块"
+            text_format, format_note = _output_format(probe.text_format, result.content)
+            _schedule_write(plan, overlay, {
+                'filename': filename,
+                'code_content': result.content,
+                'target_path': target_path,
+                'target_dir': target_dir,
+                'operation': operation_type,
+                'write_mode': 'w',
+                'text_format': text_format
+            })
+            details.append(f"- '{filename}' ({status}, 将写入到: '{target_path}')")
+            if format_note is not None:
+                details.append(format_note)
+            details.extend(rejected_details)
+            continue
+
+        # --- 处理 OVERWRITE 和 APPEND 操作 ---
+        content_to_write = code_content_normalized
+        content_prefix = ""
+        write_mode = 'w'
+        text_format, format_note = probe.text_format, None
+
+        if operation_type == "OVERWRITE":
+            # 比较规则不变：现有文件内容标准化换行并 strip() 后与剪贴板内容相等（见 content_compare）
+            if file_exists and probe.unchanged:
+                print(f"文件 '{filename}' (OVERWRITE) 内容与现有文件一致，跳过写入。")
+                continue # 内容一致，跳过此文件
+            status = "更新" if file_exists else "创建"
+            text_format, format_note = _output_format(text_format, code_content_normalized)
+        else: # APPEND
+            # 如果文件存在，只在文件末尾写入新增内容，不再读取和重写整个文件
+            if file_exists:
+                # 追加的内容为空，或文件末尾已经是这段内容（重复应用同一载荷）时跳过
+                if probe.unchanged:
+                    print(f"文件 '{filename}' (APPEND) 内容已位于文件末尾，跳过写入。")
+                    continue
+                # 追加的部分必须与现有内容使用同一编码，无法表示时不能只追加
+                if text_format is not None and not text_format.can_encode(_content_chunks(code_content_normalized)):
+                    encoding_name = text_format.encoding.upper()
+                    print(f"[WARNING] 文件 '{filename}' (APPEND) 的内容无法用文件的 {encoding_name} 编码表示，跳过写入。", file=sys.stderr)
+                    details.append(f"- '{filename}' (APPEND - 内容无法用 {encoding_name} 编码表示，已跳过)")
+                    continue
+                # 确保追加的内容前有换行符，除非现有文件为空或已以换行结尾
+                if isinstance(code_content_normalized, TextSpan):
+                    content_prefix = probe.append_separator # 零拷贝内容不拼接，写入时先写前缀
+                else:
+                    content_to_write = probe.append_separator + code_content_normalized
+                write_mode = 'a'
+            status = "追加" if file_exists else "创建并写入" # 文件不存在时 APPEND 等同于创建
+
+        _schedule_write(plan, overlay, {
+            'filename': filename,
+            'code_content': content_to_write,
+            'target_path': target_path,
+            'target_dir': target_dir,
+            'operation': operation_type, # 用于提示和日志
+            'write_mode': write_mode, # 'a' 表示以追加模式只写入新增内容
+            'content_prefix': content_prefix, # 仅用于 TextSpan 内容
+            'text_format': text_format
+        })
+        details.append(f"- '{filename}' ({status}, 将{operation_type.lower()}到: '{target_path}')")
+        if format_note is not None:
+            details.append(format_note)
+
+    # 覆盖层中的每个路径只写入（或删除）一次最终结果
+    for target_path, (filename, operations, details, position) in shared_paths.items():
+        plan.prompt_details[position] = _plan_net_change(plan, overlay, target_path, filename, operations, details)
+    return plan
+
+
+def _restore_line_endings(fs, target_path, content, text_format):
+    """
+    混合换行的文件整体写入时，新内容中与原文件对应（diff_preview.match_lines）的行沿用原来的换行符，
+    新增和修改的行使用占多数的换行符，避免未修改的行因换行符统一而改变。
+    返回已包含换行符的文本；原文件无法读取时返回 None，按占多数的换行符写入。
+    """
+    try:
+        with fs.open_binary(target_path) as f:
+            old_lines, old_endings, _ = text_format.decode_lines(f.read())
+    except OSError:
+        return None
+    new_lines = ''.join(_content_chunks(content)).split('\n')
+    last = new_lines.pop() # 最后一个换行符之后的内容
+    old_ids, new_ids = intern_lines(old_lines, new_lines)
+    matches, _ = match_lines(old_ids, new_ids, deadline=time.perf_counter() + LINE_ENDING_TIME_BUDGET)
+    new_endings = [text_format.newline] * len(new_lines)
+    for i, j in matches:
+        new_endings[j] = old_endings[i]
+    return ''.join(chain.from_iterable(zip(new_lines, new_endings))) + last
+
+
+def _write_content(fs, path, file_info, mode):
+    """
+    把一个写入操作的内容写到 path（mode 为 'w' 或 'a'）。
+    TextSpan 内容按块标准化换行符并直接写入，不生成完整副本；
+    合并后的片段元组（见 OverlayFileSystem.net_change）依次逐块写入。
+    内容按 file_info 中的 text_format 编码；追加的部分不带 BOM。
+    混合换行的现有文件整体写入时，未修改的行保留原来的换行符（见 _restore_line_endings）。
+    BinaryContent 按块解码后直接写入字节。
+    """
+    content = file_info['code_content']
+    if isinstance(content, BinaryContent):
+        fs.write_binary_chunks(path, content.iter_bytes())
+        return
+    text_format = file_info.get('text_format')
+    if text_format is not None and file_info.get('write_mode') == 'a':
+        text_format = text_format._replace(bom=False)
+    elif text_format is not None and text_format.mixed_newlines and mode == 'w':
+        restored = _restore_line_endings(fs, file_info['target_path'], content, text_format)
+        if restored is not None:
+            fs.write_text(path, restored, text_format._replace(newline='\n')) # 换行符已在文本中，不再转换
+            return
+    if isinstance(content, tuple):
+        fs.write_chunks(path, _content_chunks(content), mode, text_format)
+    elif isinstance(content, TextSpan):
+        fs.write_chunks(path, chain((file_info.get('content_prefix', ""),), content.iter_normalized()), mode, text_format)
+    elif mode == 'a':
+        fs.append_text(path, content, text_format)
+    else:
+        fs.write_text(path, content, text_format)
+
+
+def _write_kind(file_infos):
+    """同一路径上的写入只有追加时提交为追加（'append'），否则为整体替换（'write'）。"""
+    return 'append' if all(f.get('write_mode') == 'a' for f in file_infos) else 'write'
+
+
+def _stage_group(transaction, fs, file_infos, before_change=None):
+    """
+    把同一路径上的所有写入按顺序合并到一个临时文件：整体替换从最后一个整体写入开始，之前的写入不影响结果；
+    只有追加时临时文件只包含追加的内容。before_change 在暂存之前调用，失败时整个批次回滚。
+    """
+    target_path = file_infos[0]['target_path']
+    kind = _write_kind(file_infos)
+    if before_change is not None:
+        before_change(target_path, kind == 'append')
+    first = 0
+    if kind == 'write':
+        first = max(index for index, f in enumerate(file_infos) if f.get('write_mode') != 'a')
+    temp_path = transaction.begin_stage(target_path)
+    for index, file_info in enumerate(file_infos[first:]):
+        _write_content(fs, temp_path, file_info, 'w' if index == 0 else 'a')
+    transaction.end_stage(target_path)
+
+
+def _stage_delete(fs, file_path, before_change=None):
+    """返回要删除的文件是否存在；存在时在提交之前调用 before_change。"""
+    if not fs.exists(file_path): # 再次检查文件是否存在，以防并发操作
+        return False
+    if before_change is not None:
+        before_change(file_path, False)
+    return True
+
+
+def _capture_error(func, *args):
+    try:
+        return func(*args), None
+    except Exception as e:
+        return None, e
+
+
+def commit_plan(plan, fs=None, max_workers=DEFAULT_IO_WORKERS, before_change=None,
+                durability=DEFAULT_DURABILITY, transaction_log=None):
+    """
+    以一个事务执行计划中的写入和删除操作（见 transaction.Transaction）：
+    每个路径的新内容先写入同目录的临时文件，全部成功后按 durability 刷盘、在 transaction_log 中记录提交点，
+    再原子替换目标文件并执行删除；任何路径暂存失败时删除所有临时文件，整个批次不修改任何文件。
+    中途崩溃时由 transaction_log.recover() 在下次启动时回滚或继续完成。
+    目录创建在整个批次内去重；暂存、替换和删除在有界线程池中并发执行，
+    同一路径上的多次写入按原顺序合并到一个临时文件。日志按计划顺序输出。
+    before_change(target_path, append_only) 在每个路径被修改之前、在同一个工作线程中调用（见 journal）。
+    返回失败列表，每项为 (操作类型, 路径, 异常)，由调用方统一展示。
+    """
+    fs = fs or LocalFileSystem()
+    if not plan.files_to_write and not plan.files_to_delete:
+        return []
+    transaction = Transaction(fs, durability, transaction_log)
+
+    # 按目标路径分组，保证同一文件的写入顺序
+    groups = {}
+    for file_info in plan.files_to_write:
+        groups.setdefault(file_info['target_path'], []).append(file_info)
+    transaction.prepare(((path, _write_kind(group)) for path, group in groups.items()), plan.files_to_delete)
+
+    # 去重后的目录只创建一次
+    stage_errors = {}
+    for target_dir in sorted({f['target_dir'] for f in plan.files_to_write if f['target_dir']}):
+        try:
+            fs.makedirs(target_dir)
+        except Exception as e:
+            stage_errors.update((path, e) for path, group in groups.items() if group[0]['target_dir'] == target_dir)
+    if not stage_errors:
+        staged = map_in_pool(lambda group: _capture_error(_stage_group, transaction, fs, group, before_change),
+                             groups.values(), max_workers)
+        stage_errors.update((path, error) for path, (_, error) in zip(groups, staged) if error is not None)
+    if not stage_errors:
+        delete_checks = map_in_pool(lambda path: _capture_error(_stage_delete, fs, path, before_change),
+                                    plan.files_to_delete, max_workers)
+        stage_errors.update((path, error) for path, (_, error) in zip(plan.files_to_delete, delete_checks)
+                            if error is not None)
+
+    if stage_errors:
+        # 提交点之前失败：删除临时文件，所有路径保持原样
+        transaction.abort(max_workers)
+        aborted = TransactionAborted("批次中其他文件暂存失败，整个批次已回滚，此文件未被修改")
+        return ([(f['operation'], f['target_path'], stage_errors.get(f['target_path'], aborted))
+                 for f in plan.files_to_write]
+                + [("DELETE", path, stage_errors.get(path, aborted)) for path in plan.files_to_delete])
+
+    transaction.deletes = [path for path, (exists, _) in zip(plan.files_to_delete, delete_checks) if exists]
+    write_results, delete_results = transaction.commit(max_workers)
+    errors = []
+    for file_info in plan.files_to_write:
+        error = write_results.get(file_info['target_path'])
+        if error is not None:
+            errors.append((file_info['operation'], file_info['target_path'], error))
+            continue
+        # 根据实际操作类型打印日志
+        log_operation_type = file_info['operation'].replace("OVERWRITE_ON_CREATE", "CREATE (已覆盖)").lower()
+        print(f"文件 '{file_info['target_path']}' 已成功 {log_operation_type}。")
+
+    deleted_results = dict(zip(transaction.deletes, delete_results))
+    for file_path in plan.files_to_delete:
+        deleted, error = deleted_results.get(file_path, (False, None))
+        if error is not None:
+            errors.append(("DELETE", file_path, error))
+        elif deleted:
+            print(f"文件 '{file_path}' 已成功删除。")
+        else:
+            print(f"尝试删除的文件 '{file_path}' 不存在，已跳过。")
+    return errors
+
+
+def plan_file_results(plan, errors=None, status=None):
+    """
+    按计划顺序返回每个文件的结果，每项为 dict: path, operation, status, error。
+    status 为 'written'、'deleted' 或 'failed'（errors 为 commit_plan 返回的失败列表）；
+    计划未执行时所有文件使用调用方给出的 status，例如 'cancelled'。结果可直接序列化为 JSON。
+    """
+    failed = {(operation, path): error for operation, path, error in errors or ()}
+    results = []
+    for operation, path, done_status in chain(
+            ((f['operation'], f['target_path'], 'written') for f in plan.files_to_write),
+            (("DELETE", path, 'deleted') for path in plan.files_to_delete)):
+        error = failed.get((operation, path))
+        results.append({
+            'path': path,
+            'operation': operation,
+            'status': status or ('failed' if error is not None else done_status),
+            'error': str(error) if error is not None else None,
+        })
+    return results
+
+
+def merge_plans(named_plans, notes=()):
+    """
+    将多个项目根目录下的计划（见 project_router）合并为一个 ApplyPlan，named_plans 为 [(项目名, ApplyPlan)]。
+    计划中的目标路径都是完整路径，合并后 commit_plan 和过期检查都不需要区分项目；
+    确认提示中的明细按项目分组。notes 为路由说明，放在路径解析的最前面。
+    """
+    if len(named_plans) == 1:
+        name, plan = named_plans[0]
+        plan.projects = ((name, plan.root_folder),)
+        plan.path_notes[:0] = notes
+        return plan
+    merged = ApplyPlan(named_plans[0][1].root_folder)
+    merged.projects = tuple((name, plan.root_folder) for name, plan in named_plans)
+    merged.path_notes.extend(notes)
+    target_paths = set()
+    for name, plan in named_plans:
+        merged.files_to_write.extend(plan.files_to_write)
+        merged.files_to_delete.extend(plan.files_to_delete)
+        target_paths.update(plan.target_paths)
+        if plan.prompt_details:
+            merged.prompt_details.append(f"[{name}]")
+            merged.prompt_details.extend("  " + detail.replace("\n", "\n  ") for detail in plan.prompt_details)
+        merged.path_notes.extend(f"[{name}] {note[2:] if note.startswith('- ') else note}" for note in plan.path_notes)
+    merged.target_paths = frozenset(target_paths)
+    return merged
+
+
+def format_commit_errors(errors):
+    """将 commit_plan 返回的失败列表格式化为一条汇总消息。"""
+    lines = [f"{len(errors)} 个操作失败："]
+    for operation, path, error in errors:
+        lines.append(f"- {operation} '{path}': {error}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    # 直接运行 `python apply_engine.py`：在注入延迟的文件系统上比较串行与线程池的规划/写入耗时，
+    # 并测量 APPEND 的 I/O 量和大载荷的峰值内存（正确性检查见 tests/test_apply_engine.py）。
+    import tempfile
+    from block_scanner import scan_blocks
+    from file_system import CountingFileSystem, LatencyFileSystem
+
+    file_count = 200
+    latency = 0.005
+    payload = "".join(
+        f"#### file: pkg{i % 10}/module_{i}.py (OVERWRITE)\n```python\nVALUE = {i}\n```\n" for i in range(file_count)
+    )
+    blocks = list(scan_blocks(payload))
+    for workers in (1, DEFAULT_IO_WORKERS, 32):
+        with tempfile.TemporaryDirectory() as root:
+            fs = LatencyFileSystem(latency)
+            started = time.perf_counter()
+            plan = plan_blocks(blocks, root, lambda *_: True, fs=fs, max_workers=workers)
+            planned = time.perf_counter()
+            _stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w') # 基准测试时不输出逐文件日志
+            try:
+                errors = commit_plan(plan, fs=fs, max_workers=workers)
+            finally:
+                sys.stdout.close()
+                sys.stdout = _stdout
+            committed = time.perf_counter()
+            print(f"{file_count} 个文件, 每次调用延迟 {latency * 1000:.0f} ms, 线程数 {workers:2d}: "
+                  f"规划 {(planned - started) * 1000:7.1f} ms, 写入 {(committed - planned) * 1000:7.1f} ms, "
+                  f"文件系统调用 {fs.calls} 次, 失败 {len(errors)} 个")
+
+    # APPEND 的 I/O 量：对同一文件追加 10,000 次，总读写字节数应随次数线性增长
+    with tempfile.TemporaryDirectory() as root:
+        fs = CountingFileSystem()
+        _stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        checkpoints = []
+        try:
+            for i in range(1, 10001):
+                block = next(scan_blocks(f"#### file: CHANGELOG.md (APPEND)\n```\n- entry {i}\n```\n"))
+                commit_plan(plan_blocks([block], root, lambda *_: True, fs=fs, max_workers=1), fs=fs, max_workers=1)
+                if i in (100, 1000, 10000):
+                    checkpoints.append((i, fs.bytes_read, fs.bytes_written, os.path.getsize(os.path.join(root, 'CHANGELOG.md'))))
+        finally:
+            sys.stdout.close()
+            sys.stdout = _stdout
+        for appends, bytes_read, bytes_written, file_size in checkpoints:
+            print(f"追加 {appends:5d} 次: 文件 {file_size:8d} 字节, 累计读取 {bytes_read:8d} 字节 "
+                  f"({bytes_read / appends:.0f}/次), 累计写入 {bytes_written:7d} 字节 ({bytes_written / appends:.1f}/次)")
+
+    # 大载荷的峰值内存：载荷本身之外的额外分配（tracemalloc 统计）
+    import tracemalloc
+    row = "INSERT INTO fixtures VALUES (1, 'name', '数据', 3.14);\r\n"
+    body = row * (10 * 1024 * 1024 // len(row))
+    large_payload = "".join(
+        f"#### file: {name} ({operation})\n```sql\n{body}```\n"
+        for name, operation in (("dump_new.sql", "OVERWRITE"), ("dump_same.sql", "CREATE"), ("dump_log.sql", "APPEND"))
+    )
+    for zero_copy in (False, True):
+        with tempfile.TemporaryDirectory() as root:
+            with open(os.path.join(root, 'dump_same.sql'), 'w', encoding='utf-8') as f:
+                f.write(body.replace('\r\n', '\n'))
+            with open(os.path.join(root, 'dump_log.sql'), 'w', encoding='utf-8') as f:
+                f.write("-- log\n")
+            _stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+            tracemalloc.start()
+            try:
+                large_blocks = list(scan_blocks(large_payload, zero_copy=zero_copy))
+                plan = plan_blocks(large_blocks, root, lambda *_: True)
+                errors = commit_plan(plan)
+                del plan, large_blocks
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+                sys.stdout.close()
+                sys.stdout = _stdout
+            payload_bytes = sys.getsizeof(large_payload) # 载荷在内存中的实际大小（含中文时每字符 2 字节）
+            ratio = (payload_bytes + peak) / payload_bytes
+            print(f"{'零拷贝' if zero_copy else '复制'}模式: 载荷 {payload_bytes / 1e6:.1f} MB, "
+                  f"额外峰值 {peak / 1e6:.1f} MB, 合计为载荷的 {ratio:.2f} 倍, 失败 {len(errors)} 个")
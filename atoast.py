@@ -1,5 +1,45 @@
-from win11toast import toast
+import sys
 import time
+import threading
+
+# win11toast 在第一次发送通知时才导入（只在 Windows 上可用），导入失败时只警告一次，之后的通知静默忽略
+_toast = None
+_toast_unavailable = False
+_import_lock = threading.Lock()
+
+
+def _load_toast():
+    global _toast, _toast_unavailable
+    with _import_lock:
+        if _toast is None and not _toast_unavailable:
+            try:
+                from win11toast import toast
+                _toast = toast
+            except ImportError as e:
+                _toast_unavailable = True
+                print(f"[WARNING] 无法导入 win11toast，将不显示 Toast 通知: {e}", file=sys.stderr)
+        return _toast
+
+
+def notify(title, message, on_click=None):
+    """
+    发送一个 Windows 11 原生 Toast 通知，不阻塞调用线程。
+    win11toast 的 toast() 会等待通知被关闭，因此在后台线程中调用。
+    on_click 为点击通知时（在该后台线程中）调用的函数。返回 False 表示通知不可用。
+    """
+    toast = _load_toast()
+    if toast is None:
+        return False
+
+    def show():
+        try:
+            toast(title, message, on_click=(lambda args: on_click()) if on_click else None)
+        except Exception as e:
+            print(f"[WARNING] 发送 Toast 通知失败: {type(e).__name__}: {e}", file=sys.stderr)
+
+    threading.Thread(target=show, daemon=True, name='Toast').start()
+    return True
+
 
 def send_win11_toast_notification():
     """
@@ -8,17 +48,20 @@ def send_win11_toast_notification():
     """
     title = "来自 Python 的通知！"
     message = "这是一个在 Windows 11 上显示的 Toast 通知。"
-    
+
     print(f"尝试发送通知：标题='{title}', 消息='{message}'")
-    
+
     # 发送Toast通知
     # duration='long' 可以让通知显示更长时间，但通常仍会进入通知中心
+    toast = _load_toast()
+    if toast is None:
+        return
     toast(title, message, duration='long') #cite: 1, 3
-    
+
     print("通知已发送。请检查您的屏幕右下角或通知中心。")
 
 if __name__ == "__main__":
     send_win11_toast_notification()
-    
+
     # 等待几秒钟，确保用户有机会看到通知（如果通知没有立即进入通知中心）
-    time.sleep(5) 
\ No newline at end of file
+    time.sleep(5)
@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+import argparse
+
+# 命令行批量模式：不导入 Tkinter、pywin32 或 pystray，可在 Linux CI 上运行。
+from apply_engine import commit_plan
+from project_router import ProjectRouter
+from block_scanner import scan_blocks
+from config_manager import ConfigManager
+from diff_preview import DiffPreviewer
+from file_system import DEFAULT_IO_WORKERS
+from journal import JournalError, default_journal_dir, format_history, format_restore_result, open_journal
+from transaction import DURABILITY_MODES, TransactionLog, default_transaction_dir
+
+
+# 终端中的提示打印之后无法更新，最多等待差异预览这么久，之后未完成的文件显示为“正在计算”
+PREVIEW_WAIT_SECONDS = 2.0
+
+
+def _default_config_file():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+
+
+def _legacy_transaction_dir():
+    """旧版本放在程序目录中的提交记录目录，其中中途退出的批次仍在启动时恢复。"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'transactions')
+
+
+def iter_payload_sources(paths):
+    """
+    按顺序产出 (名称, 路径或 '-')。目录会被递归展开（按路径排序），
+    只产出路径而不读取内容，每个文件在处理时才从磁盘读取。
+    """
+    for path in paths:
+        if path == '-':
+            yield '<stdin>', '-'
+        elif os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    full_path = os.path.join(dirpath, name)
+                    yield full_path, full_path
+        else:
+            yield path, path
+
+
+def read_payload(source):
+    """读取单个载荷的文本。"""
+    if source == '-':
+        return sys.stdin.read()
+    with open(source, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        return f.read()
+
+
+def _ask_on_terminal(question):
+    """在终端上询问是/否；标准输入不是终端时返回 None。"""
+    if not sys.stdin.isatty():
+        return None
+    try:
+        return input(f"{question} [y/N] ").strip().lower() in ('y', 'yes', '是')
+    except EOFError:
+        return None
+
+
+def apply_payloads(paths, root_folder, assume_yes=False, dry_run=False, max_workers=DEFAULT_IO_WORKERS,
+                   resolve_paths=False, projects=(), journal=None, durability='batch', transaction_log=None,
+                   previewer=None):
+    """
+    逐个处理载荷文件：扫描、比对并（按选项）写入。返回失败的载荷数量。
+    每个载荷处理完后才读取下一个，内存占用与单个最大载荷相当。
+    resolve_paths 为 True 时为项目建立文件索引，只给出文件名或部分路径的块按现有文件解析。
+    projects 为 (名称, 路径) 列表，代码块按 project_router 的规则在这些项目和 root_folder 之间路由。
+    journal 为 journal.UndoJournal 时记录每个写入的载荷，之后可以用 `autoapply undo` 整批撤销。
+    每个载荷作为一个事务写入（见 transaction），durability 为刷盘级别。
+    previewer 为 diff_preview.DiffPreviewer 时，演练和需要确认的提示中包含每个文件的差异预览。
+    """
+    total_bytes = 0
+    total_blocks = 0
+    total_operations = 0
+    failed_payloads = 0
+    payload_count = 0
+    stdin_used = '-' in paths
+    started = time.perf_counter()
+    router = ProjectRouter(index_enabled=resolve_paths, wait_for_index=True)
+    router.configure(root_folder, projects)
+
+    def confirm_overwrite_on_create(filename, target_path):
+        if assume_yes or dry_run:
+            return True
+        if stdin_used:
+            return False
+        answer = _ask_on_terminal(f"文件 '{target_path}' 已存在且内容不同，是否覆盖？")
+        return bool(answer)
+
+    for name, source in iter_payload_sources(paths):
+        payload_started = time.perf_counter()
+        try:
+            text = read_payload(source)
+        except OSError as e:
+            print(f"[ERROR] 无法读取载荷 '{name}': {e}", file=sys.stderr)
+            failed_payloads += 1
+            continue
+        payload_count += 1
+        blocks = list(scan_blocks(text))
+        payload_bytes = len(text)
+        del text # 不再直接使用原始文本；大载荷的代码块（TextSpan）仍引用它，处理完后一并释放
+
+        # 索引建议的路径只在会显示确认提示时采用（--yes 或从标准输入读取载荷时不改用）
+        plan = router.plan_blocks(blocks, confirm_overwrite_on_create, max_workers=max_workers,
+                                  redirect_missing=dry_run or not (assume_yes or stdin_used))
+        status = "无需处理"
+        if not plan.is_empty():
+            if previewer is not None and (dry_run or (not assume_yes and not stdin_used)):
+                previewer.start(plan).wait(PREVIEW_WAIT_SECONDS)
+            if dry_run:
+                status = "演练 (未写入)"
+                print(plan.build_prompt_message())
+            else:
+                # 需要询问时在等待回答之前预读原内容
+                batch = journal.begin(plan, preload=not assume_yes, max_workers=max_workers) if journal else None
+                approved = assume_yes
+                if not approved and not stdin_used:
+                    approved = bool(_ask_on_terminal(plan.build_prompt_message() + "\n是否执行？"))
+                if approved:
+                    errors = commit_plan(plan, max_workers=max_workers, before_change=batch.capture if batch else None,
+                                         durability=durability, transaction_log=transaction_log)
+                    if journal:
+                        journal.finish(batch, errors)
+                    router.note_committed(plan, errors) # 后续载荷可以解析到本次新建的文件
+                    for operation, path, error in errors:
+                        print(f"[ERROR] {operation} 失败: '{path}': {error}", file=sys.stderr)
+                    if errors:
+                        failed_payloads += 1
+                    status = f"已执行 ({len(errors)} 个失败)" if errors else "已执行"
+                else:
+                    status = "已跳过 (未确认，可使用 --yes)"
+
+        elapsed = time.perf_counter() - payload_started
+        total_bytes += payload_bytes
+        total_blocks += len(blocks)
+        total_operations += plan.operation_count()
+        print(f"[INFO] {name}: {len(blocks)} 个代码块, {plan.operation_count()} 个操作, {status}, "
+              f"{elapsed * 1000:.1f} ms, {payload_bytes / 1e6 / max(elapsed, 1e-9):.1f} MB/s")
+
+    router.stop()
+    if journal:
+        journal.close()
+    if previewer is not None:
+        previewer.close()
+    elapsed = time.perf_counter() - started
+    print(f"[INFO] 共处理 {payload_count} 个载荷, {total_blocks} 个代码块, {total_operations} 个操作, "
+          f"{total_bytes / 1e6:.2f} MB, 用时 {elapsed:.3f} s, "
+          f"{payload_count / max(elapsed, 1e-9):.1f} 载荷/s, {total_bytes / 1e6 / max(elapsed, 1e-9):.1f} MB/s")
+    return failed_payloads
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='autoapply', description="AutoApply 命令行模式：无需剪贴板和图形界面。")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    apply_parser = subparsers.add_parser('apply', help="将载荷文件（或标准输入）中的代码块应用到根目录。")
+    apply_parser.add_argument('--root', help="项目根目录，默认使用 config.json 中的 root_folder。")
+    mode = apply_parser.add_mutually_exclusive_group()
+    mode.add_argument('--yes', '-y', action='store_true', help="不询问，直接执行所有操作。")
+    mode.add_argument('--dry-run', action='store_true', help="只显示将执行的操作，不写入。")
+    apply_parser.add_argument('--jobs', '-j', type=int, default=DEFAULT_IO_WORKERS,
+                              help=f"并发读写文件的线程数，默认 {DEFAULT_IO_WORKERS}。")
+    apply_parser.add_argument('--resolve-paths', action='store_true',
+                              help="只给出文件名或部分路径时，按根目录中唯一匹配的现有文件解析。")
+    apply_parser.add_argument('--project', action='append', default=[], metavar='NAME=DIR',
+                              help="额外的命名项目根目录，可重复；未指定时使用 config.json 中的 projects。")
+    apply_parser.add_argument('--no-journal', action='store_true', help="不记录撤销信息。")
+    apply_parser.add_argument('--no-diff', action='store_true', help="演练和确认提示中不显示差异预览。")
+    apply_parser.add_argument('--durability', choices=DURABILITY_MODES,
+                              help="刷盘级别，默认使用 config.json 中的 commit_durability（batch）。")
+    apply_parser.add_argument('payloads', nargs='+', metavar='FILE', help="载荷文件或目录，'-' 表示标准输入。")
+
+    history_parser = subparsers.add_parser('history', help="列出撤销日志中最近的批次。")
+    history_parser.add_argument('--limit', '-n', type=int, default=20, help="最多列出的批次数，0 表示全部，默认 20。")
+    for command, help_text in (('undo', "撤销最近一个已写入的批次。"), ('redo', "重做最近一次撤销的批次。")):
+        restore_parser = subparsers.add_parser(command, help=help_text)
+        restore_parser.add_argument('--jobs', '-j', type=int, default=DEFAULT_IO_WORKERS,
+                                    help=f"并发恢复文件的线程数，默认 {DEFAULT_IO_WORKERS}。")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    config = ConfigManager(config_file=_default_config_file()).config
+    transaction_log = TransactionLog(default_transaction_dir())
+    transaction_log.recover() # 上次中途退出的批次先回滚或完成，之后的撤销和写入才基于一致的文件
+    if os.path.isdir(_legacy_transaction_dir()):
+        TransactionLog(_legacy_transaction_dir()).recover()
+
+    if args.command in ('history', 'undo', 'redo'):
+        journal = open_journal(config, default_journal_dir())
+        if journal is None:
+            print("[ERROR] config.json 中已关闭撤销日志 (journal_enabled)。", file=sys.stderr)
+            return 2
+        if args.command == 'history':
+            print(format_history(journal.history(limit=max(0, args.limit))))
+            return 0
+        try:
+            restore = journal.undo if args.command == 'undo' else journal.redo
+            result = restore(max_workers=max(1, args.jobs), durability=config.commit_durability,
+                             transaction_log=transaction_log)
+        except JournalError as e:
+            print(f"[ERROR] {e}", file=sys.stderr)
+            return 1
+        print(format_restore_result(result))
+        return 1 if result.errors else 0
+
+    if args.command == 'apply':
+        root_folder = args.root or config.root_folder
+        if not root_folder or not os.path.isdir(root_folder):
+            print(f"[ERROR] 根目录 '{root_folder}' 无效。请使用 --root 指定，或在 config.json 中设置 root_folder。", file=sys.stderr)
+            return 2
+        projects = config.projects
+        if args.project:
+            projects = []
+            for value in args.project:
+                name, separator, path = value.partition('=')
+                if not separator or not name.strip() or not os.path.isdir(path):
+                    print(f"[ERROR] --project '{value}' 无效，格式为 名称=已存在的目录。", file=sys.stderr)
+                    return 2
+                projects.append((name.strip(), os.path.abspath(path)))
+        failed = apply_payloads(args.payloads, os.path.abspath(root_folder), assume_yes=args.yes, dry_run=args.dry_run,
+                                max_workers=max(1, args.jobs), resolve_paths=args.resolve_paths, projects=projects,
+                                journal=None if args.no_journal else open_journal(config, default_journal_dir()),
+                                durability=args.durability or config.commit_durability, transaction_log=transaction_log,
+                                previewer=DiffPreviewer() if config.diff_preview_enabled and not args.no_diff else None)
+        return 1 if failed else 0
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import time
+import queue
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+from collections import namedtuple
+
+# 基准测试套件：解析 → 规划 → 写入 全流程，无需 Tkinter、pywin32 或真实剪贴板，可在 Linux CI 上运行。
+from apply_engine import plan_blocks, commit_plan
+from block_scanner import scan_blocks
+from clipboard_events import FakeClipboardEventSource
+from clipboard_monitor import ClipboardMonitor
+from payload_cache import PayloadCache
+
+RESULTS_VERSION = 1
+# 逐项比较的指标；时间单位为毫秒，内存单位为字节
+METRICS = ('ingest_ms', 'parse_ms', 'plan_ms', 'write_ms', 'peak_memory_bytes')
+# 低于这些绝对差值的变化视为噪声，不判定为回归
+NOISE_FLOOR = {'ingest_ms': 2.0, 'parse_ms': 2.0, 'plan_ms': 5.0, 'write_ms': 10.0, 'peak_memory_bytes': 1024 * 1024}
+INGEST_TIMEOUT = 60.0
+
+# build(root) 在临时根目录中准备现有文件并返回载荷文本；heavy 的场景在 --quick 下跳过
+BenchmarkScenario = namedtuple('BenchmarkScenario', ['name', 'build', 'heavy'])
+
+
+def _block(filename, operation, body, language='python'):
+    return f"#### file: {filename} ({operation})\n```{language}\n{body}\n```\n"
+
+
+def _body_of_size(size):
+    """生成约 size 字节的代码内容（CRLF 换行，模拟 Windows 剪贴板）。"""
+    line = "value = compute('数据', 42)  # generated\r\n"
+    count, remainder = divmod(size, len(line.encode('utf-8')))
+    return line * count + "x" * remainder
+
+
+def _many_blocks(count):
+    def build(root):
+        return "".join(_block(f"pkg{i % 50}/module_{i}.py", "CREATE", f"VALUE = {i}\n" + "x = 1\n" * 12)
+                       for i in range(count))
+    return build
+
+
+def _single_body(size):
+    def build(root):
+        return _block("generated/fixture.sql", "OVERWRITE", _body_of_size(size), language='sql')
+    return build
+
+
+def _unterminated(count):
+    def build(root):
+        # 大量缺少结束围栏的指令，最后一个代码块完整，保证载荷会被放入队列
+        broken = "".join(f"#### file: broken_{i}.py (CREATE)\n```python\n" + "print('x')\n" * 50 for i in range(count))
+        return broken + _block("complete.py", "CREATE", "ok = True")
+    return build
+
+
+def _mixed_operations(per_operation):
+    def build(root):
+        parts = []
+        for i in range(per_operation):
+            existing = f"def f_{i}():\n    return {i}\n"
+            for name in (f"same_{i}.py", f"over_{i}.py", f"log_{i}.txt", f"del_{i}.py", f"patch_{i}.py", f"repl_{i}.py"):
+                with open(os.path.join(root, name), 'w', encoding='utf-8') as f:
+                    f.write(existing)
+            parts.append(_block(f"new_{i}.py", "CREATE", existing))
+            parts.append(_block(f"same_{i}.py", "CREATE", existing))
+            parts.append(_block(f"over_{i}.py", "OVERWRITE", existing.replace("return", "return -")))
+            parts.append(_block(f"log_{i}.txt", "APPEND", f"entry {i}"))
+            parts.append(_block(f"del_{i}.py", "DELETE", ""))
+            parts.append(_block(f"patch_{i}.py", "PATCH", f"@@ -1,2 +1,2 @@\n def f_{i}():\n-    return {i}\n+    return {i + 1}",
+                                language='diff'))
+            parts.append(_block(f"repl_{i}.py", "REPLACE",
+                                f"<<<<<<< SEARCH\n    return {i}\n=======\n    return None\n>>>>>>> REPLACE"))
+        return "".join(parts)
+    return build
+
+
+SCENARIOS = [
+    BenchmarkScenario('blocks_1', _many_blocks(1), False),
+    BenchmarkScenario('blocks_100', _many_blocks(100), False),
+    BenchmarkScenario('blocks_10000', _many_blocks(10000), True),
+    BenchmarkScenario('body_100B', _single_body(100), False),
+    BenchmarkScenario('body_1MB', _single_body(1024 ** 2), False),
+    BenchmarkScenario('body_10MB', _single_body(10 * 1024 ** 2), False),
+    BenchmarkScenario('body_100MB', _single_body(100 * 1024 ** 2), True),
+    BenchmarkScenario('unterminated_200', _unterminated(200), False),
+    BenchmarkScenario('unterminated_5000', _unterminated(5000), True),
+    BenchmarkScenario('mixed_operations_700', _mixed_operations(100), False),
+]
+
+
+def _ingest(payload):
+    """
+    通过假剪贴板事件源走一遍监听线程（读取、去重摘要、预解析、入队），
+    返回 (从复制到出队的毫秒数, 出队的文本)。
+    """
+    source = FakeClipboardEventSource()
+    clipboard_queue = queue.Queue()
+    monitor = ClipboardMonitor(clipboard_queue, payload_cache=PayloadCache(), event_source=source)
+    monitor.start()
+    try:
+        started = time.perf_counter()
+        source.copy(payload)
+        item = clipboard_queue.get(timeout=INGEST_TIMEOUT)
+        return (time.perf_counter() - started) * 1000, item.text
+    finally:
+        monitor.stop()
+
+
+def _run_pipeline(scenario):
+    """在新的临时根目录中执行一次完整流程，返回各阶段耗时和载荷信息。"""
+    with tempfile.TemporaryDirectory() as root:
+        payload = scenario.build(root)
+        ingest_ms, text = _ingest(payload)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            blocks = list(scan_blocks(text))
+            parsed = time.perf_counter()
+            plan = plan_blocks(blocks, root, lambda *_: True)
+            planned = time.perf_counter()
+            errors = commit_plan(plan)
+            written = time.perf_counter()
+        return {
+            'payload_bytes': len(payload.encode('utf-8')),
+            'blocks': len(blocks),
+            'operations': plan.operation_count(),
+            'errors': len(errors),
+            'ingest_ms': ingest_ms,
+            'parse_ms': (parsed - started) * 1000,
+            'plan_ms': (planned - parsed) * 1000,
+            'write_ms': (written - planned) * 1000,
+        }
+
+
+def _measure_peak_memory(scenario):
+    """单独执行一次解析 → 规划 → 写入，用 tracemalloc 统计载荷之外的峰值分配字节数。"""
+    with tempfile.TemporaryDirectory() as root:
+        payload = scenario.build(root)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            tracemalloc.start()
+            try:
+                commit_plan(plan_blocks(list(scan_blocks(payload)), root, lambda *_: True))
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        return peak
+
+
+def run_scenario(scenario, repeat=3, measure_memory=True):
+    """执行 repeat 次并取各阶段耗时的中位数（时间与内存分开测量，避免 tracemalloc 影响计时）。"""
+    runs = [_run_pipeline(scenario) for _ in range(max(1, repeat))]
+    result = dict(runs[0])
+    for metric in ('ingest_ms', 'parse_ms', 'plan_ms', 'write_ms'):
+        values = sorted(run[metric] for run in runs)
+        result[metric] = round(values[len(values) // 2], 3)
+    result['errors'] = max(run['errors'] for run in runs)
+    if measure_memory:
+        result['peak_memory_bytes'] = _measure_peak_memory(scenario)
+    return result
+
+
+def run_suite(scenarios, repeat=3, measure_memory=True):
+    """执行所有场景并返回可写入 JSON 的结果字典。"""
+    results = {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'scenarios': {},
+    }
+    for scenario in scenarios:
+        result = run_scenario(scenario, repeat, measure_memory)
+        results['scenarios'][scenario.name] = result
+        memory = f", 峰值内存 {result['peak_memory_bytes'] / 1e6:8.1f} MB" if 'peak_memory_bytes' in result else ""
+        print(f"[INFO] {scenario.name:<22} {result['payload_bytes'] / 1e6:9.2f} MB, {result['blocks']:6d} 块: "
+              f"入队 {result['ingest_ms']:9.1f} ms, 解析 {result['parse_ms']:9.1f} ms, "
+              f"规划 {result['plan_ms']:9.1f} ms, 写入 {result['write_ms']:9.1f} ms{memory}")
+        if result['errors']:
+            print(f"[WARNING] 场景 '{scenario.name}' 中有 {result['errors']} 个操作失败。", file=sys.stderr)
+    return results
+
+
+def compare_results(results, baseline, tolerance=0.25):
+    """
+    将本次结果与基线比较，返回回归列表，每项为 (场景, 指标, 基线值, 当前值)。
+    当前值超过基线的 (1 + tolerance) 倍且绝对差值超过噪声阈值时判定为回归；
+    只比较两边都存在的场景和指标。
+    """
+    regressions = []
+    for name, current in results.get('scenarios', {}).items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        for metric in METRICS:
+            if metric not in current or metric not in previous:
+                continue
+            old, new = previous[metric], current[metric]
+            if new > old * (1 + tolerance) and new - old > NOISE_FLOOR[metric]:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def _load_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='benchmark_suite', description="AutoApply 解析/规划/写入基准测试。")
+    parser.add_argument('--quick', action='store_true', help="跳过 10,000 块、100 MB 等耗时场景。")
+    parser.add_argument('--only', nargs='+', metavar='NAME', help="只运行指定名称的场景。")
+    parser.add_argument('--list', action='store_true', help="列出所有场景后退出。")
+    parser.add_argument('--repeat', type=int, default=3, help="每个场景的重复次数，取中位数，默认 3。")
+    parser.add_argument('--no-memory', action='store_true', help="不测量峰值内存（可节省一半时间）。")
+    parser.add_argument('--output', default='benchmark_results.json', help="结果 JSON 文件，默认 benchmark_results.json。")
+    parser.add_argument('--baseline', help="与之比较的基线 JSON 文件；发现回归时退出码为 1。")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="允许的相对变慢比例，默认 0.25。")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.list:
+        for scenario in SCENARIOS:
+            print(f"{scenario.name}{' (heavy)' if scenario.heavy else ''}")
+        return 0
+
+    scenarios = [s for s in SCENARIOS if not (args.quick and s.heavy)]
+    if args.only:
+        unknown = set(args.only) - {s.name for s in SCENARIOS}
+        if unknown:
+            print(f"[ERROR] 未知场景: {', '.join(sorted(unknown))}", file=sys.stderr)
+            return 2
+        scenarios = [s for s in SCENARIOS if s.name in args.only]
+
+    results = run_suite(scenarios, repeat=args.repeat, measure_memory=not args.no_memory)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"[INFO] 结果已保存到 '{args.output}'。")
+
+    if args.baseline:
+        try:
+            baseline = _load_json(args.baseline)
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] 无法读取基线文件 '{args.baseline}': {e}", file=sys.stderr)
+            return 2
+        regressions = compare_results(results, baseline, args.tolerance)
+        for name, metric, old, new in regressions:
+            print(f"[WARNING] 回归: {name}.{metric}: {old:.1f} -> {new:.1f} ({new / max(old, 1e-9):.2f}x)", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"[INFO] 与基线 '{args.baseline}' 相比没有回归（容差 {args.tolerance:.0%}）。")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import re
+import sys
+import time
+import base64
+import binascii
+import hashlib
+
+from text_span import TextSpan
+
+# BINARY 代码块：`#### file: assets/icon.png (BINARY sha256=<64 位十六进制>)`，围栏内为 base64 文本
+# （可以按行折断、带缩进，空白会被忽略），解码后的字节原样写入目标文件，用于图标、测试数据、sqlite 种子等。
+# 解码按块进行，只保留当前一块的 base64 和解码结果，不会在内存中同时存在完整的编码和解码内容。
+# sha256 可选：给出时解码结果必须一致，否则跳过该文件；“内容一致”的判断也按大小和 sha256 比较。
+
+BINARY_CHUNK_CHARS = 1024 * 1024 # 每次解码的 base64 字符数
+FILE_DIGEST_CHUNK = 1024 * 1024 # 计算现有文件摘要时每次读取的字节数
+BASE64_LINE_WIDTH = 76 # format_binary_block 生成的每行字符数
+
+_BASE64_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+_WHITESPACE = b' \t\r\n\x0b\x0c'
+
+# 操作指令末尾的完整性校验，例如 `BINARY sha256=9f86d0...`（`=` 也可以写作 `:`）
+_INTEGRITY = re.compile(r"^(?P<operation>.*?)\s+sha256\s*[=:]\s*(?P<digest>[0-9a-fA-F]{64})\s*$", re.IGNORECASE)
+
+
+class BinaryContentError(ValueError):
+    """BINARY 代码块的 base64 无法解码，或解码结果与给出的 sha256 不符。"""
+
+
+def split_integrity(operation_raw):
+    """从操作指令中分离可选的 `sha256=<摘要>`，返回 (操作指令, 小写的十六进制摘要或 None)。"""
+    match = _INTEGRITY.match(operation_raw)
+    if match is None:
+        return operation_raw, None
+    return match.group('operation'), match.group('digest').lower()
+
+
+def _iter_encoded(encoded, chunk_chars):
+    """按块产出 base64 文本（str 或 TextSpan），TextSpan 只在此时切片。"""
+    if isinstance(encoded, TextSpan):
+        text, start, end = encoded.text, encoded.start, encoded.end
+    else:
+        text, start, end = encoded, 0, len(encoded)
+    for position in range(start, end, chunk_chars):
+        yield text[position:min(position + chunk_chars, end)]
+
+
+class BinaryContent:
+    """
+    BINARY 代码块的写入内容：只引用载荷中的 base64 文本（str 或 TextSpan），不预先解码。
+    iter_bytes() 按块解码；summary() 第一次调用时完整解码一遍（不保存结果）得到大小和 sha256 并缓存。
+    """
+    __slots__ = ('encoded', 'expected_digest', '_summary')
+
+    def __init__(self, encoded, expected_digest=None):
+        self.encoded = encoded
+        self.expected_digest = expected_digest
+        self._summary = None
+
+    def __repr__(self):
+        return f"BinaryContent({len(self.encoded)} 个 base64 字符)"
+
+    def iter_bytes(self, chunk_chars=BINARY_CHUNK_CHARS):
+        """
+        按块产出解码后的字节；base64 无效时抛出 BinaryContentError。
+        空白和字符集检查都用 bytes.translate 完成，每块只经过几次 C 层面的遍历。
+        """
+        carry = b'' # 不足 4 个字符的部分，留到下一块
+        padding = 0 # 已经出现的 '=' 个数；出现之后只能再有 '='
+        for chunk in _iter_encoded(self.encoded, chunk_chars):
+            try:
+                data = chunk.encode('ascii').translate(None, _WHITESPACE)
+            except UnicodeEncodeError:
+                raise BinaryContentError("base64 内容无效: 包含非 ASCII 字符") from None
+            stripped = data.rstrip(b'=')
+            if (padding and stripped) or stripped.translate(None, _BASE64_ALPHABET):
+                raise BinaryContentError("base64 内容无效: 包含 base64 以外的字符或位置错误的 '='")
+            padding += len(data) - len(stripped)
+            data = carry + stripped
+            usable = len(data) - len(data) % 4
+            carry = data[usable:]
+            if usable:
+                yield binascii.a2b_base64(data[:usable])
+        if padding > 2 or (len(carry) + padding) % 4 or len(carry) == 1:
+            raise BinaryContentError(f"base64 内容不完整（末尾 {len(carry)} 个字符，{padding} 个 '='）")
+        if carry:
+            yield binascii.a2b_base64(carry + b'=' * padding)
+
+    def summary(self):
+        """
+        返回 (解码后的字节数, sha256 十六进制摘要)。
+        给出了 expected_digest 而解码结果不符时抛出 BinaryContentError。在线程池中调用。
+        """
+        if self._summary is None:
+            hasher = hashlib.sha256()
+            size = 0
+            for data in self.iter_bytes():
+                hasher.update(data)
+                size += len(data)
+            digest = hasher.hexdigest()
+            if self.expected_digest is not None and digest != self.expected_digest:
+                raise BinaryContentError(f"sha256 校验失败: 期望 {self.expected_digest}，实际 {digest}")
+            self._summary = (size, digest)
+        return self._summary
+
+
+def file_digest(fs, path):
+    """按块读取文件并计算 sha256 十六进制摘要。fs 为 file_system.LocalFileSystem 兼容的对象。"""
+    hasher = hashlib.sha256()
+    with fs.open_binary(path) as f:
+        while True:
+            data = f.read(FILE_DIGEST_CHUNK)
+            if not data:
+                return hasher.hexdigest()
+            hasher.update(data)
+
+
+def binary_matches_file(fs, path, content):
+    """现有文件与解码后的内容是否一致：大小不同时不读取文件，否则比较 sha256。"""
+    size, digest = content.summary()
+    return fs.getsize(path) == size and file_digest(fs, path) == digest
+
+
+def format_binary_block(filename, data, line_width=BASE64_LINE_WIDTH):
+    """生成写入 data 的 BINARY 代码块文本（带 sha256），可直接放入载荷。"""
+    encoded = base64.b64encode(data).decode('ascii')
+    lines = "\n".join(encoded[position:position + line_width] for position in range(0, len(encoded), line_width))
+    return (f"#### file: {filename} (BINARY sha256={hashlib.sha256(data).hexdigest()})\n"
+            f"```base64\n{lines}\n```\n")
+
+
+if __name__ == '__main__':
+    # 直接运行 `python binary_block.py`：测量 50 MB 二进制内容的规划、写入和“内容一致”判断的吞吐量，
+    # 以及与一次性解码相比的峰值内存（正确性检查见 tests/test_binary_block.py）。
+    import os
+    import tempfile
+    import tracemalloc
+    from apply_engine import commit_plan, plan_blocks
+    from block_scanner import scan_blocks
+
+    def run(root, payload):
+        """规划并提交一个载荷，返回失败列表；不输出逐文件日志。"""
+        _stdout, _stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = open(os.devnull, 'w')
+        try:
+            return commit_plan(plan_blocks(list(scan_blocks(payload)), root, lambda *_: True, max_workers=4), max_workers=4)
+        finally:
+            sys.stdout.close()
+            sys.stdout, sys.stderr = _stdout, _stderr
+
+    # 50 MB 吞吐量和峰值内存
+    blob_size = 50 * 1024 * 1024
+    blob = os.urandom(blob_size)
+    payload = format_binary_block("data/seed.sqlite", blob)
+    megabytes = blob_size / 1024 / 1024
+    with tempfile.TemporaryDirectory() as root:
+        target = os.path.join(root, 'data', 'seed.sqlite')
+
+        def timed(func):
+            started = time.perf_counter()
+            result = func()
+            return result, time.perf_counter() - started
+
+        started = time.perf_counter()
+        blocks = list(scan_blocks(payload))
+        _stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            plan, plan_seconds = timed(lambda: plan_blocks(blocks, root, lambda *_: True))
+            errors, commit_seconds = timed(lambda: commit_plan(plan))
+            replan, replan_seconds = timed(lambda: plan_blocks(list(scan_blocks(payload)), root, lambda *_: True))
+        finally:
+            sys.stdout.close()
+            sys.stdout = _stdout
+        print(f"{megabytes:.0f} MB 二进制内容（base64 {len(payload) / 1024 / 1024:.1f} MB，失败 {len(errors)} 个）:")
+        print(f"    规划（解码并计算 sha256）: {plan_seconds * 1000:7.1f} ms, {megabytes / plan_seconds:6.0f} MB/s")
+        print(f"    写入（解码并写入临时文件）: {commit_seconds * 1000:7.1f} ms, {megabytes / commit_seconds:6.0f} MB/s")
+        print(f"    重复载荷（判定为内容一致）: {replan_seconds * 1000:7.1f} ms, {megabytes / replan_seconds:6.0f} MB/s")
+
+        def one_shot():
+            """对照：一次性去掉空白、解码并写入。"""
+            content = next(scan_blocks(payload, zero_copy=False)).content
+            data = base64.b64decode(''.join(content.split()), validate=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+
+        def measure(func):
+            tracemalloc.start()
+            try:
+                func()
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        del blob
+        second_payload = payload.replace("seed.sqlite", "seed2.sqlite") # 在测量之外生成
+        streaming_peak = measure(lambda: run(root, second_payload))
+        one_shot_peak = measure(one_shot)
+        print(f"    额外峰值内存: 流式 {streaming_peak / 1024 / 1024:.1f} MB，一次性解码 {one_shot_peak / 1024 / 1024:.1f} MB"
+              f"（载荷本身 {len(payload) / 1024 / 1024:.1f} MB 不计入）")
@@ -0,0 +1,301 @@
+import re
+import sys
+import time
+from collections import namedtuple
+from itertools import chain
+
+from text_span import TextSpan
+
+# 扫描结果：与旧正则 CLIPBOARD_PATTERN 的分组一一对应。
+# content 为代码块起止围栏之间的原始文本（str，零拷贝模式下为 TextSpan），调用方负责 strip()。
+# project 为代码块之前最近的 `#### project: <名称>` 指令给出的项目名，没有时为 None（见 project_router）。
+CodeBlock = namedtuple('CodeBlock', ['filename', 'operation', 'language', 'content', 'project'], defaults=(None,))
+# 只记录内容在原始文本中的区间 [start, end)
+BlockSpan = namedtuple('BlockSpan', ['filename', 'operation', 'language', 'start', 'end', 'project'], defaults=(None,))
+
+# 载荷达到此字符数时，scan_blocks 默认使用零拷贝模式
+ZERO_COPY_THRESHOLD = 4 * 1024 * 1024
+
+# 旧版正则，仅保留用于对照测试和基准测试，不再用于实际解析。
+# 它的懒惰 `.*?` 在缺少结束围栏或超大剪贴板内容时会发生严重回溯。
+LEGACY_CLIPBOARD_PATTERN = re.compile(
+    r"^####\s*file:\s*(?P<filename>.*?)\s*\((?P<operation>[^)]+)\)\s*"
+    r"```(?P<language>\w*)?\s*$"
+    r"\n(?P<content>.*?)"
+    r"^\s*```\s*$",
+    re.MULTILINE | re.DOTALL | re.IGNORECASE
+)
+
+# 围栏行：``` 加可选语言标识，应用于单行范围 [行首, 行尾)。
+_FENCE_LINE = re.compile(r"\s*```(\w*)\s*$")
+_LANGUAGE = re.compile(r"\w*")
+_NON_WHITESPACE = re.compile(r"\S")
+
+
+def _parse_header(line):
+    """
+    解析单行指令 `#### file: <filename> (<operation>)[```<language>]`。
+    返回 (filename, operation, language)；language 为 None 表示围栏在后续行。
+    不是指令行时返回 None。整个过程对行长度是线性的。
+    """
+    if not line.startswith('####'):
+        return None
+    rest = line[4:].lstrip()
+    if rest[:5].lower() != 'file:':
+        return None
+    head = rest[5:].rstrip()
+
+    language = None
+    fence_index = head.rfind('```')
+    if fence_index != -1 and _LANGUAGE.fullmatch(head, fence_index + 3):
+        language = head[fence_index + 3:]
+        head = head[:fence_index].rstrip()
+
+    if not head.endswith(')'):
+        return None
+    close_index = len(head) - 1
+    # 与懒惰匹配的文件名一致：操作指令从最后一个 ')' 之前、上一个 ')' 之后的第一个 '(' 开始
+    open_index = head.find('(', head.rfind(')', 0, close_index) + 1, close_index)
+    if open_index == -1 or open_index + 1 == close_index:
+        return None
+    return head[:open_index].strip(), head[open_index + 1:close_index], language
+
+
+def _parse_project(line):
+    """
+    解析单行指令 `#### project: <名称>`，返回项目名（名称为空时返回 ''，表示取消之前的指令）。
+    不是项目指令时返回 None。
+    """
+    if not line.startswith('####'):
+        return None
+    rest = line[4:].lstrip()
+    if rest[:8].lower() != 'project:':
+        return None
+    return rest[8:].strip()
+
+
+def _line_end(text, start):
+    end = text.find('\n', start)
+    return len(text) if end == -1 else end
+
+
+def _candidate_lines(text, start=0):
+    """
+    按顺序产出从行首偏移 start 开始的候选行的行首偏移：以 "####" 开头的行，或忽略行首空白后以 ``` 开头的行。
+    只有这些行可能是指令行或围栏行；查找全部交给 str.find，其余行不会进入 Python 循环。
+    每行至多被回看一次，因此总开销对文本长度是线性的。
+    """
+    text_length = len(text)
+    next_header = start if text.startswith('####', start) else text.find('\n####', start) + 1 or text_length
+    fence_from = start
+    next_fence = None
+
+    while True:
+        while next_fence is None and fence_from < text_length:
+            index = text.find('```', fence_from)
+            if index == -1:
+                fence_from = text_length
+                break
+            line_start = text.rfind('\n', 0, index) + 1
+            fence_from = _line_end(text, index)
+            if line_start == index or text[line_start:index].isspace():
+                next_fence = line_start
+        if next_fence is None:
+            next_fence_position = text_length
+        else:
+            next_fence_position = next_fence
+
+        position = min(next_header, next_fence_position)
+        if position >= text_length:
+            return
+        yield position
+        if next_header == position:
+            next_header = text.find('\n####', position) + 1 or text_length
+        if next_fence == position:
+            next_fence = None
+
+
+def scan_block_spans(text):
+    """
+    单次线性扫描剪贴板文本，逐个产出 BlockSpan。
+
+    与旧正则在格式正确的内容上结果一致，另外：
+    - 代码内容中带语言标识的 ```lang 围栏视为嵌套，需由对应的 ``` 关闭；
+    - 未闭合的代码块不会吞掉后续代码块：代码块中出现过单独的 ``` 行时（通常是内容中的 ```lang 没有关闭），
+      遇到能开始新代码块的指令行或文本末尾时输出警告，按旧正则的方式在第一个 ``` 行结束该代码块，
+      再从该行之后继续扫描；
+    - 代码块中不能开始新代码块的指令行（后面没有围栏行）只是内容；能开始新代码块时，被打断的代码块暂作候选：
+      新代码块结束后、下一个代码块开始前出现单独的 ``` 行，说明新代码块只是内容中的示例，候选在该行结束，
+      新代码块不输出；否则输出警告并丢弃候选；
+    - 只按 '\\n' 分行，CRLF 与 LF 混用时行尾的 '\\r' 视为空白；
+    - 指令行必须写在一行之内；
+    - 代码块之外的 `#### project: <名称>` 行为其后的代码块指定项目，直到下一条项目指令；代码块中的同样内容只是内容。
+    """
+    text_length = len(text)
+    resume_at = 0
+    block = None  # 进行中的代码块：(filename, operation, language, content_start, project)
+    depth = 0
+    first_close = None  # 进行中的代码块内第一个单独的 ``` 行的行首，旧正则在这里结束代码块
+    rescanned_to = 0  # 回退时重新扫描过的文本终点；每段文本至多重新扫描一次，总开销仍是线性的
+    candidate = None  # 被新代码块打断的未闭合代码块，格式同 block
+    candidate_tag = None  # 候选未决期间出现的项目指令，候选被丢弃时才生效
+    held = []  # 候选未决期间结束的代码块，候选被丢弃时才输出
+    project = None
+    start = 0
+
+    def unclosed(pending):
+        print(f"[WARNING] 文件 '{pending[0]}' 的代码块未闭合，已跳过。", file=sys.stderr)
+
+    while start is not None:
+        candidates = _candidate_lines(text, start)
+        start = None
+        for line_start in chain(candidates, (text_length,)):
+            if line_start < resume_at:
+                continue
+            line_end = _line_end(text, line_start)
+
+            if line_start < text_length and (block is not None or candidate is not None):
+                fence = _FENCE_LINE.match(text, line_start, line_end)
+                if fence is not None and block is not None:
+                    if fence.group(1):
+                        depth += 1
+                    elif depth:
+                        depth -= 1
+                        if first_close is None:
+                            first_close = line_start
+                    else:
+                        span = BlockSpan(*block[:4], line_start, block[4])
+                        if candidate is None:
+                            yield span
+                        else:
+                            held.append(span)
+                        block = None
+                    continue
+                if fence is not None and not fence.group(1):
+                    # 候选之后、下一个代码块之前的单独 ``` 行：候选在这里结束，期间的代码块只是它的内容
+                    yield BlockSpan(*candidate[:4], line_start, candidate[4])
+                    candidate = candidate_tag = None
+                    held.clear()
+                    continue
+                if depth:
+                    continue
+
+            if line_start < text_length and not text.startswith('####', line_start):
+                continue
+            line = text[line_start:line_end]
+            header = _parse_header(line)
+            tag = _parse_project(line) if header is None and block is None else None
+            if header is not None and header[2] is None:
+                # 围栏在后续行：跳过空白行，下一个非空白字符所在行必须是围栏行
+                non_blank = _NON_WHITESPACE.search(text, line_end)
+                fence = None
+                if non_blank is not None:
+                    fence_start = text.rfind('\n', line_end, non_blank.start()) + 1
+                    fence_end = _line_end(text, fence_start)
+                    fence = _FENCE_LINE.match(text, fence_start, fence_end)
+                if fence is None:
+                    header = None
+                else:
+                    header = header[:2] + (fence.group(1),)
+                    line_end = fence_end
+            if header is not None and line_end >= text_length:
+                header = None  # 围栏行后没有换行符，不可能有内容和结束围栏
+
+            interrupted = None
+            if block is not None and (header is not None or line_start == text_length):
+                # 代码块到能开始新代码块的指令行或文本末尾仍未闭合
+                if first_close is not None:
+                    filename = block[0]
+                    print(f"[WARNING] 文件 '{filename}' 的代码块中有未闭合的 ```lang 围栏，"
+                          f"已在第一个单独的 ``` 行结束该代码块。", file=sys.stderr)
+                    span = BlockSpan(*block[:4], first_close, block[4])
+                    if candidate is None:
+                        yield span
+                    else:
+                        held.append(span)
+                    block = None
+                    if first_close >= rescanned_to:
+                        # 从该 ``` 行之后重新扫描：嵌套期间跳过的指令行在那里重新生效
+                        rescanned_to = line_start
+                        start = resume_at = _line_end(text, first_close) + 1
+                        break
+                else:
+                    interrupted = block
+                block = None
+            if candidate is not None and (header is not None or line_start == text_length):
+                # 下一个代码块开始或文本结束前没有单独的 ``` 行：丢弃候选，输出期间结束的代码块
+                unclosed(candidate)
+                if candidate_tag is not None:
+                    project = candidate_tag or None
+                yield from held
+                held.clear()
+                candidate = candidate_tag = None
+            if interrupted is not None:
+                if header is not None:
+                    candidate = interrupted  # 被新代码块打断：暂作候选，见文档字符串
+                else:
+                    unclosed(interrupted)
+            if tag is not None:
+                if candidate is not None:
+                    candidate_tag = tag
+                else:
+                    project = tag or None
+            if header is None:
+                continue
+            filename, operation, language = header
+            block = (filename, operation, language, line_end + 1, project)
+            depth = 0
+            first_close = None
+            resume_at = line_end + 1
+
+
+def scan_blocks(text, zero_copy=None):
+    """
+    扫描剪贴板文本，逐个产出 CodeBlock，解析规则见 scan_block_spans。
+    zero_copy 为 True 时 content 为指向 text 的 TextSpan，不复制代码内容；
+    为 None 时按载荷大小自动选择（不小于 ZERO_COPY_THRESHOLD 时使用零拷贝）。
+    """
+    if zero_copy is None:
+        zero_copy = len(text) >= ZERO_COPY_THRESHOLD
+    for span in scan_block_spans(text):
+        content = TextSpan(text, span.start, span.end) if zero_copy else text[span.start:span.end]
+        yield CodeBlock(span.filename, span.operation, span.language, content, span.project)
+
+
+def _legacy_blocks(text):
+    for match in LEGACY_CLIPBOARD_PATTERN.finditer(text):
+        yield CodeBlock(match.group('filename'), match.group('operation'),
+                        match.group('language'), match.group('content'))
+
+
+def _normalized(blocks):
+    return [(b.filename, b.operation.strip(), b.language, b.content.strip()) for b in blocks]
+
+
+if __name__ == '__main__':
+    # 直接运行 `python block_scanner.py`：与旧正则对比的最坏情况基准测试（正确性检查见 tests/test_block_scanner.py）。
+    import io
+    from contextlib import redirect_stderr
+
+    def bench(label, payload, include_legacy=True):
+        warnings = io.StringIO() # 未闭合的代码块逐个警告，只统计条数
+        start = time.perf_counter()
+        with redirect_stderr(warnings):
+            count = sum(1 for _ in scan_blocks(payload))
+        scanner_seconds = time.perf_counter() - start
+        line = f"{label}: {len(payload) / 1e6:.1f} MB, 扫描器 {scanner_seconds * 1000:.1f} ms ({count} 块"
+        warning_count = warnings.getvalue().count('[WARNING]')
+        line += f", {warning_count} 条警告)" if warning_count else ")"
+        if include_legacy:
+            start = time.perf_counter()
+            sum(1 for _ in LEGACY_CLIPBOARD_PATTERN.finditer(payload))
+            legacy_seconds = time.perf_counter() - start
+            line += f", 旧正则 {legacy_seconds * 1000:.1f} ms, 加速 {legacy_seconds / max(scanner_seconds, 1e-9):.1f}x"
+        print(line)
+
+    bench("大日志", "2024-01-01 INFO something happened (code 42)\n" * 400000)
+    bench("多个代码块", ("#### file: m.py (OVERWRITE)\n```python\n" + "x = 1\n" * 200 + "```\n") * 1000)
+    # 最坏情况：大量缺少结束围栏的指令，旧正则对每个指令都扫描到文本末尾
+    unterminated = "#### file: u.py (CREATE)\n```python\n" + "print('x')\n" * 50
+    bench("未闭合围栏", unterminated * 60)
+    bench("未闭合围栏 (仅扫描器)", unterminated * 40000, include_legacy=False)
@@ -1,39 +1,45 @@
 import os
-import re
 import sys
+
+# --profile-startup 需要在其他导入之前开始统计导入耗时
+from startup_profile import StartupProfiler
+STARTUP_PROFILER = StartupProfiler.from_argv(sys.argv)
+
 import threading
 # import json # 用户指示不删除此导入，即使 ConfigManager 已移出。
 import time
+import queue
 import ctypes
+import argparse
+import importlib.util
 import tkinter as tk
 from tkinter import messagebox, simpledialog
-from queue import Queue, Empty # Queue, Empty 仍然需要
-
-# --- pystray 相关的导入 ---
-try:
-    from pystray import Icon, Menu, MenuItem
-except ImportError:
-    print(
-        "错误: 缺少必要的库。请安装 'pystray'。\n"
-        "请运行 'pip install pystray' 后再启动程序。",
-        file=sys.stderr
-    )
-    sys.exit(1)
 
-
-import win32clipboard # 仍需用于 pywin32 依赖检查
-import win32con # 仍需用于 pywin32 依赖检查
-import win32gui # 仍需用于 pywin32 依赖检查
-import pywintypes # 仍需用于 pywin32 依赖检查
+# pystray 和 Pillow 只在托盘线程中导入（见 _setup_tray_icon），不再拖慢启动；
+# pywin32 由 clipboard_events 导入，依赖检查在 __main__ 中只查找模块而不导入。
 
 # --- 从本地模块导入 ---
 from config_manager import ConfigManager
+from config_watcher import ConfigWatcher
 from clipboard_monitor import ClipboardMonitor
-from icon_creator import create_default_icon # 从新文件中导入图标创建函数
+from icon_creator import load_icon # 图标从磁盘缓存读取，只在绘制参数变化时重新绘制
+from apply_engine import format_commit_errors # 与命令行模式共用的比对与写入逻辑
+from payload_cache import PayloadCache # 按内容摘要缓存解析结果，代码块由 block_scanner 线性扫描得到
+from metrics import PipelineMetrics, UiStallMonitor # 按阶段统计处理延迟和 Tk 主线程的卡顿
+from pipeline import ApplyPipeline, PipelineFrontend # 解析、规划、确认、写入在 asyncio 流水线中进行
+from confirmation_window import ConfirmationWindow # 非模态的确认窗口，可一次批准多个批次
+from atoast import notify # win11toast 通知，不可用时静默忽略
+from ingest_server import IngestServer # 不经过剪贴板的本地载荷接收端点（可选）
+from project_router import ProjectRouter # 多个项目根目录之间的路由，以及只给出文件名或部分路径时的解析
+from journal import JournalError, default_journal_dir, format_history, format_restore_result, open_journal # 整批撤销和重做
+from transaction import TransactionLog, default_transaction_dir # 批次写入的提交记录，中途崩溃后在下次启动时恢复
+from diff_preview import DiffPreviewer # 确认窗口中每个文件的增删行数和修改块，在后台线程中计算
 
 
 # MessageBoxW Constants
+MB_OK = 0x00000000
 MB_YESNO = 0x00000004
+MB_ICONERROR = 0x00000010
 MB_ICONQUESTION = 0x00000020
 MB_FOREGROUND = 0x00010000 # Places the message box in the foreground
 IDYES = 6
@@ -51,70 +57,138 @@ def win32_askyesno(title, message):
     )
     return result == IDYES
 
+# 两次“等待确认”通知之间的最短间隔（秒），连续复制多个内容时只提醒一次
+CONFIRMATION_TOAST_INTERVAL = 5.0
+
 # create_default_icon 函数已移动到 icon_creator.py 文件中。
 
 # ConfigManager 类已移动到 config_manager.py 文件中。
 # ClipboardMonitor 类已移动到 clipboard_monitor.py 文件中。
 
 
-class AutoCodeApplier:
+class AutoCodeApplier(PipelineFrontend):
     """
-    主应用程序逻辑，处理剪贴板内容，模式匹配，用户交互和文件写入。
+    主应用程序：托盘图标、根目录配置，以及处理流水线的前端（确认窗口和状态显示）。
+    剪贴板内容的解析、规划和写入由 pipeline.ApplyPipeline 在后台完成，Tk 主线程只处理界面。
+    等待确认的计划加入 ConfirmationWindow，用户决定之前后续内容照常在后台解析和规划。
     """
-    # --- 正则表达式优化 ---
-    # 优化点：
-    # 1. 在指令行 `(...)` 和代码块起始符 ` ``` ` 之间使用 `\s*` 匹配任意空白字符（包括零个或多个空格、换行符）。
-    # 2. 这使得 `#### file: ...(...)``` ` (在同一行) 和 `#### file: ...(...)\n``` ` (换行) 两种格式都能被正确匹配。
-    CLIPBOARD_PATTERN = re.compile(
-        # 匹配元数据标题行：#### file: <path/filename.ext> (OVERWRITE|APPEND|DELETE|CREATE|覆盖|追加|删除|创建|修改)
-        r"^####\s*file:\s*(?P<filename>.*?)\s*\((?P<operation>[^)]+)\)\s*"
-        r"```(?P<language>\w*)?\s*$" # 匹配代码块起始：```<language>
-        r"\n(?P<content>.*?)"              # 懒惰匹配实际代码内容
-        r"^\s*```\s*$",                    # 匹配代码块结束：```
-        re.MULTILINE | re.DOTALL | re.IGNORECASE
-    )
-
     def __init__(self):
-        self.root = tk.Tk()
-        self.root.withdraw() # 隐藏主窗口
+        with STARTUP_PROFILER.phase("Tk 初始化"):
+            self.root = tk.Tk()
+            self.root.withdraw() # 隐藏主窗口
         
         # 始终使用固定的 config.json 文件路径
         current_script_dir = os.path.dirname(os.path.abspath(__file__))
         config_file_path = os.path.join(current_script_dir, 'config.json') # 更改为 config.json
-        self.config_manager = ConfigManager(config_file=config_file_path)
+        with STARTUP_PROFILER.phase("加载配置"):
+            self.config_manager = ConfigManager(config_file=config_file_path)
         
         # 初始获取根目录。如果 config.json 中没有，会提示用户设置。
         self.root_folder = self._get_or_set_root_folder_path()
         self._last_loaded_root_folder = self.root_folder # 用于检测 config.json 中的变化
+        # 仅在 config.json 的签名变化时重新解析；支持原生通知时由后台线程推送变化
+        self.config_watcher = ConfigWatcher(self.config_manager, self._on_config_changed)
         
-        self.clipboard_queue = Queue()
-        self.monitor = ClipboardMonitor(self.clipboard_queue)
-        self.icon = None # 初始化托盘图标对象
-
-        self._setup_tray_icon() # 设置系统托盘图标，现在 self.root_folder 已经可用
-
-        # 调度定时任务
-        self.root.after(100, self._check_clipboard_queue)
-        self.root.after(1000, self._schedule_root_folder_check) # 每秒检查一次根目录配置
+        config = self.config_manager.config
+        with STARTUP_PROFILER.phase("创建剪贴板监听器"):
+            self.metrics = PipelineMetrics(
+                enabled=config.metrics_enabled,
+                jsonl_path=config.metrics_file or os.path.join(current_script_dir, 'metrics.jsonl'),
+                http_port=config.metrics_port
+            )
+            # 每个项目根目录的文件索引按需建立并在切换项目后保留；默认项目为 root_folder
+            self.router = ProjectRouter(index_enabled=config.file_index_enabled,
+                                        refresh_seconds=config.file_index_refresh_seconds)
+            self.router.configure(self.root_folder, config.projects)
+            # 每个写入的批次在用户数据目录中记录原内容，可从托盘菜单整批撤销；与命令行模式共用同一个目录
+            self.journal = open_journal(config, default_journal_dir())
+            # 上次运行在写入中途退出时，先回滚或完成那个批次，再开始处理新的内容（包括旧版本放在程序目录中的记录）
+            self.transaction_log = TransactionLog(default_transaction_dir())
+            self.transaction_log.recover()
+            legacy_transaction_dir = os.path.join(current_script_dir, 'transactions')
+            if os.path.isdir(legacy_transaction_dir):
+                TransactionLog(legacy_transaction_dir).recover()
+            self.diff_previewer = DiffPreviewer() # 等待确认的计划在后台计算差异预览，结果按内容摘要缓存
+            self.payload_cache = PayloadCache(
+                max_entries=config.payload_cache_max_entries,
+                max_bytes=config.payload_cache_max_bytes
+            )
+            self.pipeline = ApplyPipeline(
+                self,
+                lambda: self.root_folder,
+                payload_cache=self.payload_cache,
+                metrics=self.metrics,
+                queue_size=config.pipeline_queue_size,
+                overflow_policy=config.pipeline_overflow_policy,
+                get_io_workers=lambda: self.config_manager.config.io_workers,
+                get_file_index=self.router.file_index_for,
+                get_router=lambda: self.router,
+                get_journal=lambda: self.journal,
+                get_durability=lambda: self.config_manager.config.commit_durability,
+                transaction_log=self.transaction_log,
+                get_previewer=lambda: self.diff_previewer if self.config_manager.config.diff_preview_enabled else None
+            )
+            # 监听线程只做读取和去重，解析交给流水线的解析线程
+            self.monitor = ClipboardMonitor(
+                self.pipeline,
+                payload_cache=self.payload_cache,
+                metrics=self.metrics,
+                parse=False,
+                coalesce_window=config.clipboard_coalesce_ms / 1000 # 同一次复制的多个更新事件只读取一次剪贴板
+            )
+            # 配置了 ingest_address 时，编辑器扩展等本地程序可以直接把载荷交给同一条流水线
+            self.ingest_server = IngestServer(
+                self.pipeline,
+                config.ingest_address,
+                auth_token=config.ingest_token,
+                auto_approve=config.ingest_auto_approve
+            ) if config.ingest_address else None
+        self.icon = None # 托盘图标在托盘线程中创建（见 _run_tray_icon）
+        self._quit_requested = False
+        self._idle_icon_variant = 'default' # 处理完剪贴板内容后恢复的图标状态
+        self.confirmation_window = ConfirmationWindow(self.root)
+        self._ui_calls = queue.SimpleQueue() # 其他线程交给 Tk 主线程执行的 (函数, 参数)
+        self._last_confirmation_toast = 0.0
+        self.ui_stall = UiStallMonitor(lambda seconds, callback: self.root.after(int(seconds * 1000), callback))
+
+        self.root.bind('<<ConfigChanged>>', lambda event: self._check_and_update_root_folder_from_config())
+        self.root.bind('<<UiCall>>', self._run_ui_calls)
+
+        # 没有原生文件通知时，每秒检查一次配置文件签名（一次 stat，不解析 JSON）
+        if not self.config_watcher.uses_push:
+            self.root.after(1000, self._schedule_root_folder_check)
+
+    def _build_tray_menu(self, root_folder_path):
+        """构建托盘菜单；根目录变化时需要重新构建以更新只读项的文本。"""
+        from pystray import Menu, MenuItem
+        return (
+            MenuItem(f"项目根目录: {root_folder_path}", None, enabled=False), # 显示当前根目录，不可点击
+            MenuItem("修改根目录", self._modify_root_folder_action),
+            MenuItem("切换默认项目", Menu(*(
+                MenuItem(project.name, self._switch_project_action(project.path), radio=True,
+                         checked=lambda item, path=project.path: path == self.root_folder)
+                for project in self.router.projects)), visible=len(self.router.projects) > 1),
+            MenuItem("待确认的操作", self._show_confirmation_window_action),
+            MenuItem("撤销上一批操作", self._restore_action('undo'), visible=self.journal is not None),
+            MenuItem("重做", self._restore_action('redo'), visible=self.journal is not None),
+            MenuItem("操作历史", self._show_history_action, visible=self.journal is not None),
+            MenuItem("延迟统计 (p50/p95/p99)", self._show_latency_stats_action),
+            Menu.SEPARATOR,
+            MenuItem("退出", self._quit_application)
+        )
 
     def _setup_tray_icon(self):
         """
-        设置系统托盘图标及其菜单。
+        设置系统托盘图标及其菜单。在托盘线程中调用，pystray 和 Pillow 在这里才被导入。
         """
-        icon_image = create_default_icon() # 从导入的模块调用函数
+        from pystray import Icon
+        icon_image = load_icon('default')
 
-        menu = (
-            MenuItem(f"项目根目录: {self.root_folder}", None, enabled=False), # 显示当前根目录，不可点击
-            MenuItem("修改根目录", self._modify_root_folder_action),
-            Menu.SEPARATOR,
-            MenuItem("退出", self._quit_application)
-        )
-        
         self.icon = Icon(
             'AutoCodeApplier',
             icon_image,
             hover_text=f"AutoCodeApplier - 根目录: {self.root_folder}",
-            menu=menu
+            menu=self._build_tray_menu(self.root_folder)
         )
         self.icon.title = f"AutoCodeApplier - 根目录: {self.root_folder}"
 
@@ -124,16 +198,29 @@ class AutoCodeApplier:
         """
         if self.icon:
             # 需要重新设置菜单以更新只读项的文本
-            menu = (
-                MenuItem(f"项目根目录: {new_root_folder_path}", None, enabled=False),
-                MenuItem("修改根目录", self._modify_root_folder_action),
-                Menu.SEPARATOR,
-                MenuItem("退出", self._quit_application)
-            )
-            self.icon.menu = menu
+            self.icon.menu = self._build_tray_menu(new_root_folder_path)
             self.icon.title = f"AutoCodeApplier - 根目录: {new_root_folder_path}"
             self.icon.tooltip = f"AutoCodeApplier - 根目录: {new_root_folder_path}"
 
+    def _set_tray_icon_variant(self, variant):
+        """切换托盘图标的状态（default/busy/error），图标已缓存时只是一次赋值。"""
+        if self.icon:
+            try:
+                self.icon.icon = load_icon(variant)
+            except Exception as e:
+                print(f"[WARNING] 无法切换托盘图标状态 '{variant}': {e}", file=sys.stderr)
+
+    def _run_tray_icon(self):
+        """托盘线程：创建图标并运行 pystray 的阻塞事件循环，不占用主线程的启动时间。"""
+        try:
+            with STARTUP_PROFILER.phase("托盘图标 (pystray + 图标缓存)"):
+                self._setup_tray_icon() # 设置系统托盘图标，现在 self.root_folder 已经可用
+        except Exception as e:
+            print(f"[ERROR] 无法创建托盘图标: {type(e).__name__}: {e}", file=sys.stderr)
+            return
+        if not self._quit_requested:
+            self.icon.run()
+
     def _modify_root_folder_action(self):
         """
         托盘菜单中“修改根目录”选项的回调函数。
@@ -146,18 +233,122 @@ class AutoCodeApplier:
                 self.root_folder = new_path
                 self._update_tray_icon_status(self.root_folder)
                 self._last_loaded_root_folder = self.root_folder # 更新最后加载的根目录
+                self._configure_projects()
         
         self.root.after(0, prompt_and_update)
 
 
+    def _configure_projects(self):
+        """
+        按当前根目录和 config.json 中的 projects 更新路由器。路径未变的项目沿用已建立的文件索引，
+        因此切换默认项目不需要重新扫描；默认项目的索引在后台开始建立。
+        """
+        config = self.config_manager.config
+        self.router.index_enabled = config.file_index_enabled
+        self.router.refresh_seconds = config.file_index_refresh_seconds
+        self.router.configure(self.root_folder, config.projects)
+        self.router.start_default_index()
+        if self.icon:
+            self.icon.menu = self._build_tray_menu(self.root_folder) # 项目列表可能变化
+
+    def _switch_project_action(self, path):
+        """返回托盘菜单中切换默认项目的回调函数：保存到 config.json 并立即生效，不弹出对话框。"""
+        def switch(icon=None, item=None):
+            def update():
+                if path == self.root_folder:
+                    return
+                self.config_manager.set_root_folder(path)
+                self.root_folder = path
+                self._last_loaded_root_folder = path
+                self._update_tray_icon_status(path)
+                self._configure_projects()
+            self.root.after(0, update)
+        return switch
+
+    def _show_confirmation_window_action(self):
+        """托盘菜单中“待确认的操作”选项的回调函数，重新打开被关闭（隐藏）的确认窗口。"""
+        self._call_in_ui(self.confirmation_window.show)
+
+    def _restore_action(self, action):
+        """
+        返回托盘菜单中撤销（'undo'）或重做（'redo'）的回调函数。恢复在流水线的 IO 线程中进行，
+        与写入串行，不阻塞托盘线程和 Tk 主线程；完成后显示结果。
+        """
+        def restore(icon=None, item=None):
+            try:
+                future = self.pipeline.run_coroutine(self.pipeline.restore(action))
+            except RuntimeError as e:
+                self._call_in_ui(messagebox.showerror, "撤销", str(e))
+                return
+            future.add_done_callback(self._on_restored)
+        return restore
+
+    def _on_restored(self, future):
+        try:
+            result = future.result()
+        except JournalError as e:
+            self._call_in_ui(messagebox.showinfo, "撤销", str(e))
+            return
+        except Exception as e:
+            self._call_in_ui(messagebox.showerror, "撤销", f"撤销或重做失败: {type(e).__name__}: {e}")
+            return
+        message = format_restore_result(result)
+        print(message)
+        if result.errors or result.modified:
+            self._call_in_ui(messagebox.showwarning, "撤销", message)
+        else:
+            notify("AutoApply：撤销/重做完成", message)
+
+    def _show_history_action(self):
+        """托盘菜单中“操作历史”选项的回调函数，列出最近的批次及其状态。"""
+        self._call_in_ui(lambda: messagebox.showinfo("操作历史", format_history(self.journal.history())))
+
+    def _show_latency_stats_action(self):
+        """
+        托盘菜单中“延迟统计”选项的回调函数，显示各阶段当前的 p50/p95/p99、流水线各队列的状态和 UI 线程的卡顿。
+        """
+        self.root.after(0, lambda: messagebox.showinfo(
+            "延迟统计", "\n\n".join(filter(None, (
+                self.metrics.format_summary(), self.monitor.format_coalescing_summary(), self.pipeline.format_summary(),
+                self.ingest_server.format_summary() if self.ingest_server else "", self.ui_stall.format_summary())))))
+
+    def _call_in_ui(self, func, *args):
+        """在 Tk 主线程中执行 func(*args)，可从任意线程调用。"""
+        self._ui_calls.put((func, args))
+        try:
+            self.root.event_generate('<<UiCall>>', when='tail')
+        except (tk.TclError, RuntimeError) as e:
+            print(f"[WARNING] 无法通知主线程: {e}", file=sys.stderr)
+
+    def _run_ui_calls(self, event=None):
+        while True:
+            try:
+                func, args = self._ui_calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"[ERROR] 更新界面时出错: {type(e).__name__}: {e}", file=sys.stderr)
+
     def _quit_application(self, icon=None, item=None):
         """
         托盘菜单中“退出”选项的回调函数。
         优雅地关闭所有组件。
         """
         print("收到退出指令...")
+        self._quit_requested = True
         if self.monitor:
             self.monitor.stop() # 停止剪贴板监听线程
+        if self.ingest_server:
+            self.ingest_server.stop()
+        self.pipeline.stop()
+        self.router.stop()
+        self.diff_previewer.close()
+        if self.journal:
+            self.journal.close() # 等待后台线程保存完最后的批次
+        self.config_watcher.stop()
+        self.metrics.stop()
         if self.icon:
             self.icon.stop() # 停止托盘图标线程
         
@@ -211,303 +402,158 @@ class AutoCodeApplier:
                     # messagebox.showinfo("取消操作", "未修改项目根目录，将继续使用现有设置。")
                     return current_root_from_config # 返回旧的有效路径
 
-    def _check_clipboard_queue(self):
+    def _schedule_root_folder_check(self):
         """
-        定时检查剪贴板队列，处理其中的内容。
+        调度周期性检查配置文件签名的任务，仅在没有原生文件通知时使用。
         """
         try:
-            clipboard_content = self.clipboard_queue.get_nowait()
-            self._handle_clipboard_change(clipboard_content)
-        except Empty:
-            pass # 明确捕获并忽略 queue.Empty 异常
+            self.config_watcher.poll() # 签名未变化时只有一次 stat 调用
         except Exception as e:
-            # 仅打印非 Empty 且非 Tkinter TclError 的异常
-            if not isinstance(e, tk.TclError):
-                 print(f"[ERROR] Error in _check_clipboard_queue: {type(e).__name__}: {e}", file=sys.stderr)
-        finally:
-            # 在主线程中调度下一次检查
-            self.root.after(100, self._check_clipboard_queue)
+            print(f"[ERROR] 检查配置文件变化时发生错误: {type(e).__name__}: {e}", file=sys.stderr)
+        self.root.after(1000, self._schedule_root_folder_check) # 每秒再次调度自己
 
-    def _schedule_root_folder_check(self):
+    def _on_config_changed(self, config):
         """
-        调度周期性检查根目录配置的任务。
+        ConfigWatcher 的回调。原生通知模式下在后台线程中调用，需要转交给 Tk 主线程。
         """
-        self._check_and_update_root_folder_from_config()
-        self.root.after(1000, self._schedule_root_folder_check) # 每秒再次调度自己
+        if threading.current_thread() is threading.main_thread():
+            self._check_and_update_root_folder_from_config()
+            return
+        try:
+            self.root.event_generate('<<ConfigChanged>>', when='tail')
+        except (tk.TclError, RuntimeError) as e:
+            print(f"[WARNING] 无法通知主线程配置已变化: {e}", file=sys.stderr)
 
     def _check_and_update_root_folder_from_config(self):
         """
-        重新加载 config.json，并检查 root_folder 是否发生变化。
-        如果发生变化，则更新当前根目录并刷新托盘图标。
+        使用缓存的配置对象检查 root_folder 是否发生变化（仅在 config.json 变化后调用）。
+        如果发生变化，则更新当前根目录并刷新托盘图标；之后按新的配置更新项目路由。
         """
         try:
-            self.config_manager._load_config() # 重新从文件加载配置
-            new_root_folder = self.config_manager.get_root_folder()
+            config = self.config_manager.config
+            new_root_folder = config.root_folder
             
-            if new_root_folder and os.path.isdir(new_root_folder) and new_root_folder != self._last_loaded_root_folder:
+            if config.root_folder_valid and new_root_folder != self._last_loaded_root_folder:
                 # 只有当新路径有效且与上次加载的不同时才更新
                 self.root_folder = new_root_folder
                 self._last_loaded_root_folder = new_root_folder
                 self._update_tray_icon_status(self.root_folder)
                 print(f"[INFO] 项目根目录已自动更新为: {self.root_folder}")
-            elif not new_root_folder or not os.path.isdir(new_root_folder):
+            elif not config.root_folder_valid:
                 # 如果 config.json 中的路径无效或为空，并且当前程序持有的 root_folder 也无效，
                 # 则可以考虑弹窗提示用户，但为了不打扰用户，这里只打印警告。
                 # 如果之前有效，现在无效，则保持旧的有效路径不变。
                 if self.root_folder and not os.path.isdir(self.root_folder):
                      print(f"[WARNING] config.json 中的根目录 '{new_root_folder}' 无效，或当前 '{self.root_folder}' 已失效。请手动修改或通过VS Code扩展重新设置。", file=sys.stderr)
                      # 此时可以选择让用户重新设置，但为了避免频繁弹窗，目前只警告
-                elif not self.root_folder and new_root_folder and os.path.isdir(new_root_folder):
+                elif not self.root_folder and config.root_folder_valid:
                     # config.json 之前为空或无效，现在有有效值了
                     self.root_folder = new_root_folder
                     self._last_loaded_root_folder = new_root_folder
                     self._update_tray_icon_status(self.root_folder)
                     print(f"[INFO] 项目根目录已从空值自动更新为: {self.root_folder}")
+            self._configure_projects()
 
         except Exception as e:
             print(f"[ERROR] 检查并更新根目录时发生错误: {type(e).__name__}: {e}", file=sys.stderr)
 
 
-    def _handle_clipboard_change(self, clipboard_content):
-        """
-        处理剪贴板内容变化的逻辑，现在支持一次性确认多个文件块的写入，
-        并在写入前检查内容是否与现有文件一致，并增加了追加、删除和创建操作。
-        """
-        if not clipboard_content:
-            return
-
-        matches = list(self.CLIPBOARD_PATTERN.finditer(clipboard_content))
-
-        if not matches:
-            return
-
-        files_to_write = []
-        files_to_delete = []
-        prompt_details = []
-
-        for match in matches:
-            filename = match.group('filename').strip()
-            operation_raw = match.group('operation').strip() # 获取原始操作指令
-            
-            # --- 指令标准化 ---
-            # 将中文或英文指令统一映射为大写的英文指令，以便后续逻辑处理
-            # re.IGNORECASE 标志确保了 'overwrite', 'OVERWRITE' 等都会被正确处理
-            operation_type = ""
-            if operation_raw.lower() in ['create', '创建']:
-                operation_type = "CREATE"
-            elif operation_raw.lower() in ['overwrite', '覆盖', '修改']: # 增加“修改”
-                operation_type = "OVERWRITE"
-            elif operation_raw.lower() in ['append', '追加']:
-                operation_type = "APPEND"
-            elif operation_raw.lower() in ['delete', '删除']:
-                operation_type = "DELETE"
-            else:
-                # 如果匹配到未知指令（理论上不会，因为正则表达式限制了），则跳过
-                print(f"[WARNING] 检测到文件 '{filename}' 的未知操作类型 '{operation_raw}'，跳过此代码块。", file=sys.stderr)
-                continue
-
-            code_content_raw = match.group('content').strip()
-            # 标准化剪贴板内容的换行符
-            code_content_normalized = code_content_raw.replace('\r\n', '\n').replace('\r', '\n')
-            
-            target_path = os.path.join(self.root_folder, filename)
-            target_dir = os.path.dirname(target_path)
-
-            # --- 处理 DELETE 操作 ---
-            if operation_type == "DELETE":
-                if os.path.exists(target_path):
-                    files_to_delete.append(target_path)
-                    prompt_details.append(f"- '{filename}' (删除, 路径: '{target_path}')")
-                else:
-                    print(f"[INFO] 文件 '{filename}' 不存在，跳过删除操作。")
-                    prompt_details.append(f"- '{filename}' (删除 - 文件不存在，已跳过)")
-                continue # 完成此匹配项的处理，进入下一个匹配
-
-            # --- 处理 CREATE 操作 ---
-            elif operation_type == "CREATE":
-                existing_content = ""
-                file_exists = os.path.exists(target_path) and os.path.isfile(target_path)
-
-                if file_exists:
-                    try:
-                        with open(target_path, 'r', encoding='utf-8') as f:
-                            existing_content = f.read().replace('\r\n', '\n').replace('\r', '\n')
-                    except Exception as e:
-                        print(f"[WARNING] 无法读取文件 '{target_path}' 进行比较 (CREATE 操作): {e}. 将视为新内容或空内容。", file=sys.stderr)
-                        existing_content = ""
-                    
-                    if code_content_normalized == existing_content.strip():
-                        print(f"文件 '{filename}' (CREATE) 内容与现有文件一致，跳过写入。")
-                        continue # 如果文件存在且内容一致，跳过
-                    else:
-                        # 文件存在但内容不同，CREATE 操作应询问是否覆盖
-                        confirmation = win32_askyesno(
-                            "文件已存在警告", 
-                            f"您尝试创建一个文件 '{filename}'，但该文件已存在且内容不同。\n"
-                            f"路径: '{target_path}'\n"
-                            f"是否要覆盖现有文件？\n"
-                            f"（取消将跳过此文件）"
-                        )
-                        if not confirmation:
-                            print(f"用户取消了 '{filename}' (CREATE) 操作，文件已存在且内容不同。")
-                            continue # 用户选择不覆盖，跳过此文件
-                        
-                        # 如果用户确认覆盖，则视为覆盖操作
-                        status = "覆盖 (CREATE 请求)"
-                        operation_for_log = "OVERWRITE_ON_CREATE"
-                else:
-                    status = "创建"
-                    operation_for_log = "CREATE"
-
-                files_to_write.append({
-                    'filename': filename,
-                    'code_content': code_content_normalized,
-                    'target_path': target_path,
-                    'target_dir': target_dir,
-                    'operation': operation_for_log # 存储实际执行的操作类型
-                })
-                prompt_details.append(f"- '{filename}' ({status}, 将写入到: '{target_path}')")
-                continue # 完成此匹配项的处理，进入下一个匹配
-
-
-            # --- 处理 OVERWRITE 和 APPEND 操作 ---
-            elif operation_type in ["OVERWRITE", "APPEND"]:
-                existing_content = ""
-                file_exists = os.path.exists(target_path) and os.path.isfile(target_path)
-
-                if file_exists:
-                    try:
-                        with open(target_path, 'r', encoding='utf-8') as f:
-                            existing_content = f.read().replace('\r\n', '\n').replace('\r', '\n')
-                    except Exception as e:
-                        print(f"[WARNING] 无法读取文件 '{target_path}' 进行比较/追加: {e}. 将视为新内容或空内容。", file=sys.stderr)
-                        existing_content = "" # 无法读取，视为文件不存在或内容为空
-                
-                content_to_write = code_content_normalized
-                status = ""
-
-                if operation_type == "OVERWRITE":
-                    # 在比较前，对现有文件内容和剪贴板内容都执行 strip()
-                    if file_exists and code_content_normalized == existing_content.strip():
-                        print(f"文件 '{filename}' (OVERWRITE) 内容与现有文件一致，跳过写入。")
-                        continue # 内容一致，跳过此文件
-                    status = "更新" if file_exists else "创建"
-
-                elif operation_type == "APPEND":
-                    # 如果文件存在，新内容是现有内容加上要追加的内容
-                    if file_exists:
-                        # 确保追加的内容前有换行符，除非现有文件为空
-                        content_to_write = existing_content + ("\n" if existing_content and not existing_content.endswith('\n') else "") + code_content_normalized
-                        # 检查追加后内容是否与现有内容相同（如果追加的是空内容，或者现有文件已经包含该内容）
-                        if content_to_write.strip() == existing_content.strip():
-                            print(f"文件 '{filename}' (APPEND) 内容追加后与现有文件一致，跳过写入。")
-                            continue
-                    else: # 文件不存在，APPEND 行为等同于 OVERWRITE (创建)
-                        status = "创建并写入"
-                    status = "追加" if file_exists else "创建并写入"
-                
-                files_to_write.append({
-                    'filename': filename,
-                    'code_content': content_to_write,
-                    'target_path': target_path,
-                    'target_dir': target_dir,
-                    'operation': operation_type # 用于提示和日志
-                })
-                prompt_details.append(f"- '{filename}' ({status}, 将{operation_type.lower()}到: '{target_path}')")
-            
-            else:
-                # 此处的 else 理论上不会被触发，因为前面已经做了指令标准化和检查
-                print(f"[WARNING] 检测到文件 '{filename}' 的未知操作类型 '{operation_type}'，跳过此代码块。", file=sys.stderr)
-                continue
-
+    # --- PipelineFrontend：以下方法在流水线的线程中调用，只使用线程安全的原生对话框，界面更新转交 Tk 主线程 ---
 
-        # 如果没有文件需要写入或删除，则不弹出提示框
-        if not files_to_write and not files_to_delete:
-            print("剪贴板中检测到的所有代码块内容均与现有文件一致，或操作被跳过，无需处理。")
+    def request_confirmation(self, pending):
+        """把计划加入确认窗口并发送通知后立即返回，用户在窗口中批准或拒绝（可一次处理多个批次）。"""
+        self._call_in_ui(self.confirmation_window.add, pending)
+        if pending.plan.previews is not None:
+            # 预览在确认请求之后才开始计算，全部完成后刷新窗口中显示的详情
+            pending.plan.previews.add_done_callback(lambda: self._call_in_ui(self.confirmation_window.refresh_details))
+        if not self.config_manager.config.confirmation_toast:
             return
-
-        # 构建提示消息
-        prompt_message_parts = [
-            f"在剪贴板中检测到 {len(files_to_write) + len(files_to_delete)} 个操作请求。\n"
-            f"是否执行这些操作到您的项目根目录 '{self.root_folder}' 下？\n"
-        ]
-        if prompt_details:
-            prompt_message_parts.append(f"\n以下操作将被执行：\n{' \n'.join(prompt_details)}\n")
-        
-        prompt_message_parts.append("\n注意：")
-        if any(f['operation'] == "CREATE" for f in files_to_write):
-            prompt_message_parts.append(" - 'CREATE' 操作将创建新文件。")
-        if any(f['operation'] == "OVERWRITE" for f in files_to_write) or any(f['operation'] == "OVERWRITE_ON_CREATE" for f in files_to_write):
-            prompt_message_parts.append(" - 'OVERWRITE' 或因 'CREATE' 请求导致的覆盖操作将覆盖现有文件内容。")
-        if any(f['operation'] == "APPEND" for f in files_to_write):
-            prompt_message_parts.append(" - 'APPEND' 操作将追加内容到现有文件末尾。")
-        if files_to_delete:
-            prompt_message_parts.append(" - 'DELETE' 操作将删除指定文件。")
-        
-        prompt_message = "".join(prompt_message_parts)
-        
-        # 使用 win32_askyesno 而不是 Tkinter 的 messagebox
-        response = win32_askyesno("检测到文件操作请求", prompt_message)
-
-        if response:
-            # 执行写入/追加操作
-            for file_info in files_to_write:
-                try:
-                    os.makedirs(file_info['target_dir'], exist_ok=True)
-                    with open(file_info['target_path'], 'w', encoding='utf-8') as f:
-                        f.write(file_info['code_content'])
-                    # 根据实际操作类型打印日志
-                    log_operation_type = file_info['operation'].replace("OVERWRITE_ON_CREATE", "CREATE (已覆盖)").lower()
-                    print(f"文件 '{file_info['target_path']}' 已成功 {log_operation_type}。")
-                except Exception as e:
-                    messagebox.showerror(f"{file_info['operation']}失败", f"无法 {file_info['operation'].lower()} 文件 '{file_info['target_path']}': {e}")
-            
-            # 执行删除操作
-            for file_path in files_to_delete:
-                try:
-                    if os.path.exists(file_path): # 再次检查文件是否存在，以防并发操作
-                        os.remove(file_path)
-                        print(f"文件 '{file_path}' 已成功删除。")
-                    else:
-                        print(f"尝试删除的文件 '{file_path}' 不存在，已跳过。")
-                except Exception as e:
-                    messagebox.showerror("删除失败", f"无法删除文件 '{file_path}': {e}")
-        else:
-            print("用户取消了所有操作。")
+        now = time.monotonic()
+        if now - self._last_confirmation_toast >= CONFIRMATION_TOAST_INTERVAL:
+            self._last_confirmation_toast = now
+            notify("AutoApply：有文件操作等待确认",
+                   f"{pending.plan.operation_count()} 个文件操作，请在确认窗口中批准或拒绝。",
+                   on_click=lambda: self._call_in_ui(self.confirmation_window.show))
+
+    def on_busy(self, busy):
+        """流水线中有待处理的内容时托盘图标显示为 busy 状态。"""
+        self._set_tray_icon_variant('busy' if busy else self._idle_icon_variant)
+
+    def on_committed(self, plan, errors):
+        self._idle_icon_variant = 'error' if errors else 'default' # 失败后图标保持灰色，直到下一次成功写入
+        if errors:
+            # 汇总所有失败，显示在确认窗口中而不弹出模态错误框，不阻塞后续的确认请求
+            message = format_commit_errors(errors)
+            self._call_in_ui(self.confirmation_window.show_error, message)
+            if self.config_manager.config.confirmation_toast:
+                notify("AutoApply：部分文件操作失败", message)
 
 
     def run(self):
         """启动应用程序。"""
         print(f"当前项目根目录: {self.root_folder}")
         print("剪贴板监控已启动，请复制包含 Markdown 格式的指令。")
-        self.monitor.start()
-
-        # 在单独的线程中运行 pystray icon，因为它也有自己的阻塞事件循环
-        tray_thread = threading.Thread(target=self.icon.run, daemon=True)
+        with STARTUP_PROFILER.phase("启动后台线程"):
+            self.pipeline.start() # 先启动流水线，监听线程放入的内容才有人接收
+            self.monitor.start()
+            if self.ingest_server:
+                try:
+                    self.ingest_server.start()
+                except (OSError, ValueError) as e:
+                    print(f"[ERROR] 无法启动载荷接收端点 '{self.config_manager.config.ingest_address}': {e}", file=sys.stderr)
+                    self.ingest_server = None
+            self.router.start_default_index() # 在后台线程中扫描默认项目，不推迟启动
+            self.config_watcher.start() # 仅在支持原生文件通知时启动后台线程
+            self.metrics.start() # 仅在启用统计并配置了 metrics_port 时启动本地 HTTP 端点
+            self.ui_stall.start() # Tk 主线程心跳，测量界面卡顿
+        # 在单独的线程中创建并运行 pystray icon，因为它也有自己的阻塞事件循环
+        tray_thread = threading.Thread(target=self._run_tray_icon, daemon=True, name='TrayIcon')
         tray_thread.start()
 
+        if STARTUP_PROFILER.enabled:
+            # 主循环开始处理事件时即视为启动完成
+            self.root.after_idle(lambda: print(STARTUP_PROFILER.report()))
+
         try:
             self.root.mainloop() # Tkinter 主循环在主线程运行
         except KeyboardInterrupt:
             print("程序即将退出...")
         finally:
             self.monitor.stop()
+            if self.ingest_server:
+                self.ingest_server.stop()
+            self.pipeline.stop()
+            self.router.stop()
+            self.diff_previewer.close()
+            if self.journal:
+                self.journal.close()
+            self.metrics.stop()
+            self.ui_stall.stop()
             if self.icon:
                 self.icon.stop() # 确保在退出时停止托盘图标
+            print(f"[INFO] 剪贴板内容缓存统计: {self.payload_cache.stats()}")
+            print(f"[INFO] 处理流水线统计: {self.pipeline.stats()}")
+            if self.monitor.coalescer is not None:
+                print(f"[INFO] 剪贴板事件合并统计: {self.monitor.coalescing_stats()}")
+            if self.ingest_server:
+                print(f"[INFO] {self.ingest_server.format_summary()}")
+            print(f"[INFO] {self.ui_stall.format_summary()}")
             print("应用程序已完全关闭。")
 
 if __name__ == '__main__':
-    # win32clipboard, win32gui, pywintypes 的检查保留
-    try:
-        import win32clipboard
-        import win32gui
-        import pywintypes
-    except ImportError:
-        print(
-            "错误: 缺少 'pywin32' 库。请运行 'pip install pywin32' 后再启动程序。",
-            file=sys.stderr
-        )
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="AutoApply：监听剪贴板并将代码块写入项目文件。")
+    parser.add_argument('--profile-startup', action='store_true', help="输出各模块的导入耗时和各初始化阶段的耗时。")
+    parser.parse_args()
+
+    # 只查找模块是否已安装而不导入，实际导入推迟到需要时
+    for module_name, package_name in (('win32gui', 'pywin32'), ('pystray', 'pystray'), ('PIL', 'Pillow')):
+        if importlib.util.find_spec(module_name) is None:
+            print(
+                f"错误: 缺少 '{package_name}' 库。请运行 'pip install {package_name}' 后再启动程序。",
+                file=sys.stderr
+            )
+            sys.exit(1)
 
-    app = AutoCodeApplier()
+    with STARTUP_PROFILER.phase("创建应用"):
+        app = AutoCodeApplier()
     app.run()
\ No newline at end of file
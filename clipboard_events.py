@@ -0,0 +1,195 @@
+import sys
+import time
+import ctypes
+import threading
+from queue import Queue
+
+# pywin32 仅在 Windows 上可用；其他平台仍可导入本模块并使用 FakeClipboardEventSource。
+try:
+    import win32clipboard
+    import win32con
+    import win32gui
+    import pywintypes
+except ImportError:
+    win32clipboard = win32con = win32gui = pywintypes = None
+
+
+class ClipboardEventSource:
+    """
+    剪贴板事件源的抽象接口。
+    run() 在调用线程中阻塞等待事件，每次剪贴板变化时调用 on_update()，直到 stop() 被调用。
+    实现不得使用定时轮询：没有事件时线程应完全休眠。
+    """
+    def run(self, on_update):
+        raise NotImplementedError
+
+    def read_text(self):
+        """读取当前剪贴板文本，不可用时返回 None。只在 on_update 回调中调用。"""
+        raise NotImplementedError
+
+    def stop(self):
+        """请求 run() 返回，可从任意线程调用。"""
+        raise NotImplementedError
+
+
+class Win32ClipboardEventSource(ClipboardEventSource):
+    """
+    基于隐藏消息窗口和 AddClipboardFormatListener 的事件源。
+    使用阻塞的 GetMessage 循环 (win32gui.PumpMessages)，空闲时不会唤醒 CPU。
+    """
+    WM_CLIPBOARDUPDATE = 0x031D
+    CLASS_NAME = "ClipboardMonitorClass"
+
+    def __init__(self):
+        if win32gui is None:
+            raise RuntimeError("Win32ClipboardEventSource 需要 'pywin32' 库。")
+        self.hwnd = None
+        self._on_update = None
+        self._stop_requested = threading.Event()
+
+    def _create_window(self):
+        """创建一个隐藏窗口用于接收 Windows 消息。"""
+        wc = win32gui.WNDCLASS()
+        wc.lpfnWndProc = self._wnd_proc
+        wc.lpszClassName = self.CLASS_NAME
+        wc.hInstance = win32gui.GetModuleHandle(None)
+        class_atom = win32gui.RegisterClass(wc)
+
+        self.hwnd = win32gui.CreateWindowEx(
+            0, # dwExStyle
+            class_atom, # lpClassName
+            "ClipboardMonitor", # lpWindowName
+            0, # dwStyle
+            0, 0, 0, 0, # x, y, nWidth, nHeight
+            win32con.HWND_MESSAGE, # hWndParent - 使用 HWND_MESSAGE 创建消息窗口
+            0, # hMenu
+            wc.hInstance, # hInstance
+            None
+        )
+        win32gui.UpdateWindow(self.hwnd)
+
+    def _wnd_proc(self, hwnd, msg, wparam, lparam):
+        """窗口过程函数，处理 Windows 消息。"""
+        if msg == self.WM_CLIPBOARDUPDATE:
+            self._on_update()
+        elif msg == win32con.WM_DESTROY:
+            ctypes.windll.user32.RemoveClipboardFormatListener(hwnd)
+            win32gui.PostQuitMessage(0)
+        return win32gui.DefWindowProc(hwnd, msg, wparam, lparam)
+
+    def run(self, on_update):
+        self._on_update = on_update
+        self._create_window()
+        ctypes.windll.user32.AddClipboardFormatListener(self.hwnd)
+        if self._stop_requested.is_set():
+            # stop() 在窗口创建之前被调用
+            win32gui.PostMessage(self.hwnd, win32con.WM_CLOSE, 0, 0)
+        win32gui.PumpMessages() # 阻塞直到收到 WM_QUIT
+        self.hwnd = None
+        win32gui.UnregisterClass(self.CLASS_NAME, win32gui.GetModuleHandle(None))
+
+    def read_text(self):
+        clipboard_data = None
+        opened = False
+        try:
+            win32clipboard.OpenClipboard(self.hwnd)
+            opened = True
+            if win32clipboard.IsClipboardFormatAvailable(win32con.CF_UNICODETEXT):
+                clipboard_data = win32clipboard.GetClipboardData(win32con.CF_UNICODETEXT)
+        except pywintypes.error as e:
+            # 忽略 "cannot open clipboard" (error 5) 这类常见、无害的错误
+            if e.winerror != 5:
+                print(f"[ERROR] pywintypes.error when accessing clipboard: {e}", file=sys.stderr)
+        finally:
+            if opened:
+                try:
+                    win32clipboard.CloseClipboard()
+                except Exception as e:
+                    print(f"[ERROR] Error closing clipboard in finally: {e}", file=sys.stderr)
+        return clipboard_data
+
+    def stop(self):
+        self._stop_requested.set()
+        if self.hwnd:
+            win32gui.PostMessage(self.hwnd, win32con.WM_CLOSE, 0, 0)
+
+
+_STOP = object()
+
+
+class FakeClipboardEventSource(ClipboardEventSource):
+    """
+    用于测试和基准测试的事件源，可在 Linux 上运行。
+    copy() 模拟一次复制；run() 阻塞在队列上，并统计唤醒次数和复制时间戳，
+    以便测量空闲唤醒次数和“复制 → 处理”的延迟。
+    长时间的负载测试应传入 record_copy_times=False，否则时间戳字典会随复制次数增长。
+    """
+    def __init__(self, record_copy_times=True):
+        self._events = Queue()
+        self._current_text = None
+        self.wakeups = 0
+        self.record_copy_times = record_copy_times
+        self.copy_times = {}
+
+    def copy(self, text):
+        """模拟用户复制 text，可从任意线程调用。"""
+        if self.record_copy_times:
+            self.copy_times[text] = time.perf_counter()
+        self._events.put(text)
+
+    def play(self, script):
+        """
+        按脚本回放一串事件，阻塞直到回放结束。script 为 (距上一个事件的秒数, 文本) 序列，
+        文本为 None 表示此时剪贴板中还没有文本格式（例如编辑器先写入其他格式）。
+        """
+        for delay, text in script:
+            if delay > 0:
+                time.sleep(delay)
+            self.copy(text)
+
+    def pending(self):
+        """尚未被 run() 处理的复制事件数。"""
+        return self._events.qsize()
+
+    def latency_since_copy(self, text):
+        """返回从复制 text 到现在经过的秒数。"""
+        return time.perf_counter() - self.copy_times[text]
+
+    def run(self, on_update):
+        while True:
+            item = self._events.get() # 无超时的阻塞等待
+            self.wakeups += 1
+            if item is _STOP:
+                return
+            self._current_text = item
+            on_update()
+
+    def read_text(self):
+        return self._current_text
+
+    def stop(self):
+        self._events.put(_STOP)
+
+
+if __name__ == '__main__':
+    # 直接运行 `python clipboard_events.py`：用假事件源测量空闲唤醒次数和复制到处理的延迟。
+    from clipboard_monitor import ClipboardMonitor
+
+    source = FakeClipboardEventSource()
+    handled = Queue()
+    latencies = []
+    monitor = ClipboardMonitor(handled, event_source=source)
+    monitor.start()
+
+    time.sleep(1.0)
+    print(f"空闲 1 秒内的唤醒次数: {source.wakeups}")
+
+    for i in range(200):
+        text = f"#### file: f{i}.py (CREATE)\n```\nx = {i}\n```\n"
+        source.copy(text)
+        latencies.append(source.latency_since_copy(handled.get().text))
+    monitor.stop()
+
+    latencies.sort()
+    print(f"复制到入队延迟: p50 {latencies[len(latencies) // 2] * 1e3:.3f} ms, "
+          f"max {latencies[-1] * 1e3:.3f} ms, 总唤醒次数 {source.wakeups}")
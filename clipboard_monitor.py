@@ -1,107 +1,236 @@
 import threading
-import time
 import sys
-import ctypes
-import win32clipboard
-import win32con
-import win32gui
-import pywintypes
+import time
+from collections import namedtuple
+from clipboard_events import ClipboardEventSource, Win32ClipboardEventSource
+from metrics import LatencyHistogram, PipelineMetrics
+from payload_cache import PayloadCache
 from queue import Queue # 虽然 ClipboardMonitor 接收 Queue 实例，但它内部不需要直接导入 Queue 类，不过为了模块的独立性，如果将来它需要创建或操作队列，保留在这里是合理的。
 
+# 队列中的元素：剪贴板文本及其阶段计时（未启用统计时为 metrics.NULL_TRACE）
+QueuedPayload = namedtuple('QueuedPayload', ['text', 'trace'])
+
+# 连续事件不断到达时，一组事件最多等待合并窗口的这么多倍，保证“全选-复制”循环中也能定期读取
+COALESCE_MAX_DELAY_FACTOR = 10
+
+
+class BurstCoalescer:
+    """
+    将短时间内连续到达的事件合并为一次回调：最后一个事件之后 window 秒内没有新事件时，
+    在合并线程中调用 callback(first_event, last_event, events)，参数为 time.perf_counter() 时刻和事件数。
+    事件持续不断时，从第一个事件起最多等待 max_delay 秒。
+    added_latency 记录每次回调相对于最后一个事件的额外延迟。
+    """
+    def __init__(self, callback, window, max_delay=None):
+        self.callback = callback
+        self.window = window
+        self.max_delay = max_delay if max_delay is not None else window * COALESCE_MAX_DELAY_FACTOR
+        self.events = 0
+        self.fired = 0
+        self.added_latency = LatencyHistogram()
+        self._condition = threading.Condition()
+        self._first_event = None
+        self._last_event = None
+        self._burst_events = 0
+        self._stopped = False
+        self._thread = None
+
+    @property
+    def suppressed(self):
+        """被合并掉、没有单独触发读取的事件数（包括尚未触发的一组事件）。"""
+        return self.events - self.fired
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name='ClipboardCoalescer')
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def notify(self):
+        """记录一个事件，可从任意线程调用，只需获取一次锁。"""
+        now = time.perf_counter()
+        with self._condition:
+            self.events += 1
+            self._burst_events += 1
+            self._last_event = now
+            if self._first_event is None:
+                self._first_event = now
+                self._condition.notify()
+
+    def _next_burst(self):
+        """等待一组事件结束，返回 (first, last, events)；停止时返回 None。"""
+        with self._condition:
+            while not self._stopped:
+                if self._first_event is None:
+                    self._condition.wait() # 没有事件时完全休眠
+                    continue
+                deadline = min(self._last_event + self.window, self._first_event + self.max_delay)
+                remaining = deadline - time.perf_counter()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                burst = (self._first_event, self._last_event, self._burst_events)
+                self._first_event = self._last_event = None
+                self._burst_events = 0
+                self.fired += 1
+                return burst
+            return None
+
+    def _run(self):
+        while True:
+            burst = self._next_burst()
+            if burst is None:
+                return
+            self.added_latency.observe(time.perf_counter() - burst[1])
+            try:
+                self.callback(*burst)
+            except Exception as e:
+                print(f"[ERROR] 处理剪贴板事件时出错: {type(e).__name__}: {e}", file=sys.stderr)
+
+
 class ClipboardMonitor:
     """
-    使用 Win32 API 监听剪贴板变化的类。
-    当剪贴板内容变化时，将内容放入队列。
+    监听剪贴板变化的类，具体的事件来源由 ClipboardEventSource 提供（默认使用 Win32 API）。
+    当剪贴板内容变化时，将内容放入队列，并通过 on_enqueue 回调唤醒消费者。
+    已见过或不含文件指令的内容由 PayloadCache 在监听线程中直接丢弃。
+    队列中的元素为 QueuedPayload，其中的 trace 已记录读取剪贴板和预解析两个阶段的耗时。
+    parse 为 False 时监听线程只按摘要丢弃已见过的内容，解析留给下游（处理流水线的解析线程），
+    此时 clipboard_queue 可以是任何提供 put() 的对象，例如 pipeline.ApplyPipeline。
+
+    coalesce_window（秒）大于 0 时，同一次复制产生的多个更新事件（多种格式、重复通知）会被合并：
+    一组事件结束 coalesce_window 秒后才读取一次剪贴板，只处理这组事件的最终状态。
     """
-    WM_CLIPBOARDUPDATE = 0x031D
 
-    def __init__(self, clipboard_queue: Queue):
+    def __init__(self, clipboard_queue: Queue, payload_cache: PayloadCache = None,
+                 event_source: ClipboardEventSource = None, on_enqueue=None, metrics: PipelineMetrics = None,
+                 parse=True, coalesce_window=0.0):
         self.clipboard_queue = clipboard_queue
-        self.hwnd = None
-        self.last_clipboard_data = None # 用于存储上一次放入队列的内容
-        self._stop_event = threading.Event()
-
-    def _create_window(self):
-        """创建一个隐藏窗口用于接收 Windows 消息。"""
-        wc = win32gui.WNDCLASS()
-        wc.lpfnWndProc = self._wnd_proc
-        wc.lpszClassName = "ClipboardMonitorClass"
-        wc.hInstance = win32gui.GetModuleHandle(None)
-        class_atom = win32gui.RegisterClass(wc)
-        
-        self.hwnd = win32gui.CreateWindowEx(
-            0, # dwExStyle
-            class_atom, # lpClassName
-            "ClipboardMonitor", # lpWindowName
-            0, # dwStyle (WS_POPUP is often 0, suitable for a message-only window)
-            0, 0, 0, 0, # x, y, nWidth, nHeight
-            win32con.HWND_MESSAGE, # hWndParent - **修正: 使用 HWND_MESSAGE 创建消息窗口**
-            0, # hMenu
-            wc.hInstance, # hInstance
-            None
-        )
-        win32gui.UpdateWindow(self.hwnd)
-
-    def _wnd_proc(self, hwnd, msg, wparam, lparam):
-        """窗口过程函数，处理 Windows 消息。"""
-        if msg == self.WM_CLIPBOARDUPDATE:
-            self._on_clipboard_update()
-        elif msg == win32con.WM_DESTROY:
-            win32gui.PostQuitMessage(0)
-        return win32gui.DefWindowProc(hwnd, msg, wparam, lparam)
-
-    def _on_clipboard_update(self):
-        """剪贴板内容更新时的回调。"""
-        clipboard_data = None
-        opened = False
+        self.payload_cache = payload_cache if payload_cache is not None else PayloadCache()
+        self.event_source = event_source if event_source is not None else Win32ClipboardEventSource()
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        self.on_enqueue = on_enqueue # 入队后调用，用于唤醒主线程，取代定时轮询队列
+        self.parse = parse
+        self.coalescer = BurstCoalescer(self._on_burst_end, coalesce_window) if coalesce_window > 0 else None
+        self._monitor_thread = None
+
+    def _on_burst_end(self, first_event, last_event, events):
+        """合并线程中的回调：从这组事件的最后一个开始计时，合并等待计入 coalesce 阶段。"""
+        trace = self.metrics.new_trace(started=last_event)
+        trace.mark('coalesce')
+        self._on_clipboard_update(trace)
+
+    def _on_clipboard_update(self, trace=None):
+        """剪贴板内容更新时的回调，在监听线程（启用合并时在合并线程）中执行。"""
         try:
-            win32clipboard.OpenClipboard(self.hwnd) 
-            opened = True
-            if win32clipboard.IsClipboardFormatAvailable(win32con.CF_UNICODETEXT):
-                clipboard_data = win32clipboard.GetClipboardData(win32con.CF_UNICODETEXT)
-                
-                # --- BUG 修复：增加内容比对逻辑 ---
-                # 只有当新获取的内容与上一次成功放入队列的内容不同时，才进行处理
-                if clipboard_data and clipboard_data != self.last_clipboard_data:
-                    self.clipboard_queue.put(clipboard_data)
-                    # 只有在成功放入队列后，才更新 last_clipboard_data
-                    self.last_clipboard_data = clipboard_data
-                    
-        except pywintypes.error as e:
-            # 忽略 "cannot open clipboard" (error 5) 这类常见、无害的错误
-            if e.winerror == 5:
-                pass
-            else:
-                print(f"[ERROR] pywintypes.error when accessing clipboard: {e}", file=sys.stderr)
+            if trace is None:
+                trace = self.metrics.new_trace()
+            clipboard_data = self.event_source.read_text()
+            trace.mark('clipboard_read')
+            # 按内容摘要去重：A、B、A 这样的序列中第二个 A 不会再次入队，
+            # 不含指令的内容也不会进入主线程
+            if not clipboard_data:
+                return
+            if not self.parse:
+                if not self.payload_cache.seen(clipboard_data):
+                    self.clipboard_queue.put(QueuedPayload(clipboard_data, trace))
+                    if self.on_enqueue:
+                        self.on_enqueue()
+                return
+            if self.payload_cache.classify(clipboard_data):
+                trace.mark('parse')
+                self.clipboard_queue.put(QueuedPayload(clipboard_data, trace))
+                if self.on_enqueue:
+                    self.on_enqueue()
         except Exception as e:
             print(f"[ERROR] General error accessing clipboard: {e}", file=sys.stderr)
-        finally:
-            if opened:
-                try:
-                    win32clipboard.CloseClipboard()
-                except Exception as e:
-                    print(f"[ERROR] Error closing clipboard in finally: {e}", file=sys.stderr)
+
+    def coalescing_stats(self):
+        """返回合并统计：事件数、实际读取次数、被合并的事件数和额外延迟（毫秒）。未启用合并时返回 None。"""
+        if self.coalescer is None:
+            return None
+        latency = self.coalescer.added_latency
+        return {
+            'events': self.coalescer.events,
+            'reads': self.coalescer.fired,
+            'suppressed': self.coalescer.suppressed,
+            'added_latency_p50_ms': round((latency.percentile(0.5) or 0.0) * 1000, 3),
+            'added_latency_max_ms': round(latency.max * 1000, 3),
+        }
+
+    def format_coalescing_summary(self):
+        """供托盘菜单显示的一行合并统计，未启用合并时返回空字符串。"""
+        stats = self.coalescing_stats()
+        if stats is None:
+            return ""
+        return (f"剪贴板事件合并（窗口 {self.coalescer.window * 1000:.0f} ms）：{stats['events']} 个事件，"
+                f"读取 {stats['reads']} 次，合并 {stats['suppressed']} 个，"
+                f"额外延迟 p50 {stats['added_latency_p50_ms']:.1f} ms / 最大 {stats['added_latency_max_ms']:.1f} ms")
 
     def start(self):
         """启动剪贴板监听线程。"""
-        monitor_thread = threading.Thread(target=self._run_monitor)
-        monitor_thread.daemon = True
-        monitor_thread.start()
+        if self.coalescer is not None:
+            self.coalescer.start()
+        self._monitor_thread = threading.Thread(target=self._run_monitor)
+        self._monitor_thread.daemon = True
+        self._monitor_thread.start()
 
     def _run_monitor(self):
-        """在独立线程中运行消息循环。"""
-        self._create_window()
-        ctypes.windll.user32.AddClipboardFormatListener(self.hwnd)
-        while not self._stop_event.is_set():
-            win32gui.PumpWaitingMessages()
-            time.sleep(0.01)
-
-        ctypes.windll.user32.RemoveClipboardFormatListener(self.hwnd)
-        win32gui.DestroyWindow(self.hwnd)
-        win32gui.UnregisterClass("ClipboardMonitorClass", win32gui.GetModuleHandle(None))
+        """在独立线程中运行事件源的阻塞事件循环。启用合并时事件回调只记录时间，读取在合并线程中进行。"""
+        self.event_source.run(self.coalescer.notify if self.coalescer is not None else self._on_clipboard_update)
 
     def stop(self):
         """停止剪贴板监听。"""
-        self._stop_event.set()
-        if self.hwnd:
-            win32gui.PostMessage(self.hwnd, win32con.WM_CLOSE, 0, 0)
\ No newline at end of file
+        self.event_source.stop()
+        if self.coalescer is not None:
+            self.coalescer.stop()
+
+
+if __name__ == '__main__':
+    # 直接运行 `python clipboard_monitor.py`：用脚本化的假事件流比较不合并与合并 30 ms 时
+    # 读取剪贴板的次数、被合并的事件数、入队的内容和额外延迟。可在 Linux 上运行（检查见 tests/test_clipboard_monitor.py）。
+    from queue import Empty
+    from clipboard_events import FakeClipboardEventSource
+
+    def payload(name, value):
+        return f"#### file: {name} (CREATE)\n```python\nVALUE = {value}\n```\n"
+
+    def select_all_copy_loop():
+        # 某些工具的“全选-复制”循环：每 25 ms 一次，内容不断变化，持续 1 秒
+        return [(0.025, payload("loop.py", i)) for i in range(40)]
+
+    scenarios = [
+        # 一次复制触发 5 个更新事件（多种格式 + 重复通知），间隔约 1 ms
+        ("一次复制，5 个事件", [(0.0, payload("a.py", 1))] + [(0.001, payload("a.py", 1))] * 4),
+        # 先写入非文本格式，最后才有 CF_UNICODETEXT
+        ("先无文本后有文本", [(0.0, None), (0.002, None), (0.002, payload("b.py", 2))]),
+        # 两次间隔 200 ms 的独立复制
+        ("两次独立复制", [(0.0, payload("c.py", 1)), (0.2, payload("c.py", 2))]),
+        ("全选-复制循环 40 次/秒", select_all_copy_loop()),
+    ]
+
+    for window in (0.0, 0.030):
+        print(f"合并窗口 {window * 1000:.0f} ms:")
+        for label, script in scenarios:
+            source = FakeClipboardEventSource(record_copy_times=False)
+            queued = Queue()
+            reads = []
+            monitor = ClipboardMonitor(queued, event_source=source, coalesce_window=window)
+            original_read = source.read_text
+            source.read_text = lambda: reads.append(1) or original_read() # 统计读取剪贴板的次数
+            monitor.start()
+            source.play(script)
+            time.sleep(max(0.05, window * COALESCE_MAX_DELAY_FACTOR + 0.05)) # 等待最后一组事件被处理
+            monitor.stop()
+            texts = []
+            while True:
+                try:
+                    texts.append(queued.get_nowait().text)
+                except Empty:
+                    break
+            stats = monitor.coalescing_stats() or {'suppressed': 0, 'added_latency_p50_ms': 0.0, 'added_latency_max_ms': 0.0}
+            print(f"    {label:<20} 事件 {len(script):3d}, 读取剪贴板 {len(reads):3d} 次, 合并 {stats['suppressed']:3d} 个, "
+                  f"入队 {len(texts):2d} 个, 额外延迟 p50 {stats['added_latency_p50_ms']:.1f} ms / "
+                  f"max {stats['added_latency_max_ms']:.1f} ms")
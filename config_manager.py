@@ -1,18 +1,132 @@
 import json # 导入 json 模块
 import os # 导入 os 模块，因为ConfigManager可能需要创建目录
+import sys
+from collections import namedtuple
+
+from config_options import DEFAULT_DURABILITY, DEFAULT_OVERFLOW_POLICY, DURABILITY_MODES, OVERFLOW_POLICIES
+
+
+class AppConfig(namedtuple('AppConfig', [
+        'root_folder', 'root_folder_valid', 'payload_cache_max_entries', 'payload_cache_max_bytes',
+        'io_workers', 'metrics_enabled', 'metrics_file', 'metrics_port',
+        'pipeline_queue_size', 'pipeline_overflow_policy', 'clipboard_coalesce_ms', 'confirmation_toast',
+        'ingest_address', 'ingest_token', 'ingest_auto_approve', 'file_index_enabled', 'file_index_refresh_seconds',
+        'projects', 'journal_enabled', 'journal_dir', 'journal_max_batches', 'journal_max_age_days', 'journal_max_mb',
+        'commit_durability', 'diff_preview_enabled'])):
+    """
+    从 config.json 解析出的类型化配置快照，只在配置文件变化时重新构建。
+    root_folder_valid 在解析时计算一次，避免每次访问都调用 os.path.isdir。
+    projects 为 ((名称, 绝对路径), ...)，只包含存在的目录；root_folder 是其中未能确定项目的代码块使用的默认项目。
+    journal_dir 为空时撤销日志保存在用户数据目录下（见 journal.default_journal_dir）。
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, data):
+        root_folder = str(data.get('root_folder', '') or '').strip()
+        return cls(
+            root_folder=root_folder,
+            root_folder_valid=bool(root_folder) and os.path.isdir(root_folder),
+            payload_cache_max_entries=int(data.get('payload_cache_max_entries', 256)),
+            payload_cache_max_bytes=int(data.get('payload_cache_max_bytes', 32 * 1024 * 1024)),
+            io_workers=max(1, int(data.get('io_workers', 8))),
+            metrics_enabled=bool(data.get('metrics_enabled', False)),
+            metrics_file=str(data.get('metrics_file', '') or '').strip(),
+            metrics_port=int(data.get('metrics_port', 0)),
+            pipeline_queue_size=max(1, int(data.get('pipeline_queue_size', 8))),
+            pipeline_overflow_policy=_overflow_policy(data.get('pipeline_overflow_policy', DEFAULT_OVERFLOW_POLICY)),
+            clipboard_coalesce_ms=max(0.0, float(data.get('clipboard_coalesce_ms', 30))),
+            confirmation_toast=bool(data.get('confirmation_toast', True)),
+            ingest_address=str(data.get('ingest_address', '') or '').strip(),
+            ingest_token=str(data.get('ingest_token', '') or ''),
+            ingest_auto_approve=bool(data.get('ingest_auto_approve', False)),
+            file_index_enabled=bool(data.get('file_index_enabled', True)),
+            file_index_refresh_seconds=max(0.5, float(data.get('file_index_refresh_seconds', 5))),
+            projects=_projects(data.get('projects') or {}),
+            journal_enabled=bool(data.get('journal_enabled', True)),
+            journal_dir=str(data.get('journal_dir', '') or '').strip(),
+            journal_max_batches=max(1, int(data.get('journal_max_batches', 200))),
+            journal_max_age_days=max(0.0, float(data.get('journal_max_age_days', 30))),
+            journal_max_mb=max(1.0, float(data.get('journal_max_mb', 512))),
+            commit_durability=_commit_durability(data.get('commit_durability', DEFAULT_DURABILITY)),
+            diff_preview_enabled=bool(data.get('diff_preview_enabled', True)),
+        )
+
+
+def _overflow_policy(value):
+    """无效的策略只影响这一项，不让整个配置（包括 root_folder）回退为默认值。"""
+    policy = str(value or '').strip().lower()
+    if policy not in OVERFLOW_POLICIES:
+        print(f"[WARNING] pipeline_overflow_policy 必须是 {', '.join(OVERFLOW_POLICIES)} 之一，"
+              f"而不是 '{value}'。将使用 '{DEFAULT_OVERFLOW_POLICY}'。", file=sys.stderr)
+        return DEFAULT_OVERFLOW_POLICY
+    return policy
+
+
+def _commit_durability(value):
+    durability = str(value or '').strip().lower()
+    if durability not in DURABILITY_MODES:
+        print(f"[WARNING] commit_durability 必须是 {', '.join(DURABILITY_MODES)} 之一，"
+              f"而不是 '{value}'。将使用 '{DEFAULT_DURABILITY}'。", file=sys.stderr)
+        return DEFAULT_DURABILITY
+    return durability
+
+
+def _projects(value):
+    """解析 {"名称": "路径"}；不存在的目录只跳过这一项，不让整个配置回退为默认值。"""
+    if not isinstance(value, dict):
+        print(f"[WARNING] projects 必须是 {{\"名称\": \"路径\"}} 形式的对象，已忽略。", file=sys.stderr)
+        return ()
+    projects = []
+    for name, path in value.items():
+        name, path = str(name).strip(), str(path or '').strip()
+        if not name or not path or not os.path.isdir(path):
+            print(f"[WARNING] 项目 '{name}' 的根目录 '{path}' 无效，已忽略。", file=sys.stderr)
+            continue
+        projects.append((name, os.path.abspath(path)))
+    return tuple(projects)
+
+
+def stat_signature(path):
+    """返回文件的 (mtime_ns, size, inode) 签名，文件不存在时返回 None。只需一次 stat 调用。"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
 
 class ConfigManager:
     """
     管理配置文件 (config.json) 的读取和写入。
     用于存储根目录等配置信息。
+    通过 reload_if_changed() 按文件签名判断是否需要重新解析，config 属性提供缓存的 AppConfig。
     """
     def __init__(self, config_file='config.json'): # 更改为 config.json
         self.config_file = config_file
         self.config_data = {} # 存储 JSON 数据字典
+        self.config = AppConfig.from_dict({})
+        self.parse_count = 0 # 实际解析 JSON 的次数
+        self.stat_count = 0 # 检查文件签名的次数
+        self._signature = None
         self._load_config() 
 
-    def _load_config(self):
+    def reload_if_changed(self):
+        """
+        仅当配置文件的 (mtime_ns, size, inode) 签名变化时才重新加载。
+        返回 True 表示配置已重新加载。
+        """
+        self.stat_count += 1
+        signature = stat_signature(self.config_file)
+        if signature == self._signature:
+            return False
+        self._load_config(signature)
+        return True
+
+    def _load_config(self, signature=None):
         """加载配置文件，如果不存在则 config_data 将为空字典。"""
+        self._signature = signature if signature is not None else stat_signature(self.config_file)
+        self.parse_count += 1
         try:
             with open(self.config_file, 'r', encoding='utf-8') as f:
                 self.config_data = json.load(f)
@@ -24,11 +138,16 @@ class ConfigManager:
         except Exception as e:
             print(f"[WARNING] 无法加载配置文件 '{self.config_file}': {e}", file=sys.stderr)
             self.config_data = {}
+        try:
+            self.config = AppConfig.from_dict(self.config_data)
+        except (TypeError, ValueError, AttributeError) as e:
+            print(f"[WARNING] 配置文件 '{self.config_file}' 中存在无效的配置项: {e}. 将使用默认配置。", file=sys.stderr)
+            self.config = AppConfig.from_dict({})
 
     def get_root_folder(self):
         """获取配置的根目录。如果不存在，则返回空字符串。"""
         # 根据约定好的 JSON 结构 {"root_folder": "..."}
-        return self.config_data.get('root_folder', '').strip()
+        return self.config.root_folder
 
     def set_root_folder(self, path):
         """设置根目录并保存。"""
@@ -54,3 +173,7 @@ class ConfigManager:
                 json.dump(self.config_data, f, indent=2, ensure_ascii=False) # 写入 JSON，并进行2空格缩进
         except IOError as e:
             print(f"[ERROR] 无法保存配置文件 '{self.config_file}': {e}", file=sys.stderr)
+            return
+        # 自己写入的内容无需再解析一次，只更新缓存的签名和配置对象
+        self._signature = stat_signature(self.config_file)
+        self.config = AppConfig.from_dict(self.config_data)
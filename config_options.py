@@ -0,0 +1,18 @@
+# 多个模块共用的配置取值。本模块不导入任何其他模块，
+# config_manager 校验配置时只需导入这里，不会连带加载 pipeline（asyncio）或 transaction（apply_engine 依赖链）。
+
+# 流水线队列已满时的处理策略（见 pipeline）
+OVERFLOW_POLICIES = (
+    'block', # 生产者等待空位（反压；capture 队列使用时会阻塞监听线程）
+    'drop_oldest', # 丢弃最早排队的内容
+    'drop_newest', # 丢弃新到达的内容
+    'coalesce_latest', # 用新内容替换队尾的内容：中间状态合并为最新的一个
+)
+DEFAULT_OVERFLOW_POLICY = 'drop_oldest'
+
+# 提交的持久化级别（见 transaction）
+# none：不主动刷盘（仍然是原子替换，进程崩溃后可恢复，断电可能丢失最近的写入）；
+# batch：所有临时文件写完后一起刷盘，替换后每个目录只刷一次（组提交）；Linux 上文件较多时改为每个文件系统一次 syncfs；
+# per_file：每个文件写完立即刷盘，每次替换后立即刷新所在目录
+DURABILITY_MODES = ('none', 'batch', 'per_file')
+DEFAULT_DURABILITY = 'batch'
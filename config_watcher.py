@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+import threading
+
+# inotify 常量（见 <sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyBackend:
+    """
+    Linux inotify 通知后端。监视配置文件所在目录（编辑器常以“写临时文件再重命名”的方式保存），
+    wait() 阻塞直到该文件相关的事件到达或 close() 被调用。
+    """
+    def __init__(self, path):
+        libc_name = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or not libc_name:
+            raise OSError("inotify 仅在 Linux 上可用")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._filename = os.fsencode(os.path.basename(path))
+        directory = os.path.dirname(os.path.abspath(path))
+
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        # 只关心写入完成、重命名和删除；IN_MODIFY 会在文件被截断、尚未写完时触发
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+        if self._libc.inotify_add_watch(self._fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"无法监视目录 '{directory}'")
+        self._wakeup_read, self._wakeup_write = os.pipe()
+
+    def wait(self):
+        """阻塞等待。返回 True 表示配置文件可能已变化，False 表示后端已关闭。"""
+        while True:
+            readable, _, _ = select.select([self._fd, self._wakeup_read], [], [])
+            if self._wakeup_read in readable:
+                return False
+            data = os.read(self._fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                _, _, _, name_length = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                name = data[offset:offset + name_length].rstrip(b'\0')
+                offset += name_length
+                if name == self._filename:
+                    return True
+
+    def close(self):
+        """唤醒并结束 wait()，可从任意线程调用。"""
+        if self._wakeup_write is not None:
+            os.write(self._wakeup_write, b'x')
+
+    def release(self):
+        """关闭 inotify 与唤醒管道的文件描述符。只能在 wait() 返回之后（或从未调用时）调用，可重复调用。"""
+        for fd in (self._fd, self._wakeup_read, self._wakeup_write):
+            if fd is not None:
+                os.close(fd)
+        self._fd = self._wakeup_read = self._wakeup_write = None
+
+
+class ConfigWatcher:
+    """
+    监视 config.json 的变化，只在文件签名变化时让 ConfigManager 重新解析。
+
+    - 有原生通知后端（Linux 上为 inotify）时，后台线程阻塞等待事件，变化后调用 on_change(config)；
+    - 否则由调用方定时调用 poll()，每次只需一次 stat 调用。
+    on_change 可能在后台线程中被调用，调用方需自行转交给 UI 线程。
+    """
+    def __init__(self, config_manager, on_change, backend='auto'):
+        self.config_manager = config_manager
+        self.on_change = on_change
+        self.backend = None
+        if backend == 'auto':
+            try:
+                self.backend = InotifyBackend(config_manager.config_file)
+            except (OSError, AttributeError):
+                self.backend = None # 不支持原生通知，退回到 stat 轮询
+        elif backend is not None:
+            self.backend = backend
+        self._thread = None
+
+    @property
+    def uses_push(self):
+        """是否由原生通知推送变化（无需定时 poll）。"""
+        return self.backend is not None
+
+    def poll(self):
+        """检查一次文件签名，变化时重新加载并通知。返回是否发生了变化。"""
+        if self.config_manager.reload_if_changed():
+            self.on_change(self.config_manager.config)
+            return True
+        return False
+
+    def start(self):
+        """启动后台通知线程（仅在 uses_push 为 True 时有效）。"""
+        if not self.uses_push or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self.backend.wait():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"[ERROR] 处理配置文件变化时发生错误: {type(e).__name__}: {e}", file=sys.stderr)
+
+    def stop(self):
+        """结束后台通知线程并释放后端占用的文件描述符。"""
+        if self.backend is None:
+            return
+        self.backend.close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.backend.release()
+
+
+if __name__ == '__main__':
+    # 直接运行 `python config_watcher.py`：模拟一小时的每秒检查，统计 stat 次数和 JSON 解析次数。
+    import json
+    import tempfile
+    from config_manager import ConfigManager
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, 'config.json')
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump({'root_folder': temp_dir}, f)
+
+        manager = ConfigManager(config_file=config_path)
+        changes = []
+        watcher = ConfigWatcher(manager, changes.append, backend=None)
+        for second in range(3600):
+            if second in (600, 2400):
+                # 模拟 VS Code 扩展同步写入配置
+                with open(config_path, 'w', encoding='utf-8') as f:
+                    json.dump({'root_folder': temp_dir, 'revision': second}, f)
+                os.utime(config_path, ns=(second * 10**9, second * 10**9))
+            watcher.poll()
+        print(f"轮询模式：模拟 3600 秒，stat {manager.stat_count} 次，JSON 解析 {manager.parse_count} 次，"
+              f"变化通知 {len(changes)} 次。")
+
+        try:
+            push_watcher = ConfigWatcher(manager, changes.append)
+        except Exception as e:
+            push_watcher = None
+            print(f"无法创建通知后端: {e}")
+        if push_watcher is not None and push_watcher.uses_push:
+            push_watcher.start()
+            before = manager.parse_count
+            with open(config_path, 'w', encoding='utf-8') as f:
+                json.dump({'root_folder': temp_dir, 'revision': 'push'}, f)
+            deadline = time.monotonic() + 2
+            while manager.parse_count == before and time.monotonic() < deadline:
+                time.sleep(0.01)
+            push_watcher.stop()
+            print(f"inotify 模式：写入后解析 {manager.parse_count - before} 次，最新配置 {manager.config}")
@@ -0,0 +1,152 @@
+import time
+import tkinter as tk
+
+
+class ConfirmationWindow:
+    """
+    等待确认的文件操作列表（Tk Toplevel），只能在 Tk 主线程中使用。
+    与模态确认框不同，窗口打开期间 Tk 主线程和处理流水线都不会被阻塞；列表支持多选，
+    可以一次批准或拒绝多个批次。关闭窗口只是隐藏，待确认的计划会保留，直到用户作出决定。
+    元素为 pipeline.PendingConfirmation，批准或拒绝时调用其 resolve()。
+    """
+    def __init__(self, root, title="待确认的文件操作"):
+        self.root = root
+        self.title = title
+        self.pending = [] # 按到达顺序排列，批准时也按这个顺序写入
+        self.window = None # 第一次显示时才创建
+        self._listbox = None
+        self._details = None
+        self._status = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, pending):
+        """加入一个等待确认的计划并显示窗口。"""
+        self.pending.append(pending)
+        self.show()
+        self._refresh()
+
+    def show(self):
+        if self.window is None:
+            self._create()
+        self.window.deiconify()
+        self.window.lift()
+
+    def hide(self):
+        if self.window is not None:
+            self.window.withdraw()
+
+    def refresh_details(self):
+        """重新显示所选批次的详情，例如计划的差异预览计算完成之后。"""
+        if self.window is not None:
+            self._refresh()
+
+    def show_error(self, message):
+        """在窗口底部显示写入失败的信息，并显示窗口。"""
+        self.show()
+        self._set_status(message, error=True)
+
+    def _create(self):
+        window = tk.Toplevel(self.root)
+        window.protocol('WM_DELETE_WINDOW', self.hide)
+        window.minsize(640, 360)
+
+        body = tk.PanedWindow(window, orient=tk.HORIZONTAL)
+        body.pack(fill=tk.BOTH, expand=True, padx=8, pady=(8, 4))
+
+        list_frame = tk.Frame(body)
+        self._listbox = tk.Listbox(list_frame, selectmode=tk.EXTENDED, exportselection=False, width=32)
+        list_scroll = tk.Scrollbar(list_frame, command=self._listbox.yview)
+        self._listbox.configure(yscrollcommand=list_scroll.set)
+        list_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self._listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self._listbox.bind('<<ListboxSelect>>', self._show_details)
+        body.add(list_frame)
+
+        details_frame = tk.Frame(body)
+        self._details = tk.Text(details_frame, wrap=tk.WORD, width=72, height=20, state=tk.DISABLED)
+        details_scroll = tk.Scrollbar(details_frame, command=self._details.yview)
+        self._details.configure(yscrollcommand=details_scroll.set)
+        details_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self._details.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        body.add(details_frame)
+
+        buttons = tk.Frame(window)
+        buttons.pack(fill=tk.X, padx=8)
+        for text, command in (("批准所选", self._approve_selected), ("批准所选（不覆盖已有文件）", self._approve_selected_keep),
+                              ("全部批准", self._approve_all),
+                              ("拒绝所选", self._reject_selected), ("全部拒绝", self._reject_all)):
+            tk.Button(buttons, text=text, command=command).pack(side=tk.LEFT, padx=(0, 6), pady=4)
+
+        self._status = tk.Label(window, anchor=tk.W, justify=tk.LEFT)
+        self._status.pack(fill=tk.X, padx=8, pady=(0, 8))
+        self.window = window
+
+    def _label(self, pending):
+        created = time.strftime('%H:%M:%S', time.localtime(pending.created))
+        suffix = "（因其他写入而更新）" if pending.replanned else ""
+        overwrites = f"，覆盖 {len(pending.overwrites)} 个已有文件" if pending.overwrites else ""
+        return f"{created}  {pending.plan.operation_count()} 个操作{overwrites}{suffix}"
+
+    def _refresh(self):
+        """按 pending 列表重建列表框，保留原来的选择；没有选择时选中第一项。"""
+        if self.window is None:
+            return
+        selected_ids = {self._id_at(index) for index in self._listbox.curselection()}
+        self.pending = [pending for pending in self.pending if not pending.done]
+        self._listbox.delete(0, tk.END)
+        for index, pending in enumerate(self.pending):
+            self._listbox.insert(tk.END, self._label(pending))
+            if pending.id in selected_ids:
+                self._listbox.selection_set(index)
+        if self.pending and not self._listbox.curselection():
+            self._listbox.selection_set(0)
+        self.window.title(f"{self.title} ({len(self.pending)})")
+        self._show_details()
+
+    def _id_at(self, index):
+        return self.pending[index].id if index < len(self.pending) else None
+
+    def _show_details(self, event=None):
+        """显示所选批次的全部操作，多选时依次列出。"""
+        chosen = [self.pending[index] for index in self._listbox.curselection() if index < len(self.pending)]
+        text = "\n\n".join(f"[{self._label(pending)}]\n{pending.plan.build_prompt_message()}" for pending in chosen)
+        self._details.configure(state=tk.NORMAL)
+        self._details.delete('1.0', tk.END)
+        self._details.insert('1.0', text)
+        self._details.configure(state=tk.DISABLED)
+
+    def _set_status(self, text, error=False):
+        if self._status is not None:
+            self._status.configure(text=text, fg='red' if error else 'black')
+
+    def _resolve(self, indexes, approved, overwrite=True):
+        chosen = [self.pending[index] for index in indexes if index < len(self.pending)]
+        if not chosen:
+            return
+        for pending in chosen: # 按到达顺序作出决定，批准的批次也按这个顺序写入
+            pending.resolve(approved, overwrite)
+        chosen_ids = {pending.id for pending in chosen}
+        self.pending = [pending for pending in self.pending if pending.id not in chosen_ids]
+        self._set_status(f"已{'批准' if approved else '拒绝'} {len(chosen)} 个批次。")
+        self._listbox.selection_clear(0, tk.END)
+        self._refresh()
+        if not self.pending:
+            self.hide()
+
+    def _approve_selected(self):
+        self._resolve(self._listbox.curselection(), True)
+
+    def _approve_selected_keep(self):
+        """批准所选批次，但跳过其中因 CREATE 而覆盖已有文件的操作。"""
+        self._resolve(self._listbox.curselection(), True, overwrite=False)
+
+    def _approve_all(self):
+        self._resolve(range(len(self.pending)), True)
+
+    def _reject_selected(self):
+        self._resolve(self._listbox.curselection(), False)
+
+    def _reject_all(self):
+        self._resolve(range(len(self.pending)), False)
@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+
+from file_system import LocalFileSystem
+from text_format import SNIFF_BYTES, read_file_text, sniff_file, sniff_format
+from text_span import as_text, content_is_ascii, content_length, iter_content_chunks
+
+# str.isspace() 为真的 ASCII 字符，与 str.strip() 在 ASCII 范围内去除的字符一致
+ASCII_WHITESPACE = b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f'
+COMPARE_CHUNK_SIZE = 1024 * 1024
+
+
+def _read_normalized_text(fs, path):
+    """完整路径：完整读取并按文件格式解码，标准化换行符。无法读取时视为空内容。"""
+    try:
+        text, text_format = read_file_text(fs, path)
+        return text, text_format, None
+    except Exception as e:
+        return "", None, e
+
+
+class _EncodedReader:
+    """
+    按需把期望内容（str 或 TextSpan）分块编码为文件的编码，避免为了比较而一次性编码整段内容。
+    内容无法用该编码表示时抛出 UnicodeEncodeError（此时内容必然与文件不同）。
+    """
+    def __init__(self, content, text_format):
+        self.pieces = iter_content_chunks(content, COMPARE_CHUNK_SIZE)
+        self.encoding = text_format.encoding
+        self.errors = text_format.errors
+        self.buffer = b''
+
+    def read(self, size):
+        while len(self.buffer) < size:
+            piece = next(self.pieces, None)
+            if piece is None:
+                break
+            self.buffer += piece.encode(self.encoding, self.errors)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class _PrefixedReader:
+    """先返回已经读出的文件开头（判断格式时读取的部分），再继续读取文件。"""
+    def __init__(self, prefix, f):
+        self.prefix = prefix
+        self.f = f
+
+    def read(self, size):
+        if self.prefix:
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+            return data
+        return self.f.read(size)
+
+
+def _stream_matches(f, expected):
+    """
+    按块比较文件字节与 expected（_EncodedReader，内容已 strip 且只含 LF），
+    流式完成换行符标准化，遇到第一处差异立即返回。
+    返回 True/False；无法仅凭字节确定时（首尾可能是非 ASCII 空白字符）返回 None。
+    """
+    position = 0 # expected 中已匹配的字节数
+    leading = True
+    leading_non_ascii = False
+    carry = b''
+    while True:
+        chunk = f.read(COMPARE_CHUNK_SIZE)
+        at_eof = not chunk
+        data = carry + chunk
+        carry = b''
+        if not at_eof and data.endswith(b'\r'):
+            carry = b'\r' # 可能是跨块的 CRLF，留到下一块处理
+            data = data[:-1]
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+        if leading:
+            data = data.lstrip(ASCII_WHITESPACE)
+            if data:
+                leading = False
+                leading_non_ascii = data[0] >= 0x80
+
+        if data:
+            expected_part = expected.read(len(data))
+            matched = len(expected_part)
+            if data[:matched] != expected_part:
+                # 开头若是非 ASCII 字符，它可能是 str.strip() 会去掉的 Unicode 空白
+                return None if leading_non_ascii and position < 4 else False
+            position += matched
+            rest = data[matched:].translate(None, ASCII_WHITESPACE)
+            if rest:
+                # 末尾多出非空白内容；非 ASCII 的部分可能是 Unicode 空白，交给完整比较
+                return False if rest.isascii() else None
+
+        if at_eof:
+            return not expected.read(1)
+
+
+def content_matches_file(fs, path, expected_text):
+    """
+    判断现有文件与 expected_text 是否“内容一致”：
+    文件内容按其自身格式（text_format.sniff_format 判断的编码和 BOM）解码、
+    CRLF/CR 标准化为 LF 并 strip() 后与 expected_text 相等。
+    expected_text 必须已经 strip() 且只含 LF，或者是已经 strip() 的 TextSpan（在比较时按块标准化）。
+
+    先读取开头 SNIFF_BYTES 个字节判断格式（写入时需要沿用，因此内容明显不同时也要判断），开头全是 ASCII 时
+    再读取末尾判断编码；两段都是 ASCII、判定不同而期望内容含非 ASCII 字符时，逐块读取到第一个非 ASCII 的块确认编码，
+    与判断结果不同时退回完整解码比较（避免中间的 GBK 内容被当作 UTF-8 覆盖）；
+    文件字节数小于期望内容的字符数时直接判定不同；兼容 ASCII 的编码（UTF-8、GBK 等）
+    按块流式比较原始字节（期望内容也按块编码为文件的编码），在第一处差异处停止，不解码、不复制整个文件。
+    UTF-16/32 文件在同一次打开中完整解码比较；字节层面无法确定时退回完整解码比较。
+    返回 (是否一致, 读取错误或 None, 文件的 TextFormat 或 None)。
+    """
+    fs = fs or LocalFileSystem()
+    if not expected_text:
+        # 空内容的判定依赖“无法读取视为空内容”的旧规则，直接走完整路径
+        existing, text_format, error = _read_normalized_text(fs, path)
+        return existing.strip() == as_text(expected_text), error, text_format
+
+    text_format = None
+    try:
+        size = fs.getsize(path)
+        with fs.open_binary(path) as f:
+            prefix = f.read(SNIFF_BYTES)
+            complete = len(prefix) < SNIFF_BYTES
+            tail = None
+            if not complete and prefix.isascii():
+                tail, complete = fs.read_tail(path, SNIFF_BYTES)
+            text_format = sniff_format(prefix, complete, tail)
+            # 标准化和 strip 只会让内容变短；各编码中每个字符至少占一个字节
+            if size < content_length(expected_text):
+                return False, None, text_format
+            if text_format.ascii_compatible:
+                reader = _PrefixedReader(prefix[len(text_format.bom_bytes):], f)
+                try:
+                    result = _stream_matches(reader, _EncodedReader(expected_text, text_format))
+                except UnicodeEncodeError:
+                    result = False # 期望内容无法用文件的编码表示
+                if (result is False and tail is not None and tail.isascii()
+                        and not content_is_ascii(expected_text)
+                        and sniff_file(fs, path, full=True) != text_format):
+                    result = None
+            else:
+                # UTF-16/32 直接在已打开的文件上完整解码比较
+                existing = text_format.decode(prefix + f.read())
+                result = existing.strip() == as_text(expected_text)
+    except OSError:
+        result = None # 交给完整路径，由它报告读取错误
+    if result is not None:
+        return result, None, text_format
+
+    existing, full_format, error = _read_normalized_text(fs, path)
+    return existing.strip() == as_text(expected_text), error, full_format or text_format
+
+
+if __name__ == '__main__':
+    # 直接运行 `python content_compare.py`：在 1 KB – 100 MB 的文件上比较流式判定与完整解码两种路径的耗时
+    # （结果一致性的检查见 tests/test_content_compare.py）。
+    import tempfile
+
+    fs = LocalFileSystem()
+
+    def old_path(path, expected_text):
+        existing, _, _ = _read_normalized_text(fs, path)
+        return existing.strip() == expected_text
+
+    def timed(func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        return result, (time.perf_counter() - started) * 1000
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'target.txt')
+        for size in (1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2):
+            line = "value = '数据' + str(42)\r\n"
+            file_text = line * (size // len(line.encode('utf-8')))
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                f.write(file_text + "\r\n\r\n")
+            unchanged = file_text.replace('\r\n', '\n').strip()
+            cases = [
+                ("内容一致", unchanged),
+                ("开头不同", "# header\n" + unchanged[9:]),
+                ("末尾不同", unchanged[:-1] + "X"),
+                ("内容更长", unchanged + "\nextra" * 1000),
+            ]
+            for label, expected_text in cases:
+                (new_result, _, _), new_ms = timed(content_matches_file, fs, path, expected_text)
+                old_result, old_ms = timed(old_path, path, expected_text)
+                if new_result != old_result:
+                    print(f"[MISMATCH] {label}: 新 {new_result}, 旧 {old_result}", file=sys.stderr)
+                print(f"{size / 1024:>9.0f} KB {label}: 新路径 {new_ms:8.2f} ms, 旧路径 {old_ms:8.2f} ms, "
+                      f"结果 {'一致' if new_result else '不同'}")
@@ -0,0 +1,613 @@
+import os
+import sys
+import time
+import hashlib
+import threading
+from bisect import bisect_left
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+
+from file_system import LocalFileSystem
+from binary_block import BinaryContent
+from text_format import decode_data
+from text_span import as_text, content_length
+
+# 确认提示中的差异预览：每个待写入文件的增删行数和前几个修改块。
+# 行先映射为整数（相同内容的行得到相同的编号），之后的比较只比较整数；
+# 两侧各只出现一次的行作为锚点（patience diff）把文件切成小区间，没有锚点的区间用 Myers 算法求最短编辑。
+# 每个文件有时间和大小预算，超出后退化为近似结果或只显示大小，不会拖慢确认。
+# 本模块不依赖 Tkinter，可供托盘程序和命令行共用。
+
+PREVIEW_TIME_BUDGET = 0.1 # 每个文件逐行比较的时间上限（秒），超过后剩余区间按整体替换计算并标记为近似
+MAX_DIFF_CHARS = 1024 * 1024 # 任一侧超过时不逐行比较，只按行内容的多重集合估计增删行数
+MAX_SUMMARY_BYTES = 16 * 1024 * 1024 # 任一侧超过时不读取内容，只显示大小
+MAX_MYERS_COST = 1000 # 单个区间 Myers 搜索的编辑距离上限；回溯信息占用的内存与其平方成正比
+CONTEXT_LINES = 3
+PREVIEW_HUNKS = 2 # 每个文件显示的修改块数
+PREVIEW_HUNK_LINES = 12 # 每个修改块显示的行数
+PREVIEW_FILES = 20 # 显示修改块内容的文件数，其余文件只显示增删行数
+PREVIEW_LINE_WIDTH = 120
+DIFF_CACHE_ENTRIES = 512
+DEFAULT_DIFF_WORKERS = 2
+
+# 一个文件的差异摘要：added/removed 为增删行数（文件过大未比较时为 None）；
+# hunks 为前 PREVIEW_HUNKS 个修改块的显示行，hunk_count 为修改块总数；
+# exact 为 False 表示比较超出预算，行数是近似值；note 为附加说明。
+DiffSummary = namedtuple('DiffSummary', ['added', 'removed', 'hunks', 'hunk_count', 'exact', 'note'],
+                         defaults=((), 0, True, None))
+
+
+def split_lines(text):
+    """按 \\n 切分已标准化换行的文本；末尾的换行不产生空行，与 content_compare 忽略末尾空白的规则一致。"""
+    if not text:
+        return []
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+def intern_lines(old_lines, new_lines):
+    """把两侧的行映射为整数编号，内容相同的行编号相同。"""
+    ids = {}
+    old_ids = [ids.setdefault(line, len(ids)) for line in old_lines]
+    new_ids = [ids.setdefault(line, len(ids)) for line in new_lines]
+    return old_ids, new_ids
+
+
+def _unique_anchors(a, b, a_lo, a_hi, b_lo, b_hi):
+    """区间内两侧都只出现一次的行中，位置在两侧都递增的最长序列（patience diff 的锚点）。"""
+    a_slice, b_slice = a[a_lo:a_hi], b[b_lo:b_hi]
+    a_counts, b_counts = Counter(a_slice), Counter(b_slice)
+    unique = {line for line, count in a_counts.items() if count == 1 and b_counts.get(line) == 1}
+    if not unique:
+        return []
+    b_positions = {line: j for j, line in enumerate(b_slice, b_lo) if line in unique}
+    pairs = [(i, b_positions[line]) for i, line in enumerate(a_slice, a_lo) if line in unique]
+    positions = [j for _, j in pairs]
+    if positions == sorted(positions):
+        return pairs # 常见情况：只有修改没有移动，所有唯一行的顺序一致
+    # 按 b 中的位置求最长递增子序列（耐心排序），O(k log k)
+    tails, tail_indexes, previous = [], [], [None] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        position = bisect_left(tails, j)
+        if position:
+            previous[index] = tail_indexes[position - 1]
+        if position == len(tails):
+            tails.append(j)
+            tail_indexes.append(index)
+        else:
+            tails[position] = j
+            tail_indexes[position] = index
+    anchors = []
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        anchors.append(pairs[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
+
+
+def _myers(a, b, a_lo, a_hi, b_lo, b_hi, max_cost, deadline):
+    """
+    Myers O(ND) 算法求区间的最长公共子序列，返回按顺序排列的匹配 (i, j) 列表；
+    编辑距离超过 max_cost 或超过 deadline 时返回 None。
+    """
+    n, m = a_hi - a_lo, b_hi - b_lo
+    max_d = min(n + m, max_cost)
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3) # v[offset + k]：对角线 k 上到达的最远 x
+    trace = [] # trace[d] 为第 d 步之后对角线 -d..d 上的 v
+    for d in range(max_d + 1):
+        if deadline is not None and d & 15 == 0 and time.perf_counter() > deadline:
+            return None
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _myers_backtrack(trace, n, m, d, a_lo, b_lo)
+        trace.append(v[offset - d:offset + d + 1])
+    return None
+
+
+def _myers_backtrack(trace, x, y, d, a_lo, b_lo):
+    matches = []
+    while d > 0:
+        k = x - y
+        previous = trace[d - 1] # 对角线 k 的值位于 previous[k + d - 1]
+        if k == -d or (k != d and previous[k - 1 + d - 1] < previous[k + 1 + d - 1]):
+            previous_k = k + 1
+            previous_x = previous[previous_k + d - 1]
+            start_x = previous_x # 向下：b 中插入一行，之后沿对角线匹配
+        else:
+            previous_k = k - 1
+            previous_x = previous[previous_k + d - 1]
+            start_x = previous_x + 1 # 向右：a 中删除一行
+        while x > start_x:
+            x -= 1
+            y -= 1
+            matches.append((a_lo + x, b_lo + y))
+        x, y = previous_x, previous_x - previous_k
+        d -= 1
+    while x > 0:
+        x -= 1
+        y -= 1
+        matches.append((a_lo + x, b_lo + y))
+    matches.reverse()
+    return matches
+
+
+def match_lines(a, b, deadline=None, max_cost=MAX_MYERS_COST):
+    """
+    比较两个整数序列，返回 (匹配的 (i, j) 列表, 是否精确)。
+    先去掉共同的首尾，再按唯一行锚点递归切分；没有锚点的区间使用 Myers。
+    超过 deadline 或 max_cost 的区间不再匹配（按整体替换计算），此时结果不精确。
+    """
+    matches = []
+    exact = True
+    # 任务为区间 (a_lo, a_hi, b_lo, b_hi) 或连续匹配 (a_start, b_start, 长度)；用栈代替递归，后进先出
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        task = stack.pop()
+        if len(task) == 3:
+            a_start, b_start, length = task
+            matches.extend(zip(range(a_start, a_start + length), range(b_start, b_start + length)))
+            continue
+        a_lo, a_hi, b_lo, b_hi = task
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            matches.append((a_lo, b_lo))
+            a_lo += 1
+            b_lo += 1
+        a_end, b_end = a_hi, b_hi
+        while a_end > a_lo and b_end > b_lo and a[a_end - 1] == b[b_end - 1]:
+            a_end -= 1
+            b_end -= 1
+        if a_end < a_hi:
+            stack.append((a_end, b_end, a_hi - a_end))
+        if a_lo == a_end or b_lo == b_end:
+            continue # 只有插入或只有删除
+        if deadline is not None and time.perf_counter() > deadline:
+            exact = False
+            continue
+        anchors = _unique_anchors(a, b, a_lo, a_end, b_lo, b_end)
+        if not anchors:
+            found = _myers(a, b, a_lo, a_end, b_lo, b_end, max_cost, deadline)
+            if found is None:
+                exact = False
+            else:
+                matches.extend(found)
+            continue
+        # 锚点之间的区间按顺序处理（倒序入栈）；相邻的锚点合并为一段连续匹配
+        segments = []
+        next_i, next_j = a_lo, b_lo
+        for i, j in anchors:
+            if i == next_i and j == next_j and segments and len(segments[-1]) == 3:
+                run_i, run_j, length = segments[-1]
+                segments[-1] = (run_i, run_j, length + 1)
+            else:
+                if i > next_i and j > next_j:
+                    segments.append((next_i, i, next_j, j))
+                segments.append((i, j, 1))
+            next_i, next_j = i + 1, j + 1
+        if a_end > next_i and b_end > next_j:
+            segments.append((next_i, a_end, next_j, b_end))
+        stack.extend(reversed(segments))
+    return matches, exact
+
+
+def _change_blocks(matches, old_count, new_count):
+    """由匹配得到修改区域 (a1, a2, b1, b2) 的列表。"""
+    blocks = []
+    i = j = 0
+    for match_i, match_j in matches:
+        if match_i > i or match_j > j:
+            blocks.append((i, match_i, j, match_j))
+        i, j = match_i + 1, match_j + 1
+    if i < old_count or j < new_count:
+        blocks.append((i, old_count, j, new_count))
+    return blocks
+
+
+def _group_hunks(blocks, context=CONTEXT_LINES):
+    """间隔不超过 2 * context 行的修改区域合并为一个修改块。"""
+    hunks = []
+    for block in blocks:
+        if hunks and block[0] - hunks[-1][-1][1] <= 2 * context:
+            hunks[-1].append(block)
+        else:
+            hunks.append([block])
+    return hunks
+
+
+def _display(prefix, line):
+    if len(line) > PREVIEW_LINE_WIDTH:
+        line = line[:PREVIEW_LINE_WIDTH] + "…"
+    if not line.isascii():
+        line = line.encode('utf-8', 'replace').decode('utf-8') # 文件中无法解码的字节（代理项）显示为 ?
+    return prefix + line
+
+
+def _render_hunk(hunk, old_lines, new_lines, context=CONTEXT_LINES, max_lines=PREVIEW_HUNK_LINES):
+    """渲染一个修改块：统一差异格式的块头，随后至多 max_lines 行内容。"""
+    a_start = max(0, hunk[0][0] - context)
+    a_stop = min(len(old_lines), hunk[-1][1] + context)
+    b_start = max(0, hunk[0][2] - context)
+    b_stop = min(len(new_lines), hunk[-1][3] + context)
+    body = []
+    position = a_start
+    for a1, a2, b1, b2 in hunk:
+        body.extend(_display(" ", line) for line in old_lines[position:a1])
+        body.extend(_display("-", line) for line in old_lines[a1:a2])
+        body.extend(_display("+", line) for line in new_lines[b1:b2])
+        position = a2
+        if len(body) > max_lines:
+            break
+    body.extend(_display(" ", line) for line in old_lines[position:a_stop])
+    # 与统一差异格式相同：空的一侧从第 0 行开始
+    lines = [f"@@ -{a_start + (a_stop > a_start)},{a_stop - a_start} +{b_start + (b_stop > b_start)},{b_stop - b_start} @@"]
+    lines.extend(body[:max_lines])
+    if len(body) > max_lines:
+        lines.append("…（本块其余内容未显示）")
+    return tuple(lines)
+
+
+def _estimate_counts(old_lines, new_lines):
+    """不逐行比较，按行内容的多重集合估计增删行数（不小于真实差异中出现的行数变化）。"""
+    old_counts, new_counts = Counter(old_lines), Counter(new_lines)
+    return sum((new_counts - old_counts).values()), sum((old_counts - new_counts).values())
+
+
+def diff_texts(old_text, new_text, time_budget=PREVIEW_TIME_BUDGET, max_chars=MAX_DIFF_CHARS):
+    """比较两段已标准化换行的文本，返回 DiffSummary。"""
+    old_lines, new_lines = split_lines(old_text), split_lines(new_text)
+    if max(len(old_text), len(new_text)) > max_chars:
+        added, removed = _estimate_counts(old_lines, new_lines)
+        return DiffSummary(added, removed, (), 0, False, "文件较大，增删行数按行内容估计，未生成修改块")
+    deadline = time.perf_counter() + time_budget
+    a, b = intern_lines(old_lines, new_lines)
+    matches, exact = match_lines(a, b, deadline)
+    hunks = _group_hunks(_change_blocks(matches, len(a), len(b)))
+    rendered = tuple(_render_hunk(hunk, old_lines, new_lines) for hunk in hunks[:PREVIEW_HUNKS])
+    note = None if exact else "比较超出时间预算，部分区域按整体替换计算，增删行数可能偏多"
+    return DiffSummary(len(b) - len(matches), len(a) - len(matches), rendered, len(hunks), exact, note)
+
+
+def _format_size(size):
+    return f"{size / 1024 / 1024:.1f} MB" if size >= 1024 * 1024 else f"{size / 1024:.1f} KB"
+
+
+def _new_text(file_info):
+    """计划中一个写入操作的完整新内容（片段元组、TextSpan 或 str）。"""
+    content = file_info['code_content']
+    if isinstance(content, tuple):
+        return ''.join(as_text(piece) for piece in content)
+    return file_info.get('content_prefix', "") + as_text(content)
+
+
+def _new_length(file_info):
+    content = file_info['code_content']
+    if isinstance(content, tuple):
+        return sum(content_length(piece) for piece in content)
+    return content_length(content)
+
+
+class DiffCache:
+    """
+    按 (原内容摘要, 新内容摘要) 缓存 DiffSummary 的有界 LRU 缓存。同一内容再次被规划
+    （重复复制、确认期间其他写入导致的重新规划）时直接使用结果。可在多个线程中使用。
+    """
+    def __init__(self, max_entries=DIFF_CACHE_ENTRIES):
+        self.max_entries = max(1, int(max_entries))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return summary
+
+    def remember(self, key, summary):
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def _relative_name(plan, path):
+    """待删除的文件只有完整路径，显示为相对于所在根目录的路径。"""
+    for root_folder in plan.root_folders():
+        if root_folder and path.startswith(os.path.join(root_folder, '')):
+            return path[len(os.path.join(root_folder, '')):]
+    return path
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def preview_write(fs, file_info, cache=None, time_budget=PREVIEW_TIME_BUDGET):
+    """计算一个写入操作的 DiffSummary。在线程池中调用。"""
+    if isinstance(file_info['code_content'], BinaryContent):
+        # 二进制内容不比较行；大小和摘要在规划时已经算出
+        size, digest = file_info['code_content'].summary()
+        return DiffSummary(None, None, note=f"二进制文件 {_format_size(size)}，sha256 {digest[:12]}…")
+    new_length = _new_length(file_info)
+    if file_info.get('write_mode') == 'a':
+        # 追加只在末尾增加内容，无需读取现有文件
+        if new_length > MAX_SUMMARY_BYTES:
+            return DiffSummary(None, None, note=f"追加 {_format_size(new_length)}，未统计行数")
+        lines = split_lines(_new_text(file_info).lstrip('\n'))
+        shown = tuple(_display("+", line) for line in lines[:PREVIEW_HUNK_LINES])
+        if len(lines) > PREVIEW_HUNK_LINES:
+            shown += ("…（本块其余内容未显示）",)
+        return DiffSummary(len(lines), 0, (("@@ 文件末尾 @@",) + shown,) if lines else (), 1 if lines else 0)
+    path = file_info['target_path']
+    old_size = fs.getsize(path) if fs.isfile(path) else 0
+    if max(old_size, new_length) > MAX_SUMMARY_BYTES:
+        return DiffSummary(None, None, note=f"文件过大，未比较（{_format_size(old_size)} -> {_format_size(new_length)}）")
+    old_data = b""
+    if old_size:
+        with fs.open_binary(path) as f:
+            old_data = f.read()
+    new_text = _new_text(file_info)
+    key = (_digest(old_data), _digest(new_text.encode('utf-8', 'surrogatepass')))
+    summary = cache.lookup(key) if cache is not None else None
+    if summary is None:
+        old_text, _ = decode_data(old_data)
+        summary = diff_texts(old_text, new_text, time_budget)
+        if cache is not None:
+            cache.remember(key, summary)
+    return summary
+
+
+def preview_delete(fs, path):
+    """删除操作只统计被删除的行数。"""
+    size = fs.getsize(path)
+    if size > MAX_SUMMARY_BYTES:
+        return DiffSummary(None, None, note=f"删除 {_format_size(size)}，未统计行数")
+    with fs.open_binary(path) as f:
+        data = f.read()
+    return DiffSummary(0, len(split_lines(decode_data(data)[0])))
+
+
+def _run_job(future, func, args):
+    if not future.set_running_or_notify_cancel(): # 已被 cancel()
+        return
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+
+
+class PlanPreviews:
+    """
+    一个计划中各文件的差异预览，由 DiffPreviewer.prepare() 创建，start() 之后在预览线程中陆续完成。
+    format_lines() 随时可以调用：已完成的文件显示结果，其余显示“正在计算”。
+    """
+    def __init__(self, jobs, executor):
+        self.entries = [(name, Future()) for name, _, _ in jobs] # [(显示名, Future)]，与计划中的写入、删除顺序一致
+        self._jobs = [(future, func, args) for (_, future), (_, func, args) in zip(self.entries, jobs)]
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._remaining = len(jobs)
+        self._callbacks = []
+        for _, future in self.entries:
+            future.add_done_callback(self._on_entry_done)
+
+    def start(self):
+        """把预览任务交给预览线程池，可从任意线程调用，只有第一次调用生效。"""
+        with self._lock:
+            jobs, self._jobs = self._jobs, []
+        for future, func, args in jobs:
+            self._executor.submit(_run_job, future, func, args)
+
+    def done(self):
+        with self._lock:
+            return self._remaining == 0
+
+    def wait(self, timeout=None):
+        """等待所有文件完成，至多 timeout 秒；返回是否全部完成。"""
+        _, not_done = wait_futures([future for _, future in self.entries], timeout)
+        return not not_done
+
+    def cancel(self):
+        """放弃尚未开始的预览（例如用户已经作出决定）。"""
+        for _, future in self.entries:
+            future.cancel()
+
+    def add_done_callback(self, callback):
+        """全部完成后调用 callback()；已经完成时立即在当前线程调用，否则在最后完成的预览线程中调用。"""
+        with self._lock:
+            if self._remaining:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def _on_entry_done(self, future):
+        with self._lock:
+            self._remaining -= 1
+            if self._remaining:
+                return
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[ERROR] 差异预览回调出错: {type(e).__name__}: {e}", file=sys.stderr)
+
+    def format_lines(self, max_files=PREVIEW_FILES):
+        """确认提示中的预览行：前 max_files 个文件显示修改块，其余只显示增删行数。"""
+        lines = []
+        for index, (name, future) in enumerate(self.entries):
+            if not future.done():
+                lines.append(f"- '{name}': 正在计算差异…")
+                continue
+            if future.cancelled():
+                lines.append(f"- '{name}': 未计算差异")
+                continue
+            error = future.exception()
+            if error is not None:
+                lines.append(f"- '{name}': 无法生成差异预览: {error}")
+                continue
+            summary = future.result()
+            if summary.added is None:
+                lines.append(f"- '{name}': {summary.note}")
+                continue
+            counts = f"+{summary.added} -{summary.removed} 行"
+            if not summary.exact:
+                counts += "（近似）"
+            if summary.hunk_count > 1:
+                counts += f"，{summary.hunk_count} 处修改"
+            lines.append(f"- '{name}': {counts}")
+            if summary.note:
+                lines.append(f"    {summary.note}")
+            if index >= max_files:
+                continue
+            for hunk in summary.hunks:
+                lines.extend("    " + line for line in hunk)
+            if summary.hunk_count > len(summary.hunks):
+                lines.append(f"    …（其余 {summary.hunk_count - len(summary.hunks)} 处修改未显示）")
+        if len(self.entries) > max_files:
+            lines.append(f"（第 {max_files} 个之后的文件只显示增删行数）")
+        return lines
+
+
+class DiffPreviewer:
+    """
+    为等待确认的计划在后台线程池中计算差异预览，结果按内容摘要缓存。
+    prepare() 只登记任务，不占用 CPU；PlanPreviews.start() 提交任务后立即返回，确认提示不必等待预览完成。
+    """
+    def __init__(self, max_workers=DEFAULT_DIFF_WORKERS, time_budget=PREVIEW_TIME_BUDGET, cache=None, fs=None):
+        self.time_budget = time_budget
+        self.cache = cache if cache is not None else DiffCache()
+        self.fs = fs or LocalFileSystem()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='DiffPreview')
+
+    def prepare(self, plan):
+        """为计划中的每个写入和删除登记预览任务（尚未开始），返回 PlanPreviews 并保存到 plan.previews。"""
+        jobs = [(file_info['filename'], preview_write, (self.fs, file_info, self.cache, self.time_budget))
+                for file_info in plan.files_to_write]
+        jobs.extend((_relative_name(plan, path), preview_delete, (self.fs, path)) for path in plan.files_to_delete)
+        plan.previews = PlanPreviews(jobs, self._executor)
+        return plan.previews
+
+    def start(self, plan):
+        """登记并立即开始计算计划的预览。"""
+        previews = self.prepare(plan)
+        previews.start()
+        return previews
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    # 直接运行 `python diff_preview.py`：比较 200 个文件的载荷在规划完成时和预览全部完成时的耗时，
+    # 以及大文件、无法对齐的文件的耗时上限（正确性检查见 tests/test_diff_preview.py）。
+    import contextlib
+    import io
+    import random
+    import statistics
+    import tempfile
+    from apply_engine import plan_blocks
+    from block_scanner import scan_blocks
+
+    rng = random.Random(7)
+
+    def edited(lines, count):
+        lines = list(lines)
+        for _ in range(count):
+            position = rng.randrange(len(lines) + 1)
+            action = rng.randrange(3)
+            if action == 0:
+                lines.insert(position, f"inserted_{rng.random()}")
+            elif lines and position < len(lines):
+                if action == 1:
+                    del lines[position]
+                else:
+                    lines[position] = f"changed_{rng.random()}"
+        return lines
+
+    def source_lines(count, seed):
+        return [f"    value_{seed}_{i} = compute({i})" if i % 7 else "" for i in range(count)]
+
+    # 时间预算：两侧各 20,000 行且没有唯一行、顺序完全打乱时，比较在预算附近停止
+    shuffled_old = [f"line {i % 500}" for i in range(20000)]
+    shuffled_new = list(shuffled_old)
+    rng.shuffle(shuffled_new)
+    started = time.perf_counter()
+    summary = diff_texts("\n".join(shuffled_old), "\n".join(shuffled_new))
+    shuffled_ms = (time.perf_counter() - started) * 1000
+
+    large_old = source_lines(25000, 'large')
+    large_new = edited(large_old, 40)
+    started = time.perf_counter()
+    large = diff_texts("\n".join(large_old), "\n".join(large_new))
+    large_ms = (time.perf_counter() - started) * 1000
+    huge_old = source_lines(60000, 'huge')
+    started = time.perf_counter()
+    estimated = diff_texts("\n".join(huge_old), "\n".join(edited(huge_old, 40)))
+    estimated_ms = (time.perf_counter() - started) * 1000
+
+    # 200 个文件的载荷：每个文件约 300 行，OVERWRITE 修改其中几行
+    def block_text(filename, operation, content):
+        return f"#### file: {filename} ({operation})\n```\n{content}\n```\n"
+
+    plan_timings, start_timings, ready_timings, cached_timings = [], [], [], []
+    with tempfile.TemporaryDirectory() as root, contextlib.redirect_stdout(io.StringIO()):
+        payload_parts = []
+        for i in range(200):
+            old = source_lines(300, i)
+            path = os.path.join(root, f"pkg{i % 10}", f"module_{i}.py")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                f.write("\n".join(old) + "\n")
+            payload_parts.append(block_text(f"pkg{i % 10}/module_{i}.py", "OVERWRITE", "\n".join(edited(old, 5))))
+        blocks = list(scan_blocks("".join(payload_parts)))
+        for _ in range(5):
+            previewer = DiffPreviewer()
+            started = time.perf_counter()
+            plan = plan_blocks(blocks, root, lambda filename, target_path: True)
+            planned = time.perf_counter()
+            previews = previewer.start(plan)
+            submitted = time.perf_counter()
+            previews.wait()
+            ready = time.perf_counter()
+            plan_timings.append(planned - started)
+            start_timings.append(submitted - planned)
+            ready_timings.append(ready - planned)
+            # 同一内容再次规划（例如确认期间其他写入导致的重新规划）：全部命中缓存
+            plan = plan_blocks(blocks, root, lambda filename, target_path: True)
+            started = time.perf_counter()
+            previewer.start(plan).wait()
+            cached_timings.append(time.perf_counter() - started)
+            previewer.close()
+
+    print("200 个文件（每个约 300 行，各修改 5 处）的 OVERWRITE 载荷，5 次的中位数：")
+    print(f"    规划（确认提示出现之前，原有耗时）: {statistics.median(plan_timings) * 1000:.1f} ms")
+    print(f"    登记并提交 200 个预览任务: {statistics.median(start_timings) * 1000:.2f} ms")
+    print(f"    预览全部完成（确认提示出现之后，在后台）: {statistics.median(ready_timings) * 1000:.1f} ms")
+    print(f"    重新规划后的预览（全部命中缓存）: {statistics.median(cached_timings) * 1000:.1f} ms")
+    print(f"25,000 行文件修改 40 处（逐行比较）: {large_ms:.1f} ms (+{large.added} -{large.removed}{'' if large.exact else '，近似'})")
+    print(f"60,000 行文件修改 40 处（超过 {MAX_DIFF_CHARS // 1024} KB，只估计行数）: {estimated_ms:.1f} ms "
+          f"(+{estimated.added} -{estimated.removed})")
+    print(f"20,000 行、顺序打乱的文件: {shuffled_ms:.1f} ms（时间预算 {PREVIEW_TIME_BUDGET * 1000:.0f} ms，结果{'为近似' if not summary.exact else '精确'}）")
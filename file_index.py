@@ -0,0 +1,517 @@
+import os
+import sys
+import time
+import threading
+from collections import namedtuple
+from itertools import islice
+
+# 根目录下所有文件的索引，用于把只有文件名（utils.py）或目录不对（src/utils/x.py 实际在 lib/utils/x.py）
+# 的路径解析为现有文件。
+#
+# 索引是按路径组件倒序组织的后缀字典树：第一层按文件名，第二层按所在目录名，依此类推。
+# 节点在路径数不超过 BURST_SIZE 时只是一个列表，超过后才按下一个组件拆分（burst trie），
+# 因此 50 万个文件时节点数远少于路径组件数；查找只沿查询的组件下降，再最多取 limit 个结果，与仓库大小无关。
+
+# 叶子节点最多容纳的路径数，超过后按下一个（更靠前的）路径组件拆分
+BURST_SIZE = 64
+# 建立索引时跳过的目录：版本控制、依赖和缓存目录中的文件不是代码块的目标
+DEFAULT_IGNORED_DIRS = frozenset((
+    '.git', '.hg', '.svn', 'node_modules', '__pycache__', '.venv', 'venv', '.mypy_cache', '.pytest_cache',
+    '.tox', '.idea', '.vs', '.vscode',
+))
+DEFAULT_REFRESH_SECONDS = 5.0
+
+# 解析结果：path 为唯一匹配的相对路径（使用 '/' 分隔），没有或有多个匹配时为 None；
+# candidates 为最长匹配后缀下的候选（最多 limit 个），matched 为匹配的路径组件数，
+# exact 表示请求的路径本身就是现有文件，truncated 表示候选多于 limit 个。
+Resolution = namedtuple('Resolution', ['requested', 'path', 'candidates', 'matched', 'exact', 'truncated'])
+
+
+def split_components(filename):
+    """将代码块中的文件名标准化为路径组件列表：统一分隔符，去掉开头的 ./ 和 /，忽略空组件。"""
+    return [part for part in filename.strip().replace('\\', '/').split('/') if part and part != '.']
+
+
+def _key(component):
+    # Windows 上路径不区分大小写
+    return os.path.normcase(component)
+
+
+class _SuffixNode:
+    """后缀字典树的节点。children 为 None 时是叶子，paths 中为所有以该后缀结尾的路径；
+    拆分后 paths 只保留恰好等于该后缀的路径，其余路径按下一个组件放入 children。"""
+    __slots__ = ('paths', 'children')
+
+    def __init__(self):
+        self.paths = []
+        self.children = None
+
+
+class FileIndex:
+    """
+    根目录下文件的后缀索引。build() 用 os.scandir 建立，refresh() 只重新扫描修改时间变化的目录，
+    add_file() / remove_file() 用于程序自己写入或删除的文件。所有方法都是线程安全的。
+    max_age 不为 None 时，resolve() 遇到不存在的路径且距上次检查超过 max_age 秒才先调用 refresh()：
+    索引只在查找时更新，空闲时不访问磁盘。
+    """
+    def __init__(self, root, ignored_dirs=DEFAULT_IGNORED_DIRS):
+        self.root = os.path.abspath(root)
+        self.ignored_dirs = ignored_dirs
+        self.file_count = 0
+        self.build_seconds = None
+        self.max_age = None
+        self._checked_at = time.monotonic() # 上一次建立或 refresh() 开始检查的时间
+        self._refresh_lock = threading.Lock()
+        self._root_node = _SuffixNode()
+        self._root_node.children = {}
+        self._dir_mtimes = {} # 相对目录 -> mtime_ns，根目录为 ''
+        self._dir_files = {} # 相对目录 -> 其中文件的相对路径集合（与字典树中的字符串是同一对象）
+        self._dir_subdirs = {} # 相对目录 -> 子目录的相对路径集合
+        self._lock = threading.Lock()
+
+    # --- 建立与更新 ---
+
+    @classmethod
+    def build(cls, root, ignored_dirs=DEFAULT_IGNORED_DIRS):
+        index = cls(root, ignored_dirs)
+        started = time.perf_counter()
+        index._checked_at = time.monotonic()
+        # 索引尚未共享，不需要加锁；先读取所有目录，再一次建立字典树
+        stack = ['']
+        while stack:
+            current = stack.pop()
+            scanned = index._scan_directory(current)
+            if scanned is None:
+                continue
+            index._dir_mtimes[current], index._dir_files[current], index._dir_subdirs[current] = scanned
+            stack.extend(scanned[2])
+        index._bulk_insert(path for files in index._dir_files.values() for path in files)
+        index.build_seconds = time.perf_counter() - started
+        return index
+
+    @classmethod
+    def from_paths(cls, root, relative_paths):
+        """用给定的相对路径建立索引而不访问磁盘（基准测试用），refresh() 不适用。"""
+        index = cls(root)
+        started = time.perf_counter()
+        index._bulk_insert(relative_paths)
+        index.build_seconds = time.perf_counter() - started
+        return index
+
+    def _scan_directory(self, relative_dir):
+        """读取一个目录，返回 (mtime_ns, 文件相对路径集合, 子目录相对路径集合)；目录不可读时返回 None。"""
+        directory = os.path.join(self.root, relative_dir) if relative_dir else self.root
+        prefix = relative_dir + '/' if relative_dir else ''
+        files, subdirs = set(), set()
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in self.ignored_dirs:
+                                subdirs.add(prefix + entry.name)
+                        elif entry.is_file():
+                            files.add(prefix + entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        return mtime, files, subdirs
+
+    def _scan_tree(self, relative_dir):
+        """扫描目录及其所有子目录并加入索引。I/O 在锁外进行，每个目录的结果在锁内加入。"""
+        stack = [relative_dir]
+        while stack:
+            current = stack.pop()
+            scanned = self._scan_directory(current)
+            if scanned is None:
+                continue
+            with self._lock:
+                self._apply_directory(current, *scanned)
+            stack.extend(scanned[2])
+
+    def _apply_directory(self, relative_dir, mtime, files, subdirs):
+        """在锁内把一个目录的扫描结果与索引中的记录比较，只增删有变化的文件，返回新增的子目录。"""
+        old_files = self._dir_files.get(relative_dir, set())
+        for path in old_files - files:
+            self._remove(path)
+        for path in files - old_files:
+            self._insert(path)
+        old_subdirs = self._dir_subdirs.get(relative_dir, set())
+        for subdir in old_subdirs - subdirs:
+            self._forget_tree(subdir)
+        self._dir_mtimes[relative_dir] = mtime
+        self._dir_files[relative_dir] = files
+        self._dir_subdirs[relative_dir] = subdirs
+        return subdirs - old_subdirs
+
+    def refresh(self):
+        """
+        对每个已知目录调用一次 stat，只重新读取修改时间变化的目录（目录中增删文件或子目录时其 mtime 会变化）。
+        返回 (检查的目录数, 重新读取的目录数)。
+        """
+        self._checked_at = time.monotonic()
+        with self._lock:
+            known = list(self._dir_mtimes.items())
+        rescanned = 0
+        for relative_dir, mtime in known:
+            directory = os.path.join(self.root, relative_dir) if relative_dir else self.root
+            try:
+                current_mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                current_mtime = None
+            if current_mtime == mtime:
+                continue
+            rescanned += 1
+            scanned = self._scan_directory(relative_dir) if current_mtime is not None else None
+            if scanned is None:
+                with self._lock:
+                    self._forget_tree(relative_dir)
+                continue
+            with self._lock:
+                if relative_dir not in self._dir_mtimes: # 已随父目录一起被移除
+                    continue
+                added_subdirs = self._apply_directory(relative_dir, *scanned)
+            for subdir in added_subdirs:
+                self._scan_tree(subdir)
+        return len(known), rescanned
+
+    def refresh_if_stale(self):
+        """距上次检查超过 max_age 秒时调用 refresh()，返回是否检查了。多个线程同时调用时只检查一次。"""
+        if self.max_age is None or not self._dir_mtimes:
+            return False
+        with self._refresh_lock:
+            if time.monotonic() - self._checked_at < self.max_age:
+                return False
+            self.refresh()
+            return True
+
+    def _forget_tree(self, relative_dir):
+        """在锁内移除一个目录及其所有子目录中的文件。"""
+        stack = [relative_dir]
+        while stack:
+            current = stack.pop()
+            for path in self._dir_files.pop(current, ()):
+                self._remove(path)
+            stack.extend(self._dir_subdirs.pop(current, ()))
+            self._dir_mtimes.pop(current, None)
+
+    def add_file(self, absolute_path):
+        """记录程序自己创建的文件，不必等待下一次 refresh()。根目录之外的路径被忽略。"""
+        relative = self._relative(absolute_path)
+        if relative is None:
+            return
+        relative_dir = relative.rpartition('/')[0]
+        with self._lock:
+            files = self._dir_files.get(relative_dir)
+            if files is None:
+                # 新目录：交给下一次 refresh() 发现（父目录的 mtime 已变化），这里先加入字典树
+                files = self._dir_files.setdefault(relative_dir, set())
+            if relative not in files:
+                files.add(relative)
+                self._insert(relative)
+
+    def remove_file(self, absolute_path):
+        relative = self._relative(absolute_path)
+        if relative is None:
+            return
+        with self._lock:
+            files = self._dir_files.get(relative.rpartition('/')[0])
+            if files is not None and relative in files:
+                files.discard(relative)
+                self._remove(relative)
+
+    def note_committed(self, plan, errors=()):
+        """根据执行完成的 ApplyPlan 更新索引，失败的操作不计入。"""
+        failed = {path for _, path, _ in errors or ()}
+        for file_info in plan.files_to_write:
+            if file_info['target_path'] not in failed:
+                self.add_file(file_info['target_path'])
+        for path in plan.files_to_delete:
+            if path not in failed:
+                self.remove_file(path)
+
+    def _relative(self, absolute_path):
+        relative = os.path.relpath(os.path.abspath(absolute_path), self.root)
+        if relative == os.curdir or relative.startswith(os.pardir + os.sep) or relative == os.pardir:
+            return None
+        return relative.replace(os.sep, '/')
+
+    # --- 字典树 ---
+    # 只有一个路径的子节点直接以路径字符串保存，不创建 _SuffixNode（大多数文件名在仓库中是唯一的）。
+
+    def _insert(self, path):
+        """在锁内调用。"""
+        node, depth = self._root_node, 0
+        while node.children is not None:
+            component = _component(path, depth)
+            if component is None:
+                node.paths.append(path)
+                self.file_count += 1
+                return
+            key = _key(component)
+            child = node.children.get(key)
+            if child is None:
+                node.children[key] = path
+                self.file_count += 1
+                return
+            if isinstance(child, str):
+                child = node.children[key] = _leaf([child])
+            node, depth = child, depth + 1
+        node.paths.append(path)
+        self.file_count += 1
+        if len(node.paths) > BURST_SIZE:
+            _build_subtree(node, depth)
+
+    def _bulk_insert(self, paths):
+        """建立空索引：所有路径一次分组，避免逐个插入时叶子被反复拆分。"""
+        paths = list(paths)
+        self.file_count += len(paths)
+        self._root_node.paths = paths
+        _build_subtree(self._root_node, 0)
+
+    def _remove(self, path):
+        """在锁内调用。拆分过的节点不再合并，只从列表中移除。"""
+        node, depth = self._root_node, 0
+        while node.children is not None:
+            component = _component(path, depth)
+            if component is None:
+                break
+            key = _key(component)
+            child = node.children.get(key)
+            if isinstance(child, str):
+                if child == path:
+                    del node.children[key]
+                    self.file_count -= 1
+                return
+            if child is None:
+                return
+            node, depth = child, depth + 1
+        try:
+            node.paths.remove(path)
+            self.file_count -= 1
+        except ValueError:
+            pass
+
+    def _match(self, suffix, limit):
+        """返回以 suffix（组件列表）结尾的路径，最多 limit 个。在锁内调用。"""
+        node, depth = self._root_node, 0
+        while depth < len(suffix):
+            if node.children is None:
+                # 叶子中的路径只保证前 depth 个组件匹配，其余组件逐个比较
+                return list(islice((path for path in node.paths if _ends_with(path, suffix)), limit))
+            child = node.children.get(_key(suffix[-depth - 1]))
+            if child is None:
+                return []
+            if isinstance(child, str):
+                return [child] if _ends_with(child, suffix) else []
+            node, depth = child, depth + 1
+        return list(islice(_iter_subtree(node), limit))
+
+    # --- 查询 ---
+
+    def resolve(self, filename, limit=5):
+        """
+        解析代码块中的文件名。请求的路径存在时返回 exact=True 的结果；否则从完整路径开始逐步去掉开头的目录，
+        返回第一个有匹配的后缀下的候选。有唯一候选时 path 为该候选。
+        查找前按 max_age 更新索引（见 refresh_if_stale），候选不会是已经删除的文件。
+        """
+        components = split_components(filename)
+        if not components:
+            return Resolution(filename, None, (), 0, False, False)
+        requested = '/'.join(components)
+        if os.path.exists(os.path.join(self.root, *components)):
+            return Resolution(filename, requested, (requested,), len(components), True, False)
+        try:
+            self.refresh_if_stale()
+        except Exception as e:
+            print(f"[ERROR] 更新文件索引时出错: {type(e).__name__}: {e}", file=sys.stderr)
+        with self._lock:
+            for length in range(len(components), 0, -1):
+                matches = self._match(components[-length:], limit + 1)
+                if matches:
+                    candidates = tuple(matches[:limit])
+                    return Resolution(filename, matches[0] if len(matches) == 1 else None,
+                                      candidates, length, False, len(matches) > limit)
+        return Resolution(filename, None, (), 0, False, False)
+
+    def stats(self):
+        with self._lock:
+            return {'files': self.file_count, 'directories': len(self._dir_mtimes),
+                    'build_ms': round((self.build_seconds or 0.0) * 1000, 1)}
+
+
+def _component(path, depth):
+    """路径的倒数第 depth+1 个组件；路径只有 depth 个组件时返回 None。只切分需要的部分。"""
+    parts = path.rsplit('/', depth + 1)
+    return parts[-depth - 1] if len(parts) > depth else None
+
+
+def _ends_with(path, suffix):
+    parts = path.rsplit('/', len(suffix))
+    return len(parts) >= len(suffix) and [_key(part) for part in parts[-len(suffix):]] == [_key(part) for part in suffix]
+
+
+def _leaf(paths):
+    node = _SuffixNode()
+    node.paths = paths
+    return node
+
+
+def _build_subtree(node, depth):
+    """把 node.paths 中的路径按第 depth+1 个（倒数）组件分组，超过 BURST_SIZE 的组继续分组。"""
+    stack = [(node, depth)]
+    while stack:
+        node, depth = stack.pop()
+        paths, node.paths, node.children = node.paths, [], {}
+        groups = {}
+        for path in paths:
+            component = _component(path, depth)
+            if component is None:
+                node.paths.append(path)
+            else:
+                groups.setdefault(_key(component), []).append(path)
+        for key, group in groups.items():
+            if len(group) == 1:
+                node.children[key] = group[0]
+            else:
+                child = node.children[key] = _leaf(group)
+                if len(group) > BURST_SIZE:
+                    stack.append((child, depth + 1))
+
+
+def _iter_subtree(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            yield node
+            continue
+        yield from node.paths
+        if node.children:
+            stack.extend(node.children.values())
+
+
+class FileIndexWatcher:
+    """
+    在后台线程中建立索引，建立完成后线程结束：之后的变化由 resolve() 在查找时按 max_age 检查
+    （见 FileIndex.refresh_if_stale），没有定时轮询，程序空闲时不占用 CPU。
+    index 在第一次建立完成之前为 None；建立结束（无论成功与否）后 ready 被设置。
+    """
+    def __init__(self, root, max_age=DEFAULT_REFRESH_SECONDS, ignored_dirs=DEFAULT_IGNORED_DIRS):
+        self.root = root
+        self.max_age = max_age
+        self.ignored_dirs = ignored_dirs
+        self.index = None
+        self.ready = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name='FileIndex')
+        self._thread.start()
+
+    def stop(self):
+        """不再使用该索引：之后的查找不再检查磁盘。"""
+        self._stopped = True
+        if self.index is not None:
+            self.index.max_age = None
+
+    def _run(self):
+        try:
+            index = FileIndex.build(self.root, self.ignored_dirs)
+            index.max_age = None if self._stopped else self.max_age
+            self.index = index
+            print(f"[INFO] 已为 '{self.root}' 建立文件索引: {index.stats()}")
+        except Exception as e:
+            print(f"[ERROR] 无法建立文件索引 '{self.root}': {type(e).__name__}: {e}", file=sys.stderr)
+        finally:
+            self.ready.set()
+
+
+if __name__ == '__main__':
+    # 直接运行 `python file_index.py [文件数]`：
+    # 1) 在内存中用合成的单体仓库路径（默认 50 万个）测量建立时间、内存占用和各类查询的延迟；
+    # 2) 在临时目录中创建 2 万个文件，测量 os.scandir 建立索引和无变化 / 有变化时 refresh() 的耗时。
+    # 解析、刷新和按需更新的正确性检查见 tests/test_file_index.py。
+    import random
+    import tempfile
+    import tracemalloc
+
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+
+    def synthetic_paths(count):
+        """类似单体仓库的路径：大量重复的文件名（__init__.py、index.ts）和重复的目录名（src、utils）。"""
+        rng = random.Random(0)
+        common = ['__init__.py', 'index.ts', 'README.md', 'utils.py', 'types.ts']
+        paths = []
+        i = 0
+        while len(paths) < count:
+            package = f"packages/pkg{i // 400}"
+            module = f"src/{rng.choice(['core', 'utils', 'api', 'ui'])}/mod{i // 20 % 20}"
+            name = rng.choice(common) if i % 5 == 0 else f"file{i}.{rng.choice(['py', 'ts'])}"
+            path = f"{package}/{module}/{name}"
+            paths.append(path)
+            i += 1
+        return sorted(set(paths))
+
+    paths = synthetic_paths(total)
+    index = FileIndex.from_paths('/nonexistent-root', paths)
+    tracemalloc.start() # tracemalloc 会显著拖慢分配，内存单独测量一次
+    measured = FileIndex.from_paths('/nonexistent-root', paths)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"内存中的索引: {index.file_count} 个文件, 建立 {index.build_seconds * 1000:.0f} ms, "
+          f"索引结构占用约 {memory / 1e6:.1f} MB（不含路径字符串本身）")
+
+    rng = random.Random(1)
+    unique = [path.rsplit('/', 1)[1] for path in rng.sample(paths, 2000) if 'file' in path.rsplit('/', 1)[1]]
+    queries = {
+        "只有文件名（唯一）": unique,
+        "目录不对（唯一）": ["wrong/dir/" + '/'.join(path.split('/')[-2:]) for path in rng.sample(paths, 2000)],
+        "常见文件名（多个候选）": ["__init__.py", "utils.py", "index.ts"] * 500,
+        "不存在": [f"missing{i}.py" for i in range(2000)],
+    }
+    for label, names in queries.items():
+        latencies = []
+        results = []
+        for name in names:
+            started = time.perf_counter()
+            results.append(index.resolve(name))
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        resolved = sum(result.path is not None for result in results)
+        ambiguous = sum(result.path is None and bool(result.candidates) for result in results)
+        p99 = latencies[int(len(latencies) * 0.99)]
+        print(f"    {label:<12} {len(names):5d} 次: p50 {latencies[len(latencies) // 2] * 1e6:6.1f} µs, "
+              f"p99 {p99 * 1e6:6.1f} µs, 最大 {latencies[-1] * 1e6:7.1f} µs; 唯一解析 {resolved}, 多个候选 {ambiguous}"
+              f"{'  <-- p99 超过 1 ms' if p99 > 0.001 else ''}")
+
+    with tempfile.TemporaryDirectory() as root:
+        disk_paths = synthetic_paths(20_000)
+        for path in disk_paths:
+            full_path = os.path.join(root, *path.split('/'))
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            open(full_path, 'w').close()
+        os.makedirs(os.path.join(root, 'node_modules', 'dep'))
+        open(os.path.join(root, 'node_modules', 'dep', 'ignored.js'), 'w').close()
+        disk_index = FileIndex.build(root)
+        print(f"磁盘上的索引: {disk_index.stats()}")
+        started = time.perf_counter()
+        checked, rescanned = disk_index.refresh()
+        print(f"    无变化时 refresh: 检查 {checked} 个目录, 重新读取 {rescanned} 个, {(time.perf_counter() - started) * 1000:.1f} ms")
+        time.sleep(0.01) # 保证目录的 mtime 发生变化
+        os.makedirs(os.path.join(root, 'packages', 'new', 'src'))
+        open(os.path.join(root, 'packages', 'new', 'src', 'brand_new.py'), 'w').close()
+        os.remove(os.path.join(root, *disk_paths[0].split('/')))
+        started = time.perf_counter()
+        checked, rescanned = disk_index.refresh()
+        print(f"    新增和删除后 refresh: 检查 {checked} 个目录, 重新读取 {rescanned} 个, {(time.perf_counter() - started) * 1000:.1f} ms")
+        # 查找时按需更新：不调用 refresh()，过期的索引在 resolve() 中发现新文件
+        disk_index.max_age = 0
+        time.sleep(0.01)
+        open(os.path.join(root, 'packages', 'new', 'src', 'lazy_new.py'), 'w').close()
+        started = time.perf_counter()
+        disk_index.resolve("lazy_new.py")
+        print(f"    查找时按需 refresh: {(time.perf_counter() - started) * 1000:.1f} ms")
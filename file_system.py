@@ -0,0 +1,473 @@
+import io
+import os
+import sys
+import time
+import errno
+import shutil
+import threading
+
+from text_span import as_text, content_length
+from text_format import DEFAULT_FORMAT, read_file_text
+
+DEFAULT_IO_WORKERS = 8
+
+
+def user_data_dir():
+    """
+    程序数据（撤销日志、提交记录）的目录，不放在源代码目录中：
+    Windows 上为 %LOCALAPPDATA%\\AutoApply，其他平台为 $XDG_DATA_HOME/AutoApply（默认 ~/.local/share/AutoApply）。
+    """
+    base = (os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_DATA_HOME')
+            or os.path.join(os.path.expanduser('~'), '.local', 'share'))
+    return os.path.join(base, 'AutoApply')
+
+
+class LocalFileSystem:
+    """
+    apply_engine 使用的文件系统访问接口，默认直接访问本地磁盘。
+    所有方法都可以在线程池中并发调用。
+    文本按 text_format（text_format.TextFormat，默认 DEFAULT_FORMAT）的编码、BOM 和换行符写入，
+    内容本身只含 LF。
+    """
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def isfile(self, path):
+        return os.path.isfile(path)
+
+    def getsize(self, path):
+        return os.path.getsize(path)
+
+    def read_text(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def open_binary(self, path):
+        return open(path, 'rb')
+
+    def read_tail(self, path, size):
+        """读取文件末尾至多 size 个字节，返回 (字节, 是否已读到文件开头)。"""
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            start = max(0, f.tell() - size)
+            f.seek(start)
+            return f.read(), start == 0
+
+    def write_text(self, path, content, text_format=None):
+        with _open_text(path, 'w', text_format) as f:
+            f.write(content)
+
+    def append_text(self, path, content, text_format=None):
+        with _open_text(path, 'a', text_format) as f:
+            f.write(content)
+
+    def write_chunks(self, path, chunks, mode='w', text_format=None):
+        """逐块写入文本（mode 为 'w' 或 'a'），不在内存中拼接完整内容。"""
+        with _open_text(path, mode, text_format) as f:
+            for chunk in chunks:
+                f.write(chunk)
+
+    def write_binary_chunks(self, path, chunks):
+        """逐块写入字节（BINARY 代码块解码后的内容），不在内存中拼接完整内容。"""
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+
+    def makedirs(self, path):
+        os.makedirs(path, exist_ok=True)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def replace(self, source, target):
+        """原子地用 source 替换 target（同一目录内的 os.replace）。"""
+        os.replace(source, target)
+
+    def append_file(self, path, source):
+        """把 source 文件的字节原样追加到 path 末尾，path 不存在时创建。"""
+        with open(source, 'rb') as src, open(path, 'ab') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+    def fsync(self, path):
+        """把文件内容刷到磁盘。Windows 上需要可写的句柄才能 FlushFileBuffers。"""
+        fd = os.open(path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def fsync_dir(self, path):
+        """把目录项（新建、重命名、删除）刷到磁盘。Windows 不能打开目录，NTFS 的元数据由其日志保证。"""
+        if os.name == 'nt':
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def sync_filesystem(self, path):
+        """
+        一次刷新 path 所在文件系统的所有数据和元数据（Linux syncfs），返回 False 表示不支持，
+        调用方应改为逐个文件 fsync。
+        """
+        syncfs = _syncfs()
+        if syncfs is None:
+            return False
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if syncfs(fd) != 0:
+                import ctypes
+                error = ctypes.get_errno()
+                raise OSError(error, os.strerror(error), path)
+        finally:
+            os.close(fd)
+        return True
+
+
+def _open_text(path, mode, text_format):
+    """按格式打开文本文件：换行符由文本模式转换，整体写入（'w'）且格式带 BOM 时先写入 BOM。"""
+    text_format = text_format or DEFAULT_FORMAT
+    f = open(path, mode, encoding=text_format.encoding, errors=text_format.errors, newline=text_format.newline)
+    if mode == 'w' and text_format.bom:
+        f.write('\ufeff')
+    return f
+
+
+_SYNCFS = []
+
+
+def _syncfs():
+    """libc 的 syncfs，只在 Linux 上可用；第一次调用时才加载 ctypes。"""
+    if not _SYNCFS:
+        function = None
+        if sys.platform.startswith('linux'):
+            try:
+                import ctypes
+                function = getattr(ctypes.CDLL(None, use_errno=True), 'syncfs', None)
+            except (OSError, AttributeError):
+                function = None
+        _SYNCFS.append(function)
+    return _SYNCFS[0]
+
+
+class LatencyFileSystem(LocalFileSystem):
+    """
+    在每次文件系统调用前注入固定延迟的包装器，用于模拟网络共享或被杀毒软件扫描的慢速磁盘。
+    仅用于基准测试。
+    """
+    def __init__(self, latency=0.005):
+        self.latency = latency
+        self.calls = 0
+
+    def _delay(self):
+        self.calls += 1
+        time.sleep(self.latency)
+
+    def exists(self, path):
+        self._delay()
+        return super().exists(path)
+
+    def isfile(self, path):
+        self._delay()
+        return super().isfile(path)
+
+    def getsize(self, path):
+        self._delay()
+        return super().getsize(path)
+
+    def read_text(self, path):
+        self._delay()
+        return super().read_text(path)
+
+    def open_binary(self, path):
+        self._delay()
+        return super().open_binary(path)
+
+    def read_tail(self, path, size):
+        self._delay()
+        return super().read_tail(path, size)
+
+    def write_text(self, path, content, text_format=None):
+        self._delay()
+        super().write_text(path, content, text_format)
+
+    def append_text(self, path, content, text_format=None):
+        self._delay()
+        super().append_text(path, content, text_format)
+
+    def write_chunks(self, path, chunks, mode='w', text_format=None):
+        self._delay()
+        super().write_chunks(path, chunks, mode, text_format)
+
+    def write_binary_chunks(self, path, chunks):
+        self._delay()
+        super().write_binary_chunks(path, chunks)
+
+    def makedirs(self, path):
+        self._delay()
+        super().makedirs(path)
+
+    def remove(self, path):
+        self._delay()
+        super().remove(path)
+
+    def replace(self, source, target):
+        self._delay()
+        super().replace(source, target)
+
+    def append_file(self, path, source):
+        self._delay()
+        super().append_file(path, source)
+
+    def fsync(self, path):
+        self._delay()
+        super().fsync(path)
+
+    def fsync_dir(self, path):
+        self._delay()
+        super().fsync_dir(path)
+
+    def sync_filesystem(self, path):
+        self._delay()
+        return super().sync_filesystem(path)
+
+
+class CountingFileSystem(LocalFileSystem):
+    """
+    统计每个路径上读取/写入次数和字节数的包装器，用于验证 I/O 量（例如 APPEND 只写入新增字节）。
+    字节数按 UTF-8 编码计算；open_binary 只计次数。写入先暂存在临时文件中（见 transaction），
+    替换或追加到目标路径时把临时文件的写入次数计到目标路径上。
+    """
+    def __init__(self):
+        self.reads = {}
+        self.writes = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+
+    def _count_read(self, path, size):
+        with self._lock:
+            self.reads[path] = self.reads.get(path, 0) + 1
+            self.bytes_read += size
+
+    def _count_write(self, path, content, count_call=True):
+        with self._lock:
+            if count_call:
+                self.writes[path] = self.writes.get(path, 0) + 1
+            self.bytes_written += len(content) if isinstance(content, bytes) else len(content.encode('utf-8', 'surrogatepass'))
+
+    def read_text(self, path):
+        content = super().read_text(path)
+        self._count_read(path, len(content.encode('utf-8', 'surrogatepass')))
+        return content
+
+    def open_binary(self, path):
+        self._count_read(path, 0)
+        return super().open_binary(path)
+
+    def read_tail(self, path, size):
+        data, at_start = super().read_tail(path, size)
+        self._count_read(path, len(data))
+        return data, at_start
+
+    def write_text(self, path, content, text_format=None):
+        super().write_text(path, content, text_format)
+        self._count_write(path, content)
+
+    def append_text(self, path, content, text_format=None):
+        super().append_text(path, content, text_format)
+        self._count_write(path, content)
+
+    def write_chunks(self, path, chunks, mode='w', text_format=None):
+        def counted(chunks):
+            for chunk in chunks:
+                self._count_write(path, chunk, count_call=False)
+                yield chunk
+        self._count_write(path, "")
+        super().write_chunks(path, counted(chunks), mode, text_format)
+
+    def write_binary_chunks(self, path, chunks):
+        def counted(chunks):
+            for chunk in chunks:
+                self._count_write(path, chunk, count_call=False)
+                yield chunk
+        self._count_write(path, b"")
+        super().write_binary_chunks(path, counted(chunks))
+
+    def _move_count(self, source, target):
+        with self._lock:
+            count = self.writes.pop(source, 0)
+            if count:
+                self.writes[target] = self.writes.get(target, 0) + count
+
+    def replace(self, source, target):
+        super().replace(source, target)
+        self._move_count(source, target)
+
+    def append_file(self, path, source):
+        super().append_file(path, source)
+        self._move_count(source, path)
+
+
+class _OverlayEntry:
+    """OverlayFileSystem 中一个已加载路径的状态。"""
+    __slots__ = ('base_exists', 'original', 'error', 'exists', 'keeps_original', 'pieces', 'dirty', 'text',
+                 'text_format')
+
+    def __init__(self):
+        self.base_exists = False
+        self.original = None # 底层文件的内容，读取失败时为 None
+        self.error = None # 读取底层文件时的错误
+        self.exists = False
+        self.keeps_original = True # 当前内容 = 原内容 + pieces（加载后只发生过追加）
+        self.pieces = [] # keeps_original 为 False 时是完整的当前内容
+        self.dirty = False
+        self.text = None # 当前内容的缓存，修改时清空
+        self.text_format = None # 底层文件的 TextFormat，文件不存在或读取失败时为 None
+
+
+def _join_pieces(pieces):
+    """片段全部为 str 时拼接为一个 str，含 TextSpan 时返回元组，写入时逐块标准化。"""
+    if all(isinstance(piece, str) for piece in pieces):
+        return "".join(pieces)
+    return tuple(pieces)
+
+
+class OverlayFileSystem:
+    """
+    叠加在另一个文件系统之上的内存写时复制视图。plan_blocks 用它模拟同一批次中对同一路径的多次操作：
+    后面的操作能看到前面操作的结果，底层文件只读取一次，提交时只写入每个路径的最终净变化（net_change）。
+    load(path) 从底层完整读取一次该路径（按文件的格式解码），之后它的所有读写都在内存中完成；
+    未加载的路径的读取直接透传给底层。内存中的内容只含 LF，字节视图（getsize、open_binary）为 UTF-8。
+    写入的内容可以是 str 或 TextSpan，只保存引用，读取时才生成文本。
+    """
+    def __init__(self, base):
+        self.base = base
+        self._entries = {}
+
+    def load(self, path):
+        """读取底层文件并开始在内存中跟踪该路径；读取错误会在之后读取该路径时重新抛出。"""
+        entry = _OverlayEntry()
+        entry.base_exists = entry.exists = self.base.isfile(path)
+        if entry.base_exists:
+            try:
+                entry.original, entry.text_format = read_file_text(self.base, path)
+            except Exception as e:
+                entry.error = e
+        self._entries[path] = entry
+
+    def _entry(self, path):
+        if path not in self._entries:
+            self.load(path) # 写入前未加载的路径在此加载，保证能计算净变化
+        return self._entries[path]
+
+    def _text(self, path):
+        entry = self._entries[path]
+        if not entry.exists:
+            raise FileNotFoundError(errno.ENOENT, "文件不存在或已在本批次中删除", path)
+        if entry.keeps_original and entry.error is not None:
+            raise entry.error
+        if entry.text is None:
+            original = (entry.original or "") if entry.keeps_original else ""
+            entry.text = original + "".join(as_text(piece) for piece in entry.pieces)
+        return entry.text
+
+    def _data(self, path):
+        return self._text(path).encode('utf-8', 'surrogatepass')
+
+    def exists(self, path):
+        entry = self._entries.get(path)
+        return self.base.exists(path) if entry is None else entry.exists
+
+    def isfile(self, path):
+        entry = self._entries.get(path)
+        return self.base.isfile(path) if entry is None else entry.exists
+
+    def getsize(self, path):
+        return self.base.getsize(path) if path not in self._entries else len(self._data(path))
+
+    def read_text(self, path):
+        return self.base.read_text(path) if path not in self._entries else self._text(path)
+
+    def open_binary(self, path):
+        return self.base.open_binary(path) if path not in self._entries else io.BytesIO(self._data(path))
+
+    def read_tail(self, path, size):
+        if path not in self._entries:
+            return self.base.read_tail(path, size)
+        data = self._data(path)
+        return data[-size:], len(data) <= size
+
+    def write_text(self, path, content, text_format=None):
+        entry = self._entry(path)
+        entry.exists = entry.dirty = True
+        entry.keeps_original = False
+        entry.pieces = [content]
+        entry.text = None
+
+    def append_text(self, path, content, text_format=None):
+        entry = self._entry(path)
+        if not entry.exists: # 追加到不存在的文件等同于创建
+            entry.keeps_original = False
+            entry.pieces = []
+        entry.exists = entry.dirty = True
+        entry.pieces.append(content)
+        entry.text = None
+
+    def is_loaded(self, path):
+        return path in self._entries
+
+    def text_format(self, path):
+        """该路径底层文件的 TextFormat；写入最终内容时沿用，文件原本不存在时为 None。"""
+        return self._entries[path].text_format
+
+    def existed_before(self, path):
+        """该路径在底层文件系统中原本是否存在。"""
+        return self._entries[path].base_exists
+
+    def makedirs(self, path):
+        pass # 目录在提交时创建
+
+    def remove(self, path):
+        entry = self._entry(path)
+        if not entry.exists:
+            raise FileNotFoundError(errno.ENOENT, "文件不存在或已在本批次中删除", path)
+        entry.exists = entry.keeps_original = False
+        entry.dirty = True
+        entry.pieces = []
+        entry.text = None
+
+    def net_change(self, path):
+        """
+        返回该路径相对于底层文件的最终净变化：None 表示无需任何操作，否则为 (mode, content)，
+        mode 为 'w'（整体写入）、'a'（只在末尾追加 content）或 'delete'（content 为 None）。
+        最终内容与原内容相同（例如先修改再改回）时返回 None。
+        """
+        entry = self._entries.get(path)
+        if entry is None or not entry.dirty:
+            return None
+        if not entry.exists:
+            return ('delete', None) if entry.base_exists else None
+        if entry.keeps_original:
+            return ('a', _join_pieces(entry.pieces)) if entry.pieces else None
+        if (entry.base_exists and entry.error is None
+                and sum(content_length(piece) for piece in entry.pieces) == len(entry.original)
+                and self._text(path) == entry.original): # 先比较长度，长度不同时无需生成文本
+            return None
+        return ('w', _join_pieces(entry.pieces))
+
+
+def map_in_pool(func, items, max_workers=DEFAULT_IO_WORKERS):
+    """
+    在有界线程池中对 items 执行 func，结果顺序与 items 一致。
+    只有一个任务或 max_workers <= 1 时直接在当前线程执行，避免创建线程的开销。
+    func 内部的异常会原样抛出，需要聚合错误的调用方应在 func 内自行捕获。
+    """
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return [func(item) for item in items]
+    # 延迟导入：concurrent.futures 会连带加载 logging 等模块，单个代码块的载荷和启动过程都用不到
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
@@ -1,72 +1,155 @@
+import os
 import sys
+import hashlib
 
-# --- PIL (Pillow) 相关的导入 ---
-try:
-    from PIL import Image, ImageDraw, ImageFont
-except ImportError:
-    # 这里的错误处理主要用于直接运行此文件进行测试时，
-    # 主程序中已有更全面的启动时检查。
-    print(
-        "错误: 缺少 'Pillow' 库。请运行 'pip install Pillow'。",
-        file=sys.stderr
-    )
-    sys.exit(1)
+# PIL (Pillow) 只在需要图标时才导入，启动时不再加载字体和绘图模块。
+# 主程序在启动时检查 Pillow 是否已安装。
 
-def create_default_icon():
+ICON_SIZE = 64
+ICON_TEXT = "AP" # AutoApply
+ICON_FONT_CANDIDATES = ("arialbd.ttf", "arial.ttf") # 依次尝试 Arial Bold、Arial，都不可用时使用默认字体
+ICON_FONT_SIZE = 38
+ICON_CORNER_RADIUS = 16
+ICON_TEXT_COLOR = (255, 255, 255, 255) # 白色
+# 各状态图标的背景色
+ICON_VARIANTS = {
+    'default': (217, 83, 79, 255), # 柔和、不刺眼的红色 (#D9534F)：正在监听
+    'busy': (240, 173, 78, 255), # 橙色 (#F0AD4E)：正在处理剪贴板内容
+    'error': (119, 119, 119, 255), # 灰色：上一次文件操作失败
+}
+# 修改绘制逻辑时递增，使磁盘上的图标缓存失效
+ICON_RENDER_VERSION = 1
+
+_loaded_icons = {} # 进程内已加载的图标，避免切换状态时重复读取磁盘
+
+
+def _import_pil():
+    try:
+        from PIL import Image, ImageDraw, ImageFont
+    except ImportError:
+        print("错误: 缺少 'Pillow' 库。请运行 'pip install Pillow'。", file=sys.stderr)
+        raise
+    return Image, ImageDraw, ImageFont
+
+
+def render_icon(variant='default'):
     """
-    创建一个带有圆角红色背景和白色字母 "AP" 的图标 (PIL Image)。
-    这个函数现在是独立的，不依赖于主应用的任何部分。
+    绘制一个带有圆角背景和白色字母 "AP" 的图标 (PIL Image)，背景色由 variant 决定。
+    需要探测字体并栅格化文本，启动时应优先使用 load_icon() 读取缓存。
     """
-    width, height = 64, 64
+    Image, ImageDraw, ImageFont = _import_pil()
+    width, height = ICON_SIZE, ICON_SIZE
     # 创建一个 RGBA 模式的图像，背景完全透明
     image = Image.new('RGBA', (width, height), (0, 0, 0, 0))
     draw = ImageDraw.Draw(image)
-    
-    # 定义颜色
-    # 背景色：一种柔和、不刺眼的红色 (#D9534F)
-    background_color = (217, 83, 79, 255)
-    # 文本颜色：白色
-    text_color = (255, 255, 255, 255)
-    
+
     # 绘制圆角矩形背景
-    # 使用 16px 的圆角半径
     draw.rounded_rectangle(
         (0, 0, width, height),
-        radius=16,
-        fill=background_color
+        radius=ICON_CORNER_RADIUS,
+        fill=ICON_VARIANTS[variant]
     )
-    
+
     # 尝试加载字体
-    try:
-        # 字体大小可以适当调整以适应背景
-        font = ImageFont.truetype("arialbd.ttf", 38) # 使用 Arial Bold
-    except IOError:
+    font = None
+    for font_name in ICON_FONT_CANDIDATES:
         try:
-            font = ImageFont.truetype("arial.ttf", 38)
+            font = ImageFont.truetype(font_name, ICON_FONT_SIZE)
+            break
         except IOError:
-            font = ImageFont.load_default()
+            continue
+    if font is None:
+        font = ImageFont.load_default()
 
-    text = "AP" # AutoApply
-    
     # 使用 textbbox 计算文本精确边界框以实现完美居中
-    text_bbox = draw.textbbox((0, 0), text, font=font)
+    text_bbox = draw.textbbox((0, 0), ICON_TEXT, font=font)
     text_width = text_bbox[2] - text_bbox[0]
     text_height = text_bbox[3] - text_bbox[1]
-    
+
     # 计算文本绘制的起始位置 (x, y)
     x = (width - text_width) / 2
     # textbbox 返回的 y 坐标是基线位置，需要微调
-    y = (height - text_height) / 2 - text_bbox[1] 
-    
+    y = (height - text_height) / 2 - text_bbox[1]
+
     # 绘制文本
-    draw.text((x, y), text, font=font, fill=text_color)
-    
+    draw.text((x, y), ICON_TEXT, font=font, fill=ICON_TEXT_COLOR)
+
     return image
 
+
+def create_default_icon():
+    """
+    创建默认状态的图标 (PIL Image)。
+    这个函数是独立的，不依赖于主应用的任何部分。
+    """
+    return render_icon('default')
+
+
+def icon_cache_key(variant, pil_version=''):
+    """由绘制参数、版本号和 Pillow 版本计算的缓存键；任何一项变化都会生成新的缓存文件。"""
+    parameters = (ICON_RENDER_VERSION, pil_version, ICON_SIZE, ICON_TEXT, ICON_FONT_CANDIDATES, ICON_FONT_SIZE,
+                  ICON_CORNER_RADIUS, ICON_TEXT_COLOR, ICON_VARIANTS[variant])
+    return hashlib.blake2b(repr(parameters).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def default_icon_cache_dir():
+    """Windows 上为 %LOCALAPPDATA%\\AutoApply\\icons，其他平台为 ~/.cache/AutoApply/icons。"""
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'AutoApply', 'icons')
+
+
+def _store_icon(image, cache_dir, variant, path):
+    """原子地写入缓存文件，并删除同一状态的旧版本缓存。失败时只警告。"""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = path + '.tmp'
+        image.save(temp_path, format='PNG')
+        os.replace(temp_path, path)
+        prefix = f"icon-{variant}-"
+        for name in os.listdir(cache_dir):
+            if name.startswith(prefix) and os.path.join(cache_dir, name) != path:
+                os.remove(os.path.join(cache_dir, name))
+    except OSError as e:
+        print(f"[WARNING] 无法写入图标缓存 '{path}': {e}", file=sys.stderr)
+
+
+def load_icon(variant='default', cache_dir=None):
+    """
+    返回指定状态的图标。优先读取磁盘缓存（只需解码一个 PNG），
+    缓存不存在、已损坏或绘制参数变化时重新绘制并写入缓存。
+    """
+    image = _loaded_icons.get(variant)
+    if image is not None:
+        return image
+    import PIL
+    from PIL import Image
+    cache_dir = cache_dir or default_icon_cache_dir()
+    path = os.path.join(cache_dir, f"icon-{variant}-{icon_cache_key(variant, PIL.__version__)}.png")
+    try:
+        with Image.open(path) as cached:
+            image = cached.convert('RGBA')
+    except (OSError, ValueError):
+        image = render_icon(variant)
+        _store_icon(image, cache_dir, variant, path)
+    _loaded_icons[variant] = image
+    return image
+
+
 if __name__ == '__main__':
     # 这个简单的测试脚本允许你直接运行 `python icon_creator.py`
-    # 来预览生成的图标。
+    # 来预览生成的图标，并比较绘制与读取缓存的耗时。
+    import time
+    import tempfile
+
     print("正在生成图标预览 'icon_preview.png'...")
     icon_image = create_default_icon()
     icon_image.save('icon_preview.png')
-    print("预览已保存。")
\ No newline at end of file
+    print("预览已保存。")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for label in ("首次（绘制并写入缓存）", "再次启动（读取缓存）"):
+            _loaded_icons.clear()
+            started = time.perf_counter()
+            for variant in ICON_VARIANTS:
+                load_icon(variant, cache_dir=temp_dir)
+            print(f"{label}: {len(ICON_VARIANTS)} 个状态图标 {(time.perf_counter() - started) * 1000:.2f} ms")
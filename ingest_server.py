@@ -0,0 +1,377 @@
+import os
+import sys
+import hmac
+import json
+import stat
+import socket
+import struct
+import asyncio
+import ipaddress
+
+# 本地载荷接收端点：编辑器扩展等本地程序不经过剪贴板，直接把载荷交给处理流水线，并收到每个文件的结果。
+#
+# 帧格式（双向相同）：4 字节大端无符号长度 + UTF-8 编码的 JSON 对象。
+#   请求: {"id": 任意 JSON 值, "text": "载荷文本", "token": "可选的共享密钥"}
+#   响应: {"id": 请求中的 id, "outcome": "committed" | "cancelled" | "unchanged" | "empty" | "dropped" | "error"
+#                                        | "rejected", "files": [{"path", "operation", "status", "error"}],
+#          "error": 仅 outcome 为 rejected 时给出原因}
+# 同一连接上可以连续发送多个请求而不等待响应（流水线化）；响应按完成顺序返回，用 id 对应请求。
+# 每个连接最多同时处理 max_in_flight 个请求，达到上限后暂停读取，由套接字缓冲区向客户端传递反压。
+#
+# 地址：Unix 域套接字路径（'unix:/路径' 或直接写路径），或本机 TCP 地址（'tcp:127.0.0.1:端口' 或 '主机:端口'）。
+# TCP 只允许回环地址；使用 TCP 或 auto_approve 时必须设置 auth_token。
+# 不支持 Unix 域套接字的平台（Windows）上，路径形式的地址改用 127.0.0.1 的 DEFAULT_TCP_PORT。
+
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_IN_FLIGHT = 256
+DEFAULT_TCP_PORT = 47321
+
+
+class FrameError(Exception):
+    """收到的帧无法解析（长度超过上限、不是 JSON 对象等），连接将被关闭。"""
+
+
+def _is_loopback(host):
+    if host.lower() == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host.strip('[]')).is_loopback
+    except ValueError:
+        return False
+
+
+def parse_address(address):
+    """
+    将配置中的地址解析为 ('unix', 路径) 或 ('tcp', (主机, 端口))。
+    不支持 Unix 域套接字时路径形式的地址回退为本机 TCP；TCP 主机不是回环地址时抛出 ValueError。
+    """
+    address = str(address or '').strip()
+    if address.startswith('tcp:'):
+        kind, target = 'tcp', address[4:]
+    elif address.startswith('unix:'):
+        kind, target = 'unix', address[5:]
+    elif ':' in address and not os.path.isabs(address) and address.rsplit(':', 1)[1].isdigit():
+        kind, target = 'tcp', address
+    else:
+        kind, target = 'unix', address
+    if not target:
+        raise ValueError(f"无效的接收端点地址 '{address}'")
+    if kind == 'unix' and (sys.platform == 'win32' or not hasattr(socket, 'AF_UNIX')):
+        print(f"[WARNING] 当前平台不支持 Unix 域套接字，接收端点改用 127.0.0.1:{DEFAULT_TCP_PORT}。", file=sys.stderr)
+        return 'tcp', ('127.0.0.1', DEFAULT_TCP_PORT)
+    if kind == 'tcp':
+        host, _, port = target.rpartition(':')
+        host = host or '127.0.0.1'
+        if not _is_loopback(host):
+            raise ValueError(f"接收端点只能监听本机回环地址，'{host}' 不是回环地址")
+        return 'tcp', (host, int(port))
+    return 'unix', os.path.expanduser(target)
+
+
+def encode_frame(message):
+    body = json.dumps(message, ensure_ascii=False).encode('utf-8')
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+def decode_body(body):
+    try:
+        message = json.loads(body.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise FrameError(f"帧内容不是有效的 UTF-8 JSON: {e}")
+    if not isinstance(message, dict):
+        raise FrameError("帧内容必须是 JSON 对象")
+    return message
+
+
+async def read_frame(reader):
+    """读取一个帧并返回解析后的对象；连接在帧边界处关闭时返回 None。"""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise FrameError("连接在帧头中间关闭")
+    size, = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_BYTES:
+        raise FrameError(f"帧长度 {size} 超过上限 {MAX_FRAME_BYTES}")
+    try:
+        body = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise FrameError("连接在帧内容中间关闭")
+    return decode_body(body)
+
+
+class IngestServer:
+    """
+    在处理流水线的事件循环中运行的本地接收端点。每个请求通过 ApplyPipeline.submit() 进入与剪贴板相同的
+    parse → plan → confirm → commit 流程（不按内容摘要去重），处理完成后返回每个文件的结果。
+    auto_approve 为 False 时请求与剪贴板内容一样等待用户在确认窗口中批准，响应在用户作出决定后才返回。
+    auth_token 非空时每个请求都必须携带相同的 token；监听 TCP 或 auto_approve 为 True 时 auth_token 不能为空，
+    否则本机的任何用户或程序都可以不经确认写入文件。
+    """
+    def __init__(self, pipeline, address, auth_token='', auto_approve=False, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.pipeline = pipeline
+        self.address = address
+        self.auth_token = auth_token or ''
+        self.auto_approve = auto_approve
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.bound_address = None # 实际监听的地址：('unix', 路径) 或 ('tcp', (主机, 端口))
+        self.connections = 0
+        self.requests = 0
+        self.rejected = 0
+        self.protocol_errors = 0
+        self._server = None
+
+    def start(self):
+        """开始监听，返回实际地址。可从任意线程调用，流水线必须已经启动。"""
+        return self.pipeline.run_coroutine(self._start()).result()
+
+    def stop(self, timeout=5.0):
+        if self._server is None:
+            return
+        try:
+            self.pipeline.run_coroutine(self._stop()).result(timeout)
+        except Exception as e:
+            print(f"[WARNING] 停止接收端点时出错: {type(e).__name__}: {e}", file=sys.stderr)
+
+    async def _start(self):
+        kind, target = parse_address(self.address)
+        if not self.auth_token and (kind == 'tcp' or self.auto_approve):
+            reason = "监听 TCP 地址" if kind == 'tcp' else "启用 ingest_auto_approve"
+            raise ValueError(f"{reason}时必须设置 ingest_token")
+        if kind == 'unix':
+            _remove_stale_socket(target)
+            self._server = await asyncio.start_unix_server(self._handle_connection, sock=_bind_private_socket(target))
+            self.bound_address = ('unix', target)
+        else:
+            host, port = target
+            self._server = await asyncio.start_server(self._handle_connection, host, port)
+            self.bound_address = ('tcp', self._server.sockets[0].getsockname()[:2])
+        print(f"[INFO] 载荷接收端点已启动: {format_address(self.bound_address)}")
+        return self.bound_address
+
+    async def _stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        if self.bound_address and self.bound_address[0] == 'unix':
+            _remove_stale_socket(self.bound_address[1])
+
+    async def _handle_connection(self, reader, writer):
+        self.connections += 1
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                await in_flight.acquire() # 达到上限时暂停读取，反压传递给客户端
+                try:
+                    message = await read_frame(reader)
+                except FrameError as e:
+                    self.protocol_errors += 1
+                    await self._send(writer, write_lock, {'id': None, 'outcome': 'rejected', 'files': [], 'error': str(e)})
+                    break
+                if message is None:
+                    break
+                task = asyncio.create_task(self._handle_request(message, writer, write_lock, in_flight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # 客户端停止发送后，已接收的请求仍然处理完并返回结果
+            await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _handle_request(self, message, writer, write_lock, in_flight):
+        try:
+            response = await self._process(message)
+        finally:
+            in_flight.release()
+        await self._send(writer, write_lock, response)
+
+    async def _process(self, message):
+        self.requests += 1
+        request_id = message.get('id')
+        text = message.get('text')
+        project = message.get('project')
+        if self.auth_token and not hmac.compare_digest(str(message.get('token', '')), self.auth_token):
+            return self._reject(request_id, "token 无效")
+        if not isinstance(text, str):
+            return self._reject(request_id, "请求必须包含字符串字段 text")
+        if project is not None and not isinstance(project, str):
+            return self._reject(request_id, "project 必须是字符串")
+        result = await self.pipeline.submit(text, auto_approve=self.auto_approve, project=project or None)
+        return {'id': request_id, 'outcome': result.outcome, 'files': result.files}
+
+    def _reject(self, request_id, reason):
+        self.rejected += 1
+        return {'id': request_id, 'outcome': 'rejected', 'files': [], 'error': reason}
+
+    async def _send(self, writer, write_lock, response):
+        async with write_lock:
+            try:
+                writer.write(encode_frame(response))
+                await writer.drain()
+            except ConnectionError:
+                pass # 客户端已断开，结果已经写入文件，只是无法返回
+
+    def stats(self):
+        return {
+            'address': format_address(self.bound_address) if self.bound_address else None,
+            'connections': self.connections,
+            'requests': self.requests,
+            'rejected': self.rejected,
+            'protocol_errors': self.protocol_errors,
+        }
+
+    def format_summary(self):
+        stats = self.stats()
+        return (f"载荷接收端点 {stats['address']}：{stats['connections']} 个连接，{stats['requests']} 个请求，"
+                f"拒绝 {stats['rejected']}，协议错误 {stats['protocol_errors']}")
+
+
+def format_address(bound_address):
+    kind, target = bound_address
+    return f"unix:{target}" if kind == 'unix' else f"tcp:{target[0]}:{target[1]}"
+
+
+def _bind_private_socket(path):
+    """
+    创建并绑定只允许当前用户连接的 Unix 域套接字：bind 时 umask 已经去掉其他用户的权限，
+    不存在先以默认权限创建、再 chmod 的时间窗口。umask 是进程级的，只在同步的 bind 调用期间修改。
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        previous_umask = os.umask(0o177)
+        try:
+            sock.bind(path)
+        finally:
+            os.umask(previous_umask)
+        os.chmod(path, 0o600)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def _remove_stale_socket(path):
+    """删除上次运行遗留的套接字文件；路径上是普通文件时不删除，让监听失败并报告错误。"""
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class IngestClient:
+    """
+    阻塞的参考客户端，供测试和脚本使用；编辑器扩展可以按同样的帧格式实现。
+    send() 只发送不等待，receive() 读取下一个响应，request_many() 以固定窗口流水线化地发送多个请求。
+    """
+    def __init__(self, address, token='', timeout=30.0, project=None):
+        kind, target = parse_address(address)
+        family = socket.AF_UNIX if kind == 'unix' else socket.AF_INET
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(target)
+        self._reader = self._sock.makefile('rb')
+        self.token = token
+        self.project = project # 每个请求都带上的项目名，例如编辑器窗口对应的项目
+        self._next_id = 0
+
+    def send(self, text, request_id=None):
+        """发送一个请求，返回其 id。"""
+        if request_id is None:
+            request_id = self._next_id
+            self._next_id += 1
+        message = {'id': request_id, 'text': text}
+        if self.token:
+            message['token'] = self.token
+        if self.project:
+            message['project'] = self.project
+        self._sock.sendall(encode_frame(message))
+        return request_id
+
+    def receive(self):
+        header = self._reader.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            raise ConnectionError("接收端点关闭了连接")
+        size, = FRAME_HEADER.unpack(header)
+        body = self._reader.read(size)
+        if len(body) < size:
+            raise ConnectionError("接收端点关闭了连接")
+        return decode_body(body)
+
+    def request(self, text):
+        request_id = self.send(text)
+        response = self.receive()
+        if response.get('id') != request_id:
+            raise FrameError(f"响应的 id {response.get('id')!r} 与请求 {request_id!r} 不一致")
+        return response
+
+    def request_many(self, texts, window=64):
+        """流水线化地发送多个请求，最多 window 个未返回，按请求顺序返回响应列表。"""
+        responses = {}
+        ids = []
+        for text in texts:
+            while len(ids) - len(responses) >= window:
+                response = self.receive()
+                responses[response.get('id')] = response
+            ids.append(self.send(text))
+        while len(responses) < len(ids):
+            response = self.receive()
+            responses[response.get('id')] = response
+        return [responses[request_id] for request_id in ids]
+
+    def close(self):
+        self._reader.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == '__main__':
+    # 直接运行 `python ingest_server.py`：在 Linux 上启动流水线和 Unix 域套接字接收端点，
+    # 比较逐个请求与流水线化请求的吞吐量（结果、token 校验和错误帧的检查见 tests/test_ingest_server.py）。
+    import time
+    import tempfile
+    import contextlib
+    from pipeline import ApplyPipeline, PipelineFrontend
+
+    def payload(name, value, operation='OVERWRITE'):
+        return f"#### file: {name} ({operation})\n```python\nVALUE = {value}\n```\n"
+
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as socket_dir:
+        pipeline = ApplyPipeline(PipelineFrontend(), lambda: root)
+        pipeline.start()
+        auto_server = IngestServer(pipeline, os.path.join(socket_dir, 'autoapply.sock'), auth_token='secret',
+                                   auto_approve=True)
+        print("吞吐量（Unix 域套接字，每个请求覆盖 200 个文件之一）:")
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            unix_address = format_address(auto_server.start())
+            with IngestClient(unix_address, token='secret') as client:
+                count = 300
+                started = time.perf_counter()
+                sequential = [client.request(payload(f'seq/{i % 200}.py', i)) for i in range(count)]
+                sequential_rate = count / (time.perf_counter() - started)
+                count = 3000
+                started = time.perf_counter()
+                pipelined = client.request_many([payload(f'pipe/{i % 200}.py', i) for i in range(count)], window=128)
+                pipelined_rate = count / (time.perf_counter() - started)
+        committed = sum(r['outcome'] == 'committed' for r in sequential + pipelined)
+        print(f"    逐个请求: {sequential_rate:.0f} 个/秒；流水线化（窗口 128）: {pipelined_rate:.0f} 个/秒"
+              f"（提交 {committed}/{len(sequential) + len(pipelined)}）")
+        auto_server.stop()
+        pipeline.stop()
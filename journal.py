@@ -0,0 +1,658 @@
+import hashlib
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from file_system import DEFAULT_IO_WORKERS, map_in_pool, user_data_dir
+from transaction import DEFAULT_DURABILITY, Transaction, TransactionAborted
+
+DEFAULT_MAX_BATCHES = 200
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# 大于此大小的文件不保存原内容（撤销时报告无法恢复），避免一次提交占用过多内存和磁盘
+MAX_PREIMAGE_BYTES = 64 * 1024 * 1024
+# zlib 最快的压缩级别：源代码仍能压缩到约 1/3，压缩耗时只有默认级别的几分之一
+COMPRESSION_LEVEL = 1
+# 每记录这么多个批次，后台线程执行一次回收
+GC_INTERVAL = 16
+# 回收时不删除比这更新的内容块：另一个进程（例如命令行模式）可能刚写入内容块、还没有写入批次记录
+BLOB_GRACE_SECONDS = 600
+# 恢复只追加过的文件时，按这个大小分块复制原来的部分
+COPY_CHUNK_BYTES = 1024 * 1024
+
+BatchSummary = namedtuple('BatchSummary', ['id', 'created', 'state', 'files', 'roots'])
+# errors 为 [(路径, 异常)]；modified 为在该批次之后又被修改过的路径（其当前内容已保存，可以重做恢复）
+RestoreResult = namedtuple('RestoreResult', ['batch', 'action', 'paths', 'errors', 'modified', 'roots'])
+
+
+class JournalError(Exception):
+    """没有可以撤销或重做的批次，或保存的内容无法恢复。"""
+
+
+def _stamp(path):
+    """文件的 (大小, mtime_ns)，不存在时为 None；用于发现批次之后的修改。"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _read_state(path, append_only):
+    """
+    读取路径的原状态，返回 (文件标识, 状态)；文件不存在时为 (None, None)。
+    只打开一次文件，用 fstat 得到的大小一次读完，不经过 io 模块的缓冲层。其他读取错误原样抛出。
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    except FileNotFoundError:
+        return None, None
+    try:
+        st = os.fstat(fd)
+        identity = (st.st_size, st.st_mtime_ns, st.st_ino)
+        if append_only:
+            # 只追加的文件撤销时截断到原来的大小即可，不需要读取原内容
+            return identity, {'truncate': st.st_size}
+        if st.st_size > MAX_PREIMAGE_BYTES:
+            return identity, {'lost': f"文件大于 {MAX_PREIMAGE_BYTES // (1024 * 1024)} MB，未保存原内容"}
+        data = os.read(fd, st.st_size + 1)
+        if len(data) > st.st_size: # 打开之后文件又变大了，读到末尾
+            chunks = [data]
+            while chunks[-1]:
+                chunks.append(os.read(fd, 1024 * 1024))
+            data = b"".join(chunks)
+        return identity, {'data': data}
+    finally:
+        os.close(fd)
+
+
+def _identity(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class JournalBatch:
+    """
+    一次提交的撤销记录。capture() 作为 commit_plan 的 before_change，在写入线程中、每个路径第一次被修改之前调用。
+    preload() 在规划之后（用户查看确认内容期间）预先读取原内容；提交时文件的 (大小, mtime_ns, inode) 未变化
+    就直接使用预读的内容，提交的关键路径上每个文件只多一次 stat。
+    计算摘要、压缩和写入磁盘都在 UndoJournal 的后台线程中完成。
+    """
+    def __init__(self, plan):
+        self.roots = plan.root_folders()
+        self.before = {} # 路径 -> 原状态：None（不存在）、{'truncate': 大小}、{'data': 字节} 或 {'lost': 原因}
+        self.preloaded = 0
+        self.reused = 0
+        self._preloaded = {} # 路径 -> (文件标识, 状态)
+
+    def preload(self, plan, max_workers=DEFAULT_IO_WORKERS):
+        """在线程池中读取计划将修改的所有路径的原内容；读取失败的路径在提交时再读。"""
+        append_only = {}
+        for file_info in plan.files_to_write:
+            path = file_info['target_path']
+            append_only[path] = append_only.get(path, True) and file_info.get('write_mode') == 'a'
+        for path in plan.files_to_delete:
+            append_only[path] = False
+
+        def read(path):
+            try:
+                return _read_state(path, append_only[path])
+            except OSError:
+                return None
+
+        for path, result in zip(append_only, map_in_pool(read, append_only, max_workers)):
+            if result is not None and result[0] is not None:
+                self._preloaded[path] = result
+        self.preloaded = len(self._preloaded)
+
+    def capture(self, path, append_only):
+        preloaded = self._preloaded.pop(path, None)
+        if (preloaded is not None and ('truncate' in preloaded[1]) == append_only
+                and _identity(path) == preloaded[0]):
+            self.before[path] = preloaded[1]
+            self.reused += 1
+            return
+        self.before[path] = _read_state(path, append_only)[1] # 读取失败时异常传给 commit_plan，该路径不会被写入
+
+    def discard(self):
+        """释放预读的原内容：计划被取消、丢弃或重新规划时调用，大文件的内容不必等批次对象被回收。"""
+        self._preloaded = {}
+
+
+class UndoJournal:
+    """
+    本地撤销日志：每个已确认并写入的批次记录各文件的原内容，可以整批撤销和重做。
+
+    目录结构：
+    - blobs/<摘要前两位>/<sha256>：zlib 压缩的文件内容，按内容寻址，相同的内容只保存一次；
+    - batches/<id>.json：批次记录，包括每个路径写入前（before）和撤销时（after）的状态。
+    撤销总是针对最近一个已应用的批次，重做针对其后最早被撤销的批次；记录新批次后，之前撤销的批次不能再重做。
+    撤销和重做都先保存文件的当前内容，再在线程池中一次恢复整个批次，因此两者可以反复进行而不丢失内容。
+    存储按批次数量、最近使用时间和内容块总大小从最旧的一端回收，剩余的批次始终可以连续撤销。
+    """
+    def __init__(self, directory, max_batches=DEFAULT_MAX_BATCHES, max_age_days=DEFAULT_MAX_AGE_DAYS,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = os.path.abspath(directory)
+        self.blob_dir = os.path.join(self.directory, 'blobs')
+        self.batch_dir = os.path.join(self.directory, 'batches')
+        self.max_batches = max_batches
+        self.max_age_seconds = max_age_days * 86400 # 0 表示不按时间回收
+        self.max_bytes = max_bytes
+        self._blobs = None # 摘要 -> 压缩后大小，第一次使用时扫描 blobs 目录
+        self._blob_lock = threading.Lock()
+        self._op_lock = threading.RLock() # 修改批次记录（记录、撤销、重做、回收）时持有
+        self._queue = queue.Queue()
+        self._writer = None
+        self._last_id = 0
+        self._since_gc = 0
+        self.counters = {'batches': 0, 'blobs_written': 0, 'blobs_deduplicated': 0,
+                         'bytes_captured': 0, 'bytes_stored': 0, 'writer_seconds': 0.0}
+
+    # --- 记录 ---
+
+    def begin(self, plan, preload=False, max_workers=DEFAULT_IO_WORKERS):
+        """
+        在 commit_plan 之前调用；把返回值的 capture 作为 before_change 传给 commit_plan。
+        preload 为 True 时立即预读原内容，适合在规划之后、等待确认之前调用。
+        """
+        batch = JournalBatch(plan)
+        if preload:
+            batch.preload(plan, max_workers)
+        return batch
+
+    def finish(self, batch, errors=()):
+        """提交完成后调用：记录每个路径当前的时间戳，交给后台线程保存。返回批次 id，没有修改任何文件时返回 None。
+
+        提交后的内容（after）由后台线程在时间戳仍然一致时读取，撤销时据此判断文件是否被改动过。
+        """
+        if not batch.before:
+            return None
+        record = {
+            'id': self._new_id(),
+            'created': time.time(),
+            'state': 'applied',
+            'roots': batch.roots,
+            'failed': sorted({path for _, path, _ in errors or ()}),
+            'entries': [{'path': path, 'before': before, 'stamp': _stamp(path)}
+                        for path, before in batch.before.items()],
+        }
+        record['used'] = record['created']
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run_writer, daemon=True, name='UndoJournal')
+            self._writer.start()
+        self._queue.put(record)
+        return record['id']
+
+    def flush(self):
+        """等待后台线程保存完已记录的批次。"""
+        if self._writer is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._writer is not None:
+            self.flush()
+            self._queue.put(None)
+            self._writer.join(timeout=5)
+            self._writer = None
+
+    def _new_id(self):
+        with self._blob_lock:
+            self._last_id = max(self._last_id + 1, time.time_ns())
+            return self._last_id
+
+    def _run_writer(self):
+        while True:
+            record = self._queue.get()
+            try:
+                if record is None:
+                    return
+                started = time.perf_counter()
+                with self._op_lock:
+                    for entry in record['entries']:
+                        before = entry['before']
+                        if before is not None and 'data' in before:
+                            entry['before'] = self._put_blob(before['data'])
+                        self._capture_after(entry)
+                    self._save_batch(record)
+                    self.counters['batches'] += 1
+                    self._since_gc += 1
+                    if self._since_gc >= GC_INTERVAL:
+                        self.gc()
+                self.counters['writer_seconds'] += time.perf_counter() - started
+            except Exception as e:
+                print(f"[ERROR] 无法保存撤销记录: {type(e).__name__}: {e}", file=sys.stderr)
+            finally:
+                self._queue.task_done()
+
+    # --- 内容块 ---
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _known_blobs(self):
+        """在 _blob_lock 内调用。"""
+        if self._blobs is None:
+            self._blobs = {}
+            if os.path.isdir(self.blob_dir):
+                for prefix in os.scandir(self.blob_dir):
+                    if prefix.is_dir():
+                        for entry in os.scandir(prefix.path):
+                            if entry.is_file() and not entry.name.endswith('.tmp'):
+                                self._blobs[entry.name] = entry.stat().st_size
+        return self._blobs
+
+    def _put_blob(self, data):
+        """保存内容并返回状态 {'blob': 摘要, 'size': 原大小}；相同内容已保存时不再压缩和写入。"""
+        digest = hashlib.sha256(data).hexdigest()
+        self.counters['bytes_captured'] += len(data)
+        with self._blob_lock:
+            known = digest in self._known_blobs()
+        if known:
+            self.counters['blobs_deduplicated'] += 1
+        else:
+            compressed = zlib.compress(data, COMPRESSION_LEVEL)
+            path = self._blob_path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(compressed)
+            os.replace(temp_path, path)
+            with self._blob_lock:
+                self._blobs[digest] = len(compressed)
+            self.counters['blobs_written'] += 1
+            self.counters['bytes_stored'] += len(compressed)
+        return {'blob': digest, 'size': len(data)}
+
+    def _read_blob(self, digest):
+        try:
+            with open(self._blob_path(digest), 'rb') as f:
+                data = zlib.decompress(f.read())
+        except (OSError, zlib.error) as e:
+            raise JournalError(f"保存的内容 {digest[:12]} 无法读取: {e}") from e
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise JournalError(f"保存的内容 {digest[:12]} 已损坏")
+        return data
+
+    # --- 批次记录 ---
+
+    def _batch_path(self, batch_id):
+        return os.path.join(self.batch_dir, f"{batch_id}.json")
+
+    def _save_batch(self, record):
+        os.makedirs(self.batch_dir, exist_ok=True)
+        path = self._batch_path(record['id'])
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def _load_batches(self):
+        """按 id 升序返回所有批次记录；无法解析的记录跳过。"""
+        records = []
+        if not os.path.isdir(self.batch_dir):
+            return records
+        for entry in os.scandir(self.batch_dir):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    records.append(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"[WARNING] 无法读取撤销记录 '{entry.path}': {e}", file=sys.stderr)
+        records.sort(key=lambda record: record['id'])
+        return records
+
+    def history(self, limit=20):
+        """最近的批次（新的在前），每项为 BatchSummary。"""
+        self.flush()
+        with self._op_lock:
+            records = self._load_batches()
+        return [BatchSummary(record['id'], record['created'], record['state'], len(record['entries']), record['roots'])
+                for record in reversed(records[-limit:] if limit else records)]
+
+    # --- 撤销和重做 ---
+
+    def undo(self, max_workers=DEFAULT_IO_WORKERS, durability=DEFAULT_DURABILITY, transaction_log=None):
+        """
+        撤销最近一个已应用的批次，返回 RestoreResult。没有可撤销的批次时抛出 JournalError。
+        与提交一样以一个事务恢复文件，durability 和 transaction_log 见 transaction.Transaction。
+        """
+        self.flush()
+        with self._op_lock:
+            records = self._load_batches()
+            target = next((record for record in reversed(records) if record['state'] == 'applied'), None)
+            if target is None:
+                raise JournalError("没有可以撤销的操作")
+            return self._restore_batch(target, 'undo', 'before', 'after', 'undone', max_workers, durability, transaction_log)
+
+    def redo(self, max_workers=DEFAULT_IO_WORKERS, durability=DEFAULT_DURABILITY, transaction_log=None):
+        """重做最近一次撤销的批次，返回 RestoreResult。没有可重做的批次时抛出 JournalError。参数同 undo()。"""
+        self.flush()
+        with self._op_lock:
+            records = self._load_batches()
+            last_applied = next((record['id'] for record in reversed(records) if record['state'] == 'applied'), 0)
+            target = next((record for record in records
+                           if record['id'] > last_applied and record['state'] == 'undone'), None)
+            if target is None:
+                raise JournalError("没有可以重做的操作")
+            return self._restore_batch(target, 'redo', 'after', 'before', 'applied', max_workers, durability, transaction_log)
+
+    def _restore_batch(self, record, action, restore_key, capture_key, new_state, max_workers,
+                       durability=DEFAULT_DURABILITY, transaction_log=None):
+        """
+        在线程池中一次处理整个批次：先保存每个路径的当前内容到 capture_key，再以一个事务恢复 restore_key 中的状态。
+        恢复的内容先写入同目录的临时文件，全部暂存成功后才替换和删除，中途崩溃时由 transaction_log.recover() 处理；
+        暂存失败时整个批次都不恢复，批次状态不变。没有保存内容的路径单独报告，不影响其余路径。
+        """
+        entries = record['entries']
+        paths = [entry['path'] for entry in entries]
+
+        def capture(entry):
+            path = entry['path']
+            try:
+                stamp = _stamp(path)
+                current = self._capture_current(path)
+                expected = entry.get(capture_key, {'lost': ''})
+                if expected is not None and 'lost' in expected:
+                    modified = stamp != entry['stamp']
+                else:
+                    modified = not _same_state(current, expected)
+                state = entry[restore_key]
+                if state is not None and 'blob' not in state and 'truncate' not in state:
+                    raise JournalError(state.get('lost', "没有保存内容"))
+                return current, modified, None
+            except Exception as e:
+                return None, False, e
+
+        captured = map_in_pool(capture, entries, max_workers)
+        errors = {entry['path']: error for entry, (_, _, error) in zip(entries, captured) if error is not None}
+        writes = [entry for entry in entries if entry['path'] not in errors and entry[restore_key] is not None]
+        deletes = [entry['path'] for entry in entries if entry['path'] not in errors and entry[restore_key] is None]
+        transaction = Transaction(durability=durability, log=transaction_log)
+        transaction.prepare(((entry['path'], 'write') for entry in writes), deletes)
+
+        def stage(entry):
+            try:
+                self._stage_restore(transaction, entry['path'], entry[restore_key])
+                return None
+            except Exception as e:
+                return e
+
+        stage_errors = {entry['path']: error for entry, error in zip(writes, map_in_pool(stage, writes, max_workers))
+                        if error is not None}
+        if stage_errors:
+            transaction.abort(max_workers)
+            aborted = TransactionAborted("批次中其他文件暂存失败，整个批次未恢复，此文件未被修改")
+            return RestoreResult(record['id'], action, paths,
+                                 [(path, errors.get(path) or stage_errors.get(path, aborted)) for path in paths],
+                                 [], record['roots'])
+        write_results, delete_results = transaction.commit(max_workers)
+        errors.update((path, error) for path, error in write_results.items() if error is not None)
+        errors.update((path, error) for path, (_, error) in zip(deletes, delete_results) if error is not None)
+
+        for entry, (current, _, _) in zip(entries, captured):
+            if entry['path'] not in errors:
+                entry[capture_key] = current
+                entry['stamp'] = _stamp(entry['path'])
+        record['state'] = new_state
+        record['used'] = time.time()
+        self._save_batch(record)
+        modified = [path for path, (_, changed, _) in zip(paths, captured) if changed and path not in errors]
+        return RestoreResult(record['id'], action, paths, [(path, errors[path]) for path in paths if path in errors],
+                             modified, record['roots'])
+
+    def _capture_after(self, entry):
+        """读取提交后的内容；读取前后时间戳都要与提交时一致，否则文件已被后续操作改动，保持未知。"""
+        path = entry['path']
+        if entry['stamp'] is None:
+            entry['after'] = None
+            return
+        try:
+            if entry['stamp'][0] > MAX_PREIMAGE_BYTES:
+                return
+            with open(path, 'rb') as f:
+                data = f.read()
+            if _stamp(path) == entry['stamp'] and len(data) == entry['stamp'][0]:
+                entry['after'] = self._put_blob(data)
+        except OSError:
+            pass
+
+    def _capture_current(self, path):
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+        if size > MAX_PREIMAGE_BYTES:
+            return {'lost': f"文件大于 {MAX_PREIMAGE_BYTES // (1024 * 1024)} MB，未保存当前内容"}
+        with open(path, 'rb') as f:
+            return self._put_blob(f.read())
+
+    def _stage_restore(self, transaction, path, state):
+        """在暂存线程中把 state 的内容写入 path 的临时文件；只追加过的文件复制原来的前 truncate 个字节。"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = transaction.begin_stage(path)
+        with open(temp_path, 'wb') as f:
+            if 'blob' in state:
+                f.write(self._read_blob(state['blob']))
+            else:
+                remaining = state['truncate']
+                with open(transaction.target(path), 'rb') as source:
+                    while remaining > 0:
+                        chunk = source.read(min(remaining, COPY_CHUNK_BYTES))
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        remaining -= len(chunk)
+        transaction.end_stage(path)
+
+    # --- 回收 ---
+
+    def gc(self):
+        """
+        从最旧的一端删除批次，直到数量、最近使用时间和内容块总大小都在限制之内，再删除不再被引用的内容块。
+        返回 (删除的批次数, 删除的内容块数)。
+        """
+        with self._op_lock:
+            self._since_gc = 0
+            records = self._load_batches()
+            with self._blob_lock:
+                sizes = dict(self._known_blobs())
+            references = {}
+            for record in records:
+                for digest in _record_blobs(record):
+                    references[digest] = references.get(digest, 0) + 1
+            total_bytes = sum(sizes.get(digest, 0) for digest in references)
+            now = time.time()
+            removed = 0
+            while records and (len(records) > self.max_batches or total_bytes > self.max_bytes
+                               or (self.max_age_seconds
+                                   and now - records[0].get('used', records[0]['created']) > self.max_age_seconds)):
+                record = records.pop(0)
+                for digest in _record_blobs(record):
+                    references[digest] -= 1
+                    if not references[digest]:
+                        del references[digest]
+                        total_bytes -= sizes.get(digest, 0)
+                try:
+                    os.remove(self._batch_path(record['id']))
+                except FileNotFoundError:
+                    pass
+                removed += 1
+
+            swept = 0
+            for digest in sizes:
+                if digest in references:
+                    continue
+                path = self._blob_path(digest)
+                try:
+                    if now - os.path.getmtime(path) < BLOB_GRACE_SECONDS:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                with self._blob_lock:
+                    self._blobs.pop(digest, None)
+                swept += 1
+            return removed, swept
+
+    def stats(self):
+        with self._blob_lock:
+            blobs = self._known_blobs()
+            stored = sum(blobs.values())
+            count = len(blobs)
+        return dict(self.counters, blob_count=count, blob_bytes=stored,
+                    writer_seconds=round(self.counters['writer_seconds'], 3))
+
+
+def default_journal_dir():
+    """托盘程序和命令行模式共用的撤销日志目录（见 file_system.user_data_dir），命令行写入的批次也可以从托盘菜单撤销。"""
+    return os.path.join(user_data_dir(), 'journal')
+
+
+def open_journal(config, default_directory):
+    """按 AppConfig 创建 UndoJournal；journal_enabled 为 False 时返回 None。"""
+    if not config.journal_enabled:
+        return None
+    return UndoJournal(config.journal_dir or default_directory, max_batches=config.journal_max_batches,
+                       max_age_days=config.journal_max_age_days, max_bytes=int(config.journal_max_mb * 1024 * 1024))
+
+
+def _record_blobs(record):
+    """批次记录引用的所有内容块摘要（同一批次内不重复）。"""
+    digests = set()
+    for entry in record['entries']:
+        for state in (entry['before'], entry.get('after')):
+            if state is not None and 'blob' in state:
+                digests.add(state['blob'])
+    return digests
+
+
+def _same_state(current, expected):
+    """当前内容（_capture_current 的结果）是否与记录的状态一致；截断记录只能按长度比较。"""
+    if current is None or expected is None:
+        return current is expected
+    if 'blob' not in current:
+        return False
+    if 'truncate' in expected:
+        return current['size'] == expected['truncate']
+    return current['blob'] == expected.get('blob')
+
+
+def format_history(summaries):
+    """history() 的结果格式化为多行文本，供托盘菜单和命令行显示。"""
+    if not summaries:
+        return "没有撤销记录。"
+    labels = {'applied': "已应用", 'undone': "已撤销"}
+    lines = []
+    for summary in summaries:
+        created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(summary.created))
+        roots = ", ".join(summary.roots)
+        lines.append(f"{summary.id}  {created}  {labels.get(summary.state, summary.state)}  "
+                     f"{summary.files} 个文件  {roots}")
+    return "\n".join(lines)
+
+
+def format_restore_result(result):
+    """undo()/redo() 的结果格式化为一条消息。"""
+    action = "撤销" if result.action == 'undo' else "重做"
+    lines = [f"已{action}批次 {result.batch} 中的 {len(result.paths) - len(result.errors)}/{len(result.paths)} 个文件。"]
+    if result.modified:
+        lines.append(f"以下 {len(result.modified)} 个文件在该批次之后被修改过，修改后的内容已保存，可以再次{'重做' if result.action == 'undo' else '撤销'}恢复：")
+        lines.extend(f"- {path}" for path in result.modified)
+    for path, error in result.errors:
+        lines.append(f"- 失败 '{path}': {error}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    # 直接运行 `python journal.py`：比较 40 个文件的批次在不记录和记录撤销日志时的提交耗时
+    # （后台保存的耗时单独列出）。撤销/重做的功能检查见 tests/test_journal.py。
+    import contextlib
+    import io
+    import random
+    import statistics
+    import tempfile
+    from apply_engine import plan_blocks, commit_plan
+    from block_scanner import scan_blocks
+
+    def block_text(filename, operation, content):
+        return f"#### file: {filename} ({operation})\n```\n{content}\n```\n"
+
+    def apply(root, payload):
+        plan = plan_blocks(list(scan_blocks(payload)), root, lambda filename, target_path: True)
+        return commit_plan(plan, durability='none')
+
+    # 基准测试：40 个文件（2–64 KB 的源代码），每轮覆盖全部文件
+    rng = random.Random(7)
+    words = ["def", "return", "self", "value", "index", "result", "for", "in", "range", "if", "else", "None"]
+
+    def source(size):
+        lines = []
+        while sum(map(len, lines)) < size:
+            lines.append("    " + " ".join(rng.choice(words) for _ in range(8)))
+        return "\n".join(lines)
+
+    sizes = [rng.choice((2, 4, 8, 16, 32, 64)) * 1024 for _ in range(40)]
+    rounds = 60
+    modes = ('plain', 'journal', 'journal_no_preload')
+    timings = {mode: [] for mode in modes}
+    preload_timings = []
+    reused = []
+    with tempfile.TemporaryDirectory() as temp_dir, contextlib.redirect_stdout(io.StringIO()):
+        root = os.path.join(temp_dir, 'project')
+        journal = UndoJournal(os.path.join(temp_dir, 'journal'), max_batches=rounds * len(modes) + 1)
+        payloads = ["".join(block_text(f"pkg{index % 4}/module{index}.py", "OVERWRITE", source(size) + f"\n# v{version}")
+                            for index, size in enumerate(sizes)) for version in range(3)]
+        apply(root, payloads[2])
+        # 两个计划都相对于第三个版本生成，因此都包含全部 40 个文件，交替提交时每次都改变所有文件
+        plans = [plan_blocks(list(scan_blocks(payload)), root, lambda filename, target_path: True) for payload in payloads[:2]]
+        commits = 0
+        for round_number in range(rounds):
+            order = modes[round_number % len(modes):] + modes[:round_number % len(modes)] # 轮换顺序，消除先后的影响
+            for mode in order:
+                commits += 1
+                plan = plans[commits % 2] # 每次提交都改变全部 40 个文件
+                batch = None
+                if mode == 'journal':
+                    started = time.perf_counter()
+                    batch = journal.begin(plan, preload=True) # 在流水线中发生在规划之后、等待确认期间
+                    preload_timings.append(time.perf_counter() - started)
+                elif mode == 'journal_no_preload':
+                    batch = journal.begin(plan)
+                started = time.perf_counter()
+                # 不刷盘：只比较记录撤销信息的开销，不受刷盘耗时波动的影响
+                errors = commit_plan(plan, before_change=batch.capture if batch is not None else None, durability='none')
+                if batch is not None:
+                    journal.finish(batch, errors)
+                timings[mode].append(time.perf_counter() - started)
+                if mode == 'journal':
+                    reused.append(batch.reused)
+                journal.flush() # 后台保存不计入下一次提交
+        stats = journal.stats()
+        started = time.perf_counter()
+        result = journal.undo()
+        undo_seconds = time.perf_counter() - started
+        journal.close()
+
+    plain = statistics.median(timings['plain'])
+    total_mb = sum(sizes) / 1e6
+    print(f"40 个文件 ({total_mb:.1f} MB) 的提交，{rounds} 轮中位数: 不记录 {plain * 1000:.2f} ms")
+    for mode, label in (('journal', "记录撤销日志（规划后预读）"), ('journal_no_preload', "记录撤销日志（提交时读取）")):
+        median = statistics.median(timings[mode])
+        print(f"    {label}: {median * 1000:.2f} ms (+{(median / plain - 1) * 100:.1f}%)")
+    print(f"    预读 40 个文件的原内容（不在提交路径上）: {statistics.median(preload_timings) * 1000:.2f} ms，"
+          f"提交时复用预读内容最少 {min(reused)}/{len(sizes)} 个文件")
+    print(f"后台保存: 共 {stats['writer_seconds'] * 1000:.0f} ms ({stats['batches']} 个批次), "
+          f"原内容 {stats['bytes_captured'] / 1e6:.1f} MB -> 保存 {stats['bytes_stored'] / 1e6:.2f} MB, "
+          f"去重 {stats['blobs_deduplicated']} 次")
+    print(f"整批撤销 40 个文件: {undo_seconds * 1000:.1f} ms ({len(result.errors)} 个失败)")
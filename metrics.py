@@ -0,0 +1,307 @@
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+
+# 每个剪贴板内容经过的阶段，按处理顺序排列；total 为从剪贴板事件到处理完成的总耗时。
+# coalesce 为合并突发事件带来的额外等待（从一组事件中的最后一个到读取剪贴板）；
+# plan 包含读取现有文件，以及 CREATE 覆盖确认框的等待时间；confirm_wait 为主确认框的等待时间。
+STAGES = ('coalesce', 'clipboard_read', 'parse', 'queue_wait', 'plan', 'confirm_wait', 'write', 'total')
+STAGE_LABELS = {
+    'coalesce': "合并突发事件",
+    'clipboard_read': "读取剪贴板",
+    'parse': "解析",
+    'queue_wait': "队列等待",
+    'plan': "规划 (读取文件)",
+    'confirm_wait': "等待确认",
+    'write': "写入",
+    'total': "总计",
+}
+PERCENTILES = (0.5, 0.95, 0.99)
+
+# 直方图桶的上界（秒）：50 µs 到约 110 s，按 1.5 倍递增。内存占用固定，与处理次数无关。
+BUCKET_BOUNDS = tuple(0.00005 * 1.5 ** i for i in range(37))
+JSONL_MAX_BYTES = 5 * 1024 * 1024
+
+
+class LatencyHistogram:
+    """固定桶的延迟直方图，百分位数在桶内线性插值。不加锁，由 PipelineMetrics 负责同步。"""
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # 最后一个桶收集超过最大上界的值
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """返回第 q 分位（0–1）的估计值（秒），没有数据时返回 None。"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(lower + (upper - lower) * (rank - cumulative) / bucket_count, self.max)
+            cumulative += bucket_count
+        return self.max
+
+
+class UiStallMonitor:
+    """
+    测量 UI 线程（Tk 事件循环）的卡顿：每 interval 秒通过 after(seconds, callback) 安排一次心跳，
+    心跳实际执行时间比预定时间晚多少即为这段时间内 UI 线程被阻塞的时长（例如模态对话框）。
+    after 由调用方提供，Tk 中为 lambda seconds, callback: root.after(int(seconds * 1000), callback)。
+    只在 UI 线程中更新，其他线程读取的统计可能略有滞后。
+    """
+    def __init__(self, after, interval=0.1):
+        self.after = after
+        self.interval = interval
+        self.stalls = LatencyHistogram()
+        self._expected = None
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self._schedule()
+
+    def stop(self):
+        self._running = False
+
+    def _schedule(self):
+        self._expected = time.perf_counter() + self.interval
+        self.after(self.interval, self._tick)
+
+    def _tick(self):
+        if not self._running:
+            return
+        self.stalls.observe(max(0.0, time.perf_counter() - self._expected))
+        self._schedule()
+
+    def stats(self):
+        """返回心跳次数和卡顿的 p50 / p95 / 最大值（毫秒）。"""
+        return {
+            'ticks': self.stalls.count,
+            'p50_ms': round((self.stalls.percentile(0.5) or 0.0) * 1000, 3),
+            'p95_ms': round((self.stalls.percentile(0.95) or 0.0) * 1000, 3),
+            'max_ms': round(self.stalls.max * 1000, 3),
+        }
+
+    def format_summary(self):
+        stats = self.stats()
+        return (f"UI 线程卡顿（每 {self.interval * 1000:.0f} ms 心跳 {stats['ticks']} 次）："
+                f"p50 {stats['p50_ms']:.1f} ms，p95 {stats['p95_ms']:.1f} ms，最大 {stats['max_ms']:.1f} ms")
+
+
+class PayloadTrace:
+    """
+    单个剪贴板内容的阶段计时。每次 mark(stage) 把距上一次标记的时间计入该阶段，
+    同一阶段可多次累加（例如监听线程的预解析和主线程的缓存查询都计入 parse）。
+    """
+    __slots__ = ('metrics', 'started', 'last', 'durations')
+
+    def __init__(self, metrics, started=None):
+        self.metrics = metrics
+        self.started = self.last = time.perf_counter() if started is None else started
+        self.durations = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.durations[stage] = self.durations.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def finish(self, **fields):
+        """结束计时并提交给 PipelineMetrics；fields 会写入 JSONL 记录（如 blocks、outcome）。"""
+        self.durations['total'] = time.perf_counter() - self.started
+        self.metrics.record(self.durations, fields)
+
+
+class _NullTrace:
+    """未启用统计时使用的空实现，每个阶段只多一次空方法调用。"""
+    __slots__ = ()
+
+    def mark(self, stage):
+        pass
+
+    def finish(self, **fields):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+def _create_metrics_server(metrics, port):
+    """创建只监听 127.0.0.1 的 HTTP 服务器，GET /metrics 返回 Prometheus 文本格式。"""
+    # 延迟导入：http.server 会连带加载 email、http.client 等模块，只有配置了端口时才需要
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # 不在控制台输出每次抓取的访问日志
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsRequestHandler)
+    server.daemon_threads = True
+    return server
+
+
+class PipelineMetrics:
+    """
+    按阶段统计剪贴板处理延迟：内存中的直方图（p50/p95/p99）、滚动的 JSONL 记录文件，
+    以及可选的仅监听 localhost 的 Prometheus 文本格式端点 (/metrics)。
+    enabled 为 False 时 new_trace() 返回 NULL_TRACE，不计时、不加锁、不写文件。
+    """
+    def __init__(self, enabled=False, jsonl_path=None, http_port=0, jsonl_max_bytes=JSONL_MAX_BYTES):
+        self.enabled = enabled
+        self.jsonl_path = jsonl_path if enabled else None
+        self.jsonl_max_bytes = jsonl_max_bytes
+        self.http_port = http_port if enabled else 0
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self.payload_count = 0
+        self._lock = threading.Lock()
+        self._jsonl_lock = threading.Lock()
+        self._jsonl_failed = False
+        self._server = None
+
+    def new_trace(self, started=None):
+        """started 为 time.perf_counter() 的值，用于从更早的时刻（例如剪贴板事件到达时）开始计时。"""
+        return PayloadTrace(self, started) if self.enabled else NULL_TRACE
+
+    def record(self, durations, fields=None):
+        """记录一个剪贴板内容各阶段的耗时（秒）。"""
+        with self._lock:
+            self.payload_count += 1
+            for stage, seconds in durations.items():
+                histogram = self.histograms.get(stage)
+                if histogram is not None:
+                    histogram.observe(seconds)
+        if self.jsonl_path:
+            entry = {'time': round(time.time(), 3)}
+            entry.update(fields or {})
+            entry['stages_ms'] = {stage: round(seconds * 1000, 3) for stage, seconds in durations.items()}
+            self._append_jsonl(json.dumps(entry, ensure_ascii=False))
+
+    def _append_jsonl(self, line):
+        """追加一行记录；文件超过上限时轮换为 <文件名>.1，只保留一个旧文件。"""
+        with self._jsonl_lock:
+            try:
+                if os.path.exists(self.jsonl_path) and os.path.getsize(self.jsonl_path) >= self.jsonl_max_bytes:
+                    os.replace(self.jsonl_path, self.jsonl_path + '.1')
+                with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+                self._jsonl_failed = False
+            except OSError as e:
+                if not self._jsonl_failed: # 同一问题只警告一次
+                    print(f"[WARNING] 无法写入延迟统计文件 '{self.jsonl_path}': {e}", file=sys.stderr)
+                self._jsonl_failed = True
+
+    def percentiles(self):
+        """返回 {阶段: (次数, p50, p95, p99)}，单位为秒；没有数据的阶段百分位为 None。"""
+        with self._lock:
+            return self._percentiles()
+
+    def _percentiles(self):
+        """同 percentiles()，调用方需持有 _lock。"""
+        return {stage: (h.count,) + tuple(h.percentile(q) for q in PERCENTILES)
+                for stage, h in self.histograms.items()}
+
+    def format_summary(self):
+        """供托盘菜单显示的多行文本。"""
+        if not self.enabled:
+            return "延迟统计未启用。请在 config.json 中设置 \"metrics_enabled\": true 后重新启动。"
+        with self._lock: # 处理次数与百分位数取自同一时刻
+            payload_count = self.payload_count
+            percentiles = self._percentiles()
+        lines = [f"已处理 {payload_count} 个剪贴板内容（p50 / p95 / p99）："]
+        for stage, (count, *values) in percentiles.items():
+            if not count:
+                lines.append(f"{STAGE_LABELS[stage]}: 无数据")
+                continue
+            lines.append(f"{STAGE_LABELS[stage]}: " + " / ".join(f"{value * 1000:.1f} ms" for value in values)
+                         + f"  ({count} 次)")
+        return "\n".join(lines)
+
+    def render_prometheus(self):
+        """以 Prometheus 文本格式导出所有直方图。"""
+        with self._lock:
+            lines = [
+                "# HELP autoapply_payloads_total Clipboard payloads fully handled.",
+                "# TYPE autoapply_payloads_total counter",
+                f"autoapply_payloads_total {self.payload_count}",
+                "# HELP autoapply_stage_latency_seconds Per-stage latency of clipboard payload handling.",
+                "# TYPE autoapply_stage_latency_seconds histogram",
+            ]
+            for stage, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.bounds, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'autoapply_stage_latency_seconds_bucket{{stage="{stage}",le="{bound:.6g}"}} {cumulative}')
+                lines.append(f'autoapply_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'autoapply_stage_latency_seconds_sum{{stage="{stage}"}} {histogram.total:.6f}')
+                lines.append(f'autoapply_stage_latency_seconds_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def start(self):
+        """启用且配置了端口时，在后台线程中启动只监听 127.0.0.1 的 HTTP 端点。"""
+        if not self.http_port or self._server is not None:
+            return
+        try:
+            self._server = _create_metrics_server(self, self.http_port)
+        except OSError as e:
+            print(f"[WARNING] 无法在 127.0.0.1:{self.http_port} 启动延迟统计端点: {e}", file=sys.stderr)
+            return
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"[INFO] 延迟统计端点: http://127.0.0.1:{self._server.server_address[1]}/metrics")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+if __name__ == '__main__':
+    # 直接运行 `python metrics.py`：测量关闭和开启统计时每个剪贴板内容的额外开销，并输出示例统计。
+    import random
+    import tempfile
+
+    def handle(metrics, count):
+        started = time.perf_counter()
+        for _ in range(count):
+            trace = metrics.new_trace()
+            for stage in STAGES[:-1]:
+                trace.mark(stage)
+            trace.finish(blocks=1, outcome='committed')
+        return (time.perf_counter() - started) / count
+
+    count = 100000
+    print(f"关闭统计: 每个内容 {handle(PipelineMetrics(enabled=False), count) * 1e6:.3f} µs")
+    print(f"开启统计 (仅内存): 每个内容 {handle(PipelineMetrics(enabled=True), count) * 1e6:.3f} µs")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        jsonl_metrics = PipelineMetrics(enabled=True, jsonl_path=os.path.join(temp_dir, 'metrics.jsonl'))
+        print(f"开启统计 (JSONL): 每个内容 {handle(jsonl_metrics, 2000) * 1e6:.3f} µs")
+
+    sample = PipelineMetrics(enabled=True)
+    random.seed(0)
+    for _ in range(1000):
+        sample.record({stage: random.lognormvariate(-6, 1) for stage in STAGES})
+    print(sample.format_summary())
@@ -0,0 +1,243 @@
+import re
+from collections import namedtuple
+
+# 一个待应用的修改块：old_lines 被替换为 new_lines。
+# old_start 为期望位置（0 起始的行号，统一 diff 中由 @@ 行给出）；SEARCH/REPLACE 块为 None，表示在全文中查找。
+Hunk = namedtuple('Hunk', ['old_lines', 'new_lines', 'old_start'])
+# 应用结果：content 为修改后的全文；applied 为已应用块的序号；rejected 为 (序号, 原因) 列表。序号从 1 开始。
+PatchResult = namedtuple('PatchResult', ['content', 'applied', 'rejected'])
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+_SEARCH_MARKER = re.compile(r"^<{5,9} ?SEARCH\s*$")
+_DIVIDER_MARKER = re.compile(r"^={5,9}\s*$")
+_REPLACE_MARKER = re.compile(r"^>{5,9} ?REPLACE\s*$")
+
+
+class PatchParseError(ValueError):
+    """补丁内容无法解析。"""
+
+
+def _diff_file_header(lines, index):
+    """
+    lines[index] 开始的文件头部（`diff --git a/x b/x`，或紧接 @@ 行的 `--- a/x` / `+++ b/x` 两行）给出的目标路径
+    （去掉 a/、b/ 前缀），不是文件头部时返回 None。修改块中删除以 "-- " 开头的行也会以 "--- " 开头，
+    因此只有后面紧跟 +++ 和 @@ 行时才视为头部。
+    """
+    line = lines[index]
+    if line.startswith('diff --git '):
+        parts = line.split()
+        return _strip_diff_prefix(parts[-1]) if len(parts) >= 4 else ''
+    if (line.startswith('--- ') and index + 2 < len(lines) and lines[index + 1].startswith('+++ ')
+            and _HUNK_HEADER.match(lines[index + 2])):
+        new_path = lines[index + 1][4:].split('\t')[0].strip()
+        old_path = line[4:].split('\t')[0].strip()
+        return _strip_diff_prefix(new_path if new_path != '/dev/null' else old_path)
+    return None
+
+
+def _strip_diff_prefix(path):
+    return path[2:] if path[:2] in ('a/', 'b/') else path
+
+
+def parse_unified_diff(text):
+    """
+    解析统一 diff 格式的补丁，返回 Hunk 列表。--- / +++ / diff / index 等头部行会被忽略，修改块之间的也一样。
+    一个代码块只对应一个文件：头部中出现第二个不同的文件时抛出 PatchParseError，而不是把其他文件的修改应用到本文件。
+    LLM 输出的空白上下文行常常缺少前导空格，这里按空上下文行处理；@@ 行中的行数不作校验。
+    """
+    hunks = []
+    old_lines = new_lines = None
+    old_start = 0
+    lines = text.rstrip('\n').split('\n')
+    target = None # 文件头部给出的路径
+    skip_to = 0 # 文件头部的后续行（--- 之后的 +++）
+    for index, line in enumerate(lines):
+        if index < skip_to:
+            continue
+        path = _diff_file_header(lines, index)
+        if path is not None:
+            if target and path and path != target:
+                raise PatchParseError(f"补丁包含多个文件的修改（'{target}' 和 '{path}'），每个代码块只能修改一个文件")
+            target = target or path
+            if line.startswith('--- '):
+                skip_to = index + 2
+            if old_lines is not None:
+                hunks.append(Hunk(old_lines, new_lines, old_start))
+                old_lines = new_lines = None # 下一个 @@ 之前是头部信息（index 等）
+            continue
+        header = _HUNK_HEADER.match(line)
+        if header:
+            if old_lines is not None:
+                hunks.append(Hunk(old_lines, new_lines, old_start))
+            start = int(header.group(1))
+            old_count = 1 if header.group(2) is None else int(header.group(2))
+            # 旧行数为 0 时，@@ 中的行号表示“插入到该行之后”
+            old_start = start if old_count == 0 else start - 1
+            old_lines, new_lines = [], []
+        elif old_lines is None:
+            continue # 第一个 @@ 之前的头部信息
+        elif line.startswith('\\'):
+            continue # "\ No newline at end of file"
+        elif line.startswith('+'):
+            new_lines.append(line[1:])
+        elif line.startswith('-'):
+            old_lines.append(line[1:])
+        else:
+            context = line[1:] if line.startswith(' ') else line
+            old_lines.append(context)
+            new_lines.append(context)
+    if old_lines is not None:
+        hunks.append(Hunk(old_lines, new_lines, old_start))
+    if not hunks:
+        raise PatchParseError("未找到 @@ 修改块")
+    return hunks
+
+
+def parse_search_replace(text):
+    """
+    解析 SEARCH/REPLACE 格式：
+        <<<<<<< SEARCH
+        原有内容
+        =======
+        新内容
+        >>>>>>> REPLACE
+    一个代码块中可以包含多段。
+    """
+    hunks = []
+    section = None
+    old_lines = new_lines = None
+    for line in text.split('\n'):
+        if section is None:
+            if _SEARCH_MARKER.match(line):
+                section, old_lines, new_lines = 'search', [], []
+        elif section == 'search':
+            if _DIVIDER_MARKER.match(line):
+                section = 'replace'
+            else:
+                old_lines.append(line)
+        elif _REPLACE_MARKER.match(line):
+            hunks.append(Hunk(old_lines, new_lines, None))
+            section = None
+        else:
+            new_lines.append(line)
+    if section is not None:
+        raise PatchParseError("SEARCH/REPLACE 段未闭合")
+    if not hunks:
+        raise PatchParseError("未找到 SEARCH/REPLACE 段")
+    return hunks
+
+
+def _locate(lines, old_lines, expected, lower):
+    """
+    在 lines[lower:] 中查找与 old_lines 完全相同的连续行，返回起始下标或 None。
+    expected 不为 None 时返回离它最近的位置（允许偏移），否则返回第一个位置。
+    只在首行出现的位置上做比较，首行的查找由 list.index 在 C 层完成。
+    """
+    first = old_lines[0]
+    length = len(old_lines)
+    best = None
+    position = lower
+    while True:
+        try:
+            candidate = lines.index(first, position)
+        except ValueError:
+            break
+        if candidate + length > len(lines):
+            break
+        if expected is not None and best is not None and candidate - expected >= abs(best - expected):
+            break # 之后的位置只会更远
+        if lines[candidate:candidate + length] == old_lines:
+            if expected is None:
+                return candidate
+            if best is None or abs(candidate - expected) < abs(best - expected):
+                best = candidate
+        position = candidate + 1
+    return best
+
+
+def _locate_ignoring_trailing_whitespace(lines, old_lines, expected, lower):
+    """精确查找失败时的模糊匹配：忽略每行末尾的空白。"""
+    stripped = [line.rstrip() for line in lines]
+    return _locate(stripped, [line.rstrip() for line in old_lines], expected, lower)
+
+
+def apply_hunks(content, hunks):
+    """
+    将 hunks 依次应用到 content（只含 LF 的文本），返回 PatchResult。
+    带行号的块先在期望位置附近查找（允许任意偏移，选择最近的匹配），
+    找不到时再忽略行尾空白重试；仍找不到的块被拒绝，不影响其他块。
+    """
+    lines = content.split('\n') if content else []
+    applied = []
+    rejected = []
+    delta = 0 # 已应用的块带来的行数变化
+    lower = 0 # 带行号的块不能与前一个已应用的块重叠
+
+    for number, hunk in enumerate(hunks, 1):
+        expected = None if hunk.old_start is None else max(0, hunk.old_start + delta)
+        search_from = 0 if hunk.old_start is None else lower
+
+        if not hunk.old_lines:
+            if hunk.old_start is None and lines:
+                rejected.append((number, "SEARCH 内容为空，无法确定位置"))
+                continue
+            position = min(max(expected or 0, search_from), len(lines))
+        else:
+            position = _locate(lines, hunk.old_lines, expected, search_from)
+            if position is None:
+                position = _locate_ignoring_trailing_whitespace(lines, hunk.old_lines, expected, search_from)
+            if position is None:
+                rejected.append((number, f"未找到匹配的原有内容（首行: {hunk.old_lines[0].strip()[:60]!r}）"))
+                continue
+
+        lines[position:position + len(hunk.old_lines)] = hunk.new_lines
+        delta += len(hunk.new_lines) - len(hunk.old_lines)
+        if hunk.old_start is not None:
+            lower = position + len(hunk.new_lines)
+        applied.append(number)
+
+    return PatchResult('\n'.join(lines), applied, rejected)
+
+
+def apply_patch_text(operation_type, content, patch_text):
+    """按操作类型（PATCH 或 REPLACE）解析 patch_text 并应用到 content。解析失败时抛出 PatchParseError。"""
+    if operation_type == "PATCH":
+        hunks = parse_unified_diff(patch_text)
+    else:
+        hunks = parse_search_replace(patch_text)
+    return apply_hunks(content, hunks)
+
+
+if __name__ == '__main__':
+    # 直接运行 `python patch_ops.py`：在 5,000 行的文件上应用 3 行修改，比较补丁与完整内容载荷。
+    # 应用结果的检查见 tests/test_patch_ops.py。
+    import time
+    from block_scanner import scan_blocks
+
+    original = "\n".join(f"def function_{i}():\n    return {i}\n" for i in range(1667)) + "\n"
+    lines = original.split('\n')
+    diff = (
+        "--- a/big_module.py\n+++ b/big_module.py\n"
+        "@@ -2498,3 +2498,3 @@\n"  # 行号故意偏移 5 行，测试偏移匹配
+        f" {lines[2502]}\n-{lines[2503]}\n+    return -1\n {lines[2504]}\n"
+        "@@ -4000,2 +4000,2 @@\n"
+        "-this line does not exist\n+never applied\n"
+    )
+    search_replace = (
+        f"<<<<<<< SEARCH\n{lines[2503]}\n=======\n    return -1\n>>>>>>> REPLACE\n"
+    )
+    full_payload = f"#### file: big_module.py (OVERWRITE)\n```python\n{original.replace(lines[2503], '    return -1', 1)}```\n"
+    patch_payload = f"#### file: big_module.py (PATCH)\n```diff\n{diff}```\n"
+
+    for label, payload in (("完整内容 (OVERWRITE)", full_payload), ("补丁 (PATCH)", patch_payload)):
+        started = time.perf_counter()
+        for _ in range(100):
+            blocks = list(scan_blocks(payload))
+        print(f"{label}: 载荷 {len(payload.encode('utf-8')):7d} 字节, 扫描 {(time.perf_counter() - started) * 10:.3f} ms/次")
+
+    for label, operation, text in (("PATCH", "PATCH", diff), ("REPLACE", "REPLACE", search_replace)):
+        started = time.perf_counter()
+        for _ in range(100):
+            result = apply_patch_text(operation, original, text)
+        elapsed = (time.perf_counter() - started) * 10
+        print(f"{label}: 应用 {elapsed:.3f} ms/次, 已应用 {result.applied}, 被拒绝 {result.rejected}")
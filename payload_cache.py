@@ -0,0 +1,118 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+from block_scanner import scan_blocks
+
+# 缓存条目：has_directives 表示剪贴板内容中是否包含文件指令，
+# blocks 为解析出的代码块列表（超出内存上限时为 None，需要重新解析）。
+PayloadCacheEntry = namedtuple('PayloadCacheEntry', ['digest', 'has_directives', 'blocks', 'size'])
+
+
+def payload_digest(text):
+    """计算剪贴板文本的内容摘要（128 位 BLAKE2b），作为缓存键。"""
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+def _blocks_size(blocks):
+    """粗略估算代码块占用的字符数，用于内存上限控制。"""
+    return sum(len(b.filename) + len(b.operation) + len(b.language or '') + len(b.content) for b in blocks)
+
+
+class PayloadCache:
+    """
+    以内容摘要为键的有界 LRU 缓存，记录每个剪贴板内容是否包含指令及其解析结果。
+    同时被监听线程和 Tk 主线程访问，所有操作都在锁内完成。
+    """
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, digest):
+        """按摘要查找条目，命中时将其移到最近使用的位置。未命中返回 None。"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry
+
+    def remember(self, digest, blocks):
+        """记录一次解析结果并返回新条目，必要时按 LRU 顺序淘汰旧条目。"""
+        size = _blocks_size(blocks)
+        if size > self.max_bytes:
+            # 单个内容超过内存上限：只记住“是否含指令”，不保留解析结果
+            entry = PayloadCacheEntry(digest, bool(blocks), None, 0)
+        else:
+            entry = PayloadCacheEntry(digest, bool(blocks), blocks, size)
+
+        with self._lock:
+            previous = self._entries.pop(digest, None)
+            if previous is not None:
+                self._total_bytes -= previous.size
+            self._entries[digest] = entry
+            self._total_bytes += entry.size
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted.size
+                self.evictions += 1
+        return entry
+
+    def classify(self, text):
+        """
+        供监听线程调用：判断剪贴板内容是否需要放入队列。
+        已见过的内容（无论是否含指令）和不含指令的内容都返回 False。
+        """
+        return bool(self.parse_new(text))
+
+    def parse_new(self, text):
+        """
+        解析未见过的内容并记录结果，返回代码块列表（不含指令时为空列表）；已见过的内容返回 None。
+        处理流水线在解析线程中调用。
+        """
+        digest = payload_digest(text)
+        if self.lookup(digest) is not None:
+            return None
+        blocks = list(scan_blocks(text))
+        self.remember(digest, blocks)
+        return blocks
+
+    def seen(self, text):
+        """内容是否已经解析过。只计算摘要，不解析、不计入命中统计，供只做去重的监听线程使用。"""
+        digest = payload_digest(text)
+        with self._lock:
+            return digest in self._entries
+
+    def blocks_for(self, text):
+        """
+        供主线程调用：返回剪贴板内容的代码块列表，优先使用缓存的解析结果。
+        该查询不计入命中/未命中统计。
+        """
+        digest = payload_digest(text)
+        with self._lock:
+            entry = self._entries.get(digest)
+        if entry is not None and entry.blocks is not None:
+            return entry.blocks
+        blocks = list(scan_blocks(text))
+        if entry is None:
+            self.remember(digest, blocks)
+        return blocks
+
+    def stats(self):
+        """返回当前的缓存统计信息。"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,898 @@
+import os
+import sys
+import time
+import asyncio
+import itertools
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from apply_engine import plan_blocks, commit_plan, plan_file_results
+from config_options import DEFAULT_DURABILITY, DEFAULT_OVERFLOW_POLICY, OVERFLOW_POLICIES
+from file_system import DEFAULT_IO_WORKERS
+from journal import JournalError
+from metrics import PipelineMetrics
+from payload_cache import PayloadCache
+
+# 剪贴板内容的处理流水线：capture → parse → plan → confirm → commit。
+# 各阶段在同一个 asyncio 事件循环（独立线程）中以协程运行，由有界队列连接；
+# 解析和文件读写在线程池中执行，确认对话框等前端调用在单独的前端线程中串行执行，
+# 因此 Tk 主线程和事件循环都不会被阻塞。本模块不依赖 Tkinter 或 pywin32。
+# 确认是异步的：等待确认的计划登记为 PendingConfirmation，用户决定之前后续内容照常解析和规划，
+# 同时最多有 queue_size 个计划等待确认。
+
+# 队列已满时的处理策略见 config_options.OVERFLOW_POLICIES
+DEFAULT_QUEUE_SIZE = 8
+# 记住最近这么多次提交写入的路径，用于判断计划是否需要重新规划；更早的计划一律重新规划
+COMMIT_HISTORY = 1024
+
+# submit() 返回的处理结果：outcome 与 outcomes 统计中的键相同（committed、cancelled、unchanged 等），
+# files 为 apply_engine.plan_file_results() 给出的每个文件的结果
+PipelineResult = namedtuple('PipelineResult', ['outcome', 'files'])
+
+
+class PipelineClosed(Exception):
+    """队列已关闭，消费者应退出。"""
+
+
+class BoundedQueue:
+    """
+    带溢出策略的有界 asyncio 队列，只能在事件循环线程中使用。
+    被策略丢弃的元素交给 on_discard(item, reason) 处理，reason 为 'dropped' 或 'coalesced'。
+    """
+    def __init__(self, name, maxsize, policy='block', on_discard=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的溢出策略 '{policy}'，可选: {', '.join(OVERFLOW_POLICIES)}")
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self.on_discard = on_discard
+        self._items = deque()
+        # 生产者和消费者分别等待，每次只唤醒一个：大量生产者等待空位时，取出一个元素不会唤醒所有生产者
+        lock = asyncio.Lock()
+        self._not_empty = asyncio.Condition(lock)
+        self._not_full = asyncio.Condition(lock)
+        self._closed = False
+        self.accepted = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked = 0 # 生产者因队列已满而等待的次数
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def _discard(self, item, reason):
+        if reason == 'coalesced':
+            self.coalesced += 1
+        else:
+            self.dropped += 1
+        if self.on_discard:
+            self.on_discard(item, reason)
+
+    async def put(self, item, policy=None):
+        """
+        放入一个元素，返回 False 表示新元素本身被丢弃（drop_newest 或队列已关闭）。
+        policy 可以为这一次放入指定不同的溢出策略，例如等待结果的调用方使用 'block'，不被丢弃。
+        """
+        policy = policy or self.policy
+        async with self._not_full:
+            if self._closed:
+                self._discard(item, 'dropped')
+                return False
+            if len(self._items) >= self.maxsize:
+                if policy == 'block':
+                    self.blocked += 1
+                    await self._not_full.wait_for(lambda: len(self._items) < self.maxsize or self._closed)
+                    if self._closed:
+                        self._discard(item, 'dropped')
+                        return False
+                elif policy == 'drop_oldest':
+                    self._discard(self._items.popleft(), 'dropped')
+                elif policy == 'drop_newest':
+                    self._discard(item, 'dropped')
+                    return False
+                else: # coalesce_latest
+                    self._discard(self._items.pop(), 'coalesced')
+            self._items.append(item)
+            self.accepted += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._not_empty.notify()
+            return True
+
+    async def get(self):
+        """取出一个元素；队列已关闭且为空时抛出 PipelineClosed。"""
+        async with self._not_empty:
+            await self._not_empty.wait_for(lambda: self._items or self._closed)
+            if not self._items:
+                raise PipelineClosed(self.name)
+            item = self._items.popleft()
+            self._not_full.notify()
+            return item
+
+    async def close(self):
+        """关闭队列，丢弃剩余元素并唤醒所有等待者。"""
+        async with self._not_empty:
+            self._closed = True
+            while self._items:
+                self._discard(self._items.popleft(), 'dropped')
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def stats(self):
+        return {
+            'depth': len(self._items),
+            'max_depth': self.max_depth,
+            'accepted': self.accepted,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'blocked': self.blocked,
+        }
+
+
+class PendingConfirmation:
+    """
+    一个等待用户确认的计划。前端在任意线程中调用 resolve(True/False) 作出决定，只有第一次调用生效。
+    replanned 为 True 表示这是已批准的计划在期间其他内容写入后重新规划、需要再次确认的版本。
+    overwrites 为计划中因 CREATE 而覆盖已有文件的 (filename, target_path)：覆盖与其他操作一起在确认内容中列出，
+    不单独弹出对话框；批准时 overwrite=False 表示跳过这些文件，只执行其余操作。
+    """
+    __slots__ = ('id', 'plan', 'created', 'replanned', 'overwrites', 'overwrite', '_loop', '_future')
+
+    def __init__(self, pending_id, plan, loop, replanned=False):
+        self.id = pending_id
+        self.plan = plan
+        self.created = time.time()
+        self.replanned = replanned
+        self.overwrites = tuple((file_info['filename'], file_info['target_path']) for file_info in plan.files_to_write
+                                if file_info['operation'] == "OVERWRITE_ON_CREATE")
+        self.overwrite = True
+        self._loop = loop
+        self._future = loop.create_future()
+
+    @property
+    def done(self):
+        return self._future.done()
+
+    def resolve(self, approved, overwrite=True):
+        """批准（True）或拒绝（False）这个计划，可从任意线程调用。overwrite=False 时批准但不覆盖 overwrites 中的文件。"""
+        try:
+            self._loop.call_soon_threadsafe(self._set_result, bool(approved), bool(overwrite))
+        except RuntimeError: # 事件循环已关闭
+            pass
+
+    def _set_result(self, approved, overwrite):
+        if not self._future.done():
+            self.overwrite = overwrite
+            self._future.set_result(approved)
+
+    async def wait(self):
+        return await self._future
+
+
+class PipelineFrontend:
+    """
+    流水线的前端（托盘程序、测试等）。除 on_busy 外，所有方法都在流水线的前端线程中串行调用，
+    可以阻塞（例如弹出对话框），但不能直接操作 Tk 控件。默认实现拒绝所有操作。
+    CREATE 的目标已存在且内容不同时不单独询问：覆盖列在计划中，随计划一起确认（见 PendingConfirmation.overwrites）。
+    """
+    def confirm_plan(self, plan):
+        """返回 True 表示执行计划中的全部操作。只在默认的 request_confirmation() 中使用。"""
+        return False
+
+    def request_confirmation(self, pending):
+        """
+        有计划等待确认时调用，pending 为 PendingConfirmation。前端可以立即返回，稍后（在任意线程中）
+        调用 pending.resolve()；在此期间流水线继续处理后续内容。默认实现调用阻塞的 confirm_plan()。
+        """
+        pending.resolve(self.confirm_plan(pending.plan))
+
+    def on_busy(self, busy):
+        """流水线中开始有 / 不再有待处理的内容时调用。在事件循环线程中调用，不能阻塞，以免被对话框延迟。"""
+
+    def on_committed(self, plan, errors):
+        """计划执行完成后调用，errors 为 commit_plan 返回的失败列表。"""
+
+
+class _PipelineItem:
+    """
+    流水线中的一个内容。auto_approve 为 True 时跳过确认（CREATE 覆盖也直接同意）；
+    dedupe 为 False 时已见过的内容也会处理；result 为 submit() 等待的 future，剪贴板内容没有。
+    project 为整个内容指定的项目名（见 project_router），没有项目指令的代码块写入该项目。
+    journal_batch 为规划后预读了原内容的 journal.JournalBatch，提交时用于记录撤销信息。
+    keep_existing 为用户选择不覆盖的 CREATE 目标路径，重新规划时沿用。
+    """
+    __slots__ = ('text', 'trace', 'blocks', 'plan', 'generation', 'auto_approve', 'dedupe', 'result', 'project',
+                 'journal_batch', 'keep_existing')
+
+    def __init__(self, text, trace, auto_approve=False, dedupe=True, result=None, project=None):
+        self.text = text
+        self.trace = trace
+        self.blocks = None
+        self.plan = None
+        self.generation = 0 # 规划时已完成的提交次数，用于判断计划是否过期
+        self.auto_approve = auto_approve
+        self.dedupe = dedupe
+        self.result = result
+        self.project = project
+        self.journal_batch = None
+        self.keep_existing = set()
+
+
+class ApplyPipeline:
+    """
+    剪贴板内容的异步处理流水线。监听线程通过 put()（与 queue.Queue.put 兼容）放入 QueuedPayload，
+    之后的解析、规划、确认和写入都在流水线内完成，结果通过 PipelineFrontend 通知前端。
+
+    capture 队列使用可配置的溢出策略（默认 drop_oldest）；后续队列已满时上游阶段等待（反压），
+    因此积压只会出现在 capture 队列中，内存占用由 queue_size 限定。
+    等待确认的计划同样最多 queue_size 个，达到上限后 planned 队列开始积压。
+    已批准的计划写入前如果期间的提交写入了计划涉及的文件，会重新规划；结果与用户看到的不同时重新请求确认。
+    """
+    def __init__(self, frontend, get_root_folder, payload_cache=None, metrics=None,
+                 queue_size=DEFAULT_QUEUE_SIZE, overflow_policy=DEFAULT_OVERFLOW_POLICY,
+                 get_io_workers=lambda: DEFAULT_IO_WORKERS, get_file_index=lambda root_folder: None,
+                 get_router=lambda: None, get_journal=lambda: None, get_durability=lambda: DEFAULT_DURABILITY,
+                 transaction_log=None, get_previewer=lambda: None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的溢出策略 '{overflow_policy}'，可选: {', '.join(OVERFLOW_POLICIES)}")
+        self.frontend = frontend
+        self.get_root_folder = get_root_folder
+        self.get_io_workers = get_io_workers
+        self.get_file_index = get_file_index # root_folder -> file_index.FileIndex 或 None（索引未建立）
+        self.get_router = get_router # 返回 project_router.ProjectRouter 时按项目路由代码块，否则全部写入 get_root_folder()
+        self.get_journal = get_journal # 返回 journal.UndoJournal 时记录每次提交的撤销信息
+        self.get_durability = get_durability # 提交的持久化级别，见 config_options.DURABILITY_MODES
+        self.transaction_log = transaction_log # transaction.TransactionLog，崩溃后由下次启动时的 recover() 处理
+        self.get_previewer = get_previewer # 返回 diff_preview.DiffPreviewer 时为等待确认的计划生成差异预览
+        self.payload_cache = payload_cache if payload_cache is not None else PayloadCache()
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.outcomes = {} # 结果 -> 次数，例如 committed、cancelled、dropped
+        self._queues = {}
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._stop_event = None
+        self._in_flight = 0
+        self._generation = 0
+        self._commit_history = deque(maxlen=COMMIT_HISTORY) # 每次提交写入或删除的路径，按提交顺序
+        self._pending = {} # id -> PendingConfirmation
+        self._pending_ids = itertools.count(1)
+        self._pending_slots = None
+        self._decision_tasks = set()
+        self.max_pending = 0 # 同时等待确认的计划数的最大值
+        # 解析（CPU）和文件读写分别使用单独的线程，前端调用在单独的线程中串行执行
+        self._parse_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='PipelineParse')
+        self._io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='PipelineIO')
+        self._frontend_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='PipelineFrontend')
+
+    # --- 生命周期 ---
+
+    def start(self):
+        """在后台线程中启动事件循环，返回时流水线已可接收内容。"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_loop, daemon=True, name='ApplyPipeline')
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self, timeout=5.0):
+        """停止所有阶段并丢弃未处理的内容，可从任意线程调用。"""
+        if self._loop is not None and self._thread is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+            self._thread.join(timeout)
+        for executor in (self._parse_executor, self._io_executor, self._frontend_executor):
+            executor.shutdown(wait=False)
+
+    def _run_loop(self):
+        try:
+            asyncio.run(self._main())
+        except Exception as e:
+            print(f"[ERROR] 处理流水线异常退出: {type(e).__name__}: {e}", file=sys.stderr)
+        finally:
+            self._ready.set() # 启动失败时不让 start() 永远等待
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._pending_slots = asyncio.Semaphore(self.queue_size)
+        self._queues = {
+            'capture': BoundedQueue('capture', self.queue_size, self.overflow_policy, self._on_discard),
+            'parsed': BoundedQueue('parsed', self.queue_size, 'block', self._on_discard),
+            'planned': BoundedQueue('planned', self.queue_size, 'block', self._on_discard),
+            'confirmed': BoundedQueue('confirmed', 1, 'block', self._on_discard),
+        }
+        stages = [
+            asyncio.create_task(self._run_stage(self._parse_stage, 'capture', 'parsed')),
+            asyncio.create_task(self._run_stage(self._plan_stage, 'parsed', 'planned')),
+            asyncio.create_task(self._run_stage(self._confirm_stage, 'planned', 'confirmed')),
+            asyncio.create_task(self._run_stage(self._commit_stage, 'confirmed', None)),
+        ]
+        self._ready.set()
+        await self._stop_event.wait()
+        for queue in self._queues.values():
+            await queue.close()
+        tasks = stages + list(self._decision_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # --- 输入 ---
+
+    def put(self, payload):
+        """
+        供监听线程调用，payload 为 QueuedPayload。策略为 block 时阻塞调用线程直到 capture 队列有空位，
+        其他策略立即返回。流水线未启动时内容被丢弃。
+        """
+        if self._loop is None or self._loop.is_closed():
+            print("[WARNING] 处理流水线未运行，丢弃剪贴板内容。", file=sys.stderr)
+            return
+        try:
+            future = asyncio.run_coroutine_threadsafe(self._capture(payload), self._loop)
+        except RuntimeError: # 事件循环已关闭
+            return
+        if self.overflow_policy == 'block':
+            future.result()
+
+    async def _capture(self, payload):
+        item = _PipelineItem(payload.text, payload.trace)
+        self._begin_item()
+        await self._queues['capture'].put(item)
+
+    async def submit(self, text, auto_approve=False, dedupe=False, project=None):
+        """
+        在流水线的事件循环中调用（例如 ingest_server）：放入一个内容并等待处理完成，返回 PipelineResult。
+        capture 队列已满时等待而不按溢出策略丢弃，调用方因此获得反压。
+        """
+        item = _PipelineItem(text, self.metrics.new_trace(), auto_approve, dedupe, self._loop.create_future(), project)
+        self._begin_item()
+        await self._queues['capture'].put(item, policy='block')
+        return await item.result
+
+    def run_coroutine(self, coroutine):
+        """在流水线的事件循环中运行协程，返回 concurrent.futures.Future。可从任意线程调用。"""
+        if self._loop is None or self._loop.is_closed():
+            raise RuntimeError("处理流水线未运行")
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    # --- 阶段 ---
+
+    async def _run_stage(self, handler, source, target):
+        """从 source 队列逐个取出内容交给 handler；handler 返回 True 时放入 target 队列。"""
+        source_queue = self._queues[source]
+        target_queue = self._queues[target] if target else None
+        while True:
+            try:
+                item = await source_queue.get()
+            except PipelineClosed:
+                return
+            try:
+                forward = await handler(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[ERROR] 处理流水线 {source} 之后的阶段出错: {type(e).__name__}: {e}", file=sys.stderr)
+                self._finish_item(item, 'error')
+                continue
+            if forward and target_queue is not None:
+                await target_queue.put(item)
+
+    async def _parse_stage(self, item):
+        item.trace.mark('queue_wait')
+        parse = self.payload_cache.parse_new if item.dedupe else self.payload_cache.blocks_for
+        item.blocks = await self._loop.run_in_executor(self._parse_executor, parse, item.text)
+        item.trace.mark('parse')
+        if not item.blocks:
+            self._finish_item(item, 'duplicate' if item.blocks is None else 'empty')
+            return False
+        return True
+
+    async def _plan_stage(self, item):
+        await self._make_plan(item)
+        if item.plan.is_empty():
+            print("剪贴板中检测到的所有代码块内容均与现有文件一致，或操作被跳过，无需处理。")
+            self._finish_item(item, 'unchanged')
+            return False
+        return True
+
+    async def _make_plan(self, item):
+        item.generation = self._generation
+        # 不在规划中弹出对话框（会占用唯一的 IO 线程）：覆盖列入计划，由确认一并决定；用户选择不覆盖的文件重新规划时跳过
+        confirm_overwrite = lambda filename, target_path: target_path not in item.keep_existing
+        self._release_journal_batch(item)
+        router = self.get_router()
+        if router is not None:
+            make_plan = lambda: router.plan_blocks(item.blocks, confirm_overwrite, project=item.project,
+                                                   max_workers=self.get_io_workers(), redirect_missing=not item.auto_approve)
+        else:
+            root_folder = self.get_root_folder()
+            make_plan = lambda: plan_blocks(item.blocks, root_folder, confirm_overwrite,
+                                            max_workers=self.get_io_workers(), file_index=self.get_file_index(root_folder),
+                                            redirect_missing=not item.auto_approve)
+        item.plan, item.journal_batch = await self._loop.run_in_executor(
+            self._io_executor, self._plan_with_journal, make_plan, not item.auto_approve)
+        item.trace.mark('plan')
+
+    def _plan_with_journal(self, make_plan, preload):
+        """
+        在 IO 线程中规划。需要等待用户确认时登记差异预览（在确认请求交给前端之后才开始计算），
+        并顺便预读计划涉及文件的原内容，提交时文件未变化就直接使用，读取不占用提交的时间。
+        """
+        plan = make_plan()
+        if plan.is_empty():
+            return plan, None
+        previewer = self.get_previewer()
+        if preload and previewer is not None:
+            previewer.prepare(plan)
+        journal = self.get_journal()
+        if journal is None:
+            return plan, None
+        return plan, journal.begin(plan, preload=preload, max_workers=self.get_io_workers())
+
+    @staticmethod
+    def _release_journal_batch(item):
+        """释放计划预读的原内容：重新规划之前，以及内容处理结束（包括取消和丢弃）时调用。"""
+        if item.journal_batch is not None:
+            item.journal_batch.discard()
+            item.journal_batch = None
+
+    async def _confirm_stage(self, item):
+        if item.auto_approve:
+            item.trace.mark('confirm_wait')
+            return True
+        # 只登记确认请求，不等待用户：决定由 _await_decision 处理，本阶段立即处理下一个计划
+        await self._request_confirmation(item)
+        return False
+
+    async def _request_confirmation(self, item, replanned=False):
+        """占用一个等待确认的名额（已满时等待），登记 PendingConfirmation 并通知前端。"""
+        await self._pending_slots.acquire()
+        pending = PendingConfirmation(next(self._pending_ids), item.plan, self._loop, replanned)
+        self._pending[pending.id] = pending
+        self.max_pending = max(self.max_pending, len(self._pending))
+        task = asyncio.create_task(self._await_decision(pending, item))
+        self._decision_tasks.add(task)
+        task.add_done_callback(self._decision_tasks.discard)
+        self._call_frontend_nowait(self.frontend.request_confirmation, pending)
+        if item.plan.previews is not None:
+            # 前端线程串行执行：确认请求送达之后预览线程才开始占用 CPU，不推迟确认提示
+            self._call_frontend_nowait(item.plan.previews.start)
+
+    async def _await_decision(self, pending, item):
+        try:
+            approved = await pending.wait()
+        except asyncio.CancelledError:
+            self._finish_item(item, 'dropped')
+            raise
+        finally:
+            del self._pending[pending.id]
+            self._pending_slots.release()
+            if pending.plan.previews is not None:
+                pending.plan.previews.cancel() # 已作出决定，尚未开始的预览不再需要
+        item.trace.mark('confirm_wait')
+        if not approved:
+            print("用户取消了所有操作。")
+            self._finish_item(item, 'cancelled')
+            return
+        if not pending.overwrite and pending.overwrites:
+            # 批准但不覆盖已存在的文件：按用户的选择重新规划。期间有其他写入、或出现了新的覆盖时重新请求确认
+            stale = self._is_stale(item)
+            item.keep_existing.update(target_path for _, target_path in pending.overwrites)
+            await self._make_plan(item)
+            if item.plan.is_empty():
+                self._finish_item(item, 'unchanged')
+                return
+            if stale or any(file_info['operation'] == "OVERWRITE_ON_CREATE" for file_info in item.plan.files_to_write):
+                print("[INFO] 已批准的操作因其他内容写入而发生变化，需要重新确认。")
+                await self._request_confirmation(item, replanned=True)
+                return
+        await self._queues['confirmed'].put(item)
+
+    def _is_stale(self, item):
+        """规划之后的提交是否写入了计划检查过的路径。只比较路径集合，无关的提交不会导致重新规划。"""
+        commits_since = self._generation - item.generation
+        if commits_since == 0:
+            return False
+        if commits_since > len(self._commit_history):
+            return True
+        paths = item.plan.target_paths
+        return any(not paths.isdisjoint(committed) for committed in itertools.islice(
+            reversed(self._commit_history), commits_since))
+
+    async def _commit_stage(self, item):
+        if self._is_stale(item):
+            # 确认期间有其他内容已写入：按最新的文件重新规划，操作与用户批准的不同时重新请求确认
+            approved_details = item.plan.prompt_details
+            await self._make_plan(item)
+            if item.plan.is_empty():
+                self._finish_item(item, 'unchanged')
+                return False
+            if item.plan.prompt_details != approved_details and not item.auto_approve:
+                print("[INFO] 已批准的操作因其他内容写入而发生变化，需要重新确认。")
+                await self._request_confirmation(item, replanned=True)
+                return False
+        try:
+            errors = await self._loop.run_in_executor(self._io_executor, self._commit, item.plan, item.journal_batch)
+        finally:
+            self._commit_history.append(item.plan.target_paths)
+            self._generation += 1
+        item.trace.mark('write')
+        self._finish_item(item, 'committed', commit_errors=errors, errors=len(errors))
+        self._call_frontend_nowait(self.frontend.on_committed, item.plan, errors)
+        return False
+
+    def _commit(self, plan, journal_batch=None):
+        """在 IO 线程中写入并记录撤销信息，在下一个计划开始之前把新建和删除的文件告诉文件索引。"""
+        journal = self.get_journal()
+        if journal is not None and journal_batch is None:
+            journal_batch = journal.begin(plan)
+        errors = commit_plan(plan, max_workers=self.get_io_workers(),
+                             before_change=journal_batch.capture if journal is not None else None,
+                             durability=self.get_durability(), transaction_log=self.transaction_log)
+        if journal is not None:
+            journal.finish(journal_batch, errors)
+        for root_folder in plan.root_folders():
+            file_index = self.get_file_index(root_folder)
+            if file_index is not None:
+                file_index.note_committed(plan, errors)
+        return errors
+
+    async def restore(self, action):
+        """
+        在流水线的事件循环中调用：撤销（'undo'）或重做（'redo'）最近的批次，返回 journal.RestoreResult。
+        与提交使用同一个 IO 线程；恢复的路径计入提交历史，等待确认的计划在提交前会重新规划。
+        """
+        journal = self.get_journal()
+        if journal is None:
+            raise JournalError("未启用撤销日志")
+        result = await self._loop.run_in_executor(self._io_executor, self._restore, journal, action)
+        self._commit_history.append(frozenset(result.paths))
+        self._generation += 1
+        return result
+
+    def _restore(self, journal, action):
+        restore = journal.undo if action == 'undo' else journal.redo
+        result = restore(max_workers=self.get_io_workers(), durability=self.get_durability(),
+                         transaction_log=self.transaction_log)
+        failed = {path for path, _ in result.errors}
+        for root_folder in result.roots:
+            file_index = self.get_file_index(root_folder)
+            if file_index is None:
+                continue
+            for path in result.paths:
+                if path in failed:
+                    continue
+                if os.path.exists(path):
+                    file_index.add_file(path)
+                else:
+                    file_index.remove_file(path)
+        return result
+
+    # --- 前端与统计 ---
+
+    def _call_frontend_nowait(self, func, *args):
+        future = self._frontend_executor.submit(func, *args)
+        future.add_done_callback(_report_frontend_error)
+
+    def _notify_busy(self, busy):
+        try:
+            self.frontend.on_busy(busy)
+        except Exception as e:
+            print(f"[ERROR] 前端回调出错: {type(e).__name__}: {e}", file=sys.stderr)
+
+    def _begin_item(self):
+        self._in_flight += 1
+        if self._in_flight == 1:
+            self._notify_busy(True)
+
+    def _finish_item(self, item, outcome, commit_errors=None, **fields):
+        self._release_journal_batch(item)
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        blocks = len(item.blocks) if item.blocks else 0
+        operations = item.plan.operation_count() if item.plan is not None else 0
+        item.trace.finish(blocks=blocks, operations=operations, outcome=outcome, **fields)
+        if item.result is not None and not item.result.done():
+            files = []
+            if item.plan is not None and outcome in ('committed', 'cancelled', 'dropped', 'error'):
+                files = plan_file_results(item.plan, commit_errors, None if outcome == 'committed' else outcome)
+            item.result.set_result(PipelineResult(outcome, files))
+        self._in_flight -= 1
+        if self._in_flight == 0:
+            self._notify_busy(False)
+
+    def _on_discard(self, item, reason):
+        self._finish_item(item, reason)
+
+    def stats(self):
+        """返回各队列的统计和各结果的次数。可从任意线程调用，数值可能略有滞后。"""
+        return {
+            'queues': {name: queue.stats() for name, queue in list(self._queues.items())},
+            'outcomes': dict(self.outcomes),
+            'in_flight': self._in_flight,
+            'pending_confirmations': len(self._pending),
+            'max_pending_confirmations': self.max_pending,
+        }
+
+    def format_summary(self):
+        """供托盘菜单显示的多行文本。"""
+        stats = self.stats()
+        lines = [f"处理流水线（capture 队列 {self.queue_size} 项，溢出策略 {self.overflow_policy}）："]
+        for name, queue_stats in stats['queues'].items():
+            lines.append(f"{name}: 当前 {queue_stats['depth']}，最多 {queue_stats['max_depth']}，"
+                         f"丢弃 {queue_stats['dropped']}，合并 {queue_stats['coalesced']}，等待 {queue_stats['blocked']} 次")
+        lines.append(f"等待确认: 当前 {stats['pending_confirmations']}，最多 {stats['max_pending_confirmations']}")
+        if stats['outcomes']:
+            lines.append("结果: " + "，".join(f"{outcome} {count}" for outcome, count in sorted(stats['outcomes'].items())))
+        return "\n".join(lines)
+
+
+def _report_frontend_error(future):
+    error = future.exception()
+    if error is not None:
+        print(f"[ERROR] 前端回调出错: {type(error).__name__}: {error}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    # 直接运行 `python pipeline.py`：性能测试（功能检查见 tests/test_pipeline.py）。
+    # 负载测试以每秒 1,000 次的速度向假事件源复制内容，前端每次确认耗时 5 ms（远低于复制速度），
+    # 测量各队列的积压和内存占用随时间的变化。
+    import os
+    import time
+    import tempfile
+    import tracemalloc
+    import contextlib
+    from clipboard_events import FakeClipboardEventSource
+    from clipboard_monitor import ClipboardMonitor
+
+    EVENTS_PER_SECOND = 1000
+    DURATION = 4.0
+    CONFIRM_DELAY = 0.005
+
+    class AutoApproveFrontend(PipelineFrontend):
+        def __init__(self):
+            self.committed = 0
+
+        def confirm_plan(self, plan):
+            time.sleep(CONFIRM_DELAY)
+            return True
+
+        def on_committed(self, plan, errors):
+            self.committed += 1
+
+    def payload(i):
+        if i % 100 == 0: # 每 100 次复制中有一个约 100 KB 的内容
+            return f"#### file: big/{i}.txt (OVERWRITE)\n```\n" + f"line {i}\n" * 12000 + "```\n"
+        return f"#### file: pkg/{i % 50}.py (OVERWRITE)\n```python\nVALUE = {i}\n```\n"
+
+    def run_load_test(policy):
+        with tempfile.TemporaryDirectory() as root:
+            frontend = AutoApproveFrontend()
+            metrics = PipelineMetrics(enabled=True)
+            cache = PayloadCache()
+            # 只测量队列和内存，不刷盘，写入速度不受磁盘刷新耗时的影响
+            pipeline = ApplyPipeline(frontend, lambda: root, payload_cache=cache, metrics=metrics,
+                                     overflow_policy=policy, get_durability=lambda: 'none')
+            source = FakeClipboardEventSource(record_copy_times=False)
+            monitor = ClipboardMonitor(pipeline, payload_cache=cache, event_source=source, metrics=metrics, parse=False)
+            samples = []
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                tracemalloc.start()
+                pipeline.start()
+                monitor.start()
+                started = time.perf_counter()
+                sent = 0
+                next_sample = started
+                while True:
+                    now = time.perf_counter()
+                    if now - started >= DURATION:
+                        break
+                    # 按时间补齐应发送的数量，保持平均每秒 EVENTS_PER_SECOND 次
+                    due = int((now - started) * EVENTS_PER_SECOND)
+                    while sent < due:
+                        source.copy(payload(sent))
+                        sent += 1
+                    if now >= next_sample:
+                        samples.append((now - started, tracemalloc.get_traced_memory()[0], source.pending()))
+                        next_sample += 0.25
+                    time.sleep(0.001)
+                monitor.stop()
+                pipeline.stop()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            stats = pipeline.stats()
+            half = len(samples) // 2
+            first_half = max(memory for _, memory, _ in samples[1:half])
+            second_half = max(memory for _, memory, _ in samples[half:])
+            capture = stats['queues']['capture']
+            print(f"策略 {policy:<16} 复制 {sent} 次 ({sent / DURATION:.0f}/s), 提交 {frontend.committed} 次, "
+                  f"capture 最大深度 {capture['max_depth']}, 丢弃 {capture['dropped']}, 合并 {capture['coalesced']}")
+            print(f"    内存: 前半段最高 {first_half / 1e6:.2f} MB, 后半段最高 {second_half / 1e6:.2f} MB, "
+                  f"峰值 {peak / 1e6:.2f} MB, 监听线程积压最多 {max(p for _, _, p in samples)}")
+            print(f"    结果: {stats['outcomes']}")
+
+    for policy in ('drop_oldest', 'coalesce_latest', 'drop_newest'):
+        run_load_test(policy)
+
+    # 确认方式对比：30 个内容每 20 ms 复制一次，用户每 THINK_TIME 秒作出一次决定。
+    # 模态确认框（之前）每次只能确认一个计划，且确认框打开期间 UI 线程被阻塞；
+    # 确认窗口（现在）在 UI 线程中只追加一行，用户一次批准窗口中所有待确认的批次。
+    import heapq
+    import itertools
+    from clipboard_monitor import QueuedPayload
+    from metrics import UiStallMonitor
+
+    PAYLOADS = 30
+    COPY_INTERVAL = 0.02
+    THINK_TIME = 0.2
+
+    class FakeUiLoop:
+        """模拟 Tk 事件循环：单个线程按时间顺序执行 after() 安排的回调。"""
+        def __init__(self):
+            self._heap = []
+            self._sequence = itertools.count()
+            self._condition = threading.Condition()
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, daemon=True)
+
+        def after(self, seconds, callback):
+            with self._condition:
+                heapq.heappush(self._heap, (time.perf_counter() + seconds, next(self._sequence), callback))
+                self._condition.notify()
+
+        def call_soon(self, callback):
+            self.after(0, callback)
+
+        def start(self):
+            self._thread.start()
+
+        def stop(self):
+            with self._condition:
+                self._stopped = True
+                self._condition.notify()
+            self._thread.join()
+
+        def _run(self):
+            while True:
+                with self._condition:
+                    while True:
+                        if self._stopped:
+                            return
+                        if not self._heap:
+                            self._condition.wait()
+                            continue
+                        remaining = self._heap[0][0] - time.perf_counter()
+                        if remaining > 0:
+                            self._condition.wait(remaining)
+                            continue
+                        callback = heapq.heappop(self._heap)[2]
+                        break
+                callback()
+
+    class ModalFrontend(PipelineFrontend):
+        """之前：每个计划在 UI 线程中弹出模态确认框，用户思考 THINK_TIME 秒后批准，确认完才处理下一个。"""
+        def __init__(self, ui):
+            self.ui = ui
+
+        def request_confirmation(self, pending):
+            answered = threading.Event()
+            def modal_dialog():
+                time.sleep(THINK_TIME)
+                pending.resolve(True)
+                answered.set()
+            self.ui.call_soon(modal_dialog)
+            answered.wait()
+
+    class WindowFrontend(PipelineFrontend):
+        """现在：计划加入确认窗口的列表，用户每 THINK_TIME 秒点击一次“全部批准”。"""
+        def __init__(self, ui):
+            self.ui = ui
+            self.window = []
+            self.ui.after(THINK_TIME, self.approve_all)
+
+        def request_confirmation(self, pending):
+            self.ui.call_soon(lambda: self.window.append(pending))
+
+        def approve_all(self):
+            for pending in self.window:
+                pending.resolve(True)
+            self.window.clear()
+            self.ui.after(THINK_TIME, self.approve_all)
+
+    def run_confirmation_test(frontend_class):
+        with tempfile.TemporaryDirectory() as root:
+            ui = FakeUiLoop()
+            stall_monitor = UiStallMonitor(ui.after, interval=0.02)
+            frontend = frontend_class(ui)
+            pipeline = ApplyPipeline(frontend, lambda: root, metrics=PipelineMetrics(enabled=True))
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                ui.start()
+                stall_monitor.start()
+                pipeline.start()
+                started = time.perf_counter()
+                for i in range(PAYLOADS):
+                    text = f"#### file: batch/{i}.py (CREATE)\n```python\nVALUE = {i}\n```\n"
+                    pipeline.put(QueuedPayload(text, pipeline.metrics.new_trace()))
+                    time.sleep(COPY_INTERVAL)
+                while pipeline.stats()['in_flight'] and time.perf_counter() - started < 30:
+                    time.sleep(0.01)
+                elapsed = time.perf_counter() - started
+                stall_monitor.stop()
+                pipeline.stop()
+                ui.stop()
+            stats = pipeline.stats()
+            queues = stats['queues']
+            stalls = stall_monitor.stats()
+            confirm_wait_p50 = pipeline.metrics.percentiles()['confirm_wait'][1] or 0.0
+            print(f"{frontend_class.__doc__.split('：')[0]:<4} 耗时 {elapsed:5.2f} s, 提交 {stats['outcomes'].get('committed', 0)}/{PAYLOADS}, "
+                  f"丢弃 {stats['outcomes'].get('dropped', 0)}, 队列最大深度 capture {queues['capture']['max_depth']} / "
+                  f"parsed {queues['parsed']['max_depth']} / planned {queues['planned']['max_depth']}, "
+                  f"同时等待确认最多 {stats['max_pending_confirmations']}")
+            print(f"     UI 线程卡顿 p95 {stalls['p95_ms']:.1f} ms / 最大 {stalls['max_ms']:.1f} ms, "
+                  f"等待确认 p50 {confirm_wait_p50 * 1000:.0f} ms")
+
+    print(f"确认方式对比（{PAYLOADS} 个内容，每 {COPY_INTERVAL * 1000:.0f} ms 一个，用户每 {THINK_TIME * 1000:.0f} ms 决定一次）:")
+    run_confirmation_test(ModalFrontend)
+    run_confirmation_test(WindowFrontend)
+
+    # 差异预览：200 个文件（每个约 300 行）的载荷从放入流水线到前端收到确认请求的耗时。
+    # 预览只在预览线程中提交和计算，确认请求不等待；全部完成后前端再刷新显示。
+    import statistics
+    from diff_preview import DiffPreviewer
+
+    PREVIEW_FILES = 200
+
+    class PreviewFrontend(PipelineFrontend):
+        def __init__(self):
+            self.requested = threading.Event()
+            self.previewed = threading.Event()
+            self.requested_at = None
+
+        def request_confirmation(self, pending):
+            self.requested_at = time.perf_counter() # 在前端线程中记录：预览线程开始后，等待事件的主线程可能要等 GIL
+            self.requested.set()
+            if pending.plan.previews is None:
+                self.previewed.set()
+            else:
+                pending.plan.previews.add_done_callback(self.previewed.set)
+
+    def run_preview_test(root, text, with_previews):
+        previewer = DiffPreviewer() if with_previews else None # 每次使用新的预览器，不命中缓存
+        frontend = PreviewFrontend()
+        pipeline = ApplyPipeline(frontend, lambda: root, get_previewer=lambda: previewer)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            pipeline.start()
+            started = time.perf_counter()
+            pipeline.put(QueuedPayload(text, pipeline.metrics.new_trace()))
+            frontend.requested.wait(30)
+            requested = frontend.requested_at - started
+            frontend.previewed.wait(30)
+            previewed = time.perf_counter() - started
+            pipeline.stop()
+        if previewer is not None:
+            previewer.close()
+        return requested, previewed
+
+    with tempfile.TemporaryDirectory() as root:
+        parts = []
+        for i in range(PREVIEW_FILES):
+            lines = [f"    value_{i}_{n} = compute({n})" for n in range(300)]
+            path = os.path.join(root, f"pkg{i % 10}", f"module_{i}.py")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+            for n in range(7, 300, 60):
+                lines[n] = f"    value_{i}_{n} = compute_changed({n})"
+            parts.append(f"#### file: pkg{i % 10}/module_{i}.py (OVERWRITE)\n```python\n" + "\n".join(lines) + "\n```\n")
+        payload_text = "".join(parts)
+        timings = {False: [], True: []}
+        for _ in range(5):
+            for with_previews in (False, True):
+                timings[with_previews].append(run_preview_test(root, payload_text, with_previews))
+        print(f"差异预览（{PREVIEW_FILES} 个文件的载荷，5 次的中位数）:")
+        without = statistics.median(requested for requested, _ in timings[False])
+        with_requested = statistics.median(requested for requested, _ in timings[True])
+        with_previewed = statistics.median(previewed for _, previewed in timings[True])
+        print(f"    确认请求: 无预览 {without * 1000:.1f} ms，有预览 {with_requested * 1000:.1f} ms；"
+              f"预览全部完成 {with_previewed * 1000:.1f} ms")
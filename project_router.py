@@ -0,0 +1,318 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from apply_engine import plan_blocks, merge_plans
+from file_index import DEFAULT_REFRESH_SECONDS, FileIndexWatcher
+from file_system import DEFAULT_IO_WORKERS, map_in_pool
+
+# 路由需要各项目的文件索引时，所有项目共用这一等待期限（秒）；超时的项目这一次不参与按索引路由
+INDEX_WAIT_SECONDS = 10.0
+
+
+class ProjectRoot:
+    """
+    一个命名的项目根目录及其缓存状态：规范化的真实路径（只计算一次）和按需建立的文件索引。
+    ProjectRouter 在配置变化时复用路径相同的 ProjectRoot，因此切换默认项目不需要重新扫描。
+    """
+    def __init__(self, name, path, index_enabled=True, refresh_seconds=DEFAULT_REFRESH_SECONDS):
+        self.name = name
+        self.path = os.path.abspath(path)
+        self.realpath = os.path.normcase(os.path.realpath(self.path))
+        self.index_enabled = index_enabled
+        self.refresh_seconds = refresh_seconds
+        self._watcher = None
+        self._lock = threading.Lock()
+
+    def file_index(self, wait=False, timeout=INDEX_WAIT_SECONDS):
+        """
+        返回该项目的 file_index.FileIndex。第一次调用时在后台线程中开始建立；
+        wait 为 False 时不等待，尚未建立完成时返回 None。
+        """
+        if not self.index_enabled:
+            return None
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = FileIndexWatcher(self.path, max_age=self.refresh_seconds)
+                self._watcher.start()
+            watcher = self._watcher
+        if wait:
+            watcher.ready.wait(timeout)
+        return watcher.index
+
+    def built_index(self):
+        """已建立完成的索引，不触发建立。"""
+        watcher = self._watcher
+        return watcher.index if watcher is not None else None
+
+    def relative_path(self, absolute_path):
+        """绝对路径位于该项目之内时返回相对路径，否则返回 None。"""
+        path = os.path.normcase(os.path.realpath(absolute_path))
+        if path != self.realpath and path.startswith(self.realpath.rstrip(os.sep) + os.sep):
+            return os.path.relpath(path, self.realpath)
+        return None
+
+    def stop(self):
+        with self._lock:
+            if self._watcher is not None:
+                self._watcher.stop()
+                self._watcher = None
+
+
+class ProjectRouter:
+    """
+    在多个命名项目根目录之间分配代码块，并按项目分别生成计划后合并（apply_engine.merge_plans）。
+
+    每个代码块按以下顺序确定项目：
+    1. 代码块之前的 `#### project: <名称>` 指令，或调用方为整个载荷指定的项目（例如接收端点请求中的 project）；
+    2. 绝对路径所在的项目；
+    3. 路径已存在的项目（默认项目优先）；
+    4. 父目录只在一个项目中存在；
+    5. 文件索引：路径末尾匹配的组成部分最多的项目唯一时选择它（索引尚未建立完成的项目见 _project_indexes）；
+    仍无法确定的代码块跟随同一载荷中多数代码块所在的项目，载荷中没有能确定项目的代码块时使用默认项目。
+    只配置了一个项目时直接使用它，不做任何检查。
+    """
+    def __init__(self, index_enabled=True, refresh_seconds=DEFAULT_REFRESH_SECONDS, wait_for_index=False):
+        self.index_enabled = index_enabled
+        self.refresh_seconds = refresh_seconds
+        self.wait_for_index = wait_for_index # 为 True 时规划和路由前等待索引建立完成（命令行模式）；GUI 模式不等待
+        self.projects = () # 默认项目在第一个
+        self._lock = threading.Lock()
+
+    def configure(self, default_root, projects=()):
+        """
+        设置默认根目录和 (名称, 路径) 列表。路径相同的项目沿用原来的 ProjectRoot（及其索引），
+        不再使用的项目停止刷新索引。默认根目录不在 projects 中时以目录名命名。
+        """
+        with self._lock:
+            existing = {project.path: project for project in self.projects}
+            named = [(name, os.path.abspath(path)) for name, path in projects]
+            if default_root:
+                default_root = os.path.abspath(default_root)
+                default_name = next((name for name, path in named if path == default_root), None)
+                named = [(default_name or os.path.basename(default_root.rstrip(os.sep)) or default_root, default_root)] + \
+                        [(name, path) for name, path in named if path != default_root]
+            roots = []
+            for name, path in named:
+                project = existing.pop(path, None)
+                if project is None or project.index_enabled != self.index_enabled:
+                    if project is not None:
+                        project.stop()
+                    project = ProjectRoot(name, path, self.index_enabled, self.refresh_seconds)
+                project.name = name
+                roots.append(project)
+            self.projects = tuple(roots)
+        for project in existing.values():
+            project.stop()
+
+    @property
+    def default(self):
+        projects = self.projects
+        return projects[0] if projects else None
+
+    def by_name(self, name):
+        """按名称查找项目（不区分大小写），找不到时返回 None。"""
+        key = name.casefold()
+        return next((project for project in self.projects if project.name.casefold() == key), None)
+
+    def by_root_folder(self, root_folder):
+        path = os.path.abspath(root_folder)
+        return next((project for project in self.projects if project.path == path), None)
+
+    def file_index_for(self, root_folder):
+        """根目录对应的已建立完成的文件索引，用于提交后更新索引；不触发建立。"""
+        project = self.by_root_folder(root_folder)
+        return project.built_index() if project is not None else None
+
+    def start_default_index(self):
+        """在后台开始建立默认项目的索引，不推迟启动。"""
+        if self.default is not None:
+            self.default.file_index()
+
+    def route(self, blocks, project=None):
+        """
+        将代码块分配到项目，返回 ([(ProjectRoot, [代码块, ...]), ...], 路由说明)，按各项目首次出现的顺序排列。
+        project 为整个载荷指定的项目名，代码块自己的项目指令优先。
+        """
+        projects = self.projects
+        if not projects:
+            return [], []
+        notes = []
+        assigned = [] # (代码块, ProjectRoot 或 None)
+        indexes = [] # 第一次需要按索引路由时填充，同一载荷只等待一次
+
+        def project_indexes():
+            if not indexes:
+                indexes.append(self._project_indexes(projects))
+            return indexes[0]
+
+        for block in blocks:
+            tag = block.project or project
+            if tag:
+                target = self.by_name(tag)
+                if target is None:
+                    print(f"[WARNING] 代码块 '{block.filename.strip()}' 指定的项目 '{tag}' 未配置，跳过此代码块。", file=sys.stderr)
+                    notes.append(f"- '{block.filename.strip()}' 指定的项目 '{tag}' 未配置，已跳过")
+                    continue
+                assigned.append((block, target))
+            elif len(projects) == 1:
+                assigned.append((block, projects[0]))
+            else:
+                block, target, note = self._route_untagged(block, projects, project_indexes)
+                if note is not None:
+                    notes.append(note)
+                assigned.append((block, target))
+
+        decided = Counter(target.path for _, target in assigned if target is not None)
+        fallback = projects[0]
+        if decided:
+            top = max(decided.values())
+            fallback = next(target for _, target in assigned if target is not None and decided[target.path] == top)
+        groups = {}
+        for block, target in assigned:
+            target = target or fallback
+            groups.setdefault(target.path, (target, []))[1].append(block)
+        return list(groups.values()), notes
+
+    def _project_indexes(self, projects):
+        """
+        返回 [(ProjectRoot, FileIndex), ...]，只包含已建立完成的索引。所有项目的索引同时开始建立；
+        wait_for_index 为 True 时共用一个 INDEX_WAIT_SECONDS 的期限等待，否则（GUI 模式）不等待，
+        尚未建立完成的项目这一次不参与按索引路由。
+        """
+        for target in projects:
+            target.file_index()
+        deadline = time.monotonic() + INDEX_WAIT_SECONDS
+        indexes = []
+        for target in projects:
+            if self.wait_for_index:
+                file_index = target.file_index(wait=True, timeout=max(0.0, deadline - time.monotonic()))
+            else:
+                file_index = target.built_index()
+            if file_index is not None:
+                indexes.append((target, file_index))
+        return indexes
+
+    def _route_untagged(self, block, projects, project_indexes):
+        """
+        返回 (代码块, ProjectRoot 或 None, 路由说明或 None)；绝对路径会改写为项目内的相对路径。
+        project_indexes() 返回 _project_indexes 的结果，只在需要按索引路由时调用。
+        """
+        filename = block.filename.strip()
+        if os.path.isabs(filename):
+            for target in projects:
+                relative = target.relative_path(filename)
+                if relative is not None:
+                    return block._replace(filename=relative), target, None
+            return block, projects[0], None
+
+        existing = [target for target in projects if os.path.exists(os.path.join(target.path, filename))]
+        if existing:
+            return block, existing[0], None
+        directory = os.path.dirname(filename)
+        if directory:
+            with_directory = [target for target in projects if os.path.isdir(os.path.join(target.path, directory))]
+            if len(with_directory) == 1:
+                return block, with_directory[0], None
+
+        if not self.index_enabled:
+            return block, None, None
+        best, best_length = [], 0
+        for target, file_index in project_indexes():
+            matched = file_index.resolve(filename, limit=1).matched
+            if matched > best_length:
+                best, best_length = [target], matched
+            elif matched and matched == best_length:
+                best.append(target)
+        if len(best) == 1:
+            return block, best[0], f"- '{filename}' 按项目中的现有文件路由到项目 '{best[0].name}'"
+        return block, None, None
+
+    def plan_blocks(self, blocks, confirm_overwrite_on_create, project=None, fs=None, max_workers=DEFAULT_IO_WORKERS,
+                    redirect_missing=False):
+        """
+        路由代码块并为每个项目生成计划（各项目并行读取和比对），返回合并后的 ApplyPlan。
+        confirm_overwrite_on_create 在各项目的规划线程中串行调用。
+        redirect_missing 见 apply_engine.plan_blocks：只有计划会交给用户确认时才为 True。
+        """
+        groups, notes = self.route(blocks, project)
+        if not groups:
+            # 没有可用的代码块时仍返回默认项目下的空计划（带上路由说明）
+            default = self.default
+            return merge_plans([(default.name if default else None,
+                                 plan_blocks([], default.path if default else '', confirm_overwrite_on_create, fs=fs))],
+                               notes)
+        confirm_lock = threading.Lock()
+
+        def confirm(filename, target_path):
+            with confirm_lock:
+                return confirm_overwrite_on_create(filename, target_path)
+
+        def plan_project(group):
+            target, project_blocks = group
+            return target.name, plan_blocks(project_blocks, target.path, confirm, fs=fs, max_workers=max_workers,
+                                            file_index=target.file_index(wait=self.wait_for_index),
+                                            redirect_missing=redirect_missing)
+
+        return merge_plans(map_in_pool(plan_project, groups, len(groups)), notes)
+
+    def note_committed(self, plan, errors=()):
+        """提交后更新计划涉及的各项目的文件索引。"""
+        for root_folder in plan.root_folders():
+            file_index = self.file_index_for(root_folder)
+            if file_index is not None:
+                file_index.note_committed(plan, errors)
+
+    def stop(self):
+        with self._lock:
+            projects, self.projects = self.projects, ()
+        for project in projects:
+            project.stop()
+
+
+if __name__ == '__main__':
+    # 直接运行 `python project_router.py`：在临时目录中创建 12 个项目，比较一个载荷同时修改多个项目时
+    # 逐个项目规划与按项目并行规划的耗时，以及切换默认项目的耗时。路由规则的检查见 tests/test_project_router.py。
+    import tempfile
+    from block_scanner import scan_blocks
+    from file_system import LatencyFileSystem
+
+    def block_text(filename, operation, content):
+        return f"#### file: {filename} ({operation})\n```\n{content}\n```\n"
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        projects = []
+        for number in range(12):
+            name = f"proj{number}"
+            for relative in (f"src/{name}/main.py", "README.md", f"lib/mod{number}/util.py"):
+                path = os.path.join(temp_dir, name, relative)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write("x = 1\n")
+            projects.append((name, os.path.join(temp_dir, name)))
+
+        router = ProjectRouter(wait_for_index=True)
+        router.configure(projects[0][1], projects)
+        never = lambda filename, target_path: False
+
+        # 切换默认项目时沿用已建立的索引
+        started = time.perf_counter()
+        router.configure(projects[5][1], projects)
+        print(f"切换默认项目: {(time.perf_counter() - started) * 1000:.2f} ms")
+
+        # 一个载荷修改 12 个项目：逐个项目规划与按项目并行规划（每次文件访问注入 5 ms 延迟）
+        wide = "".join(f"#### project: {name}\n" + block_text(f"src/{name}/main.py", "OVERWRITE", name + "!")
+                       + block_text("README.md", "OVERWRITE", name + "?") for name, _ in projects)
+        blocks = list(scan_blocks(wide))
+        slow_fs = LatencyFileSystem(latency=0.005)
+        started = time.perf_counter()
+        for target, project_blocks in router.route(blocks)[0]:
+            plan_blocks(project_blocks, target.path, never, fs=slow_fs, max_workers=1)
+        serial = time.perf_counter() - started
+        started = time.perf_counter()
+        router.plan_blocks(blocks, never, fs=slow_fs, max_workers=1)
+        parallel = time.perf_counter() - started
+        print(f"12 个项目 x 2 个文件: 逐个项目 {serial * 1000:.0f} ms, 按项目并行 {parallel * 1000:.0f} ms")
+        router.stop()
@@ -0,0 +1,83 @@
+import sys
+import time
+import builtins
+import threading
+import contextlib
+
+PROFILE_STARTUP_FLAG = '--profile-startup'
+
+
+class StartupProfiler:
+    """
+    记录启动过程中每个模块的导入耗时和各初始化阶段的耗时（`--profile-startup`）。
+    导入耗时通过临时替换 builtins.__import__ 统计，只记录首次导入；
+    self 为扣除嵌套导入后的自身耗时，cumulative 包含嵌套导入。
+    未启用时 phase() 只是一个空的上下文管理器。
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.imports = [] # (模块名, 自身秒数, 累计秒数, 嵌套深度)
+        self.phases = [] # (阶段名, 秒数, 所在线程名)
+        self._original_import = None
+        self._stack = [] # 正在导入的模块：[子模块累计耗时]
+        self._lock = threading.Lock()
+        if enabled:
+            self._install()
+
+    @classmethod
+    def from_argv(cls, argv):
+        return cls(enabled=PROFILE_STARTUP_FLAG in argv)
+
+    def _install(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # 相对导入、已导入的模块以及其他线程中的导入不计时
+        if level or name in sys.modules or threading.current_thread() is not threading.main_thread():
+            return self._original_import(name, globals, locals, fromlist, level)
+        self._stack.append([0.0])
+        started = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            cumulative = time.perf_counter() - started
+            children = self._stack.pop()[0]
+            if self._stack:
+                self._stack[-1][0] += cumulative
+            self.imports.append((name, cumulative - children, cumulative, len(self._stack)))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """统计一个初始化阶段的耗时，可在任意线程中使用。"""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.append((name, time.perf_counter() - started, threading.current_thread().name))
+
+    def report(self, top=25):
+        """返回启动报告文本：从进程开始计时到现在的总耗时、各阶段耗时和最慢的顶层导入。"""
+        elapsed = time.perf_counter() - self.started
+        lines = [f"[INFO] 启动耗时报告（自开始计时 {elapsed * 1000:.1f} ms）"]
+        with self._lock:
+            phases = list(self.phases)
+        lines.append("  初始化阶段:")
+        for name, seconds, thread_name in phases:
+            lines.append(f"    {seconds * 1000:9.2f} ms  {name}" + (f"  [{thread_name}]" if thread_name != 'MainThread' else ""))
+        top_level = sorted((record for record in self.imports if record[3] == 0), key=lambda record: -record[2])
+        lines.append(f"  导入耗时（顶层模块，共 {len(self.imports)} 个模块，累计 {sum(r[2] for r in top_level) * 1000:.1f} ms）:")
+        lines.append("    累计 ms    自身 ms  模块")
+        for name, self_seconds, cumulative, _ in top_level[:top]:
+            lines.append(f"    {cumulative * 1000:8.2f}  {self_seconds * 1000:8.2f}  {name}")
+        return "\n".join(lines)
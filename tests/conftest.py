@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# 各模块位于仓库根目录（没有打包配置），测试直接导入
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def apply_payload():
+    """规划并提交一个载荷（所有确认都同意），返回 (计划, 失败列表)。关键字参数传给 plan_blocks 和 commit_plan。"""
+    from apply_engine import commit_plan, plan_blocks
+    from block_scanner import scan_blocks
+
+    def run(root, payload, zero_copy=None, fs=None, max_workers=4, **commit_options):
+        plan = plan_blocks(list(scan_blocks(payload, zero_copy)), root, lambda *_: True, fs=fs, max_workers=max_workers)
+        errors = commit_plan(plan, fs=fs, max_workers=max_workers, **commit_options)
+        return plan, errors
+    return run
@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+from apply_engine import commit_plan, plan_blocks
+from block_scanner import scan_blocks
+from file_system import CountingFileSystem
+
+
+def block_text(filename, operation, content):
+    return f"#### file: {filename} ({operation})\n```\n{content}\n```\n"
+
+
+# 同一路径上的多个代码块：(名称, 原内容, [(操作, 内容)], 最终内容, 写入/删除次数)
+SCRIPTED_CASES = [
+    ("CREATE→APPEND→OVERWRITE", None, [("CREATE", "a"), ("APPEND", "b"), ("OVERWRITE", "final")], "final", 1),
+    ("CREATE→APPEND (新文件)", None, [("CREATE", "a"), ("APPEND", "b")], "a\nb", 1),
+    ("APPEND×3 (只追加)", "head\n", [("APPEND", "1"), ("APPEND", "2"), ("APPEND", "3")], "head\n1\n2\n3", 1),
+    ("CREATE→PATCH", None, [("CREATE", "x = 1\ny = 2"), ("PATCH", "@@ -1,2 +1,2 @@\n x = 1\n-y = 2\n+y = 3")],
+     "x = 1\ny = 3", 1),
+    ("CREATE→DELETE (新文件)", None, [("CREATE", "tmp"), ("DELETE", "")], None, 0),
+    ("DELETE→CREATE", "old", [("DELETE", ""), ("CREATE", "new")], "new", 1),
+    ("OVERWRITE→OVERWRITE 改回", "same", [("OVERWRITE", "other"), ("OVERWRITE", "same")], "same", 0),
+]
+
+
+@pytest.mark.parametrize('zero_copy', [False, True])
+@pytest.mark.parametrize('label, existing, operations, expected, expected_writes', SCRIPTED_CASES,
+                         ids=[case[0] for case in SCRIPTED_CASES])
+def test_same_path_blocks_read_and_write_once(tmp_path, zero_copy, label, existing, operations, expected, expected_writes):
+    """同一路径上的多个代码块：每个路径至多读取一次、写入一次，结果与逐个代码块依次执行一致。"""
+    root = str(tmp_path)
+    target = os.path.join(root, 'a.py')
+    if existing is not None:
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(existing)
+    payload = "".join(block_text('a.py', operation, body) for operation, body in operations)
+    fs = CountingFileSystem()
+    plan = plan_blocks(list(scan_blocks(payload, zero_copy=zero_copy)), root, lambda *_: True, fs=fs)
+    assert commit_plan(plan, fs=fs) == []
+    actual = None
+    if os.path.exists(target):
+        with open(target, 'r', encoding='utf-8') as f:
+            actual = f.read()
+    assert actual == expected
+    assert fs.reads.get(target, 0) <= 1
+    assert fs.writes.get(target, 0) + (1 if existing is not None and actual is None else 0) == expected_writes
+
+
+def test_append_reads_only_the_tail(tmp_path, apply_payload):
+    """APPEND 的读取量与新内容长度成正比，与文件大小无关。"""
+    root = str(tmp_path)
+    with open(os.path.join(root, 'CHANGELOG.md'), 'w', encoding='utf-8') as f:
+        f.write("- old entry\n" * 100000)
+    fs = CountingFileSystem()
+    apply_payload(root, block_text('CHANGELOG.md', 'APPEND', "- new entry"), fs=fs)
+    assert fs.bytes_read < 64 * 1024
+    plan, _ = apply_payload(root, block_text('CHANGELOG.md', 'APPEND', "- new entry"), fs=fs)
+    assert plan.is_empty() # 重复追加同一内容时识别为已追加
+    with open(os.path.join(root, 'CHANGELOG.md'), encoding='utf-8') as f:
+        assert f.read().endswith("- old entry\n- new entry")
+
+
+def test_base64_alias_is_binary(tmp_path, apply_payload):
+    root = str(tmp_path)
+    plan, errors = apply_payload(root, "#### file: data.bin (base64)\n```\nAAEC/w==\n```\n")
+    assert not errors
+    with open(os.path.join(root, 'data.bin'), 'rb') as f:
+        assert f.read() == b"\x00\x01\x02\xff"
+
+
+def test_create_over_existing_file_needs_confirmation(tmp_path):
+    root = str(tmp_path)
+    with open(os.path.join(root, 'a.py'), 'w', encoding='utf-8') as f:
+        f.write("old\n")
+    plan = plan_blocks(list(scan_blocks(block_text('a.py', 'CREATE', "new"))), root, lambda *_: False)
+    assert plan.is_empty()
+    plan = plan_blocks(list(scan_blocks(block_text('a.py', 'CREATE', "new"))), root, lambda *_: True)
+    assert [file_info['operation'] for file_info in plan.files_to_write] == ["OVERWRITE_ON_CREATE"]
+
+
+@pytest.mark.parametrize('zero_copy', [False, True])
+def test_large_crlf_payload(tmp_path, apply_payload, zero_copy):
+    """大载荷（CRLF、含中文）的覆盖、内容一致判断和追加。"""
+    root = str(tmp_path)
+    row = "INSERT INTO fixtures VALUES (1, 'name', '数据', 3.14);\r\n"
+    body = row * (2 * 1024 * 1024 // len(row))
+    expected = body.replace('\r\n', '\n').strip()
+    with open(os.path.join(root, 'dump_same.sql'), 'w', encoding='utf-8') as f:
+        f.write(body.replace('\r\n', '\n'))
+    with open(os.path.join(root, 'dump_log.sql'), 'w', encoding='utf-8') as f:
+        f.write("-- log\n")
+    payload = "".join(f"#### file: {name} ({operation})\n```sql\n{body}```\n" for name, operation in (
+        ("dump_new.sql", "OVERWRITE"), ("dump_same.sql", "CREATE"), ("dump_log.sql", "APPEND")))
+    plan, errors = apply_payload(root, payload, zero_copy=zero_copy)
+    assert not errors
+    assert sorted(os.path.basename(f['target_path']) for f in plan.files_to_write) == ['dump_log.sql', 'dump_new.sql']
+    with open(os.path.join(root, 'dump_new.sql'), encoding='utf-8', newline='') as f:
+        assert f.read() == expected
+    with open(os.path.join(root, 'dump_log.sql'), encoding='utf-8', newline='') as f:
+        assert f.read() == "-- log\n" + expected
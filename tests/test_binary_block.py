@@ -0,0 +1,79 @@
+import base64
+import hashlib
+import io
+import os
+
+import pytest
+
+from binary_block import (BINARY_CHUNK_CHARS, BinaryContent, BinaryContentError, format_binary_block,
+                          split_integrity)
+from text_span import TextSpan
+
+
+@pytest.mark.parametrize('size', [0, 1, 2, 3, 100, 3 * 1024 + 1])
+def test_chunked_decoding_matches_one_shot(size):
+    """任意块大小、折行、CRLF 和缩进都不影响结果。"""
+    data = os.urandom(size)
+    encoded = base64.b64encode(data).decode('ascii')
+    wrapped = "\r\n  ".join(encoded[i:i + 60] for i in range(0, len(encoded), 60))
+    for chunk_chars in (1, 5, 64, BINARY_CHUNK_CHARS):
+        for content in (BinaryContent(wrapped), BinaryContent(TextSpan("xx" + wrapped + "yy", 2, 2 + len(wrapped)))):
+            assert b"".join(content.iter_bytes(chunk_chars)) == data
+    assert BinaryContent(wrapped).summary() == (size, hashlib.sha256(data).hexdigest())
+
+
+@pytest.mark.parametrize('content', [
+    BinaryContent("QUJD$EFG"),
+    BinaryContent("QUJDRA"),
+    BinaryContent("QQ"),
+    BinaryContent("QQ==QUJD"),
+    BinaryContent("QUJD", "0" * 64),
+], ids=["非 base64 字符", "长度不完整", "缺少填充", "填充之后还有内容", "sha256 不符"])
+def test_invalid_content_is_rejected(content):
+    with pytest.raises(BinaryContentError):
+        content.summary()
+
+
+def test_split_integrity():
+    assert split_integrity("BINARY sha256=" + "AB" * 32) == ("BINARY", "ab" * 32)
+    assert split_integrity("BINARY") == ("BINARY", None)
+
+
+@pytest.fixture
+def icon():
+    """托盘图标的 PNG 字节；未安装 Pillow 时改用随机字节。"""
+    try:
+        from icon_creator import create_default_icon
+    except ImportError:
+        return os.urandom(4096)
+    buffer = io.BytesIO()
+    create_default_icon().save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_round_trip(tmp_path, apply_payload, icon):
+    root = str(tmp_path)
+    target = os.path.join(root, 'assets', 'icon.png')
+    block = format_binary_block("assets/icon.png", icon)
+    plan, errors = apply_payload(root, block)
+    assert not errors
+    with open(target, 'rb') as f:
+        assert f.read() == icon
+    plan, _ = apply_payload(root, block)
+    assert plan.is_empty() # 重复写入时判定为内容一致
+
+
+def test_checksum_mismatch_is_skipped(tmp_path, apply_payload, icon):
+    root = str(tmp_path)
+    block = format_binary_block("assets/other.png", icon)
+    corrupted = block.replace(f"sha256={hashlib.sha256(icon).hexdigest()}", "sha256=" + "0" * 64)
+    plan, _ = apply_payload(root, corrupted)
+    assert plan.is_empty()
+    assert not os.path.exists(os.path.join(root, 'assets', 'other.png'))
+
+
+def test_mixed_with_text_blocks_on_same_path_is_skipped(tmp_path, apply_payload, icon):
+    root = str(tmp_path)
+    block = format_binary_block("assets/icon.png", icon)
+    plan, _ = apply_payload(root, block + "#### file: assets/icon.png (APPEND)\n```\ntext\n```\n")
+    assert plan.is_empty()
@@ -0,0 +1,76 @@
+import pytest
+
+from block_scanner import _legacy_blocks, _normalized, scan_blocks
+from text_span import as_text
+
+# 与旧正则（LEGACY_CLIPBOARD_PATTERN）对照的语料：扫描器的结果必须与之一致
+LEGACY_CORPUS = [
+    "#### file: a.py (CREATE)\n```python\nprint('a')\n```\n",
+    "说明文字\n#### file: src/b.py (OVERWRITE)```py\r\ndef b():\r\n    return 1\r\n```\r\n尾部",
+    "#### File:  dir with space/c.txt  ( 追加 )\n\n   ```\n\n  line\n  ```  \n",
+    "#### file: d.js (删除)\n```\n```\n#### file: e.js (修改)\n```js\nconsole.log(1)\n```",
+    "#### file: f (v2).py (APPEND)\n```\nx = 1\n```\n\n#### file: g.py (create)\n```\ny\n```\n",
+    "no directives here\n```\ncode\n```\n",
+    "#### file: h.py (CREATE)\n```python\nunterminated\n",
+    "#### file: i.py (CREATE)\n```\r\na\r\nb\n```",
+    # 内容中的 ```python 没有关闭：在第一个单独的 ``` 行结束 a.md，b.py 照常解析
+    "#### file: a.md (CREATE)\n```\n介绍\n```python\nx = 1\n```\n#### file: b.py (CREATE)\n```\ny\n```\n",
+    "#### file: c.md (CREATE)\n```\n```python\nx\n```\n#### file: d.py (CREATE)\n```python\nz\n```\n尾部\n```\n",
+]
+
+
+@pytest.mark.parametrize('sample', LEGACY_CORPUS)
+def test_matches_legacy_pattern(sample):
+    assert _normalized(scan_blocks(sample)) == _normalized(_legacy_blocks(sample))
+
+
+@pytest.mark.parametrize('sample', LEGACY_CORPUS)
+def test_zero_copy_matches_copy(sample):
+    # TextSpan 在取出内容时标准化换行符，复制的内容保留原样
+    spans = [block._replace(content=as_text(block.content)) for block in scan_blocks(sample, zero_copy=True)]
+    copies = [block._replace(content=block.content.replace('\r\n', '\n')) for block in scan_blocks(sample, zero_copy=False)]
+    assert spans == copies
+
+
+def test_unbalanced_inner_fence_warns(capsys):
+    list(scan_blocks(LEGACY_CORPUS[8]))
+    assert "'a.md'" in capsys.readouterr().err
+
+
+def test_nested_fences():
+    nested = "#### file: README.md (CREATE)\n```markdown\n示例：\n```python\nx = 1\n```\n```\n"
+    assert _normalized(scan_blocks(nested)) == [('README.md', 'CREATE', 'markdown', '示例：\n```python\nx = 1\n```')]
+
+
+def test_project_directives():
+    tagged = ("#### file: a.py (CREATE)\n```\na\n```\n#### project: web\n#### file: b.py (CREATE)\n```\nb\n```\n"
+              "#### project:\n#### file: c.py (CREATE)\n```\nc\n```\n")
+    assert [(block.filename, block.project) for block in scan_blocks(tagged)] == [('a.py', None), ('b.py', 'web'), ('c.py', None)]
+
+
+def test_project_directive_inside_block_is_content():
+    notes = "#### file: notes.md (CREATE)\n```markdown\n# Notes\n#### project: roadmap\nitems\n```\n#### file: d.py (CREATE)\n```\nd\n```\n"
+    blocks = list(scan_blocks(notes))
+    assert _normalized(blocks) == _normalized(_legacy_blocks(notes))
+    assert [block.project for block in blocks] == [None, None]
+
+
+def test_header_without_fence_is_content():
+    """块内的指令行后面没有围栏行时不会打断代码块，与旧正则一致。"""
+    doc = "#### file: doc.md (CREATE)\n```\nUse this syntax:\n#### file: x.py (CREATE)\nthen a fence\n```\n"
+    assert _normalized(scan_blocks(doc)) == _normalized(_legacy_blocks(doc))
+    assert _normalized(scan_blocks(doc)) == [('doc.md', 'CREATE', '', 'Use this syntax:\n#### file: x.py (CREATE)\nthen a fence')]
+
+
+def test_interrupted_block_closed_after_example():
+    """被示例代码块打断的代码块：示例结束后出现单独的 ``` 行，则示例只是内容。"""
+    doc = "#### file: doc.md (CREATE)\n```\nUse:\n#### file: x.py (CREATE)\n```python\nx\n```\nmore\n```\n"
+    assert _normalized(scan_blocks(doc)) == [('doc.md', 'CREATE', '', 'Use:\n#### file: x.py (CREATE)\n```python\nx\n```\nmore')]
+
+
+def test_unclosed_block_is_skipped_with_warning(capsys):
+    forgot = ("#### file: a.py (CREATE)\n```\nforgot\n#### file: b.py (CREATE)\n```\nb\n```\n"
+              "#### file: c.py (CREATE)\n```\nc\n```\n#### file: d.py (CREATE)\n```\nunterminated\n")
+    assert [block.filename for block in scan_blocks(forgot)] == ['b.py', 'c.py']
+    err = capsys.readouterr().err
+    assert "文件 'a.py' 的代码块未闭合，已跳过" in err and "'d.py'" in err
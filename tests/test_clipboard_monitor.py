@@ -0,0 +1,99 @@
+import time
+from queue import Empty, Queue
+
+import pytest
+
+from clipboard_events import FakeClipboardEventSource
+from clipboard_monitor import COALESCE_MAX_DELAY_FACTOR, ClipboardMonitor
+
+
+def payload(name, value):
+    return f"#### file: {name} (CREATE)\n```python\nVALUE = {value}\n```\n"
+
+
+def run_script(script, window):
+    """回放脚本化的事件流，返回 (入队的文本, 读取剪贴板的次数, 合并统计)。"""
+    source = FakeClipboardEventSource(record_copy_times=False)
+    queued = Queue()
+    reads = []
+    monitor = ClipboardMonitor(queued, event_source=source, coalesce_window=window)
+    original_read = source.read_text
+    source.read_text = lambda: reads.append(1) or original_read() # 统计读取剪贴板的次数
+    monitor.start()
+    source.play(script)
+    time.sleep(max(0.05, window * COALESCE_MAX_DELAY_FACTOR + 0.05)) # 等待最后一组事件被处理
+    monitor.stop()
+    texts = []
+    while True:
+        try:
+            texts.append(queued.get_nowait().text)
+        except Empty:
+            return texts, len(reads), monitor.coalescing_stats()
+
+
+SCENARIOS = [
+    # 一次复制触发 5 个更新事件（多种格式 + 重复通知），间隔约 1 ms
+    ("一次复制，5 个事件", [(0.0, payload("a.py", 1))] + [(0.001, payload("a.py", 1))] * 4, {payload("a.py", 1)}),
+    # 先写入非文本格式，最后才有 CF_UNICODETEXT
+    ("先无文本后有文本", [(0.0, None), (0.002, None), (0.002, payload("b.py", 2))], {payload("b.py", 2)}),
+    # 两次间隔 200 ms 的独立复制
+    ("两次独立复制", [(0.0, payload("c.py", 1)), (0.2, payload("c.py", 2))], {payload("c.py", 1), payload("c.py", 2)}),
+    # 某些工具的“全选-复制”循环：每 25 ms 一次，内容不断变化，持续 1 秒
+    ("全选-复制循环", [(0.025, payload("loop.py", i)) for i in range(40)], {payload("loop.py", 39)}),
+]
+
+
+@pytest.mark.parametrize('window', [0.0, 0.030])
+@pytest.mark.parametrize('label, script, must_include', SCENARIOS, ids=[scenario[0] for scenario in SCENARIOS])
+def test_coalescing_keeps_final_content(window, label, script, must_include):
+    texts, reads, stats = run_script(script, window)
+    assert must_include.issubset(texts)
+    if window:
+        # 合并后每组事件只读取一次剪贴板
+        assert reads <= max(2, len(script) // 5)
+        assert stats['suppressed'] == len(script) - reads
+    else:
+        assert stats is None and reads == len(script)
+
+
+def test_seen_and_plain_content_are_dropped():
+    """按内容摘要去重（A、B、A 中第二个 A 不再入队），不含文件指令的内容也不入队。"""
+    script = [(0.0, payload("a.py", 1)), (0.01, payload("b.py", 2)), (0.01, payload("a.py", 1)), (0.01, "plain text")]
+    texts, _, _ = run_script(script, 0.0)
+    assert texts == [payload("a.py", 1), payload("b.py", 2)]
+
+
+def start_monitor(window):
+    source = FakeClipboardEventSource()
+    queued = Queue()
+    monitor = ClipboardMonitor(queued, event_source=source, coalesce_window=window)
+    monitor.start()
+    return source, queued, monitor
+
+
+@pytest.mark.parametrize('window', [0.0, 0.030])
+def test_idle_has_no_wakeups(window):
+    """没有复制时事件源和合并线程都阻塞等待，没有定时唤醒。"""
+    source, queued, monitor = start_monitor(window)
+    try:
+        with pytest.raises(Empty):
+            queued.get(timeout=0.2)
+        assert source.wakeups == 0
+        assert monitor.coalescer is None or monitor.coalescer.fired == 0
+    finally:
+        monitor.stop()
+
+
+@pytest.mark.parametrize('window', [0.0, 0.030])
+def test_dispatch_follows_copy_within_window(window):
+    """每次复制后等待入队事件：处理在合并窗口（加调度余量）之内完成，每次复制只唤醒一次。"""
+    source, queued, monitor = start_monitor(window)
+    try:
+        for value in range(20):
+            text = payload("f.py", value)
+            source.copy(text)
+            assert queued.get(timeout=5).text == text
+            assert source.latency_since_copy(text) < window + 0.25
+        assert source.wakeups == 20
+    finally:
+        monitor.stop()
@@ -0,0 +1,76 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from config_manager import ConfigManager
+from config_watcher import ConfigWatcher
+
+
+def write_config(path, data, mtime=None):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    if mtime is not None:
+        os.utime(path, ns=(mtime * 10**9, mtime * 10**9))
+
+
+def test_polling_parses_only_on_change(tmp_path):
+    config_path = str(tmp_path / 'config.json')
+    write_config(config_path, {'root_folder': str(tmp_path)}, mtime=1)
+    manager = ConfigManager(config_file=config_path)
+    changes = []
+    watcher = ConfigWatcher(manager, changes.append, backend=None)
+    assert not watcher.uses_push
+    for second in range(100):
+        if second in (10, 40):
+            write_config(config_path, {'root_folder': str(tmp_path), 'revision': second}, mtime=second)
+        watcher.poll()
+    assert manager.stat_count == 100 and manager.parse_count == 3 # 启动时一次，每次变化一次
+    assert len(changes) == 2 and manager.config_data['revision'] == 40
+
+
+def test_push_backend_reloads_after_write(tmp_path):
+    config_path = str(tmp_path / 'config.json')
+    write_config(config_path, {'root_folder': str(tmp_path)})
+    manager = ConfigManager(config_file=config_path)
+    changes = []
+    watcher = ConfigWatcher(manager, changes.append)
+    if not watcher.uses_push:
+        pytest.skip("没有原生通知后端")
+    watcher.start()
+    try:
+        write_config(config_path, {'root_folder': str(tmp_path), 'revision': 'push'})
+        deadline = time.monotonic() + 5
+        while not changes and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        watcher.stop()
+    assert changes and manager.config_data['revision'] == 'push'
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason="需要 /proc/self/fd")
+def test_stop_releases_descriptors(tmp_path):
+    config_path = str(tmp_path / 'config.json')
+    write_config(config_path, {'root_folder': str(tmp_path)})
+    manager = ConfigManager(config_file=config_path)
+    before = len(os.listdir('/proc/self/fd'))
+    for _ in range(5):
+        watcher = ConfigWatcher(manager, lambda config: None)
+        if not watcher.uses_push:
+            pytest.skip("没有原生通知后端")
+        watcher.start()
+        watcher.stop()
+    assert len(os.listdir('/proc/self/fd')) == before
+    watcher.stop() # 重复调用无副作用
+
+
+def test_config_manager_imports_no_pipeline():
+    """校验配置只需 config_options，不会连带加载 asyncio 和写入模块。"""
+    code = ("import sys, config_manager; "
+            "print(sorted({'asyncio', 'pipeline', 'transaction', 'apply_engine'} & set(sys.modules)))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
@@ -0,0 +1,48 @@
+import pytest
+
+from content_compare import _read_normalized_text, content_matches_file
+from file_system import LocalFileSystem
+from text_span import TextSpan
+
+LINE = "value = '数据' + str(42)\r\n"
+
+
+def cases(unchanged):
+    return {
+        "内容一致": unchanged,
+        "开头不同": "# header\n" + unchanged[9:],
+        "末尾不同": unchanged[:-1] + "X",
+        "内容更长": unchanged + "\nextra" * 1000,
+        "内容更短": unchanged[:len(unchanged) // 2],
+    }
+
+
+@pytest.mark.parametrize('size', [1024, 1024 ** 2])
+def test_streaming_matches_full_decode(tmp_path, size):
+    """流式判定与完整解码（标准化换行并 strip() 后比较）的结果一致。"""
+    fs = LocalFileSystem()
+    path = str(tmp_path / 'target.txt')
+    file_text = LINE * (size // len(LINE.encode('utf-8')))
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(file_text + "\r\n\r\n")
+    unchanged = file_text.replace('\r\n', '\n').strip()
+    existing, _, _ = _read_normalized_text(fs, path)
+    for label, expected_text in cases(unchanged).items():
+        result, error, text_format = content_matches_file(fs, path, expected_text)
+        assert (result, error) == (existing.strip() == expected_text, None), label
+        assert text_format.newline == '\r\n'
+
+
+def test_text_span_content(tmp_path):
+    fs = LocalFileSystem()
+    path = str(tmp_path / 'target.txt')
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write("a = 1\r\nb = 2\r\n")
+    raw = "前缀a = 1\r\nb = 2后缀"
+    assert content_matches_file(fs, path, TextSpan(raw, 2, len(raw) - 2))[0]
+    assert not content_matches_file(fs, path, TextSpan(raw, 2, len(raw) - 3))[0]
+
+
+def test_missing_file_reports_error(tmp_path):
+    result, error, text_format = content_matches_file(LocalFileSystem(), str(tmp_path / 'missing.txt'), "x")
+    assert result is False and error is not None and text_format is None
@@ -0,0 +1,132 @@
+import difflib
+import os
+import random
+import time
+
+import pytest
+
+from apply_engine import plan_blocks
+from block_scanner import scan_blocks
+from diff_preview import PREVIEW_TIME_BUDGET, DiffPreviewer, _myers, diff_texts, match_lines
+
+
+def lcs_length(a, b):
+    row = [0] * (len(b) + 1)
+    for x in a:
+        previous_diagonal = 0
+        for j, y in enumerate(b):
+            current = row[j + 1]
+            row[j + 1] = previous_diagonal + 1 if x == y else max(row[j + 1], row[j])
+            previous_diagonal = current
+    return row[-1]
+
+
+def valid_matches(a, b, matches):
+    return all(a[i] == b[j] for i, j in matches) and all(
+        i1 < i2 and j1 < j2 for (i1, j1), (i2, j2) in zip(matches, matches[1:]))
+
+
+def edited(rng, lines, count):
+    lines = list(lines)
+    for _ in range(count):
+        position = rng.randrange(len(lines) + 1)
+        action = rng.randrange(3)
+        if action == 0:
+            lines.insert(position, f"inserted_{rng.random()}")
+        elif lines and position < len(lines):
+            if action == 1:
+                del lines[position]
+            else:
+                lines[position] = f"changed_{rng.random()}"
+    return lines
+
+
+def source_lines(count, seed):
+    return [f"    value_{seed}_{i} = compute({i})" if i % 7 else "" for i in range(count)]
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_myers_is_minimal(seed):
+    """Myers 的匹配有效且为最长公共子序列；match_lines 的匹配有效且精确。"""
+    rng = random.Random(seed)
+    for _ in range(30):
+        a = [rng.randrange(6) for _ in range(rng.randrange(40))]
+        b = [rng.randrange(6) for _ in range(rng.randrange(40))]
+        found = _myers(a, b, 0, len(a), 0, len(b), len(a) + len(b), None)
+        assert valid_matches(a, b, found)
+        assert len(found) == lcs_length(a, b)
+        matches, exact = match_lines(a, b)
+        assert exact and valid_matches(a, b, matches)
+
+
+def test_counts_not_worse_than_difflib():
+    rng = random.Random(7)
+    for case in range(30):
+        old = source_lines(rng.randrange(1, 400), case)
+        new = edited(rng, old, rng.randrange(1, 12))
+        summary = diff_texts("\n".join(old), "\n".join(new))
+        opcodes = difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes()
+        same = sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == 'equal')
+        assert summary.exact
+        assert summary.added <= len(new) - same and summary.removed <= len(old) - same
+
+
+def test_small_diff():
+    summary = diff_texts("a\nb\nc\nd\n", "a\nB\nc\nd\ne\n")
+    assert (summary.added, summary.removed, summary.hunk_count) == (2, 1, 1)
+    assert summary.hunks[0] == ("@@ -1,4 +1,5 @@", " a", "-b", "+B", " c", " d", "+e")
+    assert diff_texts("a\nb\n", "a\nb").added == 0 # 末尾换行不算修改
+
+
+def test_size_budget_estimates_counts():
+    huge = diff_texts("x\n" * 600000, "x\n" * 600001)
+    assert huge.added == 1 and not huge.exact and huge.note
+    rng = random.Random(1)
+    huge_old = source_lines(60000, 'huge')
+    estimated = diff_texts("\n".join(huge_old), "\n".join(edited(rng, huge_old, 40)))
+    assert not estimated.exact and not estimated.hunks
+
+
+def test_time_budget_marks_result_approximate():
+    """两侧各 20,000 行且没有唯一行、顺序完全打乱时，比较在预算附近停止。"""
+    rng = random.Random(7)
+    old = [f"line {i % 500}" for i in range(20000)]
+    new = list(old)
+    rng.shuffle(new)
+    started = time.perf_counter()
+    summary = diff_texts("\n".join(old), "\n".join(new))
+    assert not summary.exact
+    assert time.perf_counter() - started < PREVIEW_TIME_BUDGET * 4 + 0.1
+
+
+def test_large_file_with_few_edits_is_exact():
+    old = source_lines(25000, 'large')
+    assert diff_texts("\n".join(old), "\n".join(edited(random.Random(3), old, 40))).exact
+
+
+def test_plan_previews_and_cache(tmp_path):
+    root = str(tmp_path)
+    rng = random.Random(5)
+    parts = []
+    for i in range(20):
+        old = source_lines(300, i)
+        path = os.path.join(root, f"pkg{i % 4}", f"module_{i}.py")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write("\n".join(old) + "\n")
+        new = "\n".join(edited(rng, old, 5))
+        parts.append(f"#### file: pkg{i % 4}/module_{i}.py (OVERWRITE)\n```\n{new}\n```\n")
+    blocks = list(scan_blocks("".join(parts)))
+    previewer = DiffPreviewer()
+    try:
+        plan = plan_blocks(blocks, root, lambda *_: True)
+        previewer.start(plan).wait()
+        message = plan.build_prompt_message()
+        assert "差异预览" in message and "@@ -" in message
+        assert all(future.result().exact and future.result().added for _, future in plan.previews.entries)
+        # 同一内容再次规划（例如确认期间其他写入导致的重新规划）：全部命中缓存
+        plan = plan_blocks(blocks, root, lambda *_: True)
+        previewer.start(plan).wait()
+        assert previewer.cache.stats()['hits'] >= 20
+    finally:
+        previewer.close()
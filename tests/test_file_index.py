@@ -0,0 +1,114 @@
+import os
+import time
+
+import pytest
+
+from apply_engine import plan_blocks
+from block_scanner import scan_blocks
+from file_index import FileIndex, FileIndexWatcher
+
+PATHS = [
+    "packages/web/src/app.py",
+    "packages/web/src/__init__.py",
+    "packages/api/src/__init__.py",
+    "packages/api/src/handlers/users.py",
+    "packages/api/README.md",
+    "tools/build.py",
+]
+
+
+def touch(root, relative):
+    path = os.path.join(root, *relative.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("x = 1\n")
+    return path
+
+
+@pytest.fixture
+def disk_index(tmp_path):
+    root = str(tmp_path)
+    for relative in PATHS + ["node_modules/dep/ignored.js"]:
+        touch(root, relative)
+    return FileIndex.build(root)
+
+
+def test_resolve_in_memory():
+    index = FileIndex.from_paths('/nonexistent-root', PATHS)
+    assert index.file_count == len(PATHS)
+    assert index.resolve("users.py").path == "packages/api/src/handlers/users.py" # 只有文件名
+    assert index.resolve("wrong/handlers/users.py").path == "packages/api/src/handlers/users.py" # 目录不对
+    common = index.resolve("__init__.py")
+    assert common.path is None and set(common.candidates) == {"packages/web/src/__init__.py", "packages/api/src/__init__.py"}
+    assert index.resolve("api/src/__init__.py").path == "packages/api/src/__init__.py" # 更长的后缀唯一
+    assert index.resolve("missing.py").candidates == ()
+    truncated = index.resolve("__init__.py", limit=1)
+    assert truncated.truncated and len(truncated.candidates) == 1
+
+
+def test_build_ignores_dirs_and_finds_exact_paths(disk_index):
+    assert disk_index.resolve("ignored.js").candidates == ()
+    resolution = disk_index.resolve("tools/build.py")
+    assert resolution.exact and resolution.path == "tools/build.py"
+
+
+def test_refresh_picks_up_changes(disk_index):
+    root = disk_index.root
+    checked, rescanned = disk_index.refresh()
+    assert rescanned == 0
+    time.sleep(0.01) # 保证目录的 mtime 发生变化
+    touch(root, "packages/new/src/brand_new.py")
+    os.remove(os.path.join(root, 'tools', 'build.py'))
+    disk_index.refresh()
+    assert disk_index.resolve("brand_new.py").path == "packages/new/src/brand_new.py"
+    assert disk_index.resolve("build.py").candidates == ()
+
+
+def test_resolve_refreshes_stale_index(disk_index):
+    """不调用 refresh()，过期的索引在 resolve() 中发现新文件。"""
+    disk_index.max_age = 0
+    time.sleep(0.01)
+    touch(disk_index.root, "packages/api/src/lazy_new.py")
+    assert disk_index.resolve("lazy_new.py").path == "packages/api/src/lazy_new.py"
+
+
+def test_index_without_max_age_does_not_touch_disk(disk_index):
+    disk_index.max_age = None
+    time.sleep(0.01)
+    touch(disk_index.root, "packages/api/src/unseen.py")
+    assert disk_index.resolve("unseen.py").candidates == ()
+
+
+def test_note_committed(disk_index, apply_payload):
+    root = disk_index.root
+    disk_index.max_age = None
+    plan, errors = apply_payload(root, "#### file: tools/gen.py (CREATE)\n```\ny = 2\n```\n"
+                                       "#### file: packages/api/README.md (DELETE)\n```\n```\n")
+    disk_index.note_committed(plan, errors)
+    assert disk_index.resolve("gen.py").path == "tools/gen.py"
+    assert disk_index.resolve("README.md").candidates == ()
+
+
+def test_plan_redirects_only_when_confirmed(disk_index):
+    """唯一候选只是建议：redirect_missing 为 True 时才改用，DELETE 永远不改用。"""
+    root = disk_index.root
+    payload = "#### file: users.py (OVERWRITE)\n```\nusers = []\n```\n"
+    plan = plan_blocks(list(scan_blocks(payload)), root, lambda *_: True, file_index=disk_index)
+    assert [f['target_path'] for f in plan.files_to_write] == [os.path.join(root, 'users.py')]
+    assert any("未经确认不自动解析" in note for note in plan.path_notes)
+    plan = plan_blocks(list(scan_blocks(payload)), root, lambda *_: True, file_index=disk_index, redirect_missing=True)
+    assert [f['target_path'] for f in plan.files_to_write] == [os.path.join(root, 'packages', 'api', 'src', 'handlers', 'users.py')]
+    delete = "#### file: users.py (DELETE)\n```\n```\n"
+    plan = plan_blocks(list(scan_blocks(delete)), root, lambda *_: True, file_index=disk_index, redirect_missing=True)
+    assert plan.files_to_delete == []
+
+
+def test_watcher_builds_once(tmp_path):
+    touch(str(tmp_path), "a/b.py")
+    watcher = FileIndexWatcher(str(tmp_path), max_age=1.0)
+    watcher.start()
+    assert watcher.ready.wait(10)
+    assert watcher.index.resolve("b.py").path == "a/b.py"
+    assert watcher.index.max_age == 1.0
+    watcher.stop()
+    assert watcher.index.max_age is None
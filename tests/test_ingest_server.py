@@ -0,0 +1,112 @@
+import os
+import socket
+import stat
+from types import SimpleNamespace
+
+import pytest
+
+from ingest_server import FRAME_HEADER, IngestClient, IngestServer, decode_body, format_address, parse_address
+from pipeline import ApplyPipeline, PipelineFrontend
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="需要 Unix 域套接字")
+
+
+class RejectingFrontend(PipelineFrontend):
+    """需要确认的请求一律拒绝（默认实现），用于检查 cancelled 结果。"""
+
+
+def payload(name, value, operation='OVERWRITE'):
+    return f"#### file: {name} ({operation})\n```python\nVALUE = {value}\n```\n"
+
+
+@pytest.fixture
+def endpoint(tmp_path):
+    """启动流水线和两个接收端点：Unix 域套接字（自动批准）和 TCP（需要确认，前端一律拒绝）。"""
+    root = tmp_path / 'project'
+    root.mkdir()
+    pipeline = ApplyPipeline(RejectingFrontend(), lambda: str(root))
+    pipeline.start()
+    socket_path = str(tmp_path / 'autoapply.sock')
+    auto_server = IngestServer(pipeline, socket_path, auth_token='secret', auto_approve=True)
+    confirm_server = IngestServer(pipeline, 'tcp:127.0.0.1:0', auth_token='secret')
+
+    yield SimpleNamespace(root=str(root), socket_path=socket_path, auto_server=auto_server,
+                          unix_address=format_address(auto_server.start()),
+                          tcp_address=format_address(confirm_server.start()))
+    auto_server.stop()
+    confirm_server.stop()
+    pipeline.stop()
+    assert not os.path.exists(socket_path) # 停止后删除套接字文件
+
+
+def test_results_per_file(endpoint):
+    root = endpoint.root
+    with IngestClient(endpoint.unix_address, token='secret') as client:
+        created = client.request(payload('pkg/a.py', 1, 'CREATE'))
+        assert created['outcome'] == 'committed' and [f['status'] for f in created['files']] == ['written']
+        assert os.path.isfile(os.path.join(root, 'pkg', 'a.py'))
+        # 内容相同的请求不去重，返回 unchanged
+        same = client.request(payload('pkg/a.py', 1, 'CREATE'))
+        assert same['outcome'] == 'unchanged' and same['files'] == []
+        # 一个请求中的写入和删除分别返回结果
+        mixed = client.request(payload('pkg/b.py', 2) + "#### file: pkg/a.py (DELETE)\n```\n```\n")
+        assert mixed['outcome'] == 'committed'
+        assert sorted((f['operation'], f['status']) for f in mixed['files']) == [('DELETE', 'deleted'), ('OVERWRITE', 'written')]
+        assert not os.path.exists(os.path.join(root, 'pkg', 'a.py'))
+
+
+def test_wrong_token_is_rejected(endpoint):
+    with IngestClient(endpoint.unix_address, token='wrong') as client:
+        rejected = client.request(payload('pkg/c.py', 3))
+    assert rejected['outcome'] == 'rejected'
+    assert not os.path.exists(os.path.join(endpoint.root, 'pkg', 'c.py'))
+
+
+def test_declined_confirmation_is_cancelled(endpoint):
+    with IngestClient(endpoint.tcp_address, token='secret') as client:
+        cancelled = client.request(payload('pkg/d.py', 4))
+    assert cancelled['outcome'] == 'cancelled' and [f['status'] for f in cancelled['files']] == ['cancelled']
+
+
+def test_invalid_frame_is_rejected(endpoint):
+    raw = socket.socket(socket.AF_UNIX)
+    raw.connect(endpoint.socket_path)
+    try:
+        raw.sendall(FRAME_HEADER.pack(5) + b'hello')
+        reader = raw.makefile('rb')
+        size, = FRAME_HEADER.unpack(reader.read(FRAME_HEADER.size))
+        response = decode_body(reader.read(size))
+    finally:
+        raw.close()
+    assert response['outcome'] == 'rejected' and endpoint.auto_server.protocol_errors == 1
+
+
+def test_pipelined_requests_keep_order(endpoint):
+    with IngestClient(endpoint.unix_address, token='secret') as client:
+        results = client.request_many([payload(f'pipe/{i % 10}.py', i) for i in range(200)], window=32)
+    assert [result['outcome'] for result in results] == ['committed'] * 200
+    with open(os.path.join(endpoint.root, 'pipe', '9.py'), encoding='utf-8') as f:
+        assert f.read().strip() == "VALUE = 199"
+
+
+def test_socket_is_private(endpoint):
+    assert stat.S_IMODE(os.stat(endpoint.socket_path).st_mode) == 0o600
+
+
+def test_tcp_only_on_loopback():
+    assert parse_address('tcp:127.0.0.1:9000') == ('tcp', ('127.0.0.1', 9000))
+    assert parse_address('localhost:9000') == ('tcp', ('localhost', 9000))
+    with pytest.raises(ValueError):
+        parse_address('tcp:0.0.0.0:9000')
+
+
+def test_token_required_for_tcp_and_auto_approve(tmp_path):
+    pipeline = ApplyPipeline(RejectingFrontend(), lambda: str(tmp_path))
+    pipeline.start()
+    try:
+        for server in (IngestServer(pipeline, 'tcp:127.0.0.1:0'),
+                       IngestServer(pipeline, str(tmp_path / 'a.sock'), auto_approve=True)):
+            with pytest.raises(ValueError):
+                server.start()
+    finally:
+        pipeline.stop()
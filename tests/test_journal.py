@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+from apply_engine import commit_plan, plan_blocks
+from block_scanner import scan_blocks
+from journal import JournalError, UndoJournal
+
+
+def block_text(filename, operation, content):
+    return f"#### file: {filename} ({operation})\n```\n{content}\n```\n"
+
+
+def snapshot(root):
+    files = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, root)] = f.read()
+    return files
+
+
+def apply(journal, root, payload, preload=False):
+    plan = plan_blocks(list(scan_blocks(payload)), root, lambda filename, target_path: True)
+    batch = journal.begin(plan, preload=preload)
+    errors = commit_plan(plan, before_change=batch.capture, durability='none')
+    journal.finish(batch, errors)
+    return batch, errors
+
+
+@pytest.fixture
+def project(tmp_path):
+    """一个小项目和它的撤销日志；first、second 为依次提交两个批次后的快照，original 为提交之前。"""
+    root = str(tmp_path / 'project')
+    os.makedirs(os.path.join(root, 'src'))
+    for name, content in (('src/a.py', b"a = 1\r\nb = 2\r\n"), ('src/b.py', b"x = 1\n"),
+                          ('log.txt', b"line 1\n"), ('gone.txt', b"bye\n")):
+        with open(os.path.join(root, name), 'wb') as f:
+            f.write(content)
+    journal = UndoJournal(str(tmp_path / 'journal'))
+    original = snapshot(root)
+    apply(journal, root, "".join((
+        block_text("src/a.py", "OVERWRITE", "a = 10"),
+        block_text("src/new/c.py", "CREATE", "c = 3"),
+        block_text("log.txt", "APPEND", "line 2"),
+        block_text("gone.txt", "DELETE", ""),
+        block_text("src/b.py", "PATCH", "@@ -1 +1 @@\n-x = 1\n+x = 2"),
+    )))
+    first = snapshot(root)
+    apply(journal, root, block_text("src/a.py", "OVERWRITE", "a = 20") + block_text("src/b.py", "OVERWRITE", "x = 1"))
+    second = snapshot(root)
+    yield journal, root, original, first, second
+    journal.close()
+
+
+def test_undo_and_redo_restore_bytes(project):
+    journal, root, original, first, second = project
+    assert first != original and second != first
+    assert [summary.state for summary in journal.history()] == ['applied', 'applied']
+    result = journal.undo()
+    assert snapshot(root) == first and not result.errors and not result.modified
+    # 逐字节一致，包括删除、创建和追加
+    result = journal.undo()
+    assert snapshot(root) == original and not result.modified
+    with pytest.raises(JournalError):
+        journal.undo()
+    journal.redo()
+    assert snapshot(root) == first
+    result = journal.redo()
+    assert snapshot(root) == second and not result.modified
+    # 多次撤销/重做后不误报修改
+    result = journal.undo()
+    assert snapshot(root) == first and not result.modified
+
+
+def test_hand_edits_are_reported_and_kept(project):
+    journal, root, _, _, _ = project
+    journal.undo()
+    with open(os.path.join(root, 'src', 'a.py'), 'wb') as f:
+        f.write(b"edited by hand\n")
+    result = journal.undo()
+    assert result.modified == [os.path.join(root, 'src', 'a.py')]
+    journal.redo()
+    assert snapshot(root)[os.path.join('src', 'a.py')] == b"edited by hand\n"
+
+
+def test_new_batch_clears_redo(project):
+    journal, root, _, _, _ = project
+    journal.undo()
+    apply(journal, root, block_text("src/b.py", "OVERWRITE", "x = 3"))
+    with pytest.raises(JournalError):
+        journal.redo()
+
+
+def test_identical_content_is_stored_once(project):
+    journal, root, _, _, _ = project
+    journal.flush()
+    before = journal.stats()['blob_count']
+    for _ in range(5):
+        apply(journal, root, block_text("src/b.py", "OVERWRITE", "x = 4"))
+        apply(journal, root, block_text("src/b.py", "OVERWRITE", "x = 3"))
+    journal.flush()
+    assert journal.stats()['blob_count'] - before <= 2
+
+
+def test_gc_keeps_latest_batches(project):
+    journal, root, _, _, _ = project
+    for value in range(6):
+        apply(journal, root, block_text("src/b.py", "OVERWRITE", f"x = {value}"))
+    journal.flush() # 批次由后台线程保存
+    journal.max_batches = 5
+    journal.gc()
+    assert len(journal.history(limit=0)) == 5
+    for _ in range(5):
+        journal.undo()
+    with pytest.raises(JournalError):
+        journal.undo()
+
+
+def test_commit_reuses_preloaded_content(project):
+    """规划后预读的原内容在提交时直接使用，不再读取文件。"""
+    journal, root, _, _, second = project
+    batch, errors = apply(journal, root, block_text("src/a.py", "OVERWRITE", "a = 30") +
+                          block_text("src/b.py", "OVERWRITE", "x = 30"), preload=True)
+    assert not errors and batch.reused == 2
+    journal.undo()
+    assert snapshot(root) == second
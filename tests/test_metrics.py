@@ -0,0 +1,70 @@
+import json
+import os
+import re
+
+from metrics import BUCKET_BOUNDS, NULL_TRACE, STAGES, PipelineMetrics
+
+
+def record_all(metrics, values):
+    for seconds in values:
+        metrics.record({stage: seconds for stage in STAGES}, {'outcome': 'committed'})
+
+
+def test_disabled_metrics_have_no_side_effects(tmp_path):
+    """未启用时 new_trace() 返回 NULL_TRACE：不计数、不写文件、不启动端点。"""
+    jsonl_path = str(tmp_path / 'metrics.jsonl')
+    metrics = PipelineMetrics(enabled=False, jsonl_path=jsonl_path, http_port=1)
+    trace = metrics.new_trace()
+    assert trace is NULL_TRACE
+    for stage in STAGES[:-1]:
+        trace.mark(stage)
+    trace.finish(blocks=1, outcome='committed')
+    metrics.start()
+    assert metrics.payload_count == 0 and metrics._server is None
+    assert all(histogram.count == 0 for histogram in metrics.histograms.values())
+    assert not os.listdir(str(tmp_path))
+    assert "未启用" in metrics.format_summary()
+
+
+def test_percentiles_follow_distribution():
+    metrics = PipelineMetrics(enabled=True)
+    record_all(metrics, [i / 1000 for i in range(1, 101)]) # 1 ms 到 100 ms 均匀分布
+    count, p50, p95, p99 = metrics.percentiles()['total']
+    assert count == 100 and p50 <= p95 <= p99 <= 0.1
+    # 桶按 1.5 倍递增，估计值与真实值的误差不超过一个桶
+    for estimate, actual in ((p50, 0.05), (p95, 0.095), (p99, 0.099)):
+        assert actual / 1.5 <= estimate <= actual * 1.5
+    assert "已处理 100 个剪贴板内容" in metrics.format_summary()
+
+
+def test_prometheus_buckets_add_up():
+    metrics = PipelineMetrics(enabled=True)
+    values = [0.00001, 0.0004, 0.003, 0.003, 0.2, 500.0] # 包括低于最小上界和超过最大上界的值
+    record_all(metrics, values)
+    text = metrics.render_prometheus()
+    assert f"autoapply_payloads_total {len(values)}\n" in text
+    for stage in STAGES:
+        buckets = [(le, int(value)) for le, value in
+                   re.findall(rf'_bucket\{{stage="{stage}",le="([^"]+)"\}} (\d+)', text)]
+        assert len(buckets) == len(BUCKET_BOUNDS) + 1 and buckets[-1][0] == '+Inf'
+        cumulative = [value for _, value in buckets]
+        assert cumulative == sorted(cumulative) # 累计值单调不减
+        # 各桶的增量之和等于总次数，+Inf 桶等于 _count
+        assert sum(b - a for a, b in zip([0] + cumulative, cumulative)) == len(values)
+        assert cumulative[-1] == len(values) and cumulative[-2] == len(values) - 1
+        assert f'_count{{stage="{stage}"}} {len(values)}\n' in text
+
+
+def test_jsonl_rotates_at_max_bytes(tmp_path):
+    jsonl_path = str(tmp_path / 'metrics.jsonl')
+    metrics = PipelineMetrics(enabled=True, jsonl_path=jsonl_path, jsonl_max_bytes=1000)
+    for value in range(40):
+        metrics.record({'total': value / 1000}, {'index': value})
+    with open(jsonl_path, encoding='utf-8') as f:
+        lines = f.readlines()
+    entries = [json.loads(line) for line in lines]
+    line_bytes = max(len(line.encode('utf-8')) for line in lines)
+    assert os.path.getsize(jsonl_path) < 1000 + line_bytes
+    assert 1000 <= os.path.getsize(jsonl_path + '.1') < 1000 + line_bytes
+    assert sorted(os.listdir(str(tmp_path))) == ['metrics.jsonl', 'metrics.jsonl.1'] # 只保留一个旧文件
+    assert entries[-1]['index'] == 39 and entries[-1]['stages_ms'] == {'total': 39.0}
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from patch_ops import PatchParseError, apply_hunks, apply_patch_text, parse_search_replace, parse_unified_diff
+
+ORIGINAL = "\n".join(f"def function_{i}():\n    return {i}\n" for i in range(1667)) + "\n"
+LINES = ORIGINAL.split('\n')
+EXPECTED = ORIGINAL.replace(LINES[2503], '    return -1', 1)
+
+
+def test_offset_hunk_is_applied_and_missing_hunk_rejected():
+    diff = (
+        "--- a/big_module.py\n+++ b/big_module.py\n"
+        "@@ -2498,3 +2498,3 @@\n" # 行号故意偏移 5 行
+        f" {LINES[2502]}\n-{LINES[2503]}\n+    return -1\n {LINES[2504]}\n"
+        "@@ -4000,2 +4000,2 @@\n"
+        "-this line does not exist\n+never applied\n"
+    )
+    result = apply_patch_text("PATCH", ORIGINAL, diff)
+    assert result.content == EXPECTED
+    assert result.applied == [1] and [number for number, _ in result.rejected] == [2]
+
+
+def test_search_replace():
+    text = f"<<<<<<< SEARCH\n{LINES[2503]}\n=======\n    return -1\n>>>>>>> REPLACE\n"
+    result = apply_patch_text("REPLACE", ORIGINAL, text)
+    assert result.content == EXPECTED and result.applied == [1] and not result.rejected
+
+
+def test_nearest_match_wins():
+    """同一内容出现多次时选择离 @@ 行号最近的位置。"""
+    content = "\n".join(["x"] * 3 + ["a"] + ["x"] * 10 + ["a"] + ["x"] * 3)
+    result = apply_patch_text("PATCH", content, "@@ -14,1 +14,1 @@\n-a\n+b\n")
+    assert result.content.split('\n').index('b') == 14
+
+
+def test_trailing_whitespace_is_ignored_as_fallback():
+    result = apply_hunks("a = 1   \nb = 2\n", parse_unified_diff("@@ -1 +1 @@\n-a = 1\n+a = 3\n"))
+    assert result.content == "a = 3\nb = 2\n"
+
+
+def test_blank_context_without_leading_space():
+    hunks = parse_unified_diff("@@ -1,3 +1,3 @@\n x = 1\n\n-y = 2\n+y = 3\n")
+    assert hunks[0].old_lines == ["x = 1", "", "y = 2"]
+
+
+def test_headers_between_hunks_are_skipped():
+    diff = ("diff --git a/m.py b/m.py\nindex 123..456 100644\n--- a/m.py\n+++ b/m.py\n"
+            "@@ -1 +1 @@\n-a\n+A\n"
+            "--- a/m.py\n+++ b/m.py\n"
+            "@@ -3 +3 @@\n-c\n+C\n")
+    assert [hunk.new_lines for hunk in parse_unified_diff(diff)] == [["A"], ["C"]]
+    # 删除以 "-- " 开头的行不是文件头部
+    hunks = parse_unified_diff("@@ -1,2 +1 @@\n--- comment\n+++ added\n")
+    assert hunks[0].old_lines == ["-- comment"] and hunks[0].new_lines == ["++ added"]
+
+
+def test_multi_file_diff_is_rejected():
+    diff = ("--- a/one.py\n+++ b/one.py\n@@ -1 +1 @@\n-a\n+b\n"
+            "--- a/two.py\n+++ b/two.py\n@@ -1 +1 @@\n-c\n+d\n")
+    with pytest.raises(PatchParseError):
+        parse_unified_diff(diff)
+
+
+@pytest.mark.parametrize('text, parse', [
+    ("no hunks here\n", parse_unified_diff),
+    ("<<<<<<< SEARCH\na\n=======\nb\n", parse_search_replace),
+    ("plain text\n", parse_search_replace),
+], ids=["没有 @@", "SEARCH 未闭合", "没有 SEARCH"])
+def test_parse_errors(text, parse):
+    with pytest.raises(PatchParseError):
+        parse(text)
+
+
+def test_patch_block_through_plan(tmp_path, apply_payload):
+    root = str(tmp_path)
+    with open(os.path.join(root, 'm.py'), 'w', encoding='utf-8', newline='') as f:
+        f.write("a = 1\r\nb = 2\r\n")
+    plan, errors = apply_payload(root, "#### file: m.py (PATCH)\n```diff\n@@ -2 +2 @@\n-b = 2\n+b = 3\n```\n")
+    assert not errors
+    with open(os.path.join(root, 'm.py'), 'rb') as f:
+        assert f.read() == b"a = 1\r\nb = 3\r\n" # 保留原文件的换行符
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from clipboard_monitor import QueuedPayload
+from diff_preview import DiffPreviewer
+from pipeline import ApplyPipeline, BoundedQueue, PipelineFrontend
+
+
+def payload(name, value, operation='OVERWRITE'):
+    return f"#### file: {name} ({operation})\n```python\nVALUE = {value}\n```\n"
+
+
+def read(root, relative):
+    with open(os.path.join(root, *relative.split('/')), encoding='utf-8') as f:
+        return f.read().rstrip('\n')
+
+
+class ApproveFrontend(PipelineFrontend):
+    def __init__(self):
+        self.committed = []
+
+    def confirm_plan(self, plan):
+        return True
+
+    def on_committed(self, plan, errors):
+        self.committed.append((plan, errors))
+
+
+class CollectingFrontend(PipelineFrontend):
+    """不立即决定：收集 PendingConfirmation，由测试调用 resolve()。"""
+    def __init__(self):
+        self.pending = []
+        self.requested = threading.Event()
+
+    def request_confirmation(self, pending):
+        self.pending.append(pending)
+        self.requested.set()
+
+
+@pytest.fixture
+def run_pipeline(tmp_path):
+    """启动流水线，测试结束时停止。返回 start(frontend, **options) → (pipeline, root)。"""
+    started = []
+
+    def start(frontend, **options):
+        root = str(tmp_path / 'project')
+        os.makedirs(root, exist_ok=True)
+        pipeline = ApplyPipeline(frontend, lambda: root, get_durability=lambda: 'none', **options)
+        pipeline.start()
+        started.append(pipeline)
+        return pipeline, root
+
+    yield start
+    for pipeline in started:
+        pipeline.stop()
+
+
+def submit(pipeline, text, **options):
+    return pipeline.run_coroutine(pipeline.submit(text, **options)).result(10)
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_approved_payload_is_committed(run_pipeline):
+    frontend = ApproveFrontend()
+    pipeline, root = run_pipeline(frontend)
+    result = submit(pipeline, payload('pkg/a.py', 1, 'CREATE'))
+    assert result.outcome == 'committed' and [f['status'] for f in result.files] == ['written']
+    assert read(root, 'pkg/a.py') == "VALUE = 1"
+    assert submit(pipeline, payload('pkg/a.py', 1, 'CREATE')).outcome == 'unchanged'
+    wait_until(lambda: frontend.committed) # on_committed 在前端线程中异步调用
+    assert len(frontend.committed) == 1 and frontend.committed[0][1] == []
+
+
+def test_clipboard_payloads_are_deduplicated(run_pipeline):
+    """put() 放入的剪贴板内容按内容去重，submit() 默认不去重。"""
+    pipeline, root = run_pipeline(ApproveFrontend())
+    for count in (1, 2):
+        # put() 不等待内容进入队列，按结果计数等待处理完成
+        pipeline.put(QueuedPayload(payload('pkg/b.py', 2), pipeline.metrics.new_trace()))
+        wait_until(lambda: sum(pipeline.stats()['outcomes'].values()) == count)
+    assert pipeline.stats()['outcomes'] == {'committed': 1, 'duplicate': 1}
+    assert read(root, 'pkg/b.py') == "VALUE = 2"
+
+
+def test_declined_plan_is_cancelled(run_pipeline):
+    pipeline, root = run_pipeline(PipelineFrontend())
+    result = submit(pipeline, payload('pkg/c.py', 3))
+    assert result.outcome == 'cancelled' and [f['status'] for f in result.files] == ['cancelled']
+    assert not os.path.exists(os.path.join(root, 'pkg', 'c.py'))
+
+
+def test_auto_approve_skips_frontend(run_pipeline):
+    frontend = CollectingFrontend()
+    pipeline, root = run_pipeline(frontend)
+    assert submit(pipeline, payload('pkg/d.py', 4), auto_approve=True).outcome == 'committed'
+    assert frontend.pending == []
+
+
+def test_approve_without_overwrite_keeps_existing_file(run_pipeline):
+    """CREATE 的目标已存在：overwrite=False 批准时跳过该文件，其余操作照常执行。"""
+    frontend = CollectingFrontend()
+    pipeline, root = run_pipeline(frontend)
+    os.makedirs(os.path.join(root, 'pkg'))
+    with open(os.path.join(root, 'pkg', 'keep.py'), 'w', encoding='utf-8') as f:
+        f.write("original\n")
+    future = pipeline.run_coroutine(pipeline.submit(payload('pkg/keep.py', 5, 'CREATE') + payload('pkg/new.py', 6, 'CREATE')))
+    assert frontend.requested.wait(10)
+    pending, = frontend.pending
+    assert [path for _, path in pending.overwrites] == [os.path.join(root, 'pkg', 'keep.py')]
+    pending.resolve(True, overwrite=False)
+    assert future.result(10).outcome == 'committed'
+    assert read(root, 'pkg/keep.py') == "original"
+    assert read(root, 'pkg/new.py') == "VALUE = 6"
+
+
+def test_pending_confirmations_do_not_block_later_payloads(run_pipeline):
+    """等待确认期间后续内容照常规划；只有第一次 resolve() 生效。"""
+    frontend = CollectingFrontend()
+    pipeline, root = run_pipeline(frontend)
+    futures = [pipeline.run_coroutine(pipeline.submit(payload(f'batch/{i}.py', i, 'CREATE'))) for i in range(3)]
+    wait_until(lambda: len(frontend.pending) == 3)
+    assert pipeline.stats()['pending_confirmations'] == 3
+    for i, pending in enumerate(frontend.pending):
+        pending.resolve(i != 1)
+        pending.resolve(i == 1) # 第二次调用被忽略
+    outcomes = sorted(future.result(10).outcome for future in futures)
+    assert outcomes == ['cancelled', 'committed', 'committed']
+
+
+def test_previews_are_attached_to_prompt(run_pipeline):
+    frontend = CollectingFrontend()
+    previewer = DiffPreviewer()
+    try:
+        pipeline, root = run_pipeline(frontend, get_previewer=lambda: previewer)
+        os.makedirs(os.path.join(root, 'pkg'))
+        with open(os.path.join(root, 'pkg', 'e.py'), 'w', encoding='utf-8') as f:
+            f.write("VALUE = 0\nOTHER = 1\n")
+        future = pipeline.run_coroutine(pipeline.submit(payload('pkg/e.py', 7)))
+        assert frontend.requested.wait(10)
+        pending, = frontend.pending
+        done = threading.Event()
+        pending.plan.previews.add_done_callback(done.set)
+        assert done.wait(10)
+        message = pending.plan.build_prompt_message()
+        assert "差异预览" in message and "+VALUE = 7" in message
+        pending.resolve(False)
+        assert future.result(10).outcome == 'cancelled'
+    finally:
+        previewer.close()
+
+
+@pytest.mark.parametrize('policy, expected, discarded', [
+    ('drop_oldest', [2, 3], {'dropped': 2, 'coalesced': 0}),
+    ('drop_newest', [0, 1], {'dropped': 2, 'coalesced': 0}),
+    ('coalesce_latest', [0, 3], {'dropped': 0, 'coalesced': 2}),
+])
+def test_overflow_policies(policy, expected, discarded):
+    async def scenario():
+        reasons = []
+        queue = BoundedQueue('capture', 2, policy, on_discard=lambda item, reason: reasons.append(reason))
+        accepted = [await queue.put(i) for i in range(4)]
+        items = [await queue.get(), await queue.get()]
+        return accepted, items, reasons, queue.stats()
+
+    accepted, items, reasons, stats = asyncio.run(scenario())
+    assert items == expected
+    assert accepted == ([True, True, False, False] if policy == 'drop_newest' else [True] * 4)
+    assert len(reasons) == 2 and {key: stats[key] for key in discarded} == discarded
+    assert stats['max_depth'] == 2
+
+
+def test_block_policy_waits_for_space():
+    async def scenario():
+        queue = BoundedQueue('capture', 1, 'block')
+        await queue.put('first')
+        blocked = asyncio.ensure_future(queue.put('second'))
+        await asyncio.sleep(0.01)
+        assert not blocked.done() and queue.blocked == 1
+        assert await queue.get() == 'first'
+        assert await blocked
+        await queue.close()
+        return await queue.put('late'), queue.stats()
+
+    accepted, stats = asyncio.run(scenario())
+    assert accepted is False and stats['dropped'] == 2 # close() 丢弃 'second'，关闭后放入的 'late' 也被丢弃
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        BoundedQueue('capture', 2, 'drop_everything')
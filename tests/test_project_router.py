@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+
+import pytest
+
+import project_router
+from block_scanner import scan_blocks
+from file_index import FileIndex
+from project_router import ProjectRouter
+
+
+def block_text(filename, operation, content):
+    return f"#### file: {filename} ({operation})\n```\n{content}\n```\n"
+
+
+def never(filename, target_path):
+    return False
+
+
+@pytest.fixture
+def projects(tmp_path):
+    """12 个项目，每个项目有 src/<name>/main.py、README.md 和 lib/mod<n>/util.py。"""
+    projects = []
+    for number in range(12):
+        name = f"proj{number}"
+        for relative in (f"src/{name}/main.py", "README.md", f"lib/mod{number}/util.py"):
+            path = os.path.join(str(tmp_path), name, relative)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write("x = 1\n")
+        projects.append((name, os.path.join(str(tmp_path), name)))
+    return projects
+
+
+@pytest.fixture
+def router(projects):
+    router = ProjectRouter(wait_for_index=True)
+    router.configure(projects[0][1], projects)
+    yield router
+    router.stop()
+
+
+def test_default_project_is_first(router):
+    assert router.default.name == 'proj0' and len(router.projects) == 12
+
+
+def test_routing_rules(router, projects):
+    payload = "".join((
+        block_text("README.md", "OVERWRITE", "default"), # 已存在于所有项目：默认项目
+        block_text("src/proj3/main.py", "OVERWRITE", "three"), # 只在 proj3 存在
+        "#### project: proj7\n" + block_text("notes.txt", "CREATE", "seven"), # 项目指令
+        "#### project:\n" + block_text("mod5/util.py", "OVERWRITE", "five"), # 文件索引：只有 proj5 有 mod5/util.py
+        block_text("lib/mod9/new.py", "CREATE", "nine"), # 父目录只在 proj9 存在
+        block_text(os.path.join(projects[4][1], "abs.py"), "CREATE", "four"), # 绝对路径
+        "#### project: missing\n" + block_text("x.py", "CREATE", "x"), # 未配置的项目
+    ))
+    plan = router.plan_blocks(list(scan_blocks(payload)), never, redirect_missing=True)
+    written = {file_info['target_path']: file_info['code_content'] for file_info in plan.files_to_write}
+    assert written == {
+        os.path.join(projects[0][1], "README.md"): "default",
+        os.path.join(projects[3][1], "src", "proj3", "main.py"): "three",
+        os.path.join(projects[7][1], "notes.txt"): "seven",
+        os.path.join(projects[5][1], "lib", "mod5", "util.py"): "five",
+        os.path.join(projects[9][1], "lib", "mod9", "new.py"): "nine",
+        os.path.join(projects[4][1], "abs.py"): "four",
+    }
+    # 按项目分组的提示，以及未配置项目的说明
+    assert len(plan.projects) == 6 and "[proj7]" in plan.prompt_details
+    assert any("'missing'" in note for note in plan.path_notes)
+
+
+def test_new_file_follows_majority(router, projects):
+    """无法确定项目的新文件跟随载荷中的多数项目。"""
+    payload = block_text("src/proj2/main.py", "OVERWRITE", "a") + block_text("brand_new.py", "CREATE", "b")
+    plan = router.plan_blocks(list(scan_blocks(payload)), never)
+    assert os.path.join(projects[2][1], "brand_new.py") in {f['target_path'] for f in plan.files_to_write}
+
+
+def test_switching_default_reuses_index(router, projects):
+    before = router.by_name('proj5').built_index()
+    router.configure(projects[5][1], projects)
+    assert router.default.name == 'proj5' and router.default.built_index() is before
+
+
+def test_payload_across_all_projects(router, projects):
+    payload = "".join(f"#### project: {name}\n" + block_text(f"src/{name}/main.py", "OVERWRITE", name + "!")
+                      + block_text("README.md", "OVERWRITE", name + "?") for name, _ in projects)
+    plan = router.plan_blocks(list(scan_blocks(payload)), never, max_workers=1)
+    assert plan.operation_count() == 24 and len(plan.projects) == 12
+
+
+@pytest.fixture
+def slow_index(monkeypatch):
+    """索引建立被阻塞，直到测试结束。"""
+    release = threading.Event()
+    build = FileIndex.build
+
+    def blocked_build(cls, root, *args):
+        release.wait(10)
+        return build(root, *args)
+
+    monkeypatch.setattr(FileIndex, 'build', classmethod(blocked_build))
+    yield
+    release.set()
+
+
+@pytest.mark.parametrize('wait_for_index', [False, True], ids=["GUI 模式不等待", "命令行模式共用期限"])
+def test_unbuilt_indexes_do_not_block_routing(projects, slow_index, monkeypatch, wait_for_index):
+    monkeypatch.setattr(project_router, 'INDEX_WAIT_SECONDS', 0.5)
+    router = ProjectRouter(wait_for_index=wait_for_index)
+    router.configure(projects[0][1], projects)
+    try:
+        payload = "".join(block_text(f"new{i}.py", "CREATE", "x") for i in range(3))
+        started = time.monotonic()
+        groups, _ = router.route(list(scan_blocks(payload)))
+        elapsed = time.monotonic() - started
+    finally:
+        router.stop()
+    assert [target.name for target, _ in groups] == ['proj0']
+    # 12 个项目逐个等待需要 3 个代码块 × 12 × 0.5 秒
+    assert elapsed < (1.5 if wait_for_index else 0.3)
@@ -0,0 +1,172 @@
+import codecs
+
+import pytest
+
+from content_compare import content_matches_file
+from file_system import LocalFileSystem
+from text_format import DEFAULT_FORMAT, SNIFF_BYTES, TextFormat, read_file_text, sniff_file, sniff_format
+
+# (名称, 文件字节, 期望的格式)
+CORPUS = [
+    ("UTF-8 LF", "print('你好')\nx = 1\n".encode('utf-8'), TextFormat('utf-8', False, '\n')),
+    ("UTF-8 BOM CRLF", codecs.BOM_UTF8 + "名称 = 1\r\ny = 2\r\n".encode('utf-8'), TextFormat('utf-8', True, '\r\n')),
+    ("UTF-16-LE BOM CRLF", codecs.BOM_UTF16_LE + "第一行\r\nsecond\r\n".encode('utf-16-le'),
+     TextFormat('utf-16-le', True, '\r\n')),
+    ("UTF-16-BE BOM LF", codecs.BOM_UTF16_BE + "alpha\nβeta\n".encode('utf-16-be'), TextFormat('utf-16-be', True, '\n')),
+    ("UTF-16-LE 无 BOM", "plain ascii line\nanother line\n".encode('utf-16-le'), TextFormat('utf-16-le', False, '\n')),
+    ("GBK CRLF", "# 中文注释\r\nvalue = '数据'\r\n".encode('gbk'), TextFormat('gbk', False, '\r\n')),
+    ("GB18030", "表情 😀\n第二行\n".encode('gb18030'), TextFormat('gb18030', False, '\n')),
+    ("UTF-8 CR", b"line one\rline two\r", TextFormat('utf-8', False, '\r')),
+    ("混合换行（CRLF 占多数）", b"a\r\nb\r\nc\nd\r\n", TextFormat('utf-8', False, '\r\n', True)),
+    ("无效字节", b"x = 1\n\xff bad\n", TextFormat('utf-8', False, '\n')),
+    ("空文件", b"", DEFAULT_FORMAT),
+    ("没有换行符", "单独一行".encode('utf-8'), DEFAULT_FORMAT),
+]
+corpus = pytest.mark.parametrize('data, fmt', [case[1:] for case in CORPUS], ids=[case[0] for case in CORPUS])
+
+
+def block(operation, content):
+    return f"#### file: target.txt ({operation})\n```\n{content}\n```\n"
+
+
+@pytest.fixture
+def target(tmp_path, apply_payload):
+    """临时目录中的 target.txt：reset(字节) 写入原内容，run(载荷) 规划并提交，written() 读取结果。"""
+    class Target:
+        path = str(tmp_path / 'target.txt')
+
+        def reset(self, data):
+            with open(self.path, 'wb') as f:
+                f.write(data)
+
+        def written(self):
+            with open(self.path, 'rb') as f:
+                return f.read()
+
+        def run(self, payload):
+            plan, errors = apply_payload(str(tmp_path), payload, max_workers=1)
+            assert errors == []
+            return plan
+    return Target()
+
+
+@corpus
+def test_sniff_format(data, fmt):
+    assert sniff_format(data, True) == fmt
+
+
+@corpus
+def test_unchanged_content_is_not_written(target, data, fmt):
+    text = fmt.decode(data)
+    if not text.strip():
+        pytest.skip("没有可比较的内容")
+    target.reset(data)
+    assert target.run(block("OVERWRITE", text.strip())).is_empty()
+    assert target.written() == data
+
+
+@corpus
+def test_overwrite_keeps_format(target, data, fmt):
+    target.reset(data)
+    target.run(block("OVERWRITE", "new 内容\nsecond"))
+    assert target.written() == fmt.bom_bytes + fmt.encode("new 内容\nsecond")
+
+
+@corpus
+def test_append_keeps_existing_bytes(target, data, fmt):
+    text = fmt.decode(data)
+    target.reset(data)
+    target.run(block("APPEND", "appended 追加"))
+    separator = "\n" if text and not text.endswith('\n') else ""
+    expected = (data or fmt.bom_bytes) + fmt.encode(separator + "appended 追加")
+    assert target.written() == expected
+    # 对同一载荷重复 APPEND 时识别为已追加
+    assert target.run(block("APPEND", "appended 追加")).is_empty()
+    assert target.written() == expected
+
+
+@corpus
+def test_replace_keeps_other_bytes(target, data, fmt):
+    """只修改第一行，其余内容（包括无法解码的字节和混合换行文件中各行的换行符）逐字节保留。"""
+    text = fmt.decode(data)
+    if not text.strip():
+        pytest.skip("没有可替换的内容")
+    first_line = text.split('\n', 1)[0]
+    target.reset(data)
+    target.run(block("REPLACE", f"<<<<<<< SEARCH\n{first_line}\n=======\nCHANGED\n>>>>>>> REPLACE"))
+    assert target.written() == data.replace(fmt.encode(first_line), fmt.encode("CHANGED"), 1)
+
+
+GBK_DATA = "# 中文注释\r\nvalue = 1\r\n".encode('gbk')
+
+
+def test_gbk_overwrite_with_unencodable_content_switches_to_utf8(target):
+    target.reset(GBK_DATA)
+    plan = target.run(block("OVERWRITE", "emoji = '😀'"))
+    assert target.written() == "emoji = '😀'".encode('utf-8')
+    assert any("UTF-8" in line for line in plan.prompt_details)
+
+
+def test_gbk_append_with_unencodable_content_is_skipped(target):
+    target.reset(GBK_DATA)
+    assert target.run(block("APPEND", "emoji = '😀'")).is_empty()
+    assert target.written() == GBK_DATA
+
+
+def test_merged_operations_keep_format(target):
+    """同一载荷对同一路径的多个操作（覆盖层）同样沿用原格式。"""
+    target.reset(GBK_DATA)
+    target.run(block("APPEND", "a = '一'") + block("APPEND", "b = '二'"))
+    assert target.written() == GBK_DATA + "a = '一'\r\nb = '二'".encode('gbk')
+    utf16_data = codecs.BOM_UTF16_LE + "x = 1\r\ny = 2\r\n".encode('utf-16-le')
+    target.reset(utf16_data)
+    target.run(block("REPLACE", "<<<<<<< SEARCH\nx = 1\n=======\nx = 3\n>>>>>>> REPLACE") + block("APPEND", "z = 4"))
+    assert target.written() == codecs.BOM_UTF16_LE + "x = 3\r\ny = 2\r\nz = 4".encode('utf-16-le')
+
+
+MIXED_DATA = b"".join(f"line {i}".encode() + (b"\n" if i % 3 == 0 else b"\r\n") for i in range(30))
+
+
+def test_mixed_newlines_replace_keeps_untouched_lines(target):
+    target.reset(MIXED_DATA)
+    target.run(block("REPLACE", "<<<<<<< SEARCH\nline 9\n=======\nline nine\n>>>>>>> REPLACE"))
+    assert target.written() == MIXED_DATA.replace(b"line 9\n", b"line nine\r\n")
+
+
+def test_mixed_newlines_overwrite_keeps_untouched_lines(target):
+    target.reset(MIXED_DATA)
+    lines = MIXED_DATA.decode().splitlines()
+    target.run(block("OVERWRITE", "\n".join(lines[:5] + ["inserted"] + lines[5:])))
+    # 新内容末尾没有换行符，最后一行也没有
+    assert target.written() == MIXED_DATA.replace(b"line 5\r\n", b"inserted\r\nline 5\r\n")[:-2]
+
+
+ASCII_PREFIX = "x = 1\n" * (SNIFF_BYTES // 6 + 1)
+
+
+@pytest.mark.parametrize('text', [ASCII_PREFIX + "# 中文注释\n", ASCII_PREFIX + "# 中文注释\n" + ASCII_PREFIX],
+                         ids=["末尾", "中间"])
+def test_gbk_after_ascii_prefix(target, text):
+    """开头超过 SNIFF_BYTES 的 ASCII 之后才出现 GBK 内容：判断、比较和追加都沿用 GBK。"""
+    fs = LocalFileSystem()
+    data = text.encode('gbk')
+    target.reset(data)
+    assert read_file_text(fs, target.path)[1].encoding == 'gbk'
+    assert sniff_file(fs, target.path, full=True).encoding == 'gbk'
+    assert content_matches_file(fs, target.path, text.strip())[0]
+    target.run(block("APPEND", "z = '追加'"))
+    assert target.written() == data + "z = '追加'".encode('gbk')
+
+
+def test_large_file_streaming_matches_full_decode(tmp_path):
+    """流式判定（只判断开头的格式、逐块比较）与完整解码的结果一致。"""
+    fs = LocalFileSystem()
+    path = str(tmp_path / 'large.txt')
+    for encoding in ('utf-8', 'gbk', 'utf-16-le'):
+        fmt = TextFormat(encoding, encoding == 'utf-16-le', '\r\n')
+        text = "value = '数据' + str(42)\n" * 20000
+        with open(path, 'wb') as f:
+            f.write(fmt.bom_bytes + fmt.encode(text))
+        existing, _ = read_file_text(fs, path)
+        for expected in (text.strip(), "# header\n" + text.strip(), text.strip()[:-1] + "X"):
+            assert content_matches_file(fs, path, expected)[0] == (existing.strip() == expected)
@@ -0,0 +1,135 @@
+import os
+import stat
+
+import pytest
+
+from apply_engine import commit_plan, plan_blocks
+from block_scanner import scan_blocks
+from transaction import TEMP_SUFFIX, Transaction, TransactionAborted, TransactionLog
+
+ORIGINALS = {'a.py': b"a = 1\n", 'b.py': b"b = 1\n", 'c.py': b"c = 1\n", 'log.txt': b"line 1\n", 'gone.txt': b"bye\n"}
+NEW_CONTENTS = {'a.py': b"a = 2\n", 'b.py': b"b = 2\n", 'c.py': b"c = 2\n"}
+
+
+class _Crash(BaseException):
+    """模拟进程在某一步被终止，不被任何 except Exception 捕获。"""
+
+
+class CrashingTransaction(Transaction):
+    def __init__(self, *args, crash_after=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.crash_after = crash_after
+        self.applied = 0
+
+    def _apply_write(self, path):
+        if self.crash_after is not None and self.applied >= self.crash_after:
+            raise _Crash()
+        self.applied += 1
+        return super()._apply_write(path)
+
+
+def read(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def leftovers(root):
+    return [name for _, _, names in os.walk(root) for name in names if name.endswith(TEMP_SUFFIX)]
+
+
+def run_transaction(root, log, crash_after=None, crash_staging=False):
+    """写入 NEW_CONTENTS、向 log.txt 追加一行并删除 gone.txt。crash_* 模拟在对应步骤崩溃。"""
+    transaction = CrashingTransaction(durability='batch', log=log, crash_after=crash_after)
+    appends = {'log.txt': b"line 2\n"}
+    writes = [(os.path.join(root, name), 'write') for name in NEW_CONTENTS]
+    writes += [(os.path.join(root, name), 'append') for name in appends]
+    transaction.prepare(writes, [os.path.join(root, 'gone.txt')])
+    for name, data in list(NEW_CONTENTS.items()) + list(appends.items()):
+        path = os.path.join(root, name)
+        with open(transaction.begin_stage(path), 'wb') as f:
+            f.write(data)
+        transaction.end_stage(path)
+        if crash_staging:
+            raise _Crash()
+    transaction.commit(max_workers=1)
+
+
+@pytest.fixture
+def project(tmp_path):
+    root = str(tmp_path / 'project')
+    os.makedirs(root)
+    for name, data in ORIGINALS.items():
+        with open(os.path.join(root, name), 'wb') as f:
+            f.write(data)
+    return root, TransactionLog(str(tmp_path / 'transactions'))
+
+
+def test_crash_while_staging_rolls_back(project):
+    """暂存期间崩溃：回滚，目标文件保持原样，临时文件被删除。"""
+    root, log = project
+    with pytest.raises(_Crash):
+        run_transaction(root, log, crash_staging=True)
+    assert leftovers(root)
+    assert [action for _, action, _ in log.recover()] == ['rollback']
+    assert all(read(os.path.join(root, name)) == data for name, data in ORIGINALS.items())
+    assert not leftovers(root)
+
+
+@pytest.mark.parametrize('crash_after', [1, 3])
+def test_crash_after_commit_point_rolls_forward(project, crash_after):
+    """替换了部分文件之后崩溃：继续完成剩余的替换、追加和删除。"""
+    root, log = project
+    with pytest.raises(_Crash):
+        run_transaction(root, log, crash_after=crash_after)
+    if crash_after == 3:
+        # 追加已写入目标文件但临时文件尚未删除：恢复时截断后重新追加，不会重复
+        with open(os.path.join(root, 'log.txt'), 'ab') as f:
+            f.write(b"line 2\n")
+    assert read(os.path.join(root, 'a.py')) == NEW_CONTENTS['a.py'] and os.path.exists(os.path.join(root, 'gone.txt'))
+    assert [action for _, action, _ in log.recover()] == ['rollforward']
+    assert all(read(os.path.join(root, name)) == data for name, data in NEW_CONTENTS.items())
+    assert read(os.path.join(root, 'log.txt')) == b"line 1\nline 2\n"
+    assert read(os.path.join(root, 'gone.txt')) is None and not leftovers(root)
+    assert log.recover() == [] # 恢复后没有剩余的事务记录
+
+
+def test_staging_failure_writes_nothing(project):
+    """暂存失败（目标目录无法创建）：整个批次都不写入。"""
+    root, log = project
+    with open(os.path.join(root, 'blocker'), 'w') as f:
+        f.write("not a directory")
+    payload = ("#### file: a.py (OVERWRITE)\n```\na = 3\n```\n"
+               "#### file: blocker/x.py (CREATE)\n```\nx = 1\n```\n"
+               "#### file: b.py (DELETE)\n```\n```\n")
+    errors = commit_plan(plan_blocks(list(scan_blocks(payload)), root, lambda *_: True), transaction_log=log)
+    assert len(errors) == 3 and sum(isinstance(error, TransactionAborted) for _, _, error in errors) == 2
+    assert all(read(os.path.join(root, name)) == ORIGINALS[name] for name in ('a.py', 'b.py'))
+    assert not leftovers(root) and log.recover() == []
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="需要 POSIX 权限位和符号链接")
+def test_replace_keeps_mode_and_symlink(project):
+    """整体替换沿用原文件的权限位，符号链接替换其指向的文件。"""
+    root, log = project
+    script = os.path.join(root, 'run.sh')
+    with open(script, 'w') as f:
+        f.write("echo 1\n")
+    os.chmod(script, 0o755)
+    os.symlink('a.py', os.path.join(root, 'link.py'))
+    payload = ("#### file: run.sh (OVERWRITE)\n```\necho 2\n```\n"
+               "#### file: link.py (OVERWRITE)\n```\nlinked = 1\n```\n")
+    errors = commit_plan(plan_blocks(list(scan_blocks(payload)), root, lambda *_: True), transaction_log=log)
+    assert not errors and stat.S_IMODE(os.stat(script).st_mode) == 0o755
+    assert os.path.islink(os.path.join(root, 'link.py')) and read(os.path.join(root, 'a.py')) == b"linked = 1"
+
+
+@pytest.mark.parametrize('durability', ['none', 'batch', 'per_file'])
+def test_durability_modes_commit(project, durability):
+    root, log = project
+    payload = "".join(f"#### file: pkg{i % 3}/m{i}.py (OVERWRITE)\n```\nv = {i}\n```\n" for i in range(20))
+    errors = commit_plan(plan_blocks(list(scan_blocks(payload)), root, lambda *_: True),
+                         durability=durability, transaction_log=log)
+    assert not errors and read(os.path.join(root, 'pkg2', 'm5.py')) == b"v = 5"
+    assert log.recover() == []
@@ -0,0 +1,297 @@
+import os
+import re
+import codecs
+from collections import namedtuple
+
+# 现有文件的编码、BOM 和换行符。只读取文件开头的一小段来判断，比较和写入都使用文件原来的格式，
+# 因此 GBK、UTF-16 或 CRLF 的文件不会因为格式不同而被判为“已修改”，写入后也保持原来的格式。
+# 本模块只使用标准库，不依赖 file_system，可被 file_system、content_compare 等共同导入。
+
+SNIFF_BYTES = 32 * 1024 # 判断格式时读取的文件开头字节数（开头全是 ASCII 时再读取同样长度的末尾）
+SCAN_CHUNK_BYTES = 1024 * 1024 # 完整判断时逐块读取的字节数
+# 没有 BOM 且不是有效 UTF-8 时依次尝试的编码；GBK 在前，只有 GBK 无法解码时才使用其超集 GB18030
+LEGACY_ENCODINGS = ('gbk', 'gb18030')
+# 判断为没有 BOM 的 UTF-16 所需的 NUL 字节比例（高位字节为 0 的 ASCII 字符占比）
+UTF16_NUL_RATIO = 0.3
+# 换行符在文本中的写法，以及显示在确认提示中的名称
+NEWLINE_NAMES = {'\n': 'LF', '\r\n': 'CRLF', '\r': 'CR'}
+
+# 按长度从长到短检查：UTF-32-LE 的 BOM 以 UTF-16-LE 的 BOM 开头
+_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+# 换行符（保留原样，用于按行拆分）
+_NEWLINE_RE = re.compile(r'(\r\n|\r|\n)')
+# 不兼容 ASCII 的编码的编码单元字节数；其余编码中 \r、\n 和 ASCII 空白只会以单字节出现
+_UNIT_SIZES = {'utf-16-le': 2, 'utf-16-be': 2, 'utf-32-le': 4, 'utf-32-be': 4}
+
+
+class TextFormat(namedtuple('TextFormat', ['encoding', 'bom', 'newline', 'mixed_newlines'], defaults=(False,))):
+    """
+    文本文件的格式：encoding 为 Python 编解码器名称（字节序明确，不含 BOM），bom 表示文件是否以 BOM 开头，
+    newline 为文件中占多数的换行符，mixed_newlines 表示判断时读取的部分中出现了不止一种换行符。
+    解码时换行符统一为 LF，编码时再换回 newline（混合换行的文件整体写入时见 apply_engine._restore_line_endings）。
+    无法解码的字节以 surrogateescape（UTF-16/32 中孤立的代理项以 surrogatepass）保留，原样写回。
+    """
+    __slots__ = ()
+
+    @property
+    def ascii_compatible(self):
+        """字节层面的换行符标准化和 ASCII 空白处理是否可以直接作用于原始字节。"""
+        return self.encoding not in _UNIT_SIZES
+
+    @property
+    def unit_size(self):
+        return _UNIT_SIZES.get(self.encoding, 1)
+
+    @property
+    def errors(self):
+        """编解码时使用的错误处理方式，使无法解码的内容可以原样写回。"""
+        return 'surrogatepass' if self.encoding in _UNIT_SIZES else 'surrogateescape'
+
+    @property
+    def bom_bytes(self):
+        return '\ufeff'.encode(self.encoding) if self.bom else b''
+
+    def decode(self, data):
+        """完整内容（可以带 BOM）解码为只含 LF 的文本。"""
+        if self.bom and data.startswith(self.bom_bytes):
+            data = data[len(self.bom_bytes):]
+        return _normalize(self._decode(data))
+
+    def decode_tail(self, data, at_start):
+        """
+        文件末尾的一段字节解码为只含 LF 的文本，开头被截断的部分丢弃：UTF-16/32 按编码单元对齐；
+        其余编码从第一个换行符开始解码（GBK 等不能从任意字节开始解码，而换行符不会出现在多字节字符中）。
+        """
+        if at_start:
+            return self.decode(data)
+        if not self.ascii_compatible:
+            return _normalize(self._decode(data[len(data) % self.unit_size:]))
+        starts = [index for index in (data.find(b'\n'), data.find(b'\r')) if index >= 0]
+        return _normalize(self._decode(data[min(starts):] if starts else data))
+
+    def decode_lines(self, data):
+        """
+        完整内容（可以带 BOM）解码后按换行符拆分，换行符不标准化。
+        返回 (以换行符结束的各行, 各行的换行符, 最后一个换行符之后的内容)。
+        """
+        if self.bom and data.startswith(self.bom_bytes):
+            data = data[len(self.bom_bytes):]
+        pieces = _NEWLINE_RE.split(self._decode(data))
+        return pieces[0:-1:2], pieces[1::2], pieces[-1]
+
+    def _decode(self, data):
+        try:
+            return data.decode(self.encoding, self.errors)
+        except UnicodeDecodeError: # 只可能是 UTF-16/32 末尾不完整的编码单元
+            return data.decode(self.encoding, 'replace')
+
+    def encode(self, text):
+        """只含 LF 的文本编码为文件格式的字节（不含 BOM）；无法用该编码表示时抛出 UnicodeEncodeError。"""
+        if self.newline != '\n':
+            text = text.replace('\n', self.newline)
+        return text.encode(self.encoding, self.errors)
+
+    def can_encode(self, chunks):
+        """按块检查文本能否用该编码表示。UTF 编码总是可以，只有 GBK 等编码需要实际编码一次。"""
+        if self.encoding.startswith('utf-'):
+            return True
+        try:
+            for chunk in chunks:
+                chunk.encode(self.encoding, self.errors)
+        except UnicodeEncodeError:
+            return False
+        return True
+
+    def describe(self):
+        """确认提示中的简短说明，例如 “GBK, CRLF” 或 “UTF-8 BOM, LF”。"""
+        name = self.encoding.upper() + (" BOM" if self.bom else "")
+        return f"{name}, {NEWLINE_NAMES[self.newline]}"
+
+
+# 新文件和无法判断格式的文件：UTF-8、无 BOM，换行符与原来以文本模式写入时相同（os.linesep）
+DEFAULT_FORMAT = TextFormat('utf-8', False, os.linesep)
+
+
+def _normalize(text):
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def _dominant_newline(crlf, lf, cr):
+    """
+    返回 (出现次数最多的换行符, 是否出现了不止一种换行符)。
+    都没有时使用默认的换行符，次数相同时依次优先 LF、CRLF。
+    """
+    if not (crlf or lf or cr):
+        return DEFAULT_FORMAT.newline, False
+    mixed = (crlf > 0) + (lf > 0) + (cr > 0) > 1
+    return max((lf, 2, '\n'), (crlf, 1, '\r\n'), (cr, 0, '\r'))[2], mixed
+
+
+def _newline_of_bytes(data):
+    crlf = data.count(b'\r\n')
+    return _dominant_newline(crlf, data.count(b'\n') - crlf, data.count(b'\r') - crlf)
+
+
+def _newline_of_text(text):
+    crlf = text.count('\r\n')
+    return _dominant_newline(crlf, text.count('\n') - crlf, text.count('\r') - crlf)
+
+
+def _decodes(data, encoding, complete):
+    """data 能否用 encoding 严格解码；complete 为 False 时允许末尾是被截断的多字节字符。"""
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(data, final=complete)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _utf16_without_bom(data):
+    """NUL 字节集中在奇数（或偶数）位置时判断为没有 BOM 的 UTF-16-LE（或 BE）。"""
+    half = len(data) // 2
+    if not half or b'\x00' not in data:
+        return None
+    odd_nuls, even_nuls = data[1::2].count(0), data[0::2].count(0)
+    if odd_nuls >= half * UTF16_NUL_RATIO and even_nuls < odd_nuls / 8:
+        return 'utf-16-le'
+    if even_nuls >= half * UTF16_NUL_RATIO and odd_nuls < even_nuls / 8:
+        return 'utf-16-be'
+    return None
+
+
+def sniff_format(prefix, complete, tail=None):
+    """
+    根据文件开头的字节判断 TextFormat。complete 表示 prefix 是否已是完整文件；tail 为文件末尾的字节（可选），
+    prefix 全是 ASCII 时用它判断编码。
+    顺序为 BOM、没有 BOM 的 UTF-16、UTF-8、LEGACY_ENCODINGS；都不符合时按 UTF-8 处理
+    （无法解码的字节由 surrogateescape 保留）。
+    """
+    for bom, encoding in _BOMS:
+        if prefix.startswith(bom):
+            body = prefix[len(bom):]
+            if encoding in _UNIT_SIZES:
+                body = body[:len(body) - len(body) % _UNIT_SIZES[encoding]]
+                return TextFormat(encoding, True, *_newline_of_text(body.decode(encoding, 'ignore')))
+            return TextFormat(encoding, True, *_newline_of_bytes(body))
+    encoding = _utf16_without_bom(prefix)
+    if encoding is not None:
+        body = prefix[:len(prefix) - len(prefix) % 2]
+        return TextFormat(encoding, False, *_newline_of_text(body.decode(encoding, 'ignore')))
+    newline, mixed = _newline_of_bytes(prefix)
+    if prefix.isascii() and not complete and tail:
+        # 开头全是 ASCII 时无法区分 UTF-8 和 GBK 等编码，改由末尾判断；末尾从第一个换行符之后开始，
+        # 避免从多字节字符的中间开始解码
+        start = tail.find(b'\n') + 1
+        return TextFormat(_sniff_encoding(tail[start:] if start else tail, True), False, newline, mixed)
+    return TextFormat(_sniff_encoding(prefix, complete), False, newline, mixed)
+
+
+def _sniff_encoding(data, complete):
+    """没有 BOM、不是 UTF-16 的字节的编码：ASCII 或有效 UTF-8、LEGACY_ENCODINGS，都不符合时按 UTF-8 处理。"""
+    if data.isascii() or _decodes(data, 'utf-8', complete):
+        return 'utf-8'
+    for encoding in LEGACY_ENCODINGS:
+        if _decodes(data, encoding, complete):
+            return encoding
+    return 'utf-8'
+
+
+def sniff_file(fs, path, full=False):
+    """
+    读取文件开头 SNIFF_BYTES 个字节判断格式。fs 为 file_system.LocalFileSystem 兼容的对象。
+    开头全是 ASCII 时再读取末尾 SNIFF_BYTES 个字节判断编码；full 为 True 时改为逐块读取到第一个非 ASCII 的块
+    （写入非 ASCII 内容前使用，ASCII 开头和末尾之间的 GBK 内容也能识别出来）。
+    """
+    with fs.open_binary(path) as f:
+        prefix = f.read(SNIFF_BYTES)
+        if len(prefix) < SNIFF_BYTES or not prefix.isascii():
+            return sniff_format(prefix, len(prefix) < SNIFF_BYTES)
+        if full:
+            # 前面的块都是 ASCII，非 ASCII 的块从字符边界开始，只有末尾可能截断多字节字符
+            while True:
+                chunk = f.read(SCAN_CHUNK_BYTES)
+                if not chunk.isascii():
+                    encoding = _sniff_encoding(chunk, len(chunk) < SCAN_CHUNK_BYTES)
+                    return sniff_format(prefix, False)._replace(encoding=encoding)
+                if len(chunk) < SCAN_CHUNK_BYTES:
+                    return sniff_format(prefix, True)
+    tail, at_start = fs.read_tail(path, SNIFF_BYTES)
+    return sniff_format(prefix, at_start, tail)
+
+
+def decode_data(data):
+    """完整的文件内容按其格式解码，返回 (只含 LF 的文本, TextFormat)。"""
+    prefix = data[:SNIFF_BYTES]
+    text_format = sniff_format(prefix, len(data) <= SNIFF_BYTES)
+    if len(data) > SNIFF_BYTES and prefix.isascii() and not data.isascii():
+        # 开头全是 ASCII 时按完整内容判断编码，GBK 内容出现在 SNIFF_BYTES 之后也能识别
+        text_format = text_format._replace(encoding=_sniff_encoding(data, True))
+    if len(data) > SNIFF_BYTES and text_format.ascii_compatible and not text_format.mixed_newlines:
+        # 完整内容已在内存中，混合换行按整个文件判断（占多数的换行符仍按开头判断，与 sniff_file 一致）
+        text_format = text_format._replace(mixed_newlines=_newline_of_bytes(data)[1])
+    return text_format.decode(data), text_format
+
+
+def read_file_text(fs, path):
+    """完整读取文件并按其格式解码，返回 (只含 LF 的文本, TextFormat)。"""
+    with fs.open_binary(path) as f:
+        return decode_data(f.read())
+
+
+if __name__ == '__main__':
+    # 直接运行 `python text_format.py`：比较流式判定与完整解码两种路径的耗时
+    # （各种编码、BOM 和换行符的正确性检查见 tests/test_text_format.py）。
+    import sys
+    import time
+    import tempfile
+    from apply_engine import _probe_append
+    from content_compare import content_matches_file
+    from file_system import LocalFileSystem
+
+    fs = LocalFileSystem()
+
+    # 耗时：流式判定（只判断开头的格式、逐块比较、APPEND 只读末尾）与完整读取并解码的旧路径
+    def full_decode_matches(path, expected_text):
+        existing, _ = read_file_text(fs, path)
+        return existing.strip() == expected_text
+
+    def full_decode_appended(path, new_content):
+        existing, _ = read_file_text(fs, path)
+        return existing.rstrip().endswith('\n' + new_content)
+
+    def timed(func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        return result, (time.perf_counter() - started) * 1000
+
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'large.txt')
+        for encoding in ('utf-8', 'gbk', 'utf-16-le'):
+            for size in (1024 ** 2, 20 * 1024 ** 2):
+                fmt = TextFormat(encoding, encoding == 'utf-16-le', '\r\n')
+                line = "value = '数据' + str(42)\n"
+                text = line * (size // len(fmt.encode(line)))
+                with open(path, 'wb') as f:
+                    f.write(fmt.bom_bytes + fmt.encode(text))
+                unchanged = text.strip()
+                cases = [
+                    ("内容一致", lambda: content_matches_file(fs, path, unchanged)[0],
+                     lambda: full_decode_matches(path, unchanged)),
+                    ("开头不同", lambda: content_matches_file(fs, path, "# header\n" + unchanged)[0],
+                     lambda: full_decode_matches(path, "# header\n" + unchanged)),
+                    ("APPEND 判断", lambda: _probe_append(fs, path, "tail = 1").unchanged,
+                     lambda: full_decode_appended(path, "tail = 1")),
+                ]
+                for label, new_path, old_path in cases:
+                    new_result, new_ms = timed(new_path)
+                    old_result, old_ms = timed(old_path)
+                    if new_result != old_result:
+                        print(f"[MISMATCH] {encoding} {label}: 新 {new_result}, 旧 {old_result}", file=sys.stderr)
+                    print(f"{encoding:>9} {size / 1024 ** 2:4.0f} MB {label}: 新路径 {new_ms:8.2f} ms, "
+                          f"完整解码 {old_ms:8.2f} ms")
@@ -0,0 +1,81 @@
+import re
+
+# 标准化换行符时每次处理的字符数；峰值额外内存约为两个块的大小
+NORMALIZE_CHUNK_SIZE = 256 * 1024
+
+_NON_WHITESPACE = re.compile(r"\S")
+
+
+class TextSpan:
+    """
+    原始载荷文本中的一段区间，只记录起止偏移，不复制内容。
+    换行符标准化（CRLF/CR -> LF）在 iter_normalized() 中按块完成，
+    写入时由 LocalFileSystem.write_chunks 直接写到目标文件。
+    """
+    __slots__ = ('text', 'start', 'end')
+
+    def __init__(self, text, start=0, end=None):
+        self.text = text
+        self.start = start
+        self.end = len(text) if end is None else end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __bool__(self):
+        return self.end > self.start
+
+    def __repr__(self):
+        return f"TextSpan({self.start}, {self.end})"
+
+    def strip(self):
+        """与 str.strip() 相同的结果，但只移动偏移。"""
+        match = _NON_WHITESPACE.search(self.text, self.start, self.end)
+        if match is None:
+            return TextSpan(self.text, self.start, self.start)
+        end = self.end
+        while self.text[end - 1].isspace():
+            end -= 1
+        return TextSpan(self.text, match.start(), end)
+
+    def normalized_length(self):
+        """标准化换行符后的字符数，无需生成标准化后的文本。"""
+        return len(self) - self.text.count('\r\n', self.start, self.end)
+
+    def iter_normalized(self, chunk_size=NORMALIZE_CHUNK_SIZE):
+        """按块产出标准化换行符后的文本；不会在 CRLF 中间切分。"""
+        position = self.start
+        while position < self.end:
+            stop = min(position + chunk_size, self.end)
+            if stop < self.end and self.text[stop - 1] == '\r' and self.text[stop] == '\n':
+                stop += 1
+            yield self.text[position:stop].replace('\r\n', '\n').replace('\r', '\n')
+            position = stop
+
+    def normalized(self):
+        """生成完整的标准化文本。只用于补丁等小内容，或无法流式处理的回退路径。"""
+        return ''.join(self.iter_normalized())
+
+
+def content_length(content):
+    """写入内容（str 或 TextSpan）标准化后的字符数。"""
+    return content.normalized_length() if isinstance(content, TextSpan) else len(content)
+
+
+def iter_content_chunks(content, chunk_size=NORMALIZE_CHUNK_SIZE):
+    """按块产出写入内容（str 已经是标准化文本，TextSpan 在此标准化）。"""
+    if isinstance(content, TextSpan):
+        yield from content.iter_normalized(chunk_size)
+        return
+    for position in range(0, len(content), chunk_size):
+        yield content[position:position + chunk_size]
+
+
+def content_is_ascii(content):
+    """写入内容（str 或 TextSpan）是否只含 ASCII 字符。"""
+    return all(chunk.isascii() for chunk in iter_content_chunks(content))
+
+
+def as_text(content):
+    """将写入内容转换为 str。"""
+    return content.normalized() if isinstance(content, TextSpan) else content
@@ -0,0 +1,433 @@
+import itertools
+import json
+import os
+import stat
+import sys
+import time
+
+from config_options import DEFAULT_DURABILITY, DURABILITY_MODES
+from file_system import DEFAULT_IO_WORKERS, LocalFileSystem, map_in_pool, user_data_dir
+
+# 持久化级别 DURABILITY_MODES 的含义见 config_options
+TEMP_SUFFIX = '.autoapply-tmp'
+# Windows 上杀毒软件或编辑器短暂打开目标文件时替换和删除会失败，提交点之后按此重试
+REPLACE_RETRIES = 5
+REPLACE_RETRY_DELAY = 0.05
+# batch 级别下至少这么多个文件才用 syncfs 代替逐个 fsync：syncfs 也会刷新同一文件系统上其他程序的数据，
+# 文件很少时逐个 fsync 更便宜
+GROUP_SYNC_MIN_FILES = 16
+# 无法解析的事务记录可能是另一个进程正在写入的，比这更新时不处理
+CORRUPT_RECORD_GRACE_SECONDS = 60
+# 比这更旧的记录不再检查进程是否存活（进程号可能已被其他程序重用）
+STALE_RECORD_SECONDS = 3600
+
+
+class TransactionAborted(Exception):
+    """批次中其他路径暂存失败，整个批次已回滚，该路径未被修改。"""
+
+
+def _retry(func, *args):
+    for attempt in range(REPLACE_RETRIES):
+        try:
+            return func(*args)
+        except PermissionError:
+            if attempt == REPLACE_RETRIES - 1:
+                raise
+            time.sleep(REPLACE_RETRY_DELAY * (attempt + 1))
+
+
+def _process_alive(pid):
+    """pid 对应的进程是否仍在运行。Windows 上 os.kill 会结束进程，因此通过 OpenProcess 查询。"""
+    if os.name == 'nt':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x00100000, False, pid) # SYNCHRONIZE
+        if not handle:
+            return False
+        try:
+            return kernel32.WaitForSingleObject(handle, 0) == 0x102 # WAIT_TIMEOUT：尚未退出
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Transaction:
+    """
+    一次批量写入，由 apply_engine.commit_plan 使用：
+    prepare() 登记操作 → 调用方对每个路径调用 begin_stage(path)，把新内容写入返回的临时文件，再调用 end_stage(path)
+    → commit() 刷盘、记录提交点并替换；
+    暂存失败时 abort() 删除所有临时文件，目标文件不会被修改。
+    写入（'write'）的临时文件是完整的新内容，提交时原子替换目标文件；
+    追加（'append'）的临时文件只是追加的部分，提交时追加到目标文件，崩溃后可按原长度截断再追加。
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, fs=None, durability=DEFAULT_DURABILITY, log=None):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"未知的持久化级别 '{durability}'，可选: {', '.join(DURABILITY_MODES)}")
+        self.fs = fs or LocalFileSystem()
+        self.durability = durability
+        self.log = log
+        self.token = f"{os.getpid():x}-{int(time.time()):x}-{next(self._ids):x}"
+        self.writes = {} # 路径 -> 'write' 或 'append'
+        self.deletes = []
+        self._append_sizes = {} # 追加的路径 -> 追加前的大小，提交点记录，用于恢复
+        self._targets = {} # 符号链接路径 -> 链接指向的文件，替换链接指向的文件而不是链接本身
+        self._modes = {} # 整体替换的路径 -> 原文件的权限位，临时文件沿用
+
+    def target(self, path):
+        return self._targets.get(path, path)
+
+    def temp_path(self, path):
+        """与目标文件同目录的隐藏临时文件，保证替换是同一文件系统内的原子重命名。"""
+        directory, name = os.path.split(self.target(path))
+        return os.path.join(directory, f".{name}.{self.token}{TEMP_SUFFIX}")
+
+    def begin_stage(self, path):
+        """在暂存 path 的工作线程中调用，返回临时文件路径。"""
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            return self.temp_path(path)
+        if stat.S_ISLNK(st.st_mode):
+            self._targets[path] = os.path.realpath(path)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return self.temp_path(path)
+        if self.writes.get(path) == 'write':
+            self._modes[path] = stat.S_IMODE(st.st_mode)
+        return self.temp_path(path)
+
+    def end_stage(self, path):
+        """暂存完一个路径后在同一工作线程中调用：沿用原文件的权限位，per_file 级别立即刷盘。"""
+        temp_path = self.temp_path(path)
+        mode = self._modes.get(path)
+        if mode is not None:
+            os.chmod(temp_path, mode)
+        if self.durability == 'per_file':
+            self.fs.fsync(temp_path)
+
+    def prepare(self, writes, deletes=()):
+        """登记所有操作；有事务记录时先写入 prepare 记录，崩溃后据此删除临时文件。"""
+        self.writes = dict(writes)
+        self.deletes = list(deletes)
+        if self.log is not None:
+            self.log.save(self._record('prepare'), sync=False)
+
+    def abort(self, max_workers=DEFAULT_IO_WORKERS):
+        map_in_pool(self._remove_temp, list(self.writes), max_workers)
+        if self.log is not None:
+            self.log.remove(self.token)
+
+    def commit(self, max_workers=DEFAULT_IO_WORKERS):
+        """
+        刷盘、记录提交点，然后替换、追加和删除。提交点之后不再回滚：
+        个别路径（例如被其他程序锁定，重试后仍失败）的错误单独返回，其余路径照常完成。
+        返回 ({路径: 错误或 None}, [(是否已删除, 错误)])，删除结果与 deletes 顺序一致。
+        """
+        fs = self.fs
+        if self.durability == 'batch':
+            # 组提交：所有临时文件都写完后再一起刷盘
+            temp_paths = [self.temp_path(path) for path in self.writes]
+            if not self._sync_filesystems(temp_paths):
+                map_in_pool(fs.fsync, temp_paths, max_workers)
+        for path, kind in self.writes.items():
+            if kind == 'append':
+                target = self.target(path)
+                self._append_sizes[path] = os.path.getsize(target) if os.path.exists(target) else 0
+        if self.log is not None:
+            self.log.save(self._record('commit'), sync=self.durability != 'none')
+
+        paths = list(self.writes)
+        write_results = dict(zip(paths, map_in_pool(self._apply_write, paths, max_workers)))
+        delete_results = map_in_pool(self._apply_delete, self.deletes, max_workers)
+        if self.durability == 'batch':
+            changed = [self.target(path) for path in paths if write_results[path] is None]
+            changed += [path for path, (deleted, _) in zip(self.deletes, delete_results) if deleted]
+            if not self._sync_filesystems(changed):
+                appended = [self.target(path) for path in paths if self.writes[path] == 'append' and write_results[path] is None]
+                map_in_pool(fs.fsync, appended, max_workers)
+                map_in_pool(fs.fsync_dir, sorted({os.path.dirname(path) for path in changed}), max_workers)
+        if self.log is not None:
+            self.log.remove(self.token)
+        return write_results, delete_results
+
+    def _sync_filesystems(self, paths):
+        """
+        文件足够多时，对 paths 所在的每个文件系统调用一次 syncfs，代替逐个 fsync。
+        返回 False 表示未执行（文件太少或平台不支持），调用方逐个刷盘。
+        """
+        if len(paths) < GROUP_SYNC_MIN_FILES:
+            return False
+        devices = {}
+        for directory in {os.path.dirname(path) for path in paths}:
+            devices.setdefault(os.stat(directory).st_dev, directory)
+        for directory in devices.values():
+            if not self.fs.sync_filesystem(directory):
+                return False
+        return True
+
+    def _apply_write(self, path):
+        temp_path = self.temp_path(path)
+        target = self.target(path)
+        try:
+            if self.writes[path] == 'write':
+                _retry(self.fs.replace, temp_path, target)
+            else:
+                _retry(self.fs.append_file, target, temp_path)
+                self.fs.remove(temp_path)
+                if self.durability == 'per_file':
+                    self.fs.fsync(target)
+            if self.durability == 'per_file':
+                self.fs.fsync_dir(os.path.dirname(target))
+            return None
+        except Exception as e:
+            self._remove_temp(path)
+            return e
+
+    def _apply_delete(self, path):
+        try:
+            _retry(self.fs.remove, path)
+        except FileNotFoundError:
+            return False, None
+        except Exception as e:
+            return False, e
+        if self.durability == 'per_file':
+            try:
+                self.fs.fsync_dir(os.path.dirname(path))
+            except OSError as e:
+                return True, e
+        return True, None
+
+    def _remove_temp(self, path):
+        try:
+            self.fs.remove(self.temp_path(path))
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        except OSError as e:
+            print(f"[WARNING] 无法删除临时文件 '{self.temp_path(path)}': {e}", file=sys.stderr)
+
+    def _record(self, state):
+        return {
+            'token': self.token,
+            'pid': os.getpid(),
+            'state': state,
+            'writes': [[self.target(path), self.temp_path(path)] for path, kind in self.writes.items() if kind == 'write'],
+            'appends': [[self.target(path), self.temp_path(path), self._append_sizes.get(path)]
+                        for path, kind in self.writes.items() if kind == 'append'],
+            'deletes': self.deletes,
+        }
+
+
+def default_transaction_dir():
+    """托盘程序和命令行模式共用的提交记录目录（见 file_system.user_data_dir），任何一方中途退出的批次都由下一次启动的一方恢复。"""
+    return os.path.join(user_data_dir(), 'transactions')
+
+
+class TransactionLog:
+    """
+    未完成事务的记录，每个事务一个 <token>.json，事务完成后删除。
+    提交点之前的记录为 prepare（不刷盘，只用于清理临时文件），提交点的记录刷盘后才开始替换目标文件。
+    程序启动时 recover() 处理上次中断的事务：未到提交点的回滚，已到提交点的继续完成。
+    """
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+
+    def _path(self, token):
+        return os.path.join(self.directory, f"{token}.json")
+
+    def save(self, record, sync=False):
+        # 提交记录直接覆盖 prepare 记录：写到一半崩溃时记录无法解析，此时还没有替换任何文件，按回滚处理
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(record['token'])
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        if sync:
+            LocalFileSystem().fsync_dir(self.directory)
+
+    def remove(self, token):
+        try:
+            os.remove(self._path(token))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[WARNING] 无法删除事务记录 '{self._path(token)}': {e}", file=sys.stderr)
+
+    def recover(self):
+        """
+        处理上次运行中断的事务，返回 [(token, 'rollback' 或 'rollforward', 处理的路径数)]。
+        应在本进程开始提交之前调用；仍在运行的其他进程（例如同时运行的命令行模式）的事务不处理。
+        """
+        try:
+            names = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        except FileNotFoundError:
+            return []
+        results = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            token = name[:-len('.json')]
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+            except (OSError, ValueError) as e:
+                try:
+                    if time.time() - os.path.getmtime(path) < CORRUPT_RECORD_GRACE_SECONDS:
+                        continue
+                except OSError:
+                    continue
+                # 写到一半的记录：提交记录刷盘之前不会替换任何文件，临时文件无法确定，只删除记录
+                print(f"[WARNING] 事务记录 '{path}' 无法解析，已删除: {e}", file=sys.stderr)
+                self.remove(token)
+                continue
+            pid = record.get('pid')
+            try:
+                recent = time.time() - os.path.getmtime(path) < STALE_RECORD_SECONDS
+            except OSError:
+                continue
+            if pid is not None and pid != os.getpid() and recent and _process_alive(pid):
+                continue
+            if record.get('state') == 'commit':
+                count = _roll_forward(record)
+                results.append((token, 'rollforward', count))
+                print(f"[INFO] 已完成上次中断的批次 {token}（{count} 个文件）。")
+            else:
+                count = _roll_back(record)
+                results.append((token, 'rollback', count))
+                print(f"[INFO] 已回滚上次中断的批次 {token}（删除 {count} 个临时文件，目标文件未被修改）。")
+            self.remove(token)
+        return results
+
+
+def _remove_if_exists(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _roll_back(record):
+    count = 0
+    for _, temp_path in record.get('writes', []):
+        count += _remove_if_exists(temp_path)
+    for _, temp_path, _ in record.get('appends', []):
+        count += _remove_if_exists(temp_path)
+    return count
+
+
+def _roll_forward(record):
+    """
+    继续完成已到提交点的事务，每一步都可以重复执行：临时文件仍存在的写入重新替换；
+    追加先截断回记录的原长度再追加（无法确定中断前是否已追加）；删除已不存在的文件时跳过。
+    """
+    fs = LocalFileSystem()
+    count = 0
+    for path, temp_path in record.get('writes', []):
+        try:
+            if os.path.exists(temp_path):
+                os.replace(temp_path, path)
+                count += 1
+        except OSError as e:
+            print(f"[ERROR] 无法完成 '{path}' 的写入: {e}", file=sys.stderr)
+    for path, temp_path, size in record.get('appends', []):
+        try:
+            if not os.path.exists(temp_path):
+                continue
+            current = os.path.getsize(path) if os.path.exists(path) else 0
+            if size is None or current < size:
+                print(f"[WARNING] '{path}' 比追加前更短，已被其他程序修改，跳过未完成的追加。", file=sys.stderr)
+            else:
+                if os.path.exists(path):
+                    os.truncate(path, size)
+                fs.append_file(path, temp_path)
+                count += 1
+            os.remove(temp_path)
+        except OSError as e:
+            print(f"[ERROR] 无法完成 '{path}' 的追加: {e}", file=sys.stderr)
+    for path in record.get('deletes', []):
+        try:
+            count += _remove_if_exists(path)
+        except OSError as e:
+            print(f"[ERROR] 无法完成 '{path}' 的删除: {e}", file=sys.stderr)
+    return count
+
+
+if __name__ == '__main__':
+    # 直接运行 `python transaction.py`：1,000 个文件的批次在不同持久化级别下的提交耗时（组提交与逐文件刷盘对比）。
+    # 崩溃恢复和暂存失败的功能检查见 tests/test_transaction.py。
+    import contextlib
+    import io
+    import shutil
+    import statistics
+    import tempfile
+    from apply_engine import plan_blocks, commit_plan
+    from block_scanner import scan_blocks
+
+    # 基准测试：1,000 个 4 KB 文件分布在 20 个目录中。
+    # 本机磁盘之外再模拟每次刷盘 2 ms（消费级 SSD 执行 FLUSH 的典型耗时），刷盘很快的虚拟磁盘上也能看出刷盘次数的差别
+    FILE_COUNT = 1000
+    ROUNDS = 5
+    FLUSH_LATENCY = 0.002
+
+    class FlushLatencyFileSystem(LocalFileSystem):
+        def __init__(self):
+            self.flushes = 0
+
+        def fsync(self, path):
+            self.flushes += 1
+            time.sleep(FLUSH_LATENCY)
+            super().fsync(path)
+
+        def fsync_dir(self, path):
+            self.flushes += 1
+            time.sleep(FLUSH_LATENCY)
+            super().fsync_dir(path)
+
+        def sync_filesystem(self, path):
+            self.flushes += 1
+            time.sleep(FLUSH_LATENCY)
+            return super().sync_filesystem(path)
+
+    payloads = ["".join(f"#### file: pkg{index % 20}/module_{index}.py (OVERWRITE)\n```python\n"
+                        + f"VALUE_{version} = {index}\n" * 200 + "```\n" for index in range(FILE_COUNT))
+                for version in range(2)]
+    timings = {}
+    flushes = {}
+    with tempfile.TemporaryDirectory() as temp_dir, contextlib.redirect_stdout(io.StringIO()):
+        log = TransactionLog(os.path.join(temp_dir, 'transactions'))
+        for round_number in range(ROUNDS):
+            for simulated in (False, True):
+                for durability in DURABILITY_MODES:
+                    root = os.path.join(temp_dir, f'{durability}-{round_number}')
+                    os.makedirs(root)
+                    commit_plan(plan_blocks(list(scan_blocks(payloads[0])), root, lambda *_: True), durability='none')
+                    plan = plan_blocks(list(scan_blocks(payloads[1])), root, lambda *_: True)
+                    fs = FlushLatencyFileSystem() if simulated else LocalFileSystem()
+                    if hasattr(os, 'sync'):
+                        os.sync() # 不让上一轮的回写影响这一次计时
+                    started = time.perf_counter()
+                    errors = commit_plan(plan, fs=fs, durability=durability, transaction_log=log)
+                    timings.setdefault((simulated, durability), []).append(time.perf_counter() - started)
+                    if simulated:
+                        flushes[durability] = fs.flushes
+                    if errors:
+                        print(f"[ERROR] {durability} 提交失败 {len(errors)} 个文件", file=sys.stderr)
+                    shutil.rmtree(root)
+
+    for simulated, title in ((False, "本机磁盘"), (True, f"每次刷盘 {FLUSH_LATENCY * 1000:.0f} ms")):
+        per_file = statistics.median(timings[(simulated, 'per_file')])
+        print(f"{FILE_COUNT} 个文件 (4 KB, 20 个目录) 的提交，{title}，{ROUNDS} 轮中位数:")
+        for durability, label in (('none', "不刷盘 (原子替换)"), ('per_file', "逐文件刷盘"), ('batch', "组提交")):
+            median = statistics.median(timings[(simulated, durability)])
+            print(f"    {label:<12} {median * 1000:8.1f} ms, 刷盘 {flushes[durability]:4d} 次"
+                  f" ({per_file / median:.2f}x 于逐文件刷盘)")